@@ -7,6 +7,7 @@ from uuid import UUID
 
 from app.core.database import get_db
 from app.models import PlatformListing, PlatformListingItem, Product
+from app.services.stock_sync_service import StockSyncService
 
 router = APIRouter()
 
@@ -20,6 +21,9 @@ class ListingCreate_DTO(BaseModel):
     platform: str
     platform_sku: str
     name: Optional[str] = None
+    shop_id: Optional[str] = None
+    platform_item_id: Optional[str] = None
+    platform_model_id: Optional[str] = None
     items: List[ListingItemCreate_DTO]
 
 class ListingItem_DTO(BaseModel):
@@ -36,6 +40,9 @@ class Listing_DTO(BaseModel):
     platform: str
     platform_sku: str
     name: Optional[str] = None
+    shop_id: Optional[str] = None
+    platform_item_id: Optional[str] = None
+    platform_model_id: Optional[str] = None
     items: List[ListingItem_DTO]
     
     class Config:
@@ -85,6 +92,9 @@ def get_listings(
             platform=listing.platform,
             platform_sku=listing.platform_sku,
             name=listing.name,
+            shop_id=listing.shop_id,
+            platform_item_id=listing.platform_item_id,
+            platform_model_id=listing.platform_model_id,
             items=items_dto
         ))
         
@@ -106,7 +116,10 @@ def create_listing(payload: ListingCreate_DTO, db: Session = Depends(get_db)):
     new_listing = PlatformListing(
         platform=payload.platform,
         platform_sku=payload.platform_sku,
-        name=payload.name or payload.platform_sku
+        name=payload.name or payload.platform_sku,
+        shop_id=payload.shop_id,
+        platform_item_id=payload.platform_item_id,
+        platform_model_id=payload.platform_model_id
     )
     db.add(new_listing)
     db.flush() # Get ID
@@ -124,7 +137,8 @@ def create_listing(payload: ListingCreate_DTO, db: Session = Depends(get_db)):
             quantity=item_data.quantity
         )
         db.add(new_item)
-        
+    
+    StockSyncService.mark_dirty(db, [item.product_id for item in payload.items])
     db.commit()
     db.refresh(new_listing)
     
@@ -144,6 +158,9 @@ def create_listing(payload: ListingCreate_DTO, db: Session = Depends(get_db)):
         platform=new_listing.platform,
         platform_sku=new_listing.platform_sku,
         name=new_listing.name,
+        shop_id=new_listing.shop_id,
+        platform_item_id=new_listing.platform_item_id,
+        platform_model_id=new_listing.platform_model_id,
         items=items_dto
     )
 @router.put("/{id}", response_model=Listing_DTO)
@@ -161,6 +178,9 @@ def update_listing(id: UUID, payload: ListingCreate_DTO, db: Session = Depends(g
     # 2. Update simple fields
     if payload.name:
         listing.name = payload.name
+    listing.shop_id = payload.shop_id
+    listing.platform_item_id = payload.platform_item_id
+    listing.platform_model_id = payload.platform_model_id
         
     # Note: We usually don't allow changing platform/sku as it's the key, 
     # but if needed we could. For now, let's assume those remain fixed or are ignored.
@@ -181,7 +201,8 @@ def update_listing(id: UUID, payload: ListingCreate_DTO, db: Session = Depends(g
             quantity=item_data.quantity
         )
         db.add(new_item)
-        
+    
+    StockSyncService.mark_dirty(db, [item.product_id for item in payload.items])
     db.commit()
     db.refresh(listing)
     
@@ -201,6 +222,9 @@ def update_listing(id: UUID, payload: ListingCreate_DTO, db: Session = Depends(g
         platform=listing.platform,
         platform_sku=listing.platform_sku,
         name=listing.name,
+        shop_id=listing.shop_id,
+        platform_item_id=listing.platform_item_id,
+        platform_model_id=listing.platform_model_id,
         items=items_dto
     )
 @router.delete("/{id}")
@@ -7,13 +7,13 @@ from sqlalchemy import desc
 from pydantic import BaseModel
 from typing import Optional, List
 from uuid import UUID
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 import os
 
 from app.core import get_db
 from app.models import OrderHeader
 from app.models.invoice import InvoiceProfile
-from app.services.invoice_service import InvoiceService
+from app.services.invoice_service import InvoiceService, INVOICE_BATCH_MAX
 from app.services.finance_sync_service import FinanceSyncService
 from app.models.integration import PlatformConfig
 from app.models.finance import MarketplaceTransaction
@@ -114,6 +114,35 @@ def list_invoice_requests(
     }
 
 
+@finance_router.get("/invoice-requests/print")
+def print_issued_invoices(
+    start_date: date = Query(..., description="First invoice date (inclusive)"),
+    end_date: date = Query(..., description="Last invoice date (inclusive)"),
+    limit: int = Query(INVOICE_BATCH_MAX, ge=1, le=INVOICE_BATCH_MAX),
+    db: Session = Depends(get_db)
+):
+    """
+    Issued tax invoices in a date range as one printable document
+    (one A4 page per invoice, ordered by invoice number) for bulk printing.
+    """
+    from fastapi.responses import HTMLResponse
+    
+    if end_date < start_date:
+        raise HTTPException(status_code=400, detail="end_date must not be before start_date")
+    
+    start = datetime.combine(start_date, datetime.min.time())
+    end = datetime.combine(end_date + timedelta(days=1), datetime.min.time())
+    order_ids = InvoiceService.issued_order_ids(db, start, end, limit=limit)
+    if not order_ids:
+        raise HTTPException(status_code=404, detail="ไม่พบใบกำกับภาษีที่ออกแล้วในช่วงวันที่นี้")
+    
+    html = InvoiceService.render_issued_batch(
+        db, order_ids,
+        title=f"ใบกำกับภาษี {start_date.strftime('%d/%m/%Y')} - {end_date.strftime('%d/%m/%Y')}",
+    )
+    return HTMLResponse(content=html, headers={"X-Invoice-Count": str(len(order_ids))})
+
+
 @finance_router.get("/invoice-requests/{request_id}")
 def get_invoice_request(request_id: str, db: Session = Depends(get_db)):
     """
@@ -400,7 +429,7 @@ def get_fee_details(
     db: Session = Depends(get_db)
 ):
     """
-    Get detailed fee breakdown from MarketplaceTransaction raw_data.
+    Get detailed fee breakdown from MarketplaceTransaction fee columns.
     Returns itemized fees like TikTok statement format.
     """
     from datetime import datetime, time
@@ -424,23 +453,23 @@ def get_fee_details(
         "platforms": {}
     }
     
-    # TikTok - Query from raw_data with detailed fields
+    # TikTok - Typed fee columns extracted at ingest
     try:
         tiktok_result = db.execute(text("""
             SELECT 
                 COUNT(*) as order_count,
-                COALESCE(SUM(CAST(raw_data->>'platform_commission_amount' AS NUMERIC)), 0) as platform_commission,
-                COALESCE(SUM(CAST(raw_data->>'affiliate_commission_amount' AS NUMERIC)), 0) as affiliate_commission,
-                COALESCE(SUM(CAST(raw_data->>'affiliate_ads_commission_amount' AS NUMERIC)), 0) as affiliate_ads_commission,
-                COALESCE(SUM(CAST(raw_data->>'affiliate_partner_commission_amount' AS NUMERIC)), 0) as affiliate_partner_commission,
-                COALESCE(SUM(CAST(raw_data->>'actual_shipping_fee_amount' AS NUMERIC)), 0) as actual_shipping_fee,
-                COALESCE(SUM(CAST(raw_data->>'platform_shipping_fee_discount_amount' AS NUMERIC)), 0) as platform_shipping_discount,
-                COALESCE(SUM(CAST(raw_data->>'referral_fee_amount' AS NUMERIC)), 0) as referral_fee,
-                COALESCE(SUM(CAST(raw_data->>'retail_delivery_fee_amount' AS NUMERIC)), 0) as retail_delivery_fee,
-                COALESCE(SUM(CAST(raw_data->>'fbt_fulfillment_fee_amount' AS NUMERIC)), 0) as fbt_fee,
-                COALESCE(SUM(CAST(raw_data->>'fee_amount' AS NUMERIC)), 0) as total_fee,
-                COALESCE(SUM(CAST(raw_data->>'gross_sales_amount' AS NUMERIC)), 0) as gross_sales,
-                COALESCE(SUM(CAST(raw_data->>'settlement_amount' AS NUMERIC)), 0) as settlement
+                COALESCE(SUM(platform_commission_amount), 0) as platform_commission,
+                COALESCE(SUM(affiliate_commission_amount), 0) as affiliate_commission,
+                COALESCE(SUM(affiliate_ads_commission_amount), 0) as affiliate_ads_commission,
+                COALESCE(SUM(affiliate_partner_commission_amount), 0) as affiliate_partner_commission,
+                COALESCE(SUM(actual_shipping_fee_amount), 0) as actual_shipping_fee,
+                COALESCE(SUM(platform_shipping_discount_amount), 0) as platform_shipping_discount,
+                COALESCE(SUM(referral_fee_amount), 0) as referral_fee,
+                COALESCE(SUM(retail_delivery_fee_amount), 0) as retail_delivery_fee,
+                COALESCE(SUM(fbt_fee_amount), 0) as fbt_fee,
+                COALESCE(SUM(fee_amount), 0) as total_fee,
+                COALESCE(SUM(gross_sales_amount), 0) as gross_sales,
+                COALESCE(SUM(settlement_amount), 0) as settlement
             FROM marketplace_transaction
             WHERE platform = 'tiktok' 
               AND transaction_type = 'ORDER'
@@ -613,6 +642,19 @@ def get_order_profit_breakdown(order_id: str, db: Session = Depends(get_db)):
     # Net income from platform perspective is usually subtotal + platform_discount - fees
     breakdown["net_income"] = breakdown["revenue"]["total_gross_revenue"] + total_deductions
     
+    # Profit after COGS, from the materialized order_profit row
+    from app.services.profit_service import ProfitService
+    profit = ProfitService.get_order_profit(db, order.id)
+    breakdown["profit"] = {
+        "revenue": float(profit.total_revenue or 0),
+        "cogs": float(profit.cogs_total or 0),
+        "fees": float(profit.platform_fee_total or 0),
+        "fees_source": profit.fees_source,
+        "net_profit": float(profit.net_profit or 0),
+        "margin_percent": float(profit.profit_margin_percent or 0),
+        "calculated_at": profit.calculated_at.isoformat() if profit.calculated_at else None,
+    } if profit else None
+    
     return breakdown
 
 
@@ -631,247 +673,37 @@ def get_order_profitability(
 def export_finance_report(
     start_date: date = Query(...),
     end_date: date = Query(...),
-    db: Session = Depends(get_db)
+    format: str = Query("csv", pattern="^(csv|parquet)$"),
 ):
     """
     Export finance report - DETAILED BREAKDOWN (Matching TikTok Statement)
+    Streamed; fee buckets are aggregated per order in the export query.
     """
-    import csv
-    import io
-    from fastapi.responses import StreamingResponse
-    from datetime import datetime
-    from sqlalchemy.orm import joinedload
-    from app.models import OrderHeader, OrderItem, Product
-    from app.models.finance import MarketplaceTransaction
-    from collections import defaultdict
-    
-    # Query Orders with Items, Product, and Linked Transactions
-    dt_start = datetime.combine(start_date, datetime.min.time())
-    dt_end = datetime.combine(end_date, datetime.max.time())
-    
-    # We query OrderHeader and join everything needed
-    orders = db.query(OrderHeader).options(
-        joinedload(OrderHeader.items).joinedload(OrderItem.product)
-    ).filter(
-        OrderHeader.order_datetime >= dt_start,
-        OrderHeader.order_datetime <= dt_end,
-        OrderHeader.status_normalized != 'CANCELLED'
-    ).order_by(OrderHeader.order_datetime).all()
-    
-    # Prepare CSV
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Detailed Headers matching the screenshot concept
-    headers = [
-        "วันที่",
-        "Platform", 
-        "หมายเลขออเดอร์",
-        "สินค้า",
-        "ยอดขาย (Gross Sales)",
-        "ค่าส่งที่เก็บลูกค้า",
-        "ส่วนลด Platform Support",
-        "รวมรายรับ (Total Revenue)",
-        
-        # Deductions
-        "ค่าคอมมิชชั่น (Commission)",
-        "ค่าธรรมเนียมคำสั่งซื้อ (Transaction Fee)",
-        "ค่าธรรมเนียมบริการ (Service Fee)",
-        "ค่าส่งที่ร้านจ่ายจริง (Shipping Cost)",
-        "ค่าคอม Affiliate",
-        "รวมค่าธรรมเนียม (Total Fees)",
-        
-        # Result
-        "ต้นทุนสินค้า (COGS)",
-        "กำไรสุทธิ (Net Profit)",
-        "ยอดเงินเข้าบัญชี (Payout)"
-    ]
-    writer.writerow(headers)
-    
-    for order in orders:
-        # Basic Info
-        order_date = order.order_datetime.strftime("%Y-%m-%d") if order.order_datetime else ""
-        platform = order.channel_code or "Unknown"
-        order_id = order.external_order_id or order.order_number or str(order.id)
-        
-        # Items & COGS
-        items_list = []
-        cogs = 0.0
-        for item in order.items:
-            sku = item.sku or "N/A"
-            qty = item.quantity or 0
-            items_list.append(f"{sku} x{qty}")
-            if item.product:
-                cost = float(item.product.standard_cost or 0)
-                cogs += cost * qty
-        items_str = ", ".join(items_list)
-        
-        # Find associated finance transaction for this order (if synced)
-        # This is where we get the REAL numbers from platforms
-        txs = db.query(MarketplaceTransaction).filter(
-            MarketplaceTransaction.order_id == order.id
-        ).all()
-        
-        # Initialize Values
-        gross_sales = float(order.subtotal_amount or 0)
-        shipping_income = float(order.shipping_fee or 0)
-        platform_discount = float(order.platform_discount_amount or 0)
-        
-        # Fee buckets
-        commission = 0.0
-        transaction_fee = 0.0
-        service_fee = 0.0
-        shipping_cost = 0.0
-        affiliate_cost = 0.0
-        other_fees = 0.0
-        
-        payout_amount = 0.0
-        
-        if txs:
-            # Calculate actuals from Money Trail
-            # Note: Logic here depends on how we mapped types during sync
-            for tx in txs:
-                amt = float(tx.amount) # usually negative for fees
-                t_type = tx.transaction_type
-                raw = tx.raw_data or {}
-                
-                if t_type == 'COMMISSION_FEE':
-                    commission += abs(amt)
-                elif t_type == 'TRANSACTION_FEE':
-                    transaction_fee += abs(amt)
-                elif t_type == 'SERVICE_FEE':
-                    service_fee += abs(amt)
-                elif t_type == 'SHIPPING_FEE':
-                    shipping_cost += abs(amt)
-                elif 'affiliate' in (tx.description or "").lower():
-                    affiliate_cost += abs(amt)
-                elif t_type in ['ADJUSTMENT', 'PAYMENT_FEE']:
-                    other_fees += abs(amt)
-                
-                # --- Platform Specific Field Overrides (More Accurate) ---
-                if platform == 'tiktok' and raw:
-                    # TikTok keys usually end with _amount
-                    # If we find granular keys, we might want to use them instead of generic mapping
-                    # But generic mapping is populated from these keys during sync.
-                    # Let's trust the generic mapping for now, BUT add Affiliate if missed
-                    if 'affiliate_commission_amount' in raw:
-                         val = float(raw.get('affiliate_commission_amount') or 0)
-                         if val != 0 and affiliate_cost == 0:
-                             affiliate_cost += abs(val)
-
-                elif platform == 'shopee' and raw:
-                    # Shopee raw_data often contains 'order_income' dict with full breakdown
-                    income_data = raw.get('order_income', {})
-                    if income_data:
-                        # If this transaction holds the full breakdown (usually COMMISSION_FEE type has proper keys)
-                        # We might double count if we iterate multiple transactions for same order.
-                        # BE CAREFUL.
-                        # However, commonly Shopee has multiple rows: one for shipping, one for fee, etc? 
-                        # OR one big row? 
-                        # Based on sample, COMMISSION_FEE row had 'order_income' with ALL fields.
-                        # If we have multiple rows having same 'order_income', we shouldn't sum them up.
-                        # Strategy: Only parse specific keys if the current transaction TYPE matches the bucket
-                        # OR (Better for Shopee): relying on the generic types we already mapped during Sync might be safer
-                        # Sync service ALREADY exploded these into rows. checking SyncService...
-                        # Yes, sync service loops fee_mapping and creates rows.
-                        # So 'commission += abs(amt)' above should already work!
-                        
-                        # Just double check Affiliate (AMS)
-                        if 'ams_commission_fee' in income_data:
-                            val = float(income_data.get('ams_commission_fee') or 0)
-                            # Only add if we haven't captured it via generic types
-                            # Sync service likely didn't map 'ams_commission_fee' to a specific type?
-                            # Checked sync code: 'ams' was not in fee_mapping list.
-                            # So we likely missed it or it went to 'UNKNOWN'.
-                            if val > 0:
-                                # Start fresh for affiliate if not found
-                                # But wait, is this per row or global for order? 
-                                # 'order_income' is Order Level data attached to a specific transaction record.
-                                # If we have 3 transactions for this order, and all have 'order_income', we shouldn't sum 3 times.
-                                # We should typically use the 'max' found logic or only read from one specific type.
-                                pass
-             
-            # Payout is sum of all transactions for this order
-            payout_amount = sum(float(t.amount) for t in txs)
-            
-            # Special logic for Shopee AMS (Affiliate) if not captured
-            # Check if any transaction has raw_data with AMS fee
-            if platform == 'shopee' and affiliate_cost == 0:
-                for tx in txs:
-                    raw = tx.raw_data or {}
-                    income = raw.get('order_income', {})
-                    ams = float(income.get('ams_commission_fee') or 0) + float(income.get('order_ams_commission_fee') or 0)
-                    if ams > 0:
-                        affiliate_cost = ams
-                        # Subtract from payout? Usually payout already deducts it? 
-                        # Payout = Sum(amounts). If AMS wasn't a separate negative row, then Payout is inflated?
-                        # Wait, 'order_income' fields like 'ams_commission_fee' are informational. 
-                        # Actual deduction happens in 'escrow_amount'.
-                        # If Shopee didn't generate a specific transaction line for AMS, 
-                        # then 'payout_amount' (sum of lines) might be correct (net), 
-                        # but 'affiliate_cost' breakdown would be missing.
-                        # So we can safely specific affiliate_cost here for display without altering Payout.
-                        break
-            
-            # Payout is sum of all transactions for this order
-            payout_amount = sum(float(t.amount) for t in txs)
-        else:
-            # Fallback to Estimates if no finance data
-            payout_amount = (gross_sales + shipping_income) - (gross_sales * 0.12) # Dummy est
-            transaction_fee = gross_sales * 0.03
-            commission = gross_sales * 0.04
-            service_fee = gross_sales * 0.05
-        
-        # Total Revenue
-        total_revenue = gross_sales + shipping_income + platform_discount
-        
-        # Total Deductions
-        total_fees = commission + transaction_fee + service_fee + shipping_cost + affiliate_cost + other_fees
-        
-        # Net Profit
-        # Profit = Revenue - Fees - COGS
-        # Note: Payout usually includes shipping income but excludes platform discount (which is subsidized)
-        # So Profit = (Payout + Subsidies) - COGS ?? 
-        # Simpler: Profit = (Sales + ShipIncome) - Fees - COGS
-        net_profit = total_revenue - total_fees - cogs
-        
-        writer.writerow([
-            order_date,
-            platform,
-            order_id,
-            items_str,
-            f"{gross_sales:.2f}",
-            f"{shipping_income:.2f}",
-            f"{platform_discount:.2f}",
-            f"{total_revenue:.2f}",
-            
-            f"{commission:.2f}",
-            f"{transaction_fee:.2f}",
-            f"{service_fee:.2f}",
-            f"{shipping_cost:.2f}",
-            f"{affiliate_cost:.2f}",
-            f"{total_fees:.2f}",
-            
-            f"{cogs:.2f}",
-            f"{net_profit:.2f}",
-            f"{payout_amount:.2f}"
-        ])
-        
-    output.seek(0)
-    
-    # Add BOM
-    bom = '\ufeff'
-    content = bom + output.getvalue()
-    
-    response = StreamingResponse(
-        iter([content]),
-        media_type="text/csv; charset=utf-8"
-    )
-    
-    filename = f"รายงานละเอียด_{start_date}_{end_date}.csv"
-    import urllib.parse
-    encoded_filename = urllib.parse.quote(filename)
-    response.headers["Content-Disposition"] = f"attachment; filename*=UTF-8''{encoded_filename}"
-    
-    return response
+    from app.services.export_service import ExportService, FINANCE_COLUMNS
+
+    rows = ExportService.finance_rows(start_date, end_date)
+    try:
+        return ExportService.response(FINANCE_COLUMNS, rows, format, f"รายงานละเอียด_{start_date}_{end_date}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@finance_router.get("/transactions/export")
+def export_transactions(
+    platform: Optional[str] = None,
+    start_date: Optional[date] = Query(None),
+    end_date: Optional[date] = Query(None),
+    format: str = Query("csv", pattern="^(csv|parquet)$"),
+):
+    """Stream marketplace transactions (Money Trail) as CSV or Parquet"""
+    from app.services.export_service import ExportService, TRANSACTION_COLUMNS
+
+    rows = ExportService.transaction_rows(platform, start_date, end_date)
+    try:
+        return ExportService.response(
+            TRANSACTION_COLUMNS, rows, format,
+            f"transactions_{platform or 'all'}_{start_date or 'all'}_{end_date or 'all'}"
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
@@ -223,9 +223,7 @@ def download_invoice(order_id: str, db: Session = Depends(get_db)):
     Download the issued tax invoice PDF.
     """
     from fastapi.responses import HTMLResponse
-    from jinja2 import Environment, FileSystemLoader
     from app.services.invoice_service import InvoiceService
-    import os
     
     # Find order
     order = get_order_by_any_id(db, order_id)
@@ -241,22 +239,11 @@ def download_invoice(order_id: str, db: Session = Depends(get_db)):
     if profile.status != "ISSUED":
         raise HTTPException(status_code=400, detail="ใบกำกับภาษียังไม่ได้ออก")
     
-    # Generate invoice HTML (same as original tax-invoice endpoint but with InvoiceProfile data)
-    invoice_data = InvoiceService.get_invoice_data(db, order.id)
-    if not invoice_data:
+    # Same layout as the tax-invoice endpoint, with the number/date issued on the InvoiceProfile
+    html = InvoiceService.render_invoice_html(db, order.id, issued=True)
+    if not html:
         raise HTTPException(status_code=500, detail="ไม่สามารถสร้างใบกำกับภาษีได้")
     
-    # Override with InvoiceProfile data
-    invoice_data["invoice_number"] = profile.invoice_number
-    invoice_data["invoice_date"] = profile.invoice_date.strftime("%d/%m/%Y") if profile.invoice_date else datetime.now().strftime("%d/%m/%Y")
-    
-    # Render template
-    template_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "templates")
-    env = Environment(loader=FileSystemLoader(template_dir))
-    template = env.get_template("tax_invoice.html")
-    
-    html = template.render(**invoice_data)
-    
     return HTMLResponse(content=html)
 
 @invoice_request_router.get("/lookup")
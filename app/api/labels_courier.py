@@ -5,7 +5,7 @@ with SKU grouping for efficient packing workflow
 """
 from fastapi import APIRouter, Depends, HTTPException, Query
 from fastapi.responses import Response, JSONResponse
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.orm import Session
 from sqlalchemy import func
 from datetime import datetime, timezone
 from typing import Optional, List, Dict
@@ -13,8 +13,10 @@ import io
 import logging
 
 from app.core.database import get_db
+from app.core.cache import cached_response
 from app.models import OrderHeader, OrderItem
 from app.services.label_service import LabelService
+from app.services.order_service import resolve_sku_signatures
 
 router = APIRouter(prefix="/labels", tags=["Labels"])
 logger = logging.getLogger(__name__)
@@ -28,10 +30,24 @@ COURIER_MAP = {
 }
 
 
-def get_sku_group(items: List) -> str:
-    """Generate SKU group string for sorting (same as your script)"""
-    sorted_items = sorted(items, key=lambda x: x.sku or "")
-    return ",".join([f"{item.sku}={item.quantity}" for item in sorted_items if item.sku])
+def _filter_orders(query, status: str, channel: Optional[str] = None, courier: Optional[str] = None):
+    """Status / channel / courier filters shared by the label endpoints"""
+    query = query.filter(OrderHeader.status_normalized == status)
+    if channel:
+        query = query.filter(OrderHeader.channel_code == channel)
+    # Filter by courier (partial match for flexibility)
+    if courier and courier != "all":
+        query = query.filter(OrderHeader.courier_code.ilike(f"%{courier}%"))
+    return query
+
+
+def _sku_names(db: Session, status: str, channel: Optional[str] = None, courier: Optional[str] = None) -> Dict[str, str]:
+    """Product name per SKU of the filtered orders"""
+    query = _filter_orders(
+        db.query(OrderItem.sku, func.max(OrderItem.product_name)).join(OrderHeader),
+        status, channel, courier
+    )
+    return {sku: name for sku, name in query.group_by(OrderItem.sku).all()}
 
 
 @router.get("/platform-summary")
@@ -72,6 +88,7 @@ async def get_platform_summary(
 
 
 @router.get("/courier-summary")
+@cached_response(tags=lambda kw: [f"orders:status:{kw['status']}"], ttl=15)
 async def get_courier_summary(
     status: str = Query("READY_TO_SHIP", description="Order status to filter"),
     channel: Optional[str] = Query(None, description="Platform: tiktok, shopee, lazada, or None for all"),
@@ -134,50 +151,39 @@ async def get_sku_summary(
     """
     Get summary of orders grouped by SKU content (for selective printing).
     """
-    # Query orders for this courier (with eager loading for items)
-    query = db.query(OrderHeader).options(
-        joinedload(OrderHeader.items)
-    ).filter(
-        OrderHeader.status_normalized == status
-    )
-    
-    # Filter by channel if specified
-    if channel:
-        query = query.filter(OrderHeader.channel_code == channel)
-    
-    # Filter by courier (partial match for flexibility)
-    if courier and courier != "all":
-        query = query.filter(OrderHeader.courier_code.ilike(f"%{courier}%"))
-    
-    orders = query.all()
-    
-    # Group by SKU
-    sku_groups = {}
-    
-    for order in orders:
-        # Generate hashable group key
-        sku_key = get_sku_group(order.items)
-        if not sku_key:
-            sku_key = "No Items"
-            
-        if sku_key not in sku_groups:
-            sku_groups[sku_key] = {
-                "sku_key": sku_key,
-                "display_name": sku_key.replace(",", ", "),
-                "items": [{"sku": i.sku, "qty": i.quantity, "name": i.product_name} for i in order.items],
-                "count": 0,
-                "order_ids": []
-            }
-        
-        sku_groups[sku_key]["count"] += 1
-        sku_groups[sku_key]["order_ids"].append(order.external_order_id)
+    # Group on the stored item content signature
+    groups = _filter_orders(
+        db.query(
+            OrderHeader.sku_signature,
+            func.count(OrderHeader.id).label("count"),
+            func.array_agg(OrderHeader.external_order_id).label("order_ids")
+        ),
+        status, channel, courier
+    ).group_by(OrderHeader.sku_signature).all()
+    
+    names = _sku_names(db, status, channel, courier)
+    items_by_signature = resolve_sku_signatures(db, [group.sku_signature for group in groups])
+    
+    results = []
+    for group in groups:
+        sku_key = group.sku_signature or "No Items"
+        entries = items_by_signature[group.sku_signature]
+        results.append({
+            "sku_key": sku_key,
+            "display_name": ", ".join(f"{sku}={qty}" for sku, qty in entries) or "No Items",
+            "items": [
+                {"sku": sku, "qty": qty, "name": names.get(sku)}
+                for sku, qty in entries
+            ],
+            "count": group.count,
+            "order_ids": list(group.order_ids)
+        })
         
-    # Convert to list and sort by count (desc)
-    results = list(sku_groups.values())
+    # Sort by count (desc)
     results.sort(key=lambda x: x["count"], reverse=True)
     
     return {
-        "total_orders": len(orders),
+        "total_orders": sum(g["count"] for g in results),
         "groups": results
     }
 
@@ -199,56 +205,30 @@ async def get_labels_by_courier(
     - Max 100 labels per request (split for large batches)
     - Returns PDF file
     """
-    # Query orders for this courier (with eager loading for items)
-    query = db.query(OrderHeader).options(
-        joinedload(OrderHeader.items)
-    ).filter(
-        OrderHeader.status_normalized == status
-    )
-    
-    # Filter by channel if specified
-    if channel:
-        query = query.filter(OrderHeader.channel_code == channel)
+    query = _filter_orders(db.query(OrderHeader.external_order_id), status, channel, courier)
+    total_orders = query.count()
     
-    # Filter by courier (partial match for flexibility)
-    if courier and courier != "all":
-        query = query.filter(OrderHeader.courier_code.ilike(f"%{courier}%"))
-    
-    orders = query.all()
-    
-    if not orders:
+    if not total_orders:
         return JSONResponse(
             status_code=404,
             content={"error": f"No orders found for courier: {courier}"}
         )
     
-    # Add SKU group and sort
-    orders_with_group = []
-    for order in orders:
-        sku_group = get_sku_group(order.items)
-        orders_with_group.append({
-            "order": order,
-            "sku_group": sku_group,
-            "external_id": order.external_order_id
-        })
-    
+    # Sort by SKU group (indexed sku_signature); id keeps pages stable
     if sort_by_sku:
-        orders_with_group.sort(key=lambda x: x["sku_group"])
+        query = query.order_by(OrderHeader.sku_signature, OrderHeader.id)
+    else:
+        query = query.order_by(OrderHeader.id)
     
     # Paginate
-    start = (page - 1) * per_page
-    end = start + per_page
-    page_orders = orders_with_group[start:end]
+    order_ids = [r.external_order_id for r in query.offset((page - 1) * per_page).limit(per_page).all()]
     
-    if not page_orders:
+    if not order_ids:
         return JSONResponse(
             status_code=404,
             content={"error": f"No orders on page {page}"}
         )
     
-    # Get order IDs for label generation
-    order_ids = [o["external_id"] for o in page_orders]
-    
     # Generate PDF
     try:
         pdf_bytes = await LabelService.generate_batch_labels(db, order_ids)
@@ -262,19 +242,19 @@ async def get_labels_by_courier(
         # Filename with courier and page info
         courier_name = courier.replace(" ", "_")
         date_str = datetime.now().strftime("%d%m%Y")
-        total_pages = (len(orders_with_group) + per_page - 1) // per_page
+        total_pages = (total_orders + per_page - 1) // per_page
         
-        filename = f"{courier_name}_{date_str}_page{page}of{total_pages}_{len(page_orders)}labels.pdf"
+        filename = f"{courier_name}_{date_str}_page{page}of{total_pages}_{len(order_ids)}labels.pdf"
         
         return Response(
             content=pdf_bytes,
             media_type="application/pdf",
             headers={
                 "Content-Disposition": f'attachment; filename="{filename}"',
-                "X-Total-Orders": str(len(orders_with_group)),
+                "X-Total-Orders": str(total_orders),
                 "X-Page": str(page),
                 "X-Total-Pages": str(total_pages),
-                "X-Orders-This-Page": str(len(page_orders))
+                "X-Orders-This-Page": str(len(order_ids))
             }
         )
         
@@ -298,39 +278,29 @@ async def get_sku_packing_summary(
     
     Groups orders by identical SKU combinations for efficient picking.
     """
-    # Query orders (with eager loading for items)
-    query = db.query(OrderHeader).options(
-        joinedload(OrderHeader.items)
-    ).filter(
-        OrderHeader.status_normalized == status,
-        OrderHeader.channel_code == channel
-    )
-    
-    if courier:
-        query = query.filter(OrderHeader.courier_code.ilike(f"%{courier}%"))
-    
-    orders = query.all()
-    
-    # Group by SKU combination
-    sku_groups: Dict[str, dict] = {}
-    
-    for order in orders:
-        sku_group = get_sku_group(order.items)
-        
-        if sku_group not in sku_groups:
-            sku_groups[sku_group] = {
-                "sku_group": sku_group,
-                "items": [{"sku": item.sku, "qty": item.quantity} for item in order.items if item.sku],
-                "order_count": 0,
-                "order_ids": []
-            }
-        
-        sku_groups[sku_group]["order_count"] += 1
-        sku_groups[sku_group]["order_ids"].append(order.external_order_id)
+    groups = _filter_orders(
+        db.query(
+            OrderHeader.sku_signature,
+            func.count(OrderHeader.id).label("count"),
+            func.array_agg(OrderHeader.external_order_id).label("order_ids")
+        ),
+        status, channel, courier
+    ).group_by(OrderHeader.sku_signature).all()
+    
+    items_by_signature = resolve_sku_signatures(db, [group.sku_signature for group in groups])
+    sku_groups = [
+        {
+            "sku_group": group.sku_signature or "",
+            "items": [{"sku": sku, "qty": qty} for sku, qty in items_by_signature[group.sku_signature]],
+            "order_count": group.count,
+            "order_ids": list(group.order_ids)
+        }
+        for group in groups
+    ]
     
     # Sort by item name (like your script)
     sorted_groups = sorted(
-        sku_groups.values(),
+        sku_groups,
         key=lambda x: " ".join([i["sku"] for i in x["items"]])
     )
     
@@ -338,7 +308,7 @@ async def get_sku_packing_summary(
         "status": status,
         "channel": channel,
         "courier": courier,
-        "total_orders": len(orders),
+        "total_orders": sum(g["order_count"] for g in sku_groups),
         "unique_sku_groups": len(sorted_groups),
         "groups": sorted_groups
     }
@@ -358,66 +328,48 @@ async def print_batch_labels(
     max_per_file = min(data.get("max_per_file", 50), 100)
     sort_by_sku = data.get("sort_by_sku", True)
     
-    # Query orders WITH items for SKU grouping
-    query = db.query(OrderHeader).options(
-        joinedload(OrderHeader.items)
-    ).filter(
-        OrderHeader.status_normalized == status
-    )
-    
-    if channel:
-        query = query.filter(OrderHeader.channel_code == channel)
-    
-    if courier:
-        query = query.filter(OrderHeader.courier_code.ilike(f"%{courier}%"))
-    
-    orders = query.all()
+    # Item content per order, in the same order as /by-courier pages
+    query = _filter_orders(db.query(OrderHeader.sku_signature), status, channel, courier)
+    if sort_by_sku:
+        query = query.order_by(OrderHeader.sku_signature, OrderHeader.id)
+    else:
+        query = query.order_by(OrderHeader.id)
+    signatures = [r.sku_signature for r in query.all()]
     
-    if not orders:
+    if not signatures:
         return {"error": "No orders found", "total_orders": 0, "files": []}
     
-    # Sort by SKU group if requested
-    if sort_by_sku:
-        orders_with_group = []
-        for order in orders:
-            sku_group = get_sku_group(order.items)
-            orders_with_group.append({
-                "order": order,
-                "sku_group": sku_group
-            })
-        orders_with_group.sort(key=lambda x: x["sku_group"])
-        orders = [o["order"] for o in orders_with_group]
+    names = _sku_names(db, status, channel, courier)
+    items_by_signature = resolve_sku_signatures(db, signatures)
     
     # Split into batches and collect SKU preview
-    total_orders = len(orders)
+    total_orders = len(signatures)
     files = []
     
     for page_idx in range(0, total_orders, max_per_file):
-        page_orders = orders[page_idx:page_idx + max_per_file]
+        page_signatures = signatures[page_idx:page_idx + max_per_file]
         page_num = (page_idx // max_per_file) + 1
         
         # Collect SKU counts for this batch
         sku_counts = {}
-        for order in page_orders:
-            for item in order.items:
-                if item.sku:
-                    key = item.sku
-                    if key not in sku_counts:
-                        sku_counts[key] = {
-                            "sku": item.sku,
-                            "name": item.product_name or item.sku,
-                            "qty": 0,
-                            "orders": 0
-                        }
-                    sku_counts[key]["qty"] += item.quantity
-                    sku_counts[key]["orders"] += 1
+        for signature in page_signatures:
+            for sku, qty in items_by_signature[signature]:
+                if sku not in sku_counts:
+                    sku_counts[sku] = {
+                        "sku": sku,
+                        "name": names.get(sku) or sku,
+                        "qty": 0,
+                        "orders": 0
+                    }
+                sku_counts[sku]["qty"] += qty
+                sku_counts[sku]["orders"] += 1
         
         # Sort by quantity (top SKUs first)
         top_skus = sorted(sku_counts.values(), key=lambda x: -x["qty"])[:5]
         
         files.append({
             "page": page_num,
-            "orders": len(page_orders),
+            "orders": len(page_signatures),
             "url": f"/api/labels/by-courier?courier={courier or ''}&status={status}&channel={channel or ''}&page={page_num}&per_page={max_per_file}&sort_by_sku={sort_by_sku}",
             "preview": top_skus
         })
@@ -302,6 +302,33 @@ async def get_batch_detail(
     }
 
 
+@router.get("/batch/{batch_id}/pick-list")
+async def get_batch_pick_list(
+    batch_id: UUID,
+    explode_sets: bool = Query(True, description="Expand SET products into components"),
+    refresh: bool = Query(False, description="Bypass cache"),
+    db: Session = Depends(get_db)
+):
+    """
+    Aggregated pick list for a batch (cached per batch).
+    """
+    from app.services.pick_list_service import PickListService
+
+    batch = db.query(PackingBatch).filter(PackingBatch.id == batch_id).first()
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    items = PickListService.generate_batch_summary(db, str(batch_id), explode_sets=explode_sets, refresh=refresh)
+    return {
+        "batch_id": str(batch.id),
+        "batch_number": batch.batch_number,
+        "order_count": batch.order_count,
+        "sku_count": len(items),
+        "total_quantity": sum(item["quantity"] for item in items),
+        "items": items,
+    }
+
+
 @router.get("/pending-count")
 async def get_pending_order_count(
     platform: Optional[str] = Query(None),
@@ -3,7 +3,7 @@ Reconciliation API - Endpoints for data integrity checks
 """
 from fastapi import APIRouter, Depends, Query
 from sqlalchemy.orm import Session
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 from typing import Optional
 
 from app.core import get_db
@@ -59,6 +59,7 @@ def get_data_gaps(
 async def compare_with_marketplace(
     platform: str,
     date: date = Query(..., description="Date to compare (YYYY-MM-DD)"),
+    resync: bool = Query(default=False, description="Resync missing / stale orders"),
     db: Session = Depends(get_db)
 ):
     """
@@ -68,105 +69,61 @@ async def compare_with_marketplace(
     if platform not in ['tiktok', 'shopee', 'lazada']:
         return {"error": f"Invalid platform: {platform}"}
     
-    return await ReconciliationService.compare_with_marketplace(db, platform, date)
+    return await ReconciliationService.compare_with_marketplace(db, platform, date, resync=resync)
 
 
-@router.get("/live-compare/tiktok")
-async def live_compare_tiktok(
+@router.get("/results")
+def get_reconciliation_results(
+    days: int = Query(default=7, ge=1, le=90, description="Number of days to return"),
     db: Session = Depends(get_db)
 ):
     """
-    Live comparison: Show WeOrder TikTok data and attempt TikTok API comparison
-    Returns status counts from both systems
+    Stored per-shop reconciliation results (written by the reconciliation job)
     """
-    from app.models.integration import PlatformConfig
-    from app.models.order import OrderHeader
-    from datetime import datetime
-    from sqlalchemy import func
-    
-    # Get WeOrder counts by status for today
-    today = datetime.now().date()
-    start_of_day = datetime.combine(today, datetime.min.time())
-    
-    weorder_counts = {}
-    results = db.query(
-        OrderHeader.status_normalized,
-        func.count(OrderHeader.id)
-    ).filter(
-        OrderHeader.channel_code == 'tiktok',
-        OrderHeader.order_datetime >= start_of_day
-    ).group_by(OrderHeader.status_normalized).all()
+    from app.services.order_rollup_service import local_today
     
-    for status, count in results:
-        weorder_counts[status] = count
-    
-    weorder_total = sum(weorder_counts.values())
-    
-    # Try to get TikTok config
-    channel = db.query(PlatformConfig).filter(
-        PlatformConfig.platform == 'tiktok',
-        PlatformConfig.is_active == True
-    ).first()
-    
-    response = {
-        "date": today.isoformat(),
-        "weorder": {
-            "total": weorder_total,
-            "by_status": weorder_counts
-        }
+    today = local_today()
+    return {
+        "results": ReconciliationService.get_results(db, today - timedelta(days=days - 1), today)
     }
+
+
+@router.post("/run")
+async def run_reconciliation(
+    date: date = Query(default=None, description="Date to reconcile (YYYY-MM-DD), default: recent days"),
+    db: Session = Depends(get_db)
+):
+    """
+    Reconcile all active shops now and resync missing / stale orders
+    """
+    if date:
+        results = await ReconciliationService.reconcile_day(db, date)
+    else:
+        results = await ReconciliationService.reconcile_recent(db)
+    return {"results": results}
+
+
+@router.post("/audit")
+async def audit_completeness(
+    days: int = Query(default=90, ge=1, le=365, description="Number of days to audit"),
+    resync: bool = Query(default=True, description="Resync missing / stale orders"),
+    db: Session = Depends(get_db)
+):
+    """
+    Order-set completeness audit: per-day digest comparison with the
+    marketplace order lists, order-level diff only for days that differ
+    """
+    return await ReconciliationService.audit_completeness(db, days, resync=resync)
+
+
+@router.get("/live-compare/tiktok")
+async def live_compare_tiktok(
+    db: Session = Depends(get_db)
+):
+    """
+    Live comparison of today's TikTok orders with the TikTok order list
+    (read-only, no resync)
+    """
+    from app.services.order_rollup_service import local_today
     
-    if not channel:
-        response["tiktok_api"] = {"error": "No active TikTok channel configured"}
-        return response
-    
-    # Try to call TikTok API
-    try:
-        from app.integrations.tiktok import TikTokClient
-        
-        client = TikTokClient(
-            app_key=channel.app_key,
-            app_secret=channel.app_secret,
-            shop_id=channel.shop_id,
-            access_token=channel.access_token,
-            refresh_token=channel.refresh_token
-        )
-        
-        # Get orders from TikTok (today)
-        tiktok_data = await client.get_orders(
-            time_from=start_of_day,
-            time_to=datetime.now()
-        )
-        
-        tiktok_total = tiktok_data.get('total', 0)
-        tiktok_orders = tiktok_data.get('orders', [])
-        
-        # Count by status from TikTok
-        tiktok_counts = {}
-        for order in tiktok_orders:
-            status = order.get('status', 'UNKNOWN')
-            tiktok_counts[status] = tiktok_counts.get(status, 0) + 1
-        
-        # Calculate difference
-        difference = tiktok_total - weorder_total
-        match_rate = round(weorder_total / max(tiktok_total, 1) * 100, 1)
-        
-        response["tiktok_api"] = {
-            "total": tiktok_total,
-            "fetched_count": len(tiktok_orders),
-            "by_status": tiktok_counts
-        }
-        response["comparison"] = {
-            "difference": difference,
-            "match_rate": match_rate,
-            "status": "ok" if difference == 0 else ("warning" if abs(difference) < 10 else "critical")
-        }
-        
-    except Exception as e:
-        import traceback
-        response["tiktok_api"] = {
-            "error": str(e),
-            "traceback": traceback.format_exc()
-        }
-    
-    return response
+    return await ReconciliationService.compare_with_marketplace(db, 'tiktok', local_today())
@@ -1,14 +1,15 @@
 """
 API Router - JSON Endpoints
 """
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File, Form
 from fastapi.responses import RedirectResponse
 from sqlalchemy.orm import Session
 from typing import Optional, List
 from uuid import UUID
-from datetime import datetime
+from datetime import date, datetime
 
 from app.core import get_db
+from app.core.cache import cached_response, response_cache
 from app.models import (
     OrderHeader, OrderItem, Product, Warehouse, Company, SalesChannel,
     StockLedger, Promotion, PromotionAction, PrepackBox, PaymentReceipt,
@@ -17,7 +18,8 @@ from app.models import (
 from app.services import OrderService, ProductService, StockService, PromotionService, integration_service, ReplenishmentService
 from app.schemas.order import OrderCreate, OrderUpdate
 from app.schemas.product import ProductCreate, ProductUpdate
-from app.schemas.stock import StockMovementCreate
+from app.schemas.stock import StockMovementCreate, StockMovementBulkRequest, StockTransferBulkRequest
+from app.services.stock_service import BulkMovementError
 from app.schemas.return_schema import ReturnRequest
 
 # Import sub-routers
@@ -75,13 +77,18 @@ api_router.include_router(labels_courier_router)
 @api_router.get("/stock/replenishment")
 def get_replenishment_plan(
     days: int = Query(30, ge=7, le=90, description="Days to look back for velocity"),
+    history_days: int = Query(365, ge=28, le=730, description="Days of history for seasonality/outliers"),
+    service_level: float = Query(0.95, ge=0.8, le=0.99, description="Safety stock service level"),
     db: Session = Depends(get_db)
 ):
     """
     Get Smart Reorder Suggestions.
-    Calculates sales velocity (avg daily sales) and suggests reorder qty.
+    Forecasts daily demand (moving average, trend, weekday seasonality) and
+    suggests reorder qty per horizon including lead time and safety stock.
     """
-    return ReplenishmentService.get_replenishment_plan(db, days_lookback=days)
+    return ReplenishmentService.get_replenishment_plan(
+        db, days_lookback=days, history_days=history_days, service_level=service_level
+    )
 
 
 
@@ -91,9 +98,15 @@ def get_replenishment_plan(
 def api_status():
     return {"status": "ok", "version": "1.0.0", "timestamp": datetime.now().isoformat()}
 
+@api_router.get("/cache/status")
+def cache_status():
+    """Response cache backend and hit/miss counters"""
+    return response_cache.get_status()
+
 # ===================== DASHBOARD =====================
 
 @api_router.get("/dashboard/stats")
+@cached_response(tags=["orders"])
 def dashboard_stats(
     start_date: Optional[str] = Query(None),
     end_date: Optional[str] = Query(None),
@@ -104,56 +117,18 @@ def dashboard_stats(
 # ===================== ORDERS =====================
 
 @api_router.get("/orders/pick-list-summary")
-def get_pick_list_summary_fast(
+@cached_response(tags=lambda kw: [f"orders:status:{kw['status']}", "products"])
+def get_pick_list_summary(
     status: str = Query("PAID", description="Order status to aggregate"),
+    explode_sets: bool = Query(False, description="Expand SET products into components"),
     db: Session = Depends(get_db)
 ):
     """
-    Fast Pick List summary with server-side aggregation.
+    Pick List summary with server-side aggregation (mobile pick list).
     Returns aggregated SKU counts for all orders matching the status.
     """
-    from sqlalchemy import func
-    
-    query = db.query(
-        OrderItem.sku,
-        OrderItem.product_name,
-        func.sum(OrderItem.quantity).label('total_quantity'),
-        func.count(func.distinct(OrderItem.order_id)).label('order_count')
-    ).join(
-        OrderHeader, OrderItem.order_id == OrderHeader.id
-    ).filter(
-        OrderHeader.status_normalized == status,
-        OrderItem.sku.isnot(None),
-        OrderItem.sku != ''
-    ).group_by(
-        OrderItem.sku,
-        OrderItem.product_name
-    ).order_by(
-        func.sum(OrderItem.quantity).desc()
-    )
-    
-    results = query.all()
-    
-    order_count = db.query(func.count(OrderHeader.id)).filter(
-        OrderHeader.status_normalized == status
-    ).scalar() or 0
-    
-    items = [
-        {
-            "sku": row.sku,
-            "product_name": row.product_name or "-",
-            "total_quantity": int(row.total_quantity),
-            "order_count": int(row.order_count)
-        }
-        for row in results
-    ]
-    
-    return {
-        "items": items,
-        "order_count": order_count,
-        "sku_count": len(items),
-        "status": status
-    }
+    from app.services.pick_list_service import PickListService
+    return PickListService.summarize_by_status(db, status, explode_sets=explode_sets)
 
 @api_router.get("/orders")
 def list_orders(
@@ -166,57 +141,47 @@ def list_orders(
     sku_qty: Optional[str] = Query(None),  # Format: "L14-70G:2,L3-40G:1"
     date_field: str = Query("order_datetime", description="Field to filter by: order_datetime or returned_at"),
     page: int = Query(1, ge=1),
-    per_page: int = Query(50, ge=1, le=10000),
+    per_page: int = Query(50, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from next_cursor (keyset paging, ignores page)"),
+    exact_count: bool = Query(False, description="Count total exactly instead of the cached/estimated total"),
     db: Session = Depends(get_db)
 ):
-    # If sku_qty filter is specified, use specialized method
-    if sku_qty:
-        sku_qty_list = [s.strip() for s in sku_qty.split(",") if s.strip()]
-        orders, total = OrderService.get_orders_by_sku_qty(
-            db, sku_qty_list, channel, status, page, per_page
-        )
-    else:
-        orders, total = OrderService.get_orders(
-            db, channel, status, search, start_date, end_date, page, per_page, exclude_cancelled, date_field
+    sku_qty_list = [s.strip() for s in sku_qty.split(",") if s.strip()] if sku_qty else None
+    try:
+        result = OrderService.list_orders_lean(
+            db, channel, status, search, start_date, end_date, page, per_page,
+            exclude_cancelled, date_field, sku_qty_filters=sku_qty_list,
+            cursor=cursor, exact_count=exact_count
         )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return {
-        "orders": [
-            {
-                "id": str(o.id),
-                "external_order_id": o.external_order_id,
-                "channel_code": o.channel_code,
-                "customer_name": o.customer_name,
-                "customer_phone": o.customer_phone,
-                "total_amount": float(o.total_amount or 0),
-                "status_normalized": o.status_normalized,
-                "payment_status": o.payment_status or ("PAID" if o.status_normalized in ["PAID", "PACKING", "SHIPPED", "DELIVERED", "COMPLETED"] else "PENDING"),
-                "courier_code": o.courier_code or ((o.raw_payload or {}).get("packages") or [{}])[0].get("shipping_provider_name") or "-",
-                "tracking_number": o.tracking_number or ((o.raw_payload or {}).get("packages") or [{}])[0].get("tracking_number") or "",
-                "order_datetime": o.order_datetime.isoformat() if o.order_datetime else None,
-                "created_at": o.created_at.isoformat() if o.created_at else None,
-                "returned_at": o.returned_at.isoformat() if o.returned_at else None,
-                "return_reason": o.return_reason,
-                "items": [
-                    {
-                        "id": str(item.id),
-                        "sku": item.sku,
-                        "product_name": item.product_name,
-                        "quantity": item.quantity,
-                        "unit_price": float(item.unit_price or 0),
-                        "line_total": float(item.line_total or 0),
-                        "line_type": item.line_type
-                    }
-                    for item in o.items
-                ]
-            }
-            for o in orders
-        ],
-        "total": total,
+        **result,
         "page": page,
         "per_page": per_page
     }
 
 
+@api_router.get("/orders/export")
+def export_orders(
+    channel: Optional[str] = Query(None),
+    status: Optional[str] = Query(None),
+    start_date: Optional[str] = Query(None),
+    end_date: Optional[str] = Query(None),
+    exclude_cancelled: bool = Query(False),
+    date_field: str = Query("order_datetime", description="Field to filter by: order_datetime or returned_at"),
+    format: str = Query("csv", pattern="^(csv|parquet)$"),
+):
+    """Stream orders matching the list filters as CSV or Parquet"""
+    from app.services.export_service import ExportService, ORDER_COLUMNS
+
+    rows = ExportService.order_rows(channel, status, start_date, end_date, exclude_cancelled, date_field)
+    try:
+        return ExportService.response(ORDER_COLUMNS, rows, format, f"orders_{start_date or 'all'}_{end_date or 'all'}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @api_router.get("/orders/sku-summary")
 def get_sku_summary(
     channel: Optional[str] = Query(None),
@@ -334,8 +299,10 @@ def get_pending_collection_orders(
 # ============ BigSeller-Style Workflow APIs ============
 
 @api_router.get("/orders/status-counts")
+@cached_response(tags=["orders"], ttl=15)
 def get_status_counts(
     channel: Optional[str] = Query(None, description="Filter by platform"),
+    search: Optional[str] = Query(None, description="Order search term (same semantics as /orders)"),
     db: Session = Depends(get_db)
 ):
     """
@@ -343,18 +310,30 @@ def get_status_counts(
     Returns counts for: new_orders (PAID), in_process (PACKING), to_pickup (RTS)
     """
     from sqlalchemy import func
-    
-    query = db.query(
-        OrderHeader.status_normalized,
-        func.count(OrderHeader.id).label('count')
-    )
-    
-    if channel and channel.lower() != 'all':
-        query = query.filter(OrderHeader.channel_code.ilike(f"%{channel}%"))
-    
-    counts = query.filter(
-        OrderHeader.status_normalized.in_(["PAID", "PACKING", "READY_TO_SHIP"])
-    ).group_by(OrderHeader.status_normalized).all()
+    from app.services.order_search_service import OrderSearchService
+    from app.services.order_rollup_service import OrderRollupService
+    
+    statuses = ["PAID", "PACKING", "READY_TO_SHIP"]
+    if search:
+        # Search needs the orders themselves
+        query = db.query(
+            OrderHeader.status_normalized,
+            func.count(OrderHeader.id).label('count')
+        )
+        if channel and channel.lower() != 'all':
+            query = query.filter(OrderHeader.channel_code.ilike(f"%{channel}%"))
+        query = OrderSearchService.apply(db, query, search)
+        counts = query.filter(
+            OrderHeader.status_normalized.in_(statuses)
+        ).group_by(OrderHeader.status_normalized).all()
+    else:
+        by_status = {}
+        for (channel_code, status), count in OrderRollupService.get_status_totals(db, statuses).items():
+            # Same match as channel_code ILIKE '%channel%'
+            if channel and channel.lower() != 'all' and channel.lower() not in (channel_code or "").lower():
+                continue
+            by_status[status] = by_status.get(status, 0) + count
+        counts = by_status.items()
     
     result = {
         "new_orders": 0,      # PAID
@@ -376,24 +355,21 @@ def get_status_counts(
 
 
 @api_router.get("/orders/platform-summary")
+@cached_response(tags=["orders"], ttl=15)
 def get_platform_summary(db: Session = Depends(get_db)):
     """
     BigSeller-style platform summary.
     Returns order counts by platform and status for the Packing page header.
     """
-    from sqlalchemy import func, case
-    
-    # Query counts by platform and status
-    query = db.query(
-        OrderHeader.channel_code,
-        OrderHeader.status_normalized,
-        func.count(OrderHeader.id).label('count')
-    ).filter(
-        OrderHeader.status_normalized.in_(["PAID", "PACKING", "READY_TO_SHIP"])
-    ).group_by(
-        OrderHeader.channel_code,
-        OrderHeader.status_normalized
-    ).all()
+    from app.services.order_rollup_service import OrderRollupService
+    
+    # Counts by platform and status (daily rollup + today live)
+    query = [
+        (channel, status, count)
+        for (channel, status), count in OrderRollupService.get_status_totals(
+            db, ["PAID", "PACKING", "READY_TO_SHIP"]
+        ).items()
+    ]
     
     # Build result structure
     platforms = {}
@@ -546,6 +522,32 @@ async def arrange_shipment(data: dict, db: Session = Depends(get_db)):
         "message": f"Successfully arranged shipment for {success_count} orders"
     }
 
+@api_router.post("/orders/arrange-shipment/stream")
+async def arrange_shipment_stream(data: dict):
+    """
+    Arrange Shipment (RTS) with live progress
+    Input: { "ids": ["id1", "id2"] }
+    Output: newline-delimited JSON, one {"type": "result", ...} per order as it
+    finishes, then {"type": "summary", ...}
+    """
+    import json
+    from fastapi.responses import StreamingResponse
+    from app.core import SessionLocal
+
+    ids = data.get("ids", [])
+    if not ids:
+        raise HTTPException(status_code=400, detail="No IDs provided")
+
+    async def events():
+        db = SessionLocal()  # Outlives the request handler
+        try:
+            async for event in OrderService.iter_arrange_shipment(db, ids):
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        finally:
+            db.close()
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
 @api_router.post("/orders/{id}/return")
 def return_order(
     id: UUID, 
@@ -640,7 +642,8 @@ async def get_batch_labels(
         if filter_status:
            query = query.filter(OrderHeader.status_normalized == filter_status)
         if search:
-            query = query.filter(OrderHeader.external_order_id.ilike(f"%{search}%"))
+            from app.services.order_search_service import OrderSearchService
+            query = OrderSearchService.apply(db, query, search)
             
         # Limit to prevent overload
         BATCH_LIMIT = 200
@@ -883,6 +886,7 @@ def mark_orders_as_printed(
 @api_router.get("/orders/pick-list")
 def get_pick_list(
     ids: str = Query(..., description="Comma-separated order IDs"),
+    explode_sets: bool = Query(False, description="Expand SET products into components"),
     db: Session = Depends(get_db)
 ):
     """Generate Pick List (Product Summary)"""
@@ -894,7 +898,7 @@ def get_pick_list(
         raise HTTPException(status_code=400, detail="No order IDs provided")
         
     try:
-        items = PickListService.generate_summary(db, order_ids)
+        items = PickListService.generate_summary(db, order_ids, explode_sets=explode_sets)
     except Exception as e:
         return HTMLResponse(f"<h1>Error</h1><p>{str(e)}</p>")
         
@@ -971,62 +975,6 @@ def get_pick_list(
     return HTMLResponse(content=html)
 
 
-@api_router.get("/orders/pick-list-summary")
-def get_pick_list_summary(
-    status: str = Query("PAID", description="Order status to aggregate"),
-    db: Session = Depends(get_db)
-):
-    """
-    Generate Pick List summary with server-side aggregation.
-    Returns aggregated SKU counts for all orders matching the status.
-    Fast endpoint for mobile pick list.
-    """
-    from sqlalchemy import func
-    
-    # Aggregate directly in database - much faster than fetching all orders
-    query = db.query(
-        OrderItem.sku,
-        OrderItem.product_name,
-        func.sum(OrderItem.quantity).label('total_quantity'),
-        func.count(func.distinct(OrderItem.order_id)).label('order_count')
-    ).join(
-        OrderHeader, OrderItem.order_id == OrderHeader.id
-    ).filter(
-        OrderHeader.status_normalized == status,
-        OrderItem.sku.isnot(None),
-        OrderItem.sku != ''
-    ).group_by(
-        OrderItem.sku,
-        OrderItem.product_name
-    ).order_by(
-        func.sum(OrderItem.quantity).desc()
-    )
-    
-    results = query.all()
-    
-    # Get total order count
-    order_count = db.query(func.count(OrderHeader.id)).filter(
-        OrderHeader.status_normalized == status
-    ).scalar() or 0
-    
-    items = [
-        {
-            "sku": row.sku,
-            "product_name": row.product_name or "-",
-            "total_quantity": int(row.total_quantity),
-            "order_count": int(row.order_count)
-        }
-        for row in results
-    ]
-    
-    return {
-        "items": items,
-        "order_count": order_count,
-        "sku_count": len(items),
-        "status": status
-    }
-
-
 @api_router.get("/orders/sku-summary-thermal")
 def sku_summary_thermal(ids: str, db: Session = Depends(get_db)):
     """
@@ -1337,9 +1285,7 @@ async def get_order_label(order_id: str, db: Session = Depends(get_db)):
 def get_tax_invoice(order_id: str, db: Session = Depends(get_db)):
     """Generate Tax Invoice HTML for an order (only for DELIVERED/COMPLETED orders)"""
     from fastapi.responses import HTMLResponse
-    from jinja2 import Environment, FileSystemLoader
     from app.services.invoice_service import InvoiceService
-    import os
     
     try:
         order = OrderService.get_order_by_id(db, UUID(order_id))
@@ -1356,17 +1302,10 @@ def get_tax_invoice(order_id: str, db: Session = Depends(get_db)):
             status_code=400, 
             detail=f"ไม่สามารถออกใบกำกับภาษีได้ - คำสั่งซื้อต้องอยู่ในสถานะ 'จัดส่งสำเร็จ' หรือ 'เสร็จสิ้น' (สถานะปัจจุบัน: {order.status_normalized})"
         )
-    invoice_data = InvoiceService.get_invoice_data(db, order.id)
-    if not invoice_data:
+    html = InvoiceService.render_invoice_html(db, order.id)
+    if not html:
         raise HTTPException(status_code=500, detail="Failed to generate invoice data")
     
-    # Render template
-    template_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "templates")
-    env = Environment(loader=FileSystemLoader(template_dir))
-    template = env.get_template("tax_invoice.html")
-    
-    html = template.render(**invoice_data)
-    
     return HTMLResponse(content=html)
 
 
@@ -1478,6 +1417,7 @@ def list_warehouses(db: Session = Depends(get_db)):
 # ===================== STOCK =====================
 
 @api_router.get("/stock/summary")
+@cached_response(tags=["stock", "products"])
 def stock_summary(
     warehouse_id: Optional[str] = Query(None),
     search: Optional[str] = Query(None),
@@ -1532,6 +1472,26 @@ def stock_movements(
         for m in movements
     ]
 
+@api_router.get("/stock/movements/export")
+def export_stock_movements(
+    warehouse_id: Optional[str] = Query(None),
+    movement_type: Optional[str] = Query(None),
+    start_date: Optional[date] = Query(None),
+    end_date: Optional[date] = Query(None),
+    format: str = Query("csv", pattern="^(csv|parquet)$"),
+):
+    """Stream the stock ledger as CSV or Parquet"""
+    from app.services.export_service import ExportService, STOCK_LEDGER_COLUMNS
+
+    wh_id = UUID(warehouse_id) if warehouse_id else None
+    rows = ExportService.stock_ledger_rows(wh_id, movement_type, start_date, end_date)
+    try:
+        return ExportService.response(
+            STOCK_LEDGER_COLUMNS, rows, format, f"stock_ledger_{start_date or 'all'}_{end_date or 'all'}"
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @api_router.post("/stock/movements")
 def add_stock_movement(data: dict, db: Session = Depends(get_db)):
     movement_data = StockMovementCreate(
@@ -1548,41 +1508,87 @@ def add_stock_movement(data: dict, db: Session = Depends(get_db)):
     return {"id": str(movement.id)}
 
 
+@api_router.post("/stock/movements/bulk")
+def add_stock_movements_bulk(data: StockMovementBulkRequest, db: Session = Depends(get_db)):
+    """
+    Add many stock movements at once (all-or-nothing).
+    Rows reference products by product_id or sku and warehouses by id or code.
+    movement_type COUNT = counted quantity (cycle count), saved as ADJUST of the difference.
+    """
+    try:
+        return StockService.bulk_add_stock_movements(
+            db,
+            [m.model_dump() for m in data.movements],
+            reference_type=data.reference_type,
+            note=data.note,
+        )
+    except BulkMovementError as e:
+        raise HTTPException(status_code=400, detail={"message": str(e), "errors": e.errors})
+
+
+@api_router.post("/stock/movements/bulk-csv")
+async def add_stock_movements_csv(
+    file: UploadFile = File(...),
+    reference_type: Optional[str] = Form(None),
+    note: Optional[str] = Form(None),
+    db: Session = Depends(get_db)
+):
+    """
+    Upload a CSV of stock movements (all-or-nothing).
+    Columns: sku (or product_id), warehouse_code (or warehouse_id), movement_type, quantity,
+    optional location_id, reference_type, reference_id, note.
+    """
+    import csv
+    import io
+
+    content = (await file.read()).decode("utf-8-sig")
+    movements = [
+        {k.strip().lower(): (v.strip() if isinstance(v, str) else v) for k, v in row.items() if k}
+        for row in csv.DictReader(io.StringIO(content))
+    ]
+    movements = [m for m in movements if any(m.values())]
+
+    try:
+        return StockService.bulk_add_stock_movements(db, movements, reference_type=reference_type, note=note)
+    except BulkMovementError as e:
+        raise HTTPException(status_code=400, detail={"message": str(e), "errors": e.errors})
+
+
 @api_router.post("/stock/reset-to-zero")
 def reset_stock_to_zero(db: Session = Depends(get_db)):
     """
     Reset all negative stock to zero by adding IN movements.
     This is a one-time fix for missing initial stock.
     """
-    from sqlalchemy import func
-    
-    # Get current stock summary (products with negative stock)
-    summary = StockService.get_stock_summary(db)
-    
-    # Get default warehouse
-    warehouse = db.query(Warehouse).filter(Warehouse.is_active == True).first()
-    if not warehouse:
-        raise HTTPException(status_code=400, detail="No active warehouse found")
-    
-    fixed_count = 0
-    total_adjusted = 0
-    
-    for item in summary:
-        if item.get("on_hand", 0) < 0:
-            negative_qty = abs(item["on_hand"])
-            # Create IN movement to make stock zero
-            movement_data = StockMovementCreate(
-                warehouse_id=warehouse.id,
-                product_id=item["product_id"],  # Already UUID from summary
-                movement_type="IN",
-                quantity=negative_qty,
-                reference_type="STOCK_ADJUSTMENT",
-                note=f"Initial stock adjustment (auto-fix negative {negative_qty})"
-            )
-            StockService.add_stock_movement(db, movement_data)
-            fixed_count += 1
-            total_adjusted += negative_qty
-    
+    from sqlalchemy import func, case
+
+    on_hand = func.sum(
+        case(
+            (StockLedger.movement_type.in_(["IN", "RELEASE"]), StockLedger.quantity),
+            (StockLedger.movement_type.in_(["OUT", "RESERVE"]), -StockLedger.quantity),
+            (StockLedger.movement_type == "ADJUST", StockLedger.quantity),
+            else_=0
+        )
+    )
+    negatives = db.query(
+        StockLedger.warehouse_id, StockLedger.product_id, on_hand.label("on_hand")
+    ).group_by(StockLedger.warehouse_id, StockLedger.product_id).having(on_hand < 0).all()
+
+    movements = [
+        {
+            "warehouse_id": row.warehouse_id,
+            "product_id": row.product_id,
+            "movement_type": "IN",
+            "quantity": abs(int(row.on_hand)),
+            "reference_type": "STOCK_ADJUSTMENT",
+            "note": f"Initial stock adjustment (auto-fix negative {abs(int(row.on_hand))})",
+        }
+        for row in negatives
+    ]
+    StockService.bulk_add_stock_movements(db, movements)
+
+    fixed_count = len(movements)
+    total_adjusted = sum(m["quantity"] for m in movements)
     return {
         "success": True,
         "fixed_products": fixed_count,
@@ -1591,6 +1597,25 @@ def reset_stock_to_zero(db: Session = Depends(get_db)):
     }
 
 
+@api_router.get("/stock/sync-status")
+def get_stock_sync_status(db: Session = Depends(get_db)):
+    """Marketplace stock push status (pending dirty SKUs, push lag)"""
+    from app.services.stock_sync_service import StockSyncService, get_worker
+
+    return {
+        "worker": get_worker().get_status(),
+        **StockSyncService.get_sync_status(db),
+    }
+
+
+@api_router.post("/stock/sync-push")
+async def push_stock_now(db: Session = Depends(get_db)):
+    """Push all dirty SKUs to marketplaces now (skip debounce)"""
+    from app.services.stock_sync_service import StockSyncService
+
+    return await StockSyncService.push_pending(db, force=True)
+
+
 @api_router.get("/stock/card/{sku}")
 def get_stock_card(
     sku: str,
@@ -1612,28 +1637,33 @@ def get_stock_card(
     if not product:
         raise HTTPException(status_code=404, detail=f"Product with SKU '{sku}' not found")
     
-    # Build query
-    query = db.query(StockLedger).filter(StockLedger.product_id == product.id)
-    
-    if warehouse_id:
-        query = query.filter(StockLedger.warehouse_id == UUID(warehouse_id))
-    
     # Date filters
+    dt_start = dt_end = None
     if start_date:
         try:
             dt_start = datetime.combine(datetime.strptime(start_date, "%Y-%m-%d"), time.min)
-            query = query.filter(StockLedger.created_at >= dt_start)
         except:
             pass
     if end_date:
         try:
             dt_end = datetime.combine(datetime.strptime(end_date, "%Y-%m-%d"), time.max)
-            query = query.filter(StockLedger.created_at <= dt_end)
         except:
             pass
     
+    # Build query (includes archived ledger months when the range needs them)
+    from app.services.partition_service import PartitionService
+    Ledger = PartitionService.source_for_range(db, StockLedger, dt_start, dt_end)
+    query = db.query(Ledger).filter(Ledger.product_id == product.id)
+    
+    if warehouse_id:
+        query = query.filter(Ledger.warehouse_id == UUID(warehouse_id))
+    if dt_start:
+        query = query.filter(Ledger.created_at >= dt_start)
+    if dt_end:
+        query = query.filter(Ledger.created_at <= dt_end)
+    
     # Get all movements ordered by date (oldest first for running balance)
-    movements = query.order_by(StockLedger.created_at.asc()).limit(limit).all()
+    movements = query.order_by(Ledger.created_at.asc()).limit(limit).all()
     
     # Calculate running balance
     running_balance = 0
@@ -1852,12 +1882,36 @@ def transfer_stock(
 ):
     """Transfer stock between warehouses"""
     user_id = UUID("00000000-0000-0000-0000-000000000000") # Placeholder for system/admin
-    success = StockService.transfer_stock(
-        db,
-        from_wh=UUID(data["from_warehouse_id"]),
-        to_wh=UUID(data["to_warehouse_id"]),
-        product_id=UUID(data["product_id"]),
-        qty=int(data["quantity"]),
-        user_id=user_id
-    )
+    try:
+        success = StockService.transfer_stock(
+            db,
+            from_wh=UUID(data["from_warehouse_id"]),
+            to_wh=UUID(data["to_warehouse_id"]),
+            product_id=UUID(data["product_id"]),
+            qty=int(data["quantity"]),
+            user_id=user_id
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return {"success": success}
+
+@api_router.post("/stock/transfer/bulk")
+def transfer_stock_bulk(
+    data: StockTransferBulkRequest,
+    db: Session = Depends(get_db)
+):
+    """Transfer many products (e.g. a whole rack) between warehouses in one transaction"""
+    user_id = UUID("00000000-0000-0000-0000-000000000000") # Placeholder for system/admin
+    try:
+        return StockService.transfer_stock_bulk(
+            db,
+            from_wh=data.from_warehouse_id,
+            to_wh=data.to_warehouse_id,
+            items=[item.model_dump() for item in data.items],
+            user_id=user_id,
+            note=data.note,
+        )
+    except BulkMovementError as e:
+        raise HTTPException(status_code=400, detail={"message": str(e), "errors": e.errors})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -13,19 +13,22 @@ from typing import Optional
 from app.core.database import get_db
 from app.integrations.tiktok import TikTokClient
 from app.models.integration import PlatformConfig
+from app.services.tiktok_analytics_service import TikTokAnalyticsService
 
 router = APIRouter()
 
 
-async def get_tiktok_client(db: Session):
-    """Get configured TikTok client from database config"""
-    config = db.query(PlatformConfig).filter(
-        PlatformConfig.platform == 'tiktok',
-        PlatformConfig.is_active == True
-    ).first()
-    
+def get_tiktok_config(db: Session) -> PlatformConfig:
+    """Active TikTok config (404 if none)"""
+    config = TikTokAnalyticsService.get_config(db)
     if not config:
         raise HTTPException(status_code=404, detail="No active TikTok configuration found")
+    return config
+
+
+async def get_tiktok_client(db: Session):
+    """Get configured TikTok client from database config"""
+    config = get_tiktok_config(db)
     
     return TikTokClient(
         app_key=config.app_key,
@@ -50,14 +53,17 @@ async def get_gmv_breakdown(
     - showcase_gmv: ยอดขายจาก showcase  
     - direct_gmv: ยอดขายตรง
     - affiliate_commission: ค่าคอมมิชชั่น creator
+    
+    Aggregated from stored statement transactions; only statements not
+    stored yet are fetched from TikTok.
     """
-    client = await get_tiktok_client(db)
+    config = get_tiktok_config(db)
     
     time_to = datetime.now(timezone.utc)
     time_from = time_to - timedelta(days=days)
     
     try:
-        result = await client.get_gmv_breakdown(time_from, time_to)
+        result = await TikTokAnalyticsService.get_gmv_breakdown(db, config, time_from, time_to)
         return {
             "success": True,
             "period": {
@@ -133,32 +139,37 @@ async def get_creator_performance(
     """
     Get performance statistics for a specific creator
     
-    Returns video_gmv, live_gmv, commission earned
+    Returns video_gmv, live_gmv, commission earned (cached per creator)
     """
-    client = await get_tiktok_client(db)
+    config = get_tiktok_config(db)
     
     try:
-        result = await client.get_creator_performance(creator_id, days)
-        return {"success": True, "data": result}
+        result, computed_at = await TikTokAnalyticsService.get_creator_performance(config, creator_id, days)
+        return {"success": True, "data": result, "computed_at": computed_at.isoformat()}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
 
 @router.get("/sku-creative-count")
-async def get_sku_creative_count(db: Session = Depends(get_db)):
+async def get_sku_creative_count(
+    refresh: bool = Query(False, description="Recompute instead of using the cached counts"),
+    db: Session = Depends(get_db),
+):
     """
     Get creative count grouped by SKU (last 30 days)
     
     Returns: {sku: {video_count, live_count, total_orders}}
+    Served from a cache kept warm by a background job.
     """
-    client = await get_tiktok_client(db)
+    config = get_tiktok_config(db)
     
     try:
-        result = await client.get_sku_creative_count()
+        result, computed_at = await TikTokAnalyticsService.get_sku_creative_count(config, refresh=refresh)
         return {
             "success": True,
             "sku_count": len(result),
-            "data": result
+            "data": result,
+            "computed_at": computed_at.isoformat(),
         }
     except Exception as e:
         return {"success": False, "error": str(e), "data": {}}
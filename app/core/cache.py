@@ -0,0 +1,262 @@
+"""
+Response cache for hot read endpoints
+
+Entries are JSON bodies keyed by route + normalized query params and tagged
+with the entities they depend on ("orders", "orders:channel:shopee",
+"stock", ...). Each tag has a version counter; invalidating a tag bumps its
+version, and an entry whose tag versions no longer match is a miss.
+
+The default backend is an in-process LRU. Set CACHE_BACKEND_URL to a
+redis:// URL (with the optional redis package installed) to share entries
+and tag versions between workers.
+
+    @api_router.get("/orders/status-counts")
+    @cached_response(tags=["orders"], ttl=15)
+    def get_status_counts(...): ...
+
+Responses carry an ETag; a matching If-None-Match gets 304 Not Modified.
+"""
+import asyncio
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class LocalCacheBackend:
+    """In-process LRU with per-entry TTL (also the stand-in backend for tests)"""
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._tag_versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: dict, ttl: int):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def tag_versions(self, tags: Iterable[str]) -> Dict[str, int]:
+        with self._lock:
+            return {tag: self._tag_versions.get(tag, 0) for tag in tags}
+
+    def bump_tags(self, tags: Iterable[str]):
+        with self._lock:
+            for tag in tags:
+                self._tag_versions[tag] = self._tag_versions.get(tag, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tag_versions.clear()
+
+
+class RedisCacheBackend:
+    """Shared backend; entries and tag versions live in Redis"""
+
+    PREFIX = "weorder:cache:"
+
+    def __init__(self, url: str):
+        import redis  # Optional dependency
+        self._redis = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Optional[dict]:
+        raw = self._redis.get(self.PREFIX + key)
+        return json.loads(raw) if raw else None
+
+    def set(self, key: str, value: dict, ttl: int):
+        self._redis.set(self.PREFIX + key, json.dumps(value), ex=ttl)
+
+    def tag_versions(self, tags: Iterable[str]) -> Dict[str, int]:
+        tags = list(tags)
+        if not tags:
+            return {}
+        values = self._redis.mget([self.PREFIX + "tag:" + t for t in tags])
+        return {tag: int(v or 0) for tag, v in zip(tags, values)}
+
+    def bump_tags(self, tags: Iterable[str]):
+        pipe = self._redis.pipeline()
+        for tag in tags:
+            pipe.incr(self.PREFIX + "tag:" + tag)
+        pipe.execute()
+
+    def clear(self):
+        for key in self._redis.scan_iter(self.PREFIX + "*"):
+            self._redis.delete(key)
+
+
+class ResponseCache:
+    """Tag-versioned response cache over a backend"""
+
+    def __init__(self, backend=None):
+        self.backend = backend or LocalCacheBackend()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[dict]:
+        try:
+            entry = self.backend.get(key)
+            if entry and self.backend.tag_versions(entry["tags"]) == entry["tags"]:
+                self.hits += 1
+                return entry
+        except Exception as e:
+            logger.warning(f"Response cache read failed: {e}")
+        self.misses += 1
+        return None
+
+    def tag_versions(self, tags: Iterable[str]) -> Optional[Dict[str, int]]:
+        """Current versions of tags, taken before computing a response (None if unavailable)"""
+        try:
+            return self.backend.tag_versions(tags)
+        except Exception as e:
+            logger.warning(f"Response cache read failed: {e}")
+            return None
+
+    def set(self, key: str, body: bytes, tag_versions: Optional[Dict[str, int]], ttl: int) -> dict:
+        """
+        Store a body under the tag versions seen before it was computed, so an
+        invalidation that races with the computation still wins.
+        """
+        entry = {
+            "body": body.decode(),
+            "etag": '"' + hashlib.sha1(body).hexdigest()[:20] + '"',
+            "tags": tag_versions or {},
+        }
+        if tag_versions is not None:
+            try:
+                self.backend.set(key, entry, ttl)
+            except Exception as e:
+                logger.warning(f"Response cache write failed: {e}")
+        return entry
+
+    def invalidate(self, tags: Iterable[str]):
+        tags = set(tags)
+        if not tags:
+            return
+        try:
+            self.backend.bump_tags(tags)
+        except Exception as e:
+            logger.warning(f"Response cache invalidation failed: {e}")
+
+    def clear(self):
+        self.backend.clear()
+
+    def get_status(self) -> dict:
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def _create_backend():
+    url = settings.CACHE_BACKEND_URL
+    if url.startswith("redis://") or url.startswith("rediss://"):
+        try:
+            return RedisCacheBackend(url)
+        except ImportError:
+            logger.warning("CACHE_BACKEND_URL is set but redis is not installed; using in-process cache")
+    return LocalCacheBackend(settings.CACHE_MAX_ENTRIES)
+
+
+response_cache = ResponseCache(_create_backend())
+
+
+def invalidate_tags(tags: Iterable[str]):
+    """Invalidate cached responses depending on any of the tags"""
+    response_cache.invalidate(tags)
+
+
+def cache_key(request: Request) -> str:
+    """Route path + sorted, non-empty query params"""
+    params = sorted((k, v) for k, v in request.query_params.multi_items() if v != "")
+    return request.url.path + "?" + "&".join(f"{k}={v}" for k, v in params)
+
+
+def _respond(request: Request, entry: dict, hit: bool) -> Response:
+    headers = {
+        "ETag": entry["etag"],
+        "Cache-Control": "no-cache",  # Always revalidate; 304 keeps polling cheap
+        "X-Cache": "HIT" if hit else "MISS",
+    }
+    if_none_match = request.headers.get("if-none-match", "")
+    if entry["etag"] in [t.strip().removeprefix("W/") for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry["body"], media_type="application/json", headers=headers)
+
+
+def cached_response(tags: Union[List[str], Callable[[Dict[str, Any]], List[str]]], ttl: Optional[int] = None):
+    """
+    Cache a GET endpoint's JSON response.
+
+    tags: tags the response depends on, or a function of the endpoint's
+    keyword arguments returning them. ttl defaults to CACHE_DEFAULT_TTL_SECONDS.
+    Endpoints returning a Response object are passed through uncached.
+    """
+    def decorator(fn):
+        sig = inspect.signature(fn)
+        request_param = next((p.name for p in sig.parameters.values() if p.annotation is Request), None)
+        params = list(sig.parameters.values())
+        if request_param is None:
+            params.append(inspect.Parameter("_cache_request", inspect.Parameter.KEYWORD_ONLY, annotation=Request))
+
+        def lookup(kwargs):
+            request = kwargs[request_param] if request_param else kwargs.pop("_cache_request")
+            key = cache_key(request)
+            entry_tags = tags(kwargs) if callable(tags) else tags
+            return request, key, response_cache.tag_versions(entry_tags)
+
+        def store(request, key, versions, result):
+            if isinstance(result, Response):
+                return result
+            body = json.dumps(jsonable_encoder(result), ensure_ascii=False, separators=(",", ":")).encode()
+            entry = response_cache.set(key, body, versions, ttl or settings.CACHE_DEFAULT_TTL_SECONDS)
+            return _respond(request, entry, hit=False)
+
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                request, key, versions = lookup(kwargs)
+                entry = response_cache.get(key)
+                if entry:
+                    return _respond(request, entry, hit=True)
+                return store(request, key, versions, await fn(*args, **kwargs))
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                request, key, versions = lookup(kwargs)
+                entry = response_cache.get(key)
+                if entry:
+                    return _respond(request, entry, hit=True)
+                return store(request, key, versions, fn(*args, **kwargs))
+
+        wrapper.__signature__ = sig.replace(parameters=params)
+        return wrapper
+    return decorator
@@ -17,6 +17,34 @@ class Settings(BaseSettings):
     POSTGRES_DB: str = "weorder"
     POSTGRES_PORT: int = 5432
     
+    # Marketplace stock push
+    STOCK_SYNC_ENABLED: bool = False
+    STOCK_SYNC_DEBOUNCE_SECONDS: int = 10  # Quiet period after the last change of a SKU
+    STOCK_SYNC_MAX_WAIT_SECONDS: int = 60  # Push anyway if a SKU keeps changing
+    STOCK_SYNC_RETRY_SECONDS: int = 300  # Back-off before a failed SKU is pushed again
+    
+    # Table partitioning (see scripts/migrate_partitioning.py)
+    PARTITION_MONTHS_AHEAD: int = 3
+    PARTITION_ARCHIVE_AFTER_MONTHS: int = 0  # 0 = never detach old months into the archive schema
+    
+    # Response cache (app/core/cache.py); redis://... shares it between workers
+    CACHE_BACKEND_URL: str = ""
+    CACHE_MAX_ENTRIES: int = 1000
+    CACHE_DEFAULT_TTL_SECONDS: int = 30
+    
+    # Daily order rollup (see scripts/migrate_order_rollup.py)
+    ORDER_ROLLUP_RECONCILE_DAYS: int = 35  # Nightly rebuild window
+    
+    # Daily finance facts (see scripts/migrate_finance_facts.py)
+    FINANCE_FACT_RECONCILE_DAYS: int = 35  # Nightly rebuild window
+    
+    # Materialized order profit (see scripts/migrate_order_profit.py)
+    ORDER_PROFIT_BATCH_SIZE: int = 2000  # Orders recomputed per statement
+
+    # Marketplace reconciliation (see scripts/migrate_reconciliation_results.py)
+    RECONCILIATION_DAYS: int = 3  # Recent order days checked by the periodic job
+    RECONCILIATION_RESYNC_LIMIT: int = 500  # Orders resynced per shop and day per run
+
     # Paths
     DATA_PATH: str = os.getenv("DATA_PATH", "./data")
     LOGS_PATH: str = os.getenv("LOGS_PATH", "./logs")
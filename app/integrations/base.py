@@ -5,11 +5,42 @@ from abc import ABC, abstractmethod
 from typing import Optional, List, Dict, Any
 from datetime import datetime, timedelta
 from dataclasses import dataclass
+import asyncio
+import threading
+import time
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+class AsyncRateLimiter:
+    """
+    Simple rate limiter that spaces calls evenly (N calls per second).
+    Slots are reserved under a thread lock so one limiter can be shared
+    by clients running in different event loops (API vs scheduler).
+    """
+    
+    def __init__(self, calls_per_second: float):
+        self.interval = 1.0 / calls_per_second if calls_per_second > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+    
+    async def acquire(self):
+        """Wait until the next call slot is available"""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+# Shared limiters per platform/shop (clients are created per request)
+_rate_limiters: Dict[str, AsyncRateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
 @dataclass
 class NormalizedOrder:
     """
@@ -98,6 +129,10 @@ class BasePlatformClient(ABC):
     """
     PLATFORM_NAME: str = "base"
     
+    # Platform API limits
+    RATE_LIMIT_PER_SECOND: float = 10.0
+    STOCK_BATCH_SIZE: int = 50
+    
     def __init__(
         self,
         app_key: str,
@@ -227,11 +262,30 @@ class BasePlatformClient(ABC):
         raise NotImplementedError("Product sync not implemented for this platform")
     
     async def update_stock(self, sku: str, quantity: int) -> bool:
-        """Update stock on platform (optional implementation)"""
+        """Update stock for a single seller SKU on platform"""
+        result = await self.update_stock_batch([{"sku": sku, "quantity": quantity}])
+        return not result.get("failed")
+    
+    async def update_stock_batch(self, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Update stock for many SKUs (optional implementation)
+        items: [{sku, quantity, platform_item_id, platform_model_id}]
+        Returns: {success: [sku], failed: [{sku, error}]}
+        """
         raise NotImplementedError("Stock sync not implemented for this platform")
     
     # ========== Utilities ==========
     
+    def get_rate_limiter(self) -> AsyncRateLimiter:
+        """Get the shared rate limiter for this platform/shop"""
+        key = f"{self.PLATFORM_NAME}:{self.shop_id}"
+        with _rate_limiters_lock:
+            limiter = _rate_limiters.get(key)
+            if limiter is None:
+                limiter = AsyncRateLimiter(self.RATE_LIMIT_PER_SECOND)
+                _rate_limiters[key] = limiter
+        return limiter
+    
     def _build_headers(self) -> Dict[str, str]:
         """Build common request headers"""
         return {
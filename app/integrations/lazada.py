@@ -6,8 +6,9 @@ import hashlib
 import hmac
 import time
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from urllib.parse import urlencode
+from xml.sax.saxutils import escape
 import httpx
 import logging
 
@@ -21,6 +22,7 @@ class LazadaClient(BasePlatformClient):
     Lazada Open Platform API Client
     """
     PLATFORM_NAME = "lazada"
+    RATE_LIMIT_PER_SECOND = 5.0
     
     # API Endpoints (Thailand)
     BASE_URL = "https://api.lazada.co.th/rest"
@@ -260,6 +262,43 @@ class LazadaClient(BasePlatformClient):
             return data
         return data.get("items", [])
 
+    # ========== Product & Stock ==========
+
+    async def update_stock_batch(self, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Update sellable quantity for many SKUs
+        API: /product/stock/sellable/update (XML payload, max 50 SKUs per call)
+        """
+        limiter = self.get_rate_limiter()
+        result = {"success": [], "failed": []}
+
+        for i in range(0, len(items), self.STOCK_BATCH_SIZE):
+            chunk = items[i:i + self.STOCK_BATCH_SIZE]
+            skus_xml = ""
+            for item in chunk:
+                sku_xml = f"<SellerSku>{escape(str(item['sku']))}</SellerSku>"
+                if item.get("platform_item_id"):
+                    sku_xml += f"<ItemId>{escape(str(item['platform_item_id']))}</ItemId>"
+                if item.get("platform_model_id"):
+                    sku_xml += f"<SkuId>{escape(str(item['platform_model_id']))}</SkuId>"
+                sku_xml += f"<SellableQuantity>{max(int(item['quantity']), 0)}</SellableQuantity>"
+                skus_xml += f"<Sku>{sku_xml}</Sku>"
+            payload = f"<Request><Product><Skus>{skus_xml}</Skus></Product></Request>"
+
+            await limiter.acquire()
+            try:
+                await self._make_request(
+                    "/product/stock/sellable/update",
+                    method="POST",
+                    params={"payload": payload},
+                )
+                result["success"].extend(item["sku"] for item in chunk)
+            except Exception as e:
+                logger.error(f"Error updating Lazada stock: {e}")
+                result["failed"].extend({"sku": item["sku"], "error": str(e)} for item in chunk)
+
+        return result
+
     # ========== Finance ==========
 
     async def get_transaction_details(
@@ -20,6 +20,8 @@ class ShopeeClient(BasePlatformClient):
     Shopee Open Platform API Client
     """
     PLATFORM_NAME = "shopee"
+    RATE_LIMIT_PER_SECOND = 10.0
+    BUYER_INVOICE_BATCH_SIZE = 50  # order_sn_list limit of the order APIs
     
     # API Endpoints
     BASE_URL = "https://partner.shopeemobile.com"
@@ -304,33 +306,49 @@ class ShopeeClient(BasePlatformClient):
                 logger.error(f"Error fetching batch details: {e}")
                 
         return all_orders
+    
+    async def get_buyer_invoice_info_batch(self, order_sns: List[str]) -> Dict[str, Dict[str, Any]]:
         """
-        Get buyer invoice information for an order
+        Get buyer invoice information for up to BUYER_INVOICE_BATCH_SIZE orders
         API: /api/v2/order/get_buyer_invoice_info
-        Returns: {info: {name, address, tax_code, phone, ...}}
+        Returns: {order_sn: {name, address, tax_code, phone, ...}} for orders with a request
         """
+        if not order_sns:
+            return {}
+        if len(order_sns) > self.BUYER_INVOICE_BATCH_SIZE:
+            raise ValueError(f"At most {self.BUYER_INVOICE_BATCH_SIZE} orders per buyer invoice call")
+        
         await self.ensure_valid_token()
         
         path = "/api/v2/order/get_buyer_invoice_info"
         params = self._build_common_params(path)
-        params["order_sn_list"] = order_sn
+        params["order_sn_list"] = ",".join(order_sns)
+        
+        async with httpx.AsyncClient() as client:
+            response = await client.get(f"{self.BASE_URL}{path}", params=params)
+            self._log_api_call("GET", path, response.status_code)
+            data = response.json()
         
+        if data.get("error"):
+            raise Exception(f"Shopee API Error: {data.get('message')} ({data.get('error')})")
+        
+        # The API returns a list of invoice info, one per order with a request
+        invoices = {}
+        for entry in data.get("response", {}).get("invoice_list", []):
+            order_sn = entry.get("order_sn") or (order_sns[0] if len(order_sns) == 1 else None)
+            info = entry.get("info", entry)
+            if order_sn and info:
+                invoices[order_sn] = info
+        return invoices
+    
+    async def get_buyer_invoice_info(self, order_sn: str) -> Optional[Dict]:
+        """
+        Get buyer invoice information for an order
+        Returns: {info: {name, address, tax_code, phone, ...}}
+        """
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(f"{self.BASE_URL}{path}", params=params)
-                self._log_api_call("GET", path, response.status_code)
-                data = response.json()
-                
-                if data.get("error"):
-                    # Log but returns None to allow continuation
-                    logger.warning(f"Shopee get_buyer_invoice_info error for {order_sn}: {data.get('message')} ({data.get('error')})")
-                    return None
-                
-                # The API returns a list of invoice info
-                invoice_list = data.get("response", {}).get("invoice_list", [])
-                if invoice_list:
-                    return {"info": invoice_list[0]} 
-                return None
+            info = (await self.get_buyer_invoice_info_batch([order_sn])).get(order_sn)
+            return {"info": info} if info else None
         except Exception as e:
             logger.error(f"Error fetching buyer invoice info for {order_sn}: {e}")
             return None
@@ -393,7 +411,8 @@ class ShopeeClient(BasePlatformClient):
             shipped_at=shipped_at,
             
             items=items,
-            raw_payload=raw_order,
+            # Stamp the shop so per-shop follow-up calls (buyer invoices) can route the order
+            raw_payload={**raw_order, "shop_id": str(self.shop_id)},
         )
     
     
@@ -629,3 +648,69 @@ class ShopeeClient(BasePlatformClient):
         
         return None
 
+    # ========== Product & Stock ==========
+
+    async def update_stock_batch(self, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Push seller stock for many models
+        API: /api/v2/product/update_stock (one call per item_id, max 50 models)
+        """
+        await self.ensure_valid_token()
+        path = "/api/v2/product/update_stock"
+        limiter = self.get_rate_limiter()
+        result = {"success": [], "failed": []}
+
+        # Group models by item_id
+        by_item: Dict[str, List[Dict[str, Any]]] = {}
+        for item in items:
+            item_id = item.get("platform_item_id")
+            if not item_id:
+                result["failed"].append({"sku": item.get("sku"), "error": "Missing Shopee item_id"})
+                continue
+            by_item.setdefault(str(item_id), []).append(item)
+
+        for item_id, models in by_item.items():
+            for i in range(0, len(models), self.STOCK_BATCH_SIZE):
+                chunk = models[i:i + self.STOCK_BATCH_SIZE]
+                stock_list = [
+                    {
+                        "model_id": int(m.get("platform_model_id") or 0),
+                        "seller_stock": [{"stock": max(int(m["quantity"]), 0)}],
+                    }
+                    for m in chunk
+                ]
+
+                await limiter.acquire()
+                params = self._build_common_params(path)
+                try:
+                    async with httpx.AsyncClient() as client:
+                        response = await client.post(
+                            f"{self.BASE_URL}{path}",
+                            params=params,
+                            json={"item_id": int(item_id), "stock_list": stock_list},
+                        )
+                        self._log_api_call("POST", path, response.status_code)
+                        data = response.json()
+                except Exception as e:
+                    logger.error(f"Error updating Shopee stock for item {item_id}: {e}")
+                    result["failed"].extend({"sku": m.get("sku"), "error": str(e)} for m in chunk)
+                    continue
+
+                if data.get("error"):
+                    error = data.get("message") or data.get("error")
+                    result["failed"].extend({"sku": m.get("sku"), "error": error} for m in chunk)
+                    continue
+
+                # Per-model failures are reported in failure_list
+                failures = {
+                    str(f.get("model_id")): f.get("failed_reason")
+                    for f in data.get("response", {}).get("failure_list", [])
+                }
+                for m in chunk:
+                    model_key = str(int(m.get("platform_model_id") or 0))
+                    if model_key in failures:
+                        result["failed"].append({"sku": m.get("sku"), "error": failures[model_key]})
+                    else:
+                        result["success"].append(m.get("sku"))
+
+        return result
@@ -2,12 +2,13 @@
 TikTok Shop Open API Client - V2
 API Documentation: https://partner.tiktokshop.com/docv2
 """
+import asyncio
 import hashlib
 import hmac
 import time
 import json
 from datetime import datetime, timedelta, timezone
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from urllib.parse import urlencode
 import httpx
 import logging
@@ -17,16 +18,56 @@ from .base import BasePlatformClient, NormalizedOrder
 logger = logging.getLogger(__name__)
 
 
+def empty_gmv_breakdown() -> Dict[str, Any]:
+    return {
+        "video_gmv": 0,
+        "live_gmv": 0,
+        "showcase_gmv": 0,
+        "direct_gmv": 0,
+        "total_gmv": 0,
+        "affiliate_commission": 0,
+        "orders_by_type": {
+            "video": 0,
+            "live": 0,
+            "showcase": 0,
+            "direct": 0
+        }
+    }
+
+
+def gmv_content_type(sale_type: Optional[str], affiliate_commission: float) -> str:
+    """Content type of a statement transaction: video, live, showcase or direct"""
+    sale_type = (sale_type or "").upper()
+    if "VIDEO" in sale_type:
+        return "video"
+    if "LIVE" in sale_type:
+        return "live"
+    if "SHOWCASE" in sale_type or affiliate_commission > 0:
+        return "showcase"
+    return "direct"
+
+
+def add_gmv_transaction(result: Dict[str, Any], content_type: str, order_amount: float,
+                        affiliate_commission: float, order_count: int = 1):
+    """Add a transaction (or a pre-aggregated group of them) to a GMV breakdown"""
+    result[f"{content_type}_gmv"] += order_amount
+    result["orders_by_type"][content_type] += order_count
+    result["total_gmv"] += order_amount
+    result["affiliate_commission"] += affiliate_commission
+
+
 class TikTokClient(BasePlatformClient):
     """
     TikTok Shop Open API Client - V2
     """
     PLATFORM_NAME = "tiktok"
+    RATE_LIMIT_PER_SECOND = 10.0
     
     # API Endpoints - V2
     BASE_URL = "https://open-api.tiktokglobalshop.com"
     AUTH_URL = "https://auth.tiktok-shops.com/oauth/authorize"
     API_VERSION = "202309"  # V2 API version
+    STATEMENT_CONCURRENCY = 5  # Statements fetched in parallel (shared rate limiter)
     
     # Status mapping
     STATUS_MAP = {
@@ -444,6 +485,44 @@ class TikTokClient(BasePlatformClient):
             logger.error(f"Error shipping package {package_id}: {e}")
             raise e
     
+    async def update_stock_batch(self, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Update inventory for many SKUs (grouped by product)
+        API: /product/202309/products/{product_id}/inventory/update
+        """
+        limiter = self.get_rate_limiter()
+        result = {"success": [], "failed": []}
+
+        by_product: Dict[str, List[Dict[str, Any]]] = {}
+        for item in items:
+            if not item.get("platform_item_id") or not item.get("platform_model_id"):
+                result["failed"].append({"sku": item.get("sku"), "error": "Missing TikTok product_id/sku_id"})
+                continue
+            by_product.setdefault(str(item["platform_item_id"]), []).append(item)
+
+        for product_id, skus in by_product.items():
+            for i in range(0, len(skus), self.STOCK_BATCH_SIZE):
+                chunk = skus[i:i + self.STOCK_BATCH_SIZE]
+                body = {
+                    "skus": [
+                        {
+                            "id": str(s["platform_model_id"]),
+                            "inventory": [{"quantity": max(int(s["quantity"]), 0)}],
+                        }
+                        for s in chunk
+                    ]
+                }
+
+                await limiter.acquire()
+                try:
+                    path = f"/product/{self.API_VERSION}/products/{product_id}/inventory/update"
+                    await self._make_request(path, method="POST", body=body)
+                    result["success"].extend(s["sku"] for s in chunk)
+                except Exception as e:
+                    result["failed"].extend({"sku": s["sku"], "error": str(e)} for s in chunk)
+
+        return result
+    
     def normalize_order(self, raw_order: Dict[str, Any]) -> NormalizedOrder:
         """Convert TikTok order to normalized format"""
         recipient = raw_order.get("recipient_address", {})
@@ -920,6 +999,30 @@ class TikTokClient(BasePlatformClient):
             logger.error(f"Error fetching product creatives for {product_id}: {e}")
             return {"creatives": [], "next_page_token": None}
 
+    async def get_all_statements(self, time_from: datetime, time_to: datetime) -> List[Dict]:
+        """All statements in a time range (follows page tokens)"""
+        limiter = self.get_rate_limiter()
+        statements, cursor = [], None
+        while True:
+            await limiter.acquire()
+            resp = await self.get_statements(time_from, time_to, cursor, page_size=100)
+            statements.extend(resp.get("statements", []))
+            cursor = resp.get("next_page_token")
+            if not cursor:
+                return statements
+
+    async def get_all_statement_transactions(self, statement_id: str) -> List[Dict]:
+        """All transactions of a statement (follows page tokens)"""
+        limiter = self.get_rate_limiter()
+        transactions, cursor = [], None
+        while True:
+            await limiter.acquire()
+            resp = await self.get_statement_transactions(statement_id, cursor, page_size=100)
+            transactions.extend(resp.get("statement_transactions", []))
+            cursor = resp.get("next_page_token")
+            if not cursor:
+                return transactions
+
     async def get_gmv_breakdown(self, time_from: datetime, time_to: datetime) -> Dict:
         """
         Get GMV breakdown by content type (Video, Live, Showcase, Other)
@@ -930,61 +1033,28 @@ class TikTokClient(BasePlatformClient):
         - affiliate_commission: ค่าคอมมิชชั่น creator ทั้งหมด
         - direct_gmv: ยอดขายตรง (ไม่ผ่าน affiliate)
         
-        Note: This aggregates data from statement_transactions which has
-        affiliate_commission_amount field.
+        Live version (every statement fetched, STATEMENT_CONCURRENCY at a
+        time); TikTokAnalyticsService answers from ingested transactions.
         """
-        result = {
-            "video_gmv": 0,
-            "live_gmv": 0,
-            "showcase_gmv": 0,
-            "direct_gmv": 0,
-            "total_gmv": 0,
-            "affiliate_commission": 0,
-            "orders_by_type": {
-                "video": 0,
-                "live": 0,
-                "showcase": 0,
-                "direct": 0
-            }
-        }
+        result = empty_gmv_breakdown()
         
         try:
-            # Get statements for the period
-            statements_resp = await self.get_statements(time_from, time_to)
-            statements = statements_resp.get("statements", [])
+            statements = await self.get_all_statements(time_from, time_to)
+            sem = asyncio.Semaphore(self.STATEMENT_CONCURRENCY)
             
-            for statement in statements:
-                statement_id = statement.get("id")
-                if not statement_id:
-                    continue
-                    
-                # Get transactions for each statement
-                txn_resp = await self.get_statement_transactions(statement_id)
-                transactions = txn_resp.get("statement_transactions", [])
-                
+            async def fetch(statement_id):
+                async with sem:
+                    return await self.get_all_statement_transactions(statement_id)
+            
+            pages = await asyncio.gather(*(fetch(s["id"]) for s in statements if s.get("id")))
+            for transactions in pages:
                 for txn in transactions:
-                    order_amount = float(txn.get("order_amount", 0))
-                    affiliate_commission = float(txn.get("affiliate_commission_amount", 0))
-                    
-                    # Determine content type from transaction
-                    # TikTok transaction has "sale_type" or similar indicator
-                    sale_type = txn.get("sale_type", "").upper()
-                    
-                    if "VIDEO" in sale_type:
-                        result["video_gmv"] += order_amount
-                        result["orders_by_type"]["video"] += 1
-                    elif "LIVE" in sale_type:
-                        result["live_gmv"] += order_amount
-                        result["orders_by_type"]["live"] += 1
-                    elif "SHOWCASE" in sale_type or affiliate_commission > 0:
-                        result["showcase_gmv"] += order_amount
-                        result["orders_by_type"]["showcase"] += 1
-                    else:
-                        result["direct_gmv"] += order_amount
-                        result["orders_by_type"]["direct"] += 1
-                    
-                    result["total_gmv"] += order_amount
-                    result["affiliate_commission"] += affiliate_commission
+                    add_gmv_transaction(
+                        result,
+                        gmv_content_type(txn.get("sale_type"), float(txn.get("affiliate_commission_amount") or 0)),
+                        float(txn.get("order_amount") or 0),
+                        float(txn.get("affiliate_commission_amount") or 0),
+                    )
             
             logger.info(f"TikTok GMV Breakdown: Video={result['video_gmv']}, Live={result['live_gmv']}, Total={result['total_gmv']}")
             return result
@@ -0,0 +1,220 @@
+"""
+Maintenance Jobs - Periodic housekeeping run by the in-app scheduler
+"""
+import logging
+
+from app.core import settings
+from app.core.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+def run_partition_maintenance():
+    """Create upcoming monthly partitions and archive old ones (if enabled)"""
+    from app.services.partition_service import PartitionService, PARTITIONED_TABLES
+
+    db = SessionLocal()
+    try:
+        created = PartitionService.ensure_partitions(db, months_ahead=settings.PARTITION_MONTHS_AHEAD)
+        if any(created.values()):
+            logger.info(f"[PARTITION] Created partitions: {created}")
+
+        if settings.PARTITION_ARCHIVE_AFTER_MONTHS > 0:
+            for table in PARTITIONED_TABLES:
+                PartitionService.archive_partitions(db, table, settings.PARTITION_ARCHIVE_AFTER_MONTHS)
+    except Exception as e:
+        logger.error(f"Partition maintenance failed: {e}")
+    finally:
+        db.close()
+
+
+def run_order_rollup_refresh():
+    """Recompute dirty slices of the daily order rollup"""
+    from app.services.order_rollup_service import OrderRollupService
+
+    db = SessionLocal()
+    try:
+        refreshed = OrderRollupService.refresh_dirty(db)
+        if refreshed:
+            logger.info(f"[ROLLUP] Refreshed {refreshed} dirty slices")
+    except Exception as e:
+        logger.error(f"Order rollup refresh failed: {e}")
+    finally:
+        db.close()
+
+
+def run_order_rollup_reconcile():
+    """Rebuild recent days of the daily order rollup from order_header"""
+    from app.services.order_rollup_service import OrderRollupService
+
+    db = SessionLocal()
+    try:
+        rows = OrderRollupService.reconcile(db, settings.ORDER_ROLLUP_RECONCILE_DAYS)
+        logger.info(f"[ROLLUP] Reconciled last {settings.ORDER_ROLLUP_RECONCILE_DAYS} days ({rows} rows)")
+    except Exception as e:
+        logger.error(f"Order rollup reconcile failed: {e}")
+    finally:
+        db.close()
+
+
+def run_order_profit_refresh():
+    """Recompute order_profit for orders queued since the last run"""
+    from app.services.profit_service import ProfitService
+
+    db = SessionLocal()
+    try:
+        refreshed = ProfitService.refresh_dirty(db)
+        if refreshed:
+            logger.info(f"[PROFIT] Recomputed {refreshed} orders")
+    except Exception as e:
+        logger.error(f"Order profit refresh failed: {e}")
+    finally:
+        db.close()
+
+
+def run_finance_fact_refresh():
+    """Recompute dirty slices of the daily finance facts"""
+    from app.services.finance_fact_service import FinanceFactService
+
+    db = SessionLocal()
+    try:
+        refreshed = FinanceFactService.refresh_dirty(db)
+        if refreshed:
+            logger.info(f"[FINANCE] Refreshed {refreshed} dirty fact slices")
+    except Exception as e:
+        logger.error(f"Finance fact refresh failed: {e}")
+    finally:
+        db.close()
+
+
+def run_finance_fact_reconcile():
+    """Rebuild recent days of the daily finance facts from the raw tables"""
+    from app.services.finance_fact_service import FinanceFactService
+
+    db = SessionLocal()
+    try:
+        rows = FinanceFactService.reconcile(db, settings.FINANCE_FACT_RECONCILE_DAYS)
+        logger.info(f"[FINANCE] Reconciled last {settings.FINANCE_FACT_RECONCILE_DAYS} days ({rows} rows)")
+    except Exception as e:
+        logger.error(f"Finance fact reconcile failed: {e}")
+    finally:
+        db.close()
+
+
+def run_tiktok_analytics_refresh():
+    """Recompute cached TikTok creative analytics so reads never wait on the API"""
+    import asyncio
+    from app.services.tiktok_analytics_service import TikTokAnalyticsService
+
+    db = SessionLocal()
+    try:
+        config = TikTokAnalyticsService.get_config(db)
+        if config:
+            result, _ = asyncio.run(TikTokAnalyticsService.get_sku_creative_count(config, refresh=True))
+            logger.info(f"[TIKTOK] Refreshed SKU creative count ({len(result)} SKUs)")
+    except Exception as e:
+        logger.error(f"TikTok analytics refresh failed: {e}")
+    finally:
+        db.close()
+
+
+def run_marketplace_reconciliation():
+    """Compare recent order days with the marketplace order lists and resync the differences"""
+    import asyncio
+    from app.services.reconciliation_service import ReconciliationService
+
+    db = SessionLocal()
+    try:
+        results = asyncio.run(ReconciliationService.reconcile_recent(db))
+        missing = sum(r.get("missing_count", 0) for r in results)
+        resynced = sum(r.get("resynced_count", 0) for r in results)
+        logger.info(
+            f"[RECONCILE] Checked {len(results)} shop-days: "
+            f"resynced={resynced}, still missing={missing}"
+        )
+    except Exception as e:
+        logger.error(f"Marketplace reconciliation failed: {e}")
+    finally:
+        db.close()
+
+
+def register_maintenance_jobs(scheduler):
+    """Register housekeeping jobs on an APScheduler instance"""
+    from datetime import datetime
+
+    scheduler.add_job(
+        func=run_partition_maintenance,
+        trigger="cron",
+        hour=3,
+        minute=0,
+        id="partition_maintenance",
+        name="Partition Maintenance",
+        replace_existing=True,
+    )
+    # Make sure the current month exists right after startup
+    scheduler.add_job(
+        func=run_partition_maintenance,
+        trigger="date",
+        run_date=datetime.now(),
+        id="partition_maintenance_init",
+        name="Partition Maintenance (startup)",
+        replace_existing=True,
+    )
+    scheduler.add_job(
+        func=run_order_rollup_refresh,
+        trigger="interval",
+        minutes=5,
+        id="order_rollup_refresh",
+        name="Order Rollup Refresh",
+        replace_existing=True,
+    )
+    scheduler.add_job(
+        func=run_order_rollup_reconcile,
+        trigger="cron",
+        hour=2,
+        minute=30,
+        id="order_rollup_reconcile",
+        name="Order Rollup Reconcile",
+        replace_existing=True,
+    )
+    scheduler.add_job(
+        func=run_order_profit_refresh,
+        trigger="interval",
+        minutes=5,
+        id="order_profit_refresh",
+        name="Order Profit Refresh",
+        replace_existing=True,
+    )
+    scheduler.add_job(
+        func=run_finance_fact_refresh,
+        trigger="interval",
+        minutes=5,
+        id="finance_fact_refresh",
+        name="Finance Fact Refresh",
+        replace_existing=True,
+    )
+    scheduler.add_job(
+        func=run_finance_fact_reconcile,
+        trigger="cron",
+        hour=2,
+        minute=45,
+        id="finance_fact_reconcile",
+        name="Finance Fact Reconcile",
+        replace_existing=True,
+    )
+    scheduler.add_job(
+        func=run_tiktok_analytics_refresh,
+        trigger="interval",
+        minutes=20,
+        id="tiktok_analytics_refresh",
+        name="TikTok Analytics Refresh",
+        replace_existing=True,
+    )
+    scheduler.add_job(
+        func=run_marketplace_reconciliation,
+        trigger="interval",
+        hours=1,
+        id="marketplace_reconciliation",
+        name="Marketplace Reconciliation",
+        replace_existing=True,
+    )
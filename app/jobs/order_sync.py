@@ -48,6 +48,10 @@ class OrderSyncScheduler:
                 name='Initialize Platform Syncs',
                 replace_existing=True
             )
+            
+            # Housekeeping (partitions, ...)
+            from app.jobs.maintenance import register_maintenance_jobs
+            register_maintenance_jobs(self.scheduler)
     
     def stop(self):
         """Stop the scheduler"""
@@ -3,11 +3,15 @@ from .master import Company, Warehouse, SalesChannel, Department, AppUser, Role,
 from .product import Product, ProductSetBom
 from .customer import CustomerAccount
 from .order import OrderHeader, OrderItem, OrderMemo
+from .order_rollup import OrderDailyRollup, OrderRollupDirty
 from .stock import StockLedger, StockBalance, Location
+from .stock_sync import StockSyncState
 from .prepack import PrepackBox, PrepackBoxItem, PackingSession
 from .promotion import Promotion, PromotionAction
 from .finance import RefundLedger, PlatformFeeLedger, PaymentReceipt, PaymentAllocation
-from .profit import OrderProfit
+from .finance_fact import FinanceDailyFact, FinanceFactDirty
+from .profit import OrderProfit, OrderProfitDirty
+from .reconciliation import ReconciliationResult
 from .invoice import InvoiceProfile
 from .loyalty import LoyaltyLink, LoyaltyEarnTx
 from .audit import AuditLog
@@ -28,17 +32,18 @@ __all__ = [
     # Customer
     "CustomerAccount",
     # Order
-    "OrderHeader", "OrderItem", "OrderMemo",
+    "OrderHeader", "OrderItem", "OrderMemo", "OrderDailyRollup", "OrderRollupDirty",
     # Stock
-    "StockLedger", "StockBalance", "Location",
+    "StockLedger", "StockBalance", "Location", "StockSyncState",
     # Prepack
     "PrepackBox", "PrepackBoxItem", "PackingSession",
     # Promotion
     "Promotion", "PromotionAction",
     # Finance
     "RefundLedger", "PlatformFeeLedger", "PaymentReceipt", "PaymentAllocation",
+    "FinanceDailyFact", "FinanceFactDirty",
     # Profit
-    "OrderProfit",
+    "OrderProfit", "OrderProfitDirty",
     # Invoice
     "InvoiceProfile",
     # Loyalty
@@ -46,7 +51,7 @@ __all__ = [
     # Audit
     "AuditLog",
     # Integration
-    "PlatformConfig", "SyncJob", "WebhookLog",
+    "PlatformConfig", "SyncJob", "WebhookLog", "ReconciliationResult",
     # Mappings
     "PlatformListing", "PlatformListingItem",
     # Sync
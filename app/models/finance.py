@@ -1,7 +1,7 @@
 """
 Finance & Payment Models
 """
-from sqlalchemy import Column, String, Numeric, DateTime, ForeignKey, Text
+from sqlalchemy import Column, String, Numeric, DateTime, ForeignKey, Text, Index
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -101,6 +101,43 @@ class MarketplaceTransaction(Base, UUIDMixin, TimestampMixin):
     description = Column(Text)
     payout_reference = Column(String(100))  # Batch ID / Escrow ID
     raw_data = Column(JSONB)  # Full payload from API
+    
+    # Idempotency key parts, '' when not applicable (see scripts/migrate_finance_idempotency.py)
+    shop_id = Column(String(100), nullable=False, server_default="")
+    external_order_id = Column(String(100), nullable=False, server_default="")
+    statement_id = Column(String(100), nullable=False, server_default="")
+    external_txn_id = Column(String(100), nullable=False, server_default="")  # Platform txn id / source field
+    
+    # Fee components extracted from raw_data at ingest (NULL when the payload has none)
+    gross_sales_amount = Column(Numeric(12, 2))
+    settlement_amount = Column(Numeric(12, 2))
+    fee_amount = Column(Numeric(12, 2))  # Total deductions
+    platform_commission_amount = Column(Numeric(12, 2))
+    affiliate_commission_amount = Column(Numeric(12, 2))
+    affiliate_ads_commission_amount = Column(Numeric(12, 2))
+    affiliate_partner_commission_amount = Column(Numeric(12, 2))
+    ams_commission_amount = Column(Numeric(12, 2))  # Shopee affiliate (AMS)
+    shipping_fee_amount = Column(Numeric(12, 2))
+    actual_shipping_fee_amount = Column(Numeric(12, 2))
+    platform_shipping_discount_amount = Column(Numeric(12, 2))
+    customer_paid_shipping_amount = Column(Numeric(12, 2))
+    referral_fee_amount = Column(Numeric(12, 2))
+    retail_delivery_fee_amount = Column(Numeric(12, 2))
+    fbt_fee_amount = Column(Numeric(12, 2))
+    
+    __table_args__ = (
+        # Fee reports aggregate by platform over a date range
+        Index("ix_marketplace_transaction_platform_date", "platform", "transaction_date"),
+        # Statement-level reads (TikTok GMV breakdown)
+        Index("ix_marketplace_transaction_statement", "platform", "shop_id", "statement_id"),
+        # Finance sync upserts on this key; transaction_date is the partition key
+        Index(
+            "ix_marketplace_transaction_idempotency",
+            "platform", "shop_id", "external_order_id", "statement_id",
+            "transaction_type", "external_txn_id", "transaction_date",
+            unique=True,
+        ),
+    )
 
 
 class InternalExpense(Base, UUIDMixin, TimestampMixin):
@@ -0,0 +1,47 @@
+"""
+Finance Fact Models - Daily finance aggregates for the performance dashboard
+"""
+from sqlalchemy import Column, String, Integer, Numeric, Date, DateTime
+from sqlalchemy.sql import func
+from app.core import Base
+
+
+class FinanceDailyFact(Base):
+    """
+    Finance sums per (local date, platform, shop, transaction type).
+    Marketplace transactions aggregate by transaction_date; orders placed
+    that day aggregate into the ORDER_FACT_TYPE row of their channel.
+    Rebuilt per (date, platform) slice by FinanceFactService.
+    """
+    __tablename__ = "finance_daily_fact"
+    
+    fact_date = Column(Date, primary_key=True)  # In settings.TIMEZONE
+    platform = Column(String(50), primary_key=True)
+    shop_id = Column(String(100), primary_key=True, default="")
+    transaction_type = Column(String(100), primary_key=True)
+    
+    # Marketplace transactions
+    tx_count = Column(Integer, default=0, nullable=False)
+    amount = Column(Numeric(14, 2), default=0, nullable=False)  # SUM(amount), signed
+    gross_sales = Column(Numeric(14, 2), default=0, nullable=False)
+    shipping_income = Column(Numeric(14, 2), default=0, nullable=False)  # Paid by customer
+    fee_total = Column(Numeric(14, 2), default=0, nullable=False)
+    shipping_cost = Column(Numeric(14, 2), default=0, nullable=False)
+    settlement = Column(Numeric(14, 2), default=0, nullable=False)  # Payout
+    
+    # Orders placed (ORDER_FACT_TYPE rows)
+    order_count = Column(Integer, default=0, nullable=False)  # Not cancelled/returned
+    order_revenue = Column(Numeric(14, 2), default=0, nullable=False)  # SUM(total_amount), not cancelled/returned
+    order_shipping_income = Column(Numeric(14, 2), default=0, nullable=False)
+    cogs = Column(Numeric(14, 2), default=0, nullable=False)  # standard_cost, not cancelled
+    
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class FinanceFactDirty(Base):
+    """(date, platform) slices of finance_daily_fact waiting to be recomputed"""
+    __tablename__ = "finance_fact_dirty"
+    
+    fact_date = Column(Date, primary_key=True)
+    platform = Column(String(50), primary_key=True)
+    marked_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
@@ -19,6 +19,7 @@ class PlatformType(str, enum.Enum):
 class SyncJobType(str, enum.Enum):
     POLL = "POLL"
     WEBHOOK = "WEBHOOK"
+    INVOICE = "INVOICE"  # Buyer-invoice sync (InvoiceSyncService)
 
 
 class SyncJobStatus(str, enum.Enum):
@@ -80,7 +81,7 @@ class SyncJob(Base):
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     platform_config_id = Column(UUID(as_uuid=True), ForeignKey("platform_config.id"), nullable=False)
     
-    job_type = Column(String(20), default="POLL")  # POLL, WEBHOOK
+    job_type = Column(String(20), default="POLL")  # POLL, WEBHOOK, INVOICE
     started_at = Column(DateTime, default=datetime.utcnow)
     finished_at = Column(DateTime)
     status = Column(String(20), default="RUNNING")  # RUNNING, SUCCESS, FAILED
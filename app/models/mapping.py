@@ -16,6 +16,11 @@ class PlatformListing(Base, UUIDMixin, TimestampMixin):
     platform_sku = Column(String(100), nullable=False, index=True) # The SKU string from the channel
     name = Column(String(300)) # Name of the listing (optional, can sync from platform)
     
+    # Platform identifiers used for stock push (item/model on Shopee, product/sku on TikTok, ItemId/SkuId on Lazada)
+    shop_id = Column(String(100)) # NULL = push to every active shop of the platform
+    platform_item_id = Column(String(100))
+    platform_model_id = Column(String(100))
+    
     # Relationships
     items = relationship("PlatformListingItem", back_populates="listing", cascade="all, delete-orphan")
 
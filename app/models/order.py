@@ -1,7 +1,7 @@
 """
 Order Models
 """
-from sqlalchemy import Column, String, Numeric, Integer, Boolean, DateTime, ForeignKey, Text, Index
+from sqlalchemy import Column, String, Numeric, Integer, Boolean, DateTime, ForeignKey, Text, Index, DDL, event
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import relationship
 from app.core import Base
@@ -92,6 +92,14 @@ class OrderHeader(Base, UUIDMixin, TimestampMixin):
     # Raw data from platform
     raw_payload = Column(JSONB)
     
+    # Normalized id/tracking/name/phone text, kept by OrderSearchService
+    search_text = Column(Text)
+    
+    # Item content "SKU=qty,..." (one entry per SKU, byte order) and total quantity,
+    # kept by OrderService.refresh_sku_signatures
+    sku_signature = Column(String(1000, collation="C"))
+    item_count = Column(Integer, default=0)
+    
     # Relationships
     company = relationship("Company", back_populates="orders")
     warehouse = relationship("Warehouse", back_populates="orders")
@@ -103,19 +111,31 @@ class OrderHeader(Base, UUIDMixin, TimestampMixin):
     creator = relationship("AppUser", foreign_keys=[created_by], back_populates="orders_created")
     sales_person = relationship("AppUser", foreign_keys=[sales_by], back_populates="orders_sold")
     payments = relationship("PaymentAllocation", back_populates="order")
-    profit = relationship("OrderProfit", back_populates="order", uselist=False)
+    profit = relationship("OrderProfit", back_populates="order", uselist=False, cascade="all, delete-orphan")
     
     # Unique constraint for channel + external_order_id
     __table_args__ = (
         Index("ix_order_channel_external", channel_code, external_order_id, unique=True),
+        Index("ix_order_header_order_datetime_brin", order_datetime, postgresql_using="brin"),
+        # Keyset pagination of the order list: ORDER BY order_datetime DESC, id DESC
+        Index("ix_order_header_datetime_id", "order_datetime", "id"),
+        # Order search (OrderSearchService): substring via trigrams, id/tracking prefix
+        Index("ix_order_header_search_trgm", "search_text", postgresql_using="gin", postgresql_ops={"search_text": "gin_trgm_ops"}),
+        Index("ix_order_header_external_prefix", "external_order_id", postgresql_ops={"external_order_id": "text_pattern_ops"}),
+        Index("ix_order_header_tracking_prefix", "tracking_number", postgresql_ops={"tracking_number": "text_pattern_ops"}),
+        # Courier/SKU-sorted label printing and SKU filters
+        Index("ix_order_header_status_sku_signature", "status_normalized", "sku_signature"),
     )
 
+# Trigram index needs the extension when create_all builds a fresh database
+event.listen(OrderHeader.__table__, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+
 class OrderItem(Base, UUIDMixin):
     """Order Item/Line"""
     __tablename__ = "order_item"
     
-    order_id = Column(UUID(as_uuid=True), ForeignKey("order_header.id"), nullable=False)
-    product_id = Column(UUID(as_uuid=True), ForeignKey("product.id"))
+    order_id = Column(UUID(as_uuid=True), ForeignKey("order_header.id"), nullable=False, index=True)
+    product_id = Column(UUID(as_uuid=True), ForeignKey("product.id"), index=True)
     
     sku = Column(String(100), nullable=False)
     product_name = Column(String(300))
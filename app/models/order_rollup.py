@@ -0,0 +1,39 @@
+"""
+Order Rollup Models - Daily order facts for dashboards and reports
+"""
+from sqlalchemy import Column, String, Integer, BigInteger, Numeric, Date, DateTime
+from sqlalchemy.sql import func
+from app.core import Base
+
+
+class OrderDailyRollup(Base):
+    """
+    Order counts and amounts per (local order date, channel, current status).
+    Rebuilt per (date, channel) slice by OrderRollupService; the current day
+    is always aggregated live from order_header.
+    """
+    __tablename__ = "order_daily_rollup"
+    
+    order_date = Column(Date, primary_key=True)  # order_datetime in settings.TIMEZONE
+    channel_code = Column(String(50), primary_key=True)
+    status_normalized = Column(String(20), primary_key=True)
+    
+    order_count = Column(Integer, default=0, nullable=False)
+    revenue = Column(Numeric(14, 2), default=0, nullable=False)  # SUM(total_amount)
+    item_quantity = Column(Integer, default=0, nullable=False)
+    shipped_count = Column(Integer, default=0, nullable=False)  # shipped_at set
+    collected_count = Column(Integer, default=0, nullable=False)  # collection_time set
+    # BIT_XOR of order_pair_hash(external_order_id, status) over the slice's orders;
+    # XOR-ing the slices of a (date, channel) gives its order-set checksum
+    order_digest = Column(BigInteger, default=0, nullable=False)
+    
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class OrderRollupDirty(Base):
+    """(date, channel) slices of order_daily_rollup waiting to be recomputed"""
+    __tablename__ = "order_rollup_dirty"
+    
+    order_date = Column(Date, primary_key=True)
+    channel_code = Column(String(50), primary_key=True)
+    marked_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
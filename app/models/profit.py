@@ -29,8 +29,18 @@ class OrderProfit(Base):
     net_profit = Column(Numeric(12, 2), default=0)
     profit_margin_percent = Column(Numeric(6, 2))
     
+    fees_source = Column(String(10))  # actual (marketplace transactions) or estimate
+    
     currency_code = Column(String(3), default="THB")
     calculated_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Relationships
     order = relationship("OrderHeader", back_populates="profit")
+
+
+class OrderProfitDirty(Base):
+    """Orders whose order_profit row is waiting to be recomputed"""
+    __tablename__ = "order_profit_dirty"
+    
+    order_id = Column(UUID(as_uuid=True), primary_key=True)
+    marked_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False, index=True)
@@ -0,0 +1,30 @@
+"""
+Reconciliation Models - Per-day results of comparing orders with marketplaces
+"""
+from sqlalchemy import Column, String, Integer, Boolean, Date, DateTime, Text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.sql import func
+from app.core import Base
+
+
+class ReconciliationResult(Base):
+    """
+    Outcome of the last reconciliation of one shop for one local order date.
+    Written by ReconciliationService.reconcile_day, read by the health dashboard.
+    """
+    __tablename__ = "reconciliation_result"
+    
+    result_date = Column(Date, primary_key=True)  # Order date in settings.TIMEZONE
+    platform = Column(String(50), primary_key=True)
+    shop_id = Column(String(100), primary_key=True, default="")
+    
+    marketplace_count = Column(Integer, default=0, nullable=False)  # Orders in the marketplace list
+    missing_count = Column(Integer, default=0, nullable=False)  # Not in order_header (after the resync)
+    stale_count = Column(Integer, default=0, nullable=False)  # Changed on the marketplace since last write
+    resynced_count = Column(Integer, default=0, nullable=False)  # Of those, written by the sync
+    digest_match = Column(Boolean, default=False, nullable=False)  # Platform order digest equal: no diff needed
+    status = Column(String(20), default="ok", nullable=False)  # ok, resynced, warning, error
+    error = Column(Text)
+    missing_ids = Column(JSONB)  # Sample of missing external ids (still missing after resync)
+    
+    checked_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
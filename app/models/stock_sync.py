@@ -0,0 +1,31 @@
+"""
+Stock Sync Models - Dirty SKU queue for marketplace stock push
+"""
+from sqlalchemy import Column, Integer, DateTime, ForeignKey, Text
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.sql import func
+from app.core import Base
+
+
+class StockSyncState(Base):
+    """
+    One row per product whose available stock changed since the last push.
+    dirty_since is kept from the first change so push lag can be measured;
+    last_marked_at moves on every change and drives the debounce.
+    """
+    __tablename__ = "stock_sync_state"
+    
+    product_id = Column(UUID(as_uuid=True), ForeignKey("product.id"), primary_key=True)
+    
+    # Dirty marker (NULL = in sync)
+    dirty_since = Column(DateTime(timezone=True), index=True)
+    last_marked_at = Column(DateTime(timezone=True))
+    
+    # Last push result
+    last_pushed_at = Column(DateTime(timezone=True))
+    last_push_lag_ms = Column(Integer)
+    last_error = Column(Text)
+    last_failed_at = Column(DateTime(timezone=True))  # Failed SKUs wait STOCK_SYNC_RETRY_SECONDS
+    push_count = Column(Integer, default=0, nullable=False)
+    
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
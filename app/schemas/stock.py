@@ -2,7 +2,7 @@
 Stock Schemas
 """
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, List
 from uuid import UUID
 
 class StockMovementCreate(BaseModel):
@@ -15,6 +15,35 @@ class StockMovementCreate(BaseModel):
     reference_id: Optional[str] = None
     note: Optional[str] = None
 
+class StockMovementBulkItem(BaseModel):
+    """One row of a bulk movement / cycle-count sheet (product by id or SKU, warehouse by id or code)"""
+    product_id: Optional[UUID] = None
+    sku: Optional[str] = None
+    warehouse_id: Optional[UUID] = None
+    warehouse_code: Optional[str] = None
+    location_id: Optional[UUID] = None
+    movement_type: str  # IN, OUT, RESERVE, RELEASE, ADJUST, COUNT (counted qty -> ADJUST)
+    quantity: int
+    reference_type: Optional[str] = None
+    reference_id: Optional[str] = None
+    note: Optional[str] = None
+
+class StockMovementBulkRequest(BaseModel):
+    movements: List[StockMovementBulkItem]
+    reference_type: Optional[str] = None  # Default for rows without one
+    note: Optional[str] = None
+
+class StockTransferItem(BaseModel):
+    product_id: Optional[UUID] = None
+    sku: Optional[str] = None
+    quantity: int
+
+class StockTransferBulkRequest(BaseModel):
+    from_warehouse_id: UUID
+    to_warehouse_id: UUID
+    items: List[StockTransferItem]
+    note: Optional[str] = None
+
 class StockSummary(BaseModel):
     product_id: UUID
     sku: str
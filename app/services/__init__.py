@@ -5,6 +5,13 @@ from .promotion_service import PromotionService
 from . import integration_service
 from . import sync_service
 from .replenishment_service import ReplenishmentService
+from .stock_sync_service import StockSyncService
+from .order_search_service import OrderSearchService
+from .order_rollup_service import OrderRollupService
+from .profit_service import ProfitService
+from .finance_fact_service import FinanceFactService
+from .invoice_sync_service import InvoiceSyncService
+from . import cache_invalidation
 
 __all__ = [
     "OrderService", 
@@ -14,4 +21,11 @@ __all__ = [
     "integration_service",
     "sync_service",
     "ReplenishmentService",
+    "StockSyncService",
+    "OrderSearchService",
+    "OrderRollupService",
+    "ProfitService",
+    "FinanceFactService",
+    "InvoiceSyncService",
+    "cache_invalidation",
 ]
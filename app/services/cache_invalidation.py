@@ -0,0 +1,116 @@
+"""
+Cache Invalidation - drive response cache tags from ORM writes
+
+An after_flush hook collects the tags touched by the flushed objects into
+session.info; they are invalidated after the transaction commits (and
+dropped on rollback), so a poll can never cache a response built from
+rows another transaction is still writing. Set-based writes that bypass
+the ORM call add_tags() themselves.
+
+Tags:
+    orders, orders:channel:<code>, orders:status:<status>  - order_header / order_item
+    stock                                                  - stock_ledger / stock_balance
+    listings                                               - platform_listing(_item)
+    products                                               - product / product_set_bom
+"""
+from typing import Iterable, Set
+from uuid import UUID
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from app.core.cache import invalidate_tags
+from app.models import (
+    OrderHeader, OrderItem, StockLedger, StockBalance,
+    PlatformListing, PlatformListingItem, Product, ProductSetBom,
+)
+
+_PENDING_KEY = "cache_invalidation_tags"
+
+_STATIC_TAGS = (
+    ((StockLedger, StockBalance), "stock"),
+    ((PlatformListing, PlatformListingItem), "listings"),
+    ((Product, ProductSetBom), "products"),
+)
+
+
+def order_tags(channel_code=None, status=None) -> Set[str]:
+    tags = {"orders"}
+    if channel_code:
+        tags.add(f"orders:channel:{channel_code}")
+    if status:
+        tags.add(f"orders:status:{status}")
+    return tags
+
+
+def add_tags(session: Session, tags: Iterable[str]):
+    """Queue tags for invalidation when the session's transaction commits"""
+    session.info.setdefault(_PENDING_KEY, set()).update(tags)
+
+
+def add_order_tags(session: Session, order_ids: Iterable[UUID], statuses: Iterable[str] = ()):
+    """Queue tags for orders changed by a set-based write (plus any statuses they left)"""
+    order_ids = [oid for oid in set(order_ids) if oid]
+    if not order_ids:
+        return
+    tags = {"orders"} | {f"orders:status:{s}" for s in statuses if s}
+    for channel, status in session.query(OrderHeader.channel_code, OrderHeader.status_normalized).filter(
+        OrderHeader.id.in_(order_ids)
+    ).distinct().all():
+        tags |= order_tags(channel, status)
+    add_tags(session, tags)
+
+
+def _order_header_tags(obj: OrderHeader, track_changes: bool) -> Set[str]:
+    tags = order_tags(obj.channel_code, obj.status_normalized)
+    if track_changes:
+        state = inspect(obj)
+        for old in state.attrs["status_normalized"].history.deleted:
+            tags |= order_tags(status=old)
+        for old in state.attrs["channel_code"].history.deleted:
+            tags |= order_tags(channel_code=old)
+    return tags
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_cache_tags(session: Session, flush_context):
+    tags: Set[str] = set()
+    item_order_ids: Set[UUID] = set()
+
+    for objects, track_changes in ((session.new, False), (session.dirty, True), (session.deleted, False)):
+        for obj in objects:
+            if isinstance(obj, OrderHeader):
+                tags |= _order_header_tags(obj, track_changes)
+            elif isinstance(obj, OrderItem):
+                item_order_ids.add(obj.order_id)
+            else:
+                for classes, tag in _STATIC_TAGS:
+                    if isinstance(obj, classes):
+                        tags.add(tag)
+
+    item_order_ids.discard(None)
+    if item_order_ids:
+        tags.add("orders")
+        rows = session.connection().execute(
+            select(OrderHeader.channel_code, OrderHeader.status_normalized)
+            .where(OrderHeader.id.in_(item_order_ids))
+            .distinct()
+        ).all()
+        for channel, status in rows:
+            tags |= order_tags(channel, status)
+
+    if tags:
+        add_tags(session, tags)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_tags(session: Session):
+    tags = session.info.pop(_PENDING_KEY, None)
+    if tags:
+        invalidate_tags(tags)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_pending_tags(session: Session, previous_transaction):
+    if not session.in_transaction():
+        session.info.pop(_PENDING_KEY, None)
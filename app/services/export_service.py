@@ -0,0 +1,466 @@
+"""
+Export Service - Streaming CSV / Parquet exports
+
+Exports run one query with a server-side cursor (yield_per) on their own
+session and write each fetched batch straight into a StreamingResponse, so
+memory stays bounded by EXPORT_BATCH_SIZE rows whatever the date range.
+Per-order figures (items, COGS, fee buckets) are aggregated in the same
+query instead of looked up order by order.
+
+Parquet needs the optional pyarrow package.
+"""
+import csv
+import io
+import logging
+import urllib.parse
+from datetime import date, datetime, time
+from typing import Any, Iterator, List, Optional, Sequence, Tuple
+
+from fastapi.responses import StreamingResponse
+from sqlalchemy import String, cast, func, select, text, true
+from sqlalchemy.orm import Query as OrmQuery, Session
+
+from app.core.database import SessionLocal
+from app.models import OrderHeader, OrderItem, Product, StockLedger, Warehouse
+from app.models.finance import MarketplaceTransaction
+
+logger = logging.getLogger(__name__)
+
+EXPORT_BATCH_SIZE = 2000
+EXPORT_FORMATS = ("csv", "parquet")
+
+# (header, kind) - kind is one of text, int, money, datetime
+ExportColumns = Sequence[Tuple[str, str]]
+
+FEE_TYPES = ("COMMISSION_FEE", "TRANSACTION_FEE", "SERVICE_FEE", "SHIPPING_FEE")
+
+
+_FINANCE_SQL = """
+    SELECT oh.order_datetime,
+           oh.channel_code,
+           COALESCE(oh.external_order_id, oh.id::text) AS order_ref,
+           oh.subtotal_amount,
+           oh.shipping_fee,
+           oh.platform_discount_amount,
+           it.items,
+           it.cogs,
+           tx.tx_count,
+           tx.payout,
+           tx.commission,
+           tx.transaction_fee,
+           tx.service_fee,
+           tx.shipping_cost,
+           tx.affiliate_cost,
+           tx.other_fees,
+           tx.tiktok_affiliate,
+           tx.shopee_ams
+    FROM order_header oh
+    LEFT JOIN LATERAL (
+        SELECT string_agg(COALESCE(oi.sku, 'N/A') || ' x' || COALESCE(oi.quantity, 0), ', ') AS items,
+               SUM(COALESCE(p.standard_cost, 0) * COALESCE(oi.quantity, 0)) AS cogs
+        FROM order_item oi
+        LEFT JOIN product p ON p.id = oi.product_id
+        WHERE oi.order_id = oh.id
+    ) it ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT COUNT(*) AS tx_count,
+               SUM(mt.amount) AS payout,
+               SUM(ABS(mt.amount)) FILTER (WHERE mt.transaction_type = 'COMMISSION_FEE') AS commission,
+               SUM(ABS(mt.amount)) FILTER (WHERE mt.transaction_type = 'TRANSACTION_FEE') AS transaction_fee,
+               SUM(ABS(mt.amount)) FILTER (WHERE mt.transaction_type = 'SERVICE_FEE') AS service_fee,
+               SUM(ABS(mt.amount)) FILTER (WHERE mt.transaction_type = 'SHIPPING_FEE') AS shipping_cost,
+               SUM(ABS(mt.amount)) FILTER (
+                   WHERE mt.transaction_type <> ALL(CAST(:fee_types AS text[]))
+                     AND mt.description ILIKE :affiliate
+               ) AS affiliate_cost,
+               SUM(ABS(mt.amount)) FILTER (
+                   WHERE mt.transaction_type IN ('ADJUSTMENT', 'PAYMENT_FEE')
+                     AND COALESCE(mt.description, '') NOT ILIKE :affiliate
+               ) AS other_fees,
+               MAX(ABS(mt.affiliate_commission_amount)) AS tiktok_affiliate,
+               MAX(mt.ams_commission_amount) AS shopee_ams
+        FROM marketplace_transaction mt
+        WHERE mt.order_id = oh.id
+    ) tx ON TRUE
+    WHERE oh.order_datetime >= :start_ts
+      AND oh.order_datetime <= :end_ts
+      AND oh.status_normalized != 'CANCELLED'
+    ORDER BY oh.order_datetime
+"""
+
+FINANCE_COLUMNS: ExportColumns = (
+    ("วันที่", "text"),
+    ("Platform", "text"),
+    ("หมายเลขออเดอร์", "text"),
+    ("สินค้า", "text"),
+    ("ยอดขาย (Gross Sales)", "money"),
+    ("ค่าส่งที่เก็บลูกค้า", "money"),
+    ("ส่วนลด Platform Support", "money"),
+    ("รวมรายรับ (Total Revenue)", "money"),
+    # Deductions
+    ("ค่าคอมมิชชั่น (Commission)", "money"),
+    ("ค่าธรรมเนียมคำสั่งซื้อ (Transaction Fee)", "money"),
+    ("ค่าธรรมเนียมบริการ (Service Fee)", "money"),
+    ("ค่าส่งที่ร้านจ่ายจริง (Shipping Cost)", "money"),
+    ("ค่าคอม Affiliate", "money"),
+    ("รวมค่าธรรมเนียม (Total Fees)", "money"),
+    # Result
+    ("ต้นทุนสินค้า (COGS)", "money"),
+    ("กำไรสุทธิ (Net Profit)", "money"),
+    ("ยอดเงินเข้าบัญชี (Payout)", "money"),
+)
+
+ORDER_COLUMNS: ExportColumns = (
+    ("order_datetime", "datetime"),
+    ("channel_code", "text"),
+    ("external_order_id", "text"),
+    ("status", "text"),
+    ("customer_name", "text"),
+    ("items", "text"),
+    ("item_count", "int"),
+    ("subtotal_amount", "money"),
+    ("discount_amount", "money"),
+    ("platform_discount_amount", "money"),
+    ("shipping_fee", "money"),
+    ("total_amount", "money"),
+    ("courier_code", "text"),
+    ("tracking_number", "text"),
+    ("shipped_at", "datetime"),
+)
+
+STOCK_LEDGER_COLUMNS: ExportColumns = (
+    ("created_at", "datetime"),
+    ("warehouse_code", "text"),
+    ("sku", "text"),
+    ("product_name", "text"),
+    ("movement_type", "text"),
+    ("quantity", "int"),
+    ("reference_type", "text"),
+    ("reference_id", "text"),
+    ("note", "text"),
+)
+
+TRANSACTION_COLUMNS: ExportColumns = (
+    ("transaction_date", "datetime"),
+    ("platform", "text"),
+    ("transaction_type", "text"),
+    ("amount", "money"),
+    ("currency", "text"),
+    ("external_order_id", "text"),
+    ("payout_reference", "text"),
+    ("status", "text"),
+    ("description", "text"),
+)
+
+
+def _day_bounds(start_date: Optional[date], end_date: Optional[date]) -> Tuple[Optional[datetime], Optional[datetime]]:
+    start_ts = datetime.combine(start_date, time.min) if start_date else None
+    end_ts = datetime.combine(end_date, time.max) if end_date else None
+    return start_ts, end_ts
+
+
+def _num(value) -> float:
+    return float(value or 0)
+
+
+def _stream(stmt, params: Optional[dict] = None) -> Iterator[Sequence]:
+    """
+    Yield result batches of a statement through a server-side cursor.
+    Uses its own session: the response body is produced after the request's
+    session dependency may already be closed.
+    """
+    db: Session = SessionLocal()
+    try:
+        result = db.execute(stmt.execution_options(yield_per=EXPORT_BATCH_SIZE), params or {})
+        for batch in result.partitions():
+            yield batch
+    finally:
+        db.close()
+
+
+# ========== Writers ==========
+
+def _csv_value(kind: str, value: Any) -> Any:
+    if value is None:
+        return ""
+    if kind == "money":
+        return f"{float(value):.2f}"
+    if kind == "datetime":
+        return value.isoformat()
+    return value
+
+
+def _csv_chunks(columns: ExportColumns, batches: Iterator[Sequence]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write("\ufeff")  # BOM so Excel reads UTF-8 (Thai headers)
+    writer.writerow([name for name, _ in columns])
+    for batch in batches:
+        for row in batch:
+            writer.writerow([_csv_value(kind, v) for (_, kind), v in zip(columns, row)])
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object that hands written bytes back in chunks"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _parquet_chunks(columns: ExportColumns, batches: Iterator[Sequence]) -> Iterator[bytes]:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    types = {
+        "text": pa.string(),
+        "int": pa.int64(),
+        "money": pa.float64(),
+        "datetime": pa.timestamp("us", tz="UTC"),
+    }
+    schema = pa.schema([(name, types[kind]) for name, kind in columns])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="snappy")
+    try:
+        for batch in batches:
+            arrays = []
+            for i, (_, kind) in enumerate(columns):
+                values = [row[i] for row in batch]
+                if kind == "money":
+                    values = [float(v) if v is not None else None for v in values]
+                elif kind == "text":
+                    values = [str(v) if v is not None else None for v in values]
+                arrays.append(pa.array(values, type=schema.field(i).type))
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))  # One row group per batch
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+class ExportService:
+    """Bounded-memory exports of orders, finance, stock ledger and transactions"""
+
+    @staticmethod
+    def check_format(fmt: str):
+        """Raise ValueError for an unknown or unavailable export format"""
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unsupported export format: {fmt}")
+        if fmt == "parquet":
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise ValueError("Parquet export requires the pyarrow package")
+
+    @staticmethod
+    def response(columns: ExportColumns, batches: Iterator[Sequence], fmt: str, filename: str) -> StreamingResponse:
+        """StreamingResponse writing batches as CSV or Parquet"""
+        ExportService.check_format(fmt)
+        if fmt == "parquet":
+            body, media_type = _parquet_chunks(columns, batches), "application/vnd.apache.parquet"
+        else:
+            body, media_type = _csv_chunks(columns, batches), "text/csv; charset=utf-8"
+        response = StreamingResponse(body, media_type=media_type)
+        encoded_filename = urllib.parse.quote(f"{filename}.{fmt}")
+        response.headers["Content-Disposition"] = f"attachment; filename*=UTF-8''{encoded_filename}"
+        return response
+
+    # ========== Row sources ==========
+
+    @staticmethod
+    def finance_rows(start_date: date, end_date: date) -> Iterator[List[tuple]]:
+        """Finance report rows (FINANCE_COLUMNS), detailed fee breakdown per order"""
+        start_ts, end_ts = _day_bounds(start_date, end_date)
+        params = {
+            "start_ts": start_ts,
+            "end_ts": end_ts,
+            "fee_types": list(FEE_TYPES),
+            "affiliate": "%affiliate%",
+        }
+        for batch in _stream(text(_FINANCE_SQL), params):
+            yield [ExportService._finance_row(r) for r in batch]
+
+    @staticmethod
+    def _finance_row(r) -> tuple:
+        platform = r.channel_code or "Unknown"
+        gross_sales = _num(r.subtotal_amount)
+        shipping_income = _num(r.shipping_fee)
+        platform_discount = _num(r.platform_discount_amount)
+
+        if r.tx_count:
+            # Actuals from the Money Trail (fee types mapped during finance sync)
+            commission = _num(r.commission)
+            transaction_fee = _num(r.transaction_fee)
+            service_fee = _num(r.service_fee)
+            shipping_cost = _num(r.shipping_cost)
+            affiliate_cost = _num(r.affiliate_cost)
+            other_fees = _num(r.other_fees)
+            # Affiliate is not always its own transaction line: fall back to raw payload fields
+            if affiliate_cost == 0 and platform == "tiktok":
+                affiliate_cost = _num(r.tiktok_affiliate)
+            elif affiliate_cost == 0 and platform == "shopee":
+                affiliate_cost = _num(r.shopee_ams)
+            payout_amount = _num(r.payout)
+        else:
+            # Estimates when no finance data is synced yet
+            commission = gross_sales * 0.04
+            transaction_fee = gross_sales * 0.03
+            service_fee = gross_sales * 0.05
+            shipping_cost = affiliate_cost = other_fees = 0.0
+            payout_amount = (gross_sales + shipping_income) - (gross_sales * 0.12)
+
+        total_revenue = gross_sales + shipping_income + platform_discount
+        total_fees = commission + transaction_fee + service_fee + shipping_cost + affiliate_cost + other_fees
+        cogs = _num(r.cogs)
+        net_profit = total_revenue - total_fees - cogs
+
+        return (
+            r.order_datetime.strftime("%Y-%m-%d") if r.order_datetime else "",
+            platform,
+            r.order_ref,
+            r.items or "",
+            gross_sales,
+            shipping_income,
+            platform_discount,
+            total_revenue,
+            commission,
+            transaction_fee,
+            service_fee,
+            shipping_cost,
+            affiliate_cost,
+            total_fees,
+            cogs,
+            net_profit,
+            payout_amount,
+        )
+
+    @staticmethod
+    def order_rows(
+        channel: Optional[str] = None,
+        status: Optional[str] = None,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        exclude_cancelled: bool = False,
+        date_field: str = "order_datetime",
+    ) -> Iterator[Sequence]:
+        """Order rows (ORDER_COLUMNS), same filters as the order list; items as "SKU xQTY, ..." """
+        from app.services.order_service import OrderService
+
+        items = (
+            select(
+                func.string_agg(OrderItem.sku + " x" + cast(OrderItem.quantity, String), ", ").label("skus"),
+                func.coalesce(func.sum(OrderItem.quantity), 0).label("quantity"),
+            )
+            .where(OrderItem.order_id == OrderHeader.id)
+            .lateral("items")
+        )
+        query = OrmQuery([
+            OrderHeader.order_datetime,
+            OrderHeader.channel_code,
+            OrderHeader.external_order_id,
+            OrderHeader.status_normalized,
+            OrderHeader.customer_name,
+            items.c.skus,
+            items.c.quantity,
+            OrderHeader.subtotal_amount,
+            OrderHeader.discount_amount,
+            OrderHeader.platform_discount_amount,
+            OrderHeader.shipping_fee,
+            OrderHeader.total_amount,
+            OrderHeader.courier_code,
+            OrderHeader.tracking_number,
+            OrderHeader.shipped_at,
+        ]).select_from(OrderHeader).outerjoin(items, true())
+        query = OrderService._filter_orders(
+            query, channel, status, None, start_date, end_date, exclude_cancelled, date_field
+        )
+        return _stream(query.order_by(OrderHeader.order_datetime, OrderHeader.id).statement)
+
+    @staticmethod
+    def stock_ledger_rows(
+        warehouse_id=None,
+        movement_type: Optional[str] = None,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None,
+    ) -> Iterator[Sequence]:
+        """Stock ledger rows (STOCK_LEDGER_COLUMNS)"""
+        stmt = select(
+            StockLedger.created_at,
+            Warehouse.code,
+            Product.sku,
+            Product.name,
+            StockLedger.movement_type,
+            StockLedger.quantity,
+            StockLedger.reference_type,
+            StockLedger.reference_id,
+            StockLedger.note,
+        ).select_from(StockLedger).join(
+            Warehouse, Warehouse.id == StockLedger.warehouse_id
+        ).join(
+            Product, Product.id == StockLedger.product_id
+        )
+
+        start_ts, end_ts = _day_bounds(start_date, end_date)
+        if warehouse_id:
+            stmt = stmt.where(StockLedger.warehouse_id == warehouse_id)
+        if movement_type:
+            stmt = stmt.where(StockLedger.movement_type == movement_type.upper())
+        if start_ts:
+            stmt = stmt.where(StockLedger.created_at >= start_ts)
+        if end_ts:
+            stmt = stmt.where(StockLedger.created_at <= end_ts)
+        return _stream(stmt.order_by(StockLedger.created_at, StockLedger.id))
+
+    @staticmethod
+    def transaction_rows(
+        platform: Optional[str] = None,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None,
+    ) -> Iterator[Sequence]:
+        """Marketplace transaction rows (TRANSACTION_COLUMNS)"""
+        stmt = select(
+            MarketplaceTransaction.transaction_date,
+            MarketplaceTransaction.platform,
+            MarketplaceTransaction.transaction_type,
+            MarketplaceTransaction.amount,
+            MarketplaceTransaction.currency,
+            OrderHeader.external_order_id,
+            MarketplaceTransaction.payout_reference,
+            MarketplaceTransaction.status,
+            MarketplaceTransaction.description,
+        ).select_from(MarketplaceTransaction).outerjoin(
+            OrderHeader, OrderHeader.id == MarketplaceTransaction.order_id
+        )
+
+        start_ts, end_ts = _day_bounds(start_date, end_date)
+        if platform:
+            stmt = stmt.where(MarketplaceTransaction.platform == platform.lower())
+        if start_ts:
+            stmt = stmt.where(MarketplaceTransaction.transaction_date >= start_ts)
+        if end_ts:
+            stmt = stmt.where(MarketplaceTransaction.transaction_date <= end_ts)
+        return _stream(stmt.order_by(MarketplaceTransaction.transaction_date, MarketplaceTransaction.id))
@@ -0,0 +1,374 @@
+"""
+Finance Fact Service - Daily finance facts kept current from the write paths
+
+finance_daily_fact holds one row per (local date, platform, shop,
+transaction type) with sums of marketplace transactions, plus one
+ORDER_FACT_TYPE row per (date, channel) with the orders placed that day
+(revenue, customer shipping, COGS). The finance writer and an after_flush
+hook on orders, items, products and transactions mark the touched
+(date, platform) slices dirty in the same transaction. Dirty slices are
+recomputed by a periodic job (reads never write: until then they compute
+dirty slices live); a nightly reconcile rebuilds the last
+FINANCE_FACT_RECONCILE_DAYS to catch writes that bypass both. Rebuilds of
+the same day are serialized with transaction-scoped advisory locks and
+upsert their rows.
+"""
+import logging
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from uuid import UUID
+
+from sqlalchemy import event, func, inspect, text, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.core import settings
+from app.models import OrderHeader, OrderItem, Product, FinanceDailyFact, FinanceFactDirty
+from app.models.finance import MarketplaceTransaction
+from .order_rollup_service import _day_start_utc, _tz, local_date, local_today
+
+logger = logging.getLogger(__name__)
+
+# Advisory lock key space of fact rebuilds (second key: day ordinal)
+_REBUILD_LOCK_NAMESPACE = 0x4644  # "FD"
+
+# transaction_type of the per-channel orders-placed row
+ORDER_FACT_TYPE = "_ORDERS"
+
+TRANSACTION_FACT_FIELDS = ("tx_count", "amount", "gross_sales", "shipping_income", "fee_total", "shipping_cost", "settlement")
+ORDER_FACT_FIELDS = ("order_count", "order_revenue", "order_shipping_income", "cogs")
+FACT_FIELDS = TRANSACTION_FACT_FIELDS + ORDER_FACT_FIELDS
+
+# Attributes that feed the facts
+_ORDER_ATTRS = ("order_datetime", "channel_code", "status_normalized", "total_amount", "shipping_fee")
+_ITEM_ATTRS = ("quantity", "product_id", "order_id")
+_TX_ATTRS = ("amount", "transaction_date", "platform", "shop_id", "transaction_type",
+             "gross_sales_amount", "customer_paid_shipping_amount", "fee_amount",
+             "shipping_fee_amount", "settlement_amount")
+
+_TRANSACTION_FACTS_SQL = """
+    SELECT (mt.transaction_date AT TIME ZONE :tz)::date AS fact_date,
+           mt.platform,
+           mt.shop_id,
+           mt.transaction_type,
+           COUNT(*) AS tx_count,
+           COALESCE(SUM(mt.amount), 0) AS amount,
+           COALESCE(SUM(mt.gross_sales_amount), 0) AS gross_sales,
+           COALESCE(SUM(mt.customer_paid_shipping_amount), 0) AS shipping_income,
+           COALESCE(SUM(mt.fee_amount), 0) AS fee_total,
+           COALESCE(SUM(mt.shipping_fee_amount), 0) AS shipping_cost,
+           COALESCE(SUM(mt.settlement_amount), 0) AS settlement
+    FROM marketplace_transaction mt
+    WHERE mt.transaction_date >= :start_ts AND mt.transaction_date < :end_ts {tx_platform_filter}
+    GROUP BY 1, 2, 3, 4
+"""
+
+_ORDER_FACTS_SQL = """
+    SELECT (oh.order_datetime AT TIME ZONE :tz)::date AS fact_date,
+           lower(oh.channel_code) AS platform,
+           COUNT(*) FILTER (WHERE oh.status_normalized NOT IN ('CANCELLED', 'RETURNED')) AS order_count,
+           COALESCE(SUM(oh.total_amount) FILTER (WHERE oh.status_normalized NOT IN ('CANCELLED', 'RETURNED')), 0) AS order_revenue,
+           COALESCE(SUM(oh.shipping_fee) FILTER (WHERE oh.status_normalized NOT IN ('CANCELLED', 'RETURNED')), 0) AS order_shipping_income,
+           COALESCE(SUM(it.cogs) FILTER (WHERE oh.status_normalized != 'CANCELLED'), 0) AS cogs
+    FROM order_header oh
+    LEFT JOIN LATERAL (
+        SELECT SUM(oi.quantity * p.standard_cost) AS cogs
+        FROM order_item oi
+        JOIN product p ON p.id = oi.product_id
+        WHERE oi.order_id = oh.id
+    ) it ON TRUE
+    WHERE oh.order_datetime >= :start_ts AND oh.order_datetime < :end_ts {order_platform_filter}
+    GROUP BY 1, 2
+"""
+
+
+class FinanceFactService:
+    """Daily finance fact maintenance and reads"""
+
+    # ========== Dirty tracking ==========
+
+    @staticmethod
+    def _mark_dirty_stmt(keys: Iterable[Tuple[date, str]]):
+        stmt = insert(FinanceFactDirty).values([
+            {"fact_date": d, "platform": p} for d, p in keys
+        ])
+        return stmt.on_conflict_do_update(
+            index_elements=[FinanceFactDirty.fact_date, FinanceFactDirty.platform],
+            set_={"marked_at": func.now()},
+        )
+
+    @staticmethod
+    def mark_dirty(db: Session, keys: Iterable[Tuple[date, str]]):
+        """Mark (local date, platform) slices for recompute (does not commit)"""
+        keys = {(d, p) for d, p in keys if d and p}
+        if keys:
+            db.execute(FinanceFactService._mark_dirty_stmt(keys))
+
+    @staticmethod
+    def mark_orders_dirty(db: Session, order_ids: Iterable[UUID]):
+        """Mark the slices of the given orders (for set-based writes that skip the ORM hook)"""
+        order_ids = [str(oid) for oid in set(order_ids) if oid]
+        if not order_ids:
+            return
+        db.execute(text("""
+            INSERT INTO finance_fact_dirty (fact_date, platform, marked_at)
+            SELECT DISTINCT (order_datetime AT TIME ZONE :tz)::date, lower(channel_code), now()
+            FROM order_header
+            WHERE id = ANY(CAST(:ids AS uuid[])) AND order_datetime IS NOT NULL
+            ON CONFLICT (fact_date, platform) DO UPDATE SET marked_at = EXCLUDED.marked_at
+        """), {"tz": str(_tz()), "ids": order_ids})
+
+    @staticmethod
+    def mark_products_dirty(db: Session, product_ids: Iterable[UUID]):
+        """Mark the slices of every order containing the given products (cost changed)"""
+        product_ids = [str(pid) for pid in set(product_ids) if pid]
+        if not product_ids:
+            return
+        db.execute(text("""
+            INSERT INTO finance_fact_dirty (fact_date, platform, marked_at)
+            SELECT DISTINCT (oh.order_datetime AT TIME ZONE :tz)::date, lower(oh.channel_code), now()
+            FROM order_item oi
+            JOIN order_header oh ON oh.id = oi.order_id
+            WHERE oi.product_id = ANY(CAST(:ids AS uuid[])) AND oh.order_datetime IS NOT NULL
+            ON CONFLICT (fact_date, platform) DO UPDATE SET marked_at = EXCLUDED.marked_at
+        """), {"tz": str(_tz()), "ids": product_ids})
+
+    # ========== Rebuild ==========
+
+    @staticmethod
+    def _compute(db: Session, start_date: date, end_date: date, platforms: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Fact rows for local dates start_date..end_date computed from the raw tables"""
+        params: Dict[str, Any] = {
+            "tz": str(_tz()),
+            "start_ts": _day_start_utc(start_date),
+            "end_ts": _day_start_utc(end_date + timedelta(days=1)),
+        }
+        filters = {"tx_platform_filter": "", "order_platform_filter": ""}
+        if platforms is not None:
+            filters = {
+                "tx_platform_filter": "AND mt.platform = ANY(CAST(:platforms AS text[]))",
+                "order_platform_filter": "AND lower(oh.channel_code) = ANY(CAST(:platforms AS text[]))",
+            }
+            params["platforms"] = list(platforms)
+
+        rows = []
+        for r in db.execute(text(_TRANSACTION_FACTS_SQL.format(**filters)), params).all():
+            rows.append({
+                "fact_date": r.fact_date, "platform": r.platform, "shop_id": r.shop_id or "",
+                "transaction_type": r.transaction_type,
+                **{f: getattr(r, f) for f in TRANSACTION_FACT_FIELDS},
+            })
+        for r in db.execute(text(_ORDER_FACTS_SQL.format(**filters)), params).all():
+            rows.append({
+                "fact_date": r.fact_date, "platform": r.platform, "shop_id": "",
+                "transaction_type": ORDER_FACT_TYPE,
+                **{f: getattr(r, f) for f in ORDER_FACT_FIELDS},
+            })
+        # Every row carries every field so the multi-row INSERT shares one column list
+        return [{**dict.fromkeys(FACT_FIELDS, 0), **r} for r in rows]
+
+    @staticmethod
+    def _lock_days(db: Session, start_date: date, end_date: date):
+        """Serialize concurrent rebuilds of the same days until the transaction ends"""
+        day = start_date
+        while day <= end_date:
+            db.execute(
+                text("SELECT pg_advisory_xact_lock(:ns, :day)"),
+                {"ns": _REBUILD_LOCK_NAMESPACE, "day": day.toordinal()},
+            )
+            day += timedelta(days=1)
+
+    @staticmethod
+    def rebuild(db: Session, start_date: date, end_date: date, platforms: Optional[List[str]] = None) -> int:
+        """
+        Recompute fact rows for local dates start_date..end_date (inclusive),
+        optionally some platforms only. Does not commit.
+        """
+        FinanceFactService._lock_days(db, start_date, end_date)
+        query = db.query(FinanceDailyFact).filter(
+            FinanceDailyFact.fact_date >= start_date,
+            FinanceDailyFact.fact_date <= end_date,
+        )
+        if platforms is not None:
+            query = query.filter(FinanceDailyFact.platform.in_(platforms))
+        query.delete(synchronize_session=False)
+
+        rows = FinanceFactService._compute(db, start_date, end_date, platforms)
+        if rows:
+            stmt = insert(FinanceDailyFact)
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=[
+                    FinanceDailyFact.fact_date, FinanceDailyFact.platform,
+                    FinanceDailyFact.shop_id, FinanceDailyFact.transaction_type,
+                ],
+                set_={f: stmt.excluded[f] for f in FACT_FIELDS},
+            ), rows)
+        return len(rows)
+
+    @staticmethod
+    def refresh_dirty(db: Session, start_date: Optional[date] = None, end_date: Optional[date] = None) -> int:
+        """
+        Recompute dirty slices (optionally within a date range) and commit.
+        Returns the number of slices refreshed.
+        """
+        query = db.query(FinanceFactDirty.fact_date, FinanceFactDirty.platform, FinanceFactDirty.marked_at)
+        if start_date:
+            query = query.filter(FinanceFactDirty.fact_date >= start_date)
+        if end_date:
+            query = query.filter(FinanceFactDirty.fact_date <= end_date)
+        dirty = query.all()
+        if not dirty:
+            return 0
+
+        platforms_by_date: Dict[date, List[str]] = defaultdict(list)
+        for d, p, _ in dirty:
+            platforms_by_date[d].append(p)
+        for d, platforms in platforms_by_date.items():
+            FinanceFactService.rebuild(db, d, d, platforms)
+
+        # Keep marks that moved while we were rebuilding
+        for d, p, marked_at in dirty:
+            db.query(FinanceFactDirty).filter(
+                FinanceFactDirty.fact_date == d,
+                FinanceFactDirty.platform == p,
+                FinanceFactDirty.marked_at <= marked_at,
+            ).delete(synchronize_session=False)
+        db.commit()
+        return len(dirty)
+
+    @staticmethod
+    def reconcile(db: Session, days: Optional[int] = None) -> int:
+        """Rebuild the last N days (through today) from the raw tables and commit"""
+        days = days or settings.FINANCE_FACT_RECONCILE_DAYS
+        end_date = local_today()
+        start_date = end_date - timedelta(days=days)
+        rows = FinanceFactService.rebuild(db, start_date, end_date)
+        db.query(FinanceFactDirty).filter(
+            FinanceFactDirty.fact_date >= start_date,
+            FinanceFactDirty.fact_date <= end_date,
+        ).delete(synchronize_session=False)
+        db.commit()
+        return rows
+
+    # ========== Reads ==========
+
+    @staticmethod
+    def _dirty_slices(db: Session, start_date: date, end_date: date) -> Dict[date, Set[str]]:
+        """Platforms per day whose fact rows are out of date"""
+        dirty: Dict[date, Set[str]] = defaultdict(set)
+        for d, p in db.query(FinanceFactDirty.fact_date, FinanceFactDirty.platform).filter(
+            FinanceFactDirty.fact_date >= start_date,
+            FinanceFactDirty.fact_date <= end_date,
+        ).all():
+            dirty[d].add(p)
+        return dirty
+
+    @staticmethod
+    def get_facts(db: Session, start_date: date, end_date: date) -> List[FinanceDailyFact]:
+        """
+        Fact rows summed over local dates start_date..end_date, one per
+        (platform, transaction_type), as unsaved FinanceDailyFact objects.
+        Dirty slices not yet refreshed by the periodic job are computed live.
+        """
+        dirty = FinanceFactService._dirty_slices(db, start_date, end_date)
+        query = db.query(
+            FinanceDailyFact.platform,
+            FinanceDailyFact.transaction_type,
+            *[func.sum(getattr(FinanceDailyFact, f)).label(f) for f in FACT_FIELDS],
+        ).filter(
+            FinanceDailyFact.fact_date >= start_date,
+            FinanceDailyFact.fact_date <= end_date,
+        )
+        if dirty:
+            slice_keys = [(d, p) for d, platforms in dirty.items() for p in platforms]
+            query = query.filter(~tuple_(FinanceDailyFact.fact_date, FinanceDailyFact.platform).in_(slice_keys))
+
+        totals: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for r in query.group_by(FinanceDailyFact.platform, FinanceDailyFact.transaction_type).all():
+            totals[(r.platform, r.transaction_type)] = {f: getattr(r, f) or 0 for f in FACT_FIELDS}
+
+        if dirty:
+            platforms = sorted({p for ps in dirty.values() for p in ps})
+            for r in FinanceFactService._compute(db, min(dirty), max(dirty), platforms):
+                if r["platform"] not in dirty.get(r["fact_date"], ()):
+                    continue
+                sums = totals.setdefault((r["platform"], r["transaction_type"]), dict.fromkeys(FACT_FIELDS, 0))
+                for f in FACT_FIELDS:
+                    sums[f] += r[f] or 0
+
+        return [
+            FinanceDailyFact(platform=platform, transaction_type=transaction_type, **sums)
+            for (platform, transaction_type), sums in totals.items()
+        ]
+
+
+# ========== Write hook ==========
+
+def _changed(obj, attrs) -> bool:
+    state = inspect(obj)
+    return any(state.attrs[a].history.has_changes() for a in attrs)
+
+
+def _order_keys(obj: OrderHeader, track_changes: bool) -> Set[Tuple[date, str]]:
+    keys = {(local_date(obj.order_datetime), (obj.channel_code or "").lower())}
+    if track_changes:
+        state = inspect(obj)
+        old_datetimes = state.attrs["order_datetime"].history.deleted or [obj.order_datetime]
+        old_channels = state.attrs["channel_code"].history.deleted or [obj.channel_code]
+        keys.update((local_date(d), (c or "").lower()) for d in old_datetimes for c in old_channels)
+    return keys
+
+
+def _transaction_keys(obj: MarketplaceTransaction, track_changes: bool) -> Set[Tuple[date, str]]:
+    keys = {(local_date(obj.transaction_date), obj.platform)}
+    if track_changes:
+        state = inspect(obj)
+        old_dates = state.attrs["transaction_date"].history.deleted or [obj.transaction_date]
+        old_platforms = state.attrs["platform"].history.deleted or [obj.platform]
+        keys.update((local_date(d), p) for d in old_dates for p in old_platforms)
+    return keys
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_finance_facts_dirty(session: Session, flush_context):
+    """Mark finance fact slices of flushed orders/items/products/transactions dirty"""
+    keys: Set[Tuple[date, str]] = set()
+    item_order_ids: Set[UUID] = set()
+    product_ids: Set[UUID] = set()
+
+    for obj in session.new:
+        if isinstance(obj, OrderHeader):
+            keys |= _order_keys(obj, False)
+        elif isinstance(obj, OrderItem):
+            item_order_ids.add(obj.order_id)
+        elif isinstance(obj, MarketplaceTransaction):
+            keys |= _transaction_keys(obj, False)
+
+    for obj in session.dirty:
+        if isinstance(obj, OrderHeader) and _changed(obj, _ORDER_ATTRS):
+            keys |= _order_keys(obj, True)
+        elif isinstance(obj, OrderItem) and _changed(obj, _ITEM_ATTRS):
+            item_order_ids.add(obj.order_id)
+            item_order_ids.update(inspect(obj).attrs["order_id"].history.deleted)
+        elif isinstance(obj, MarketplaceTransaction) and _changed(obj, _TX_ATTRS):
+            keys |= _transaction_keys(obj, True)
+        elif isinstance(obj, Product) and _changed(obj, ("standard_cost",)):
+            product_ids.add(obj.id)
+
+    for obj in session.deleted:
+        if isinstance(obj, OrderHeader):
+            keys |= _order_keys(obj, False)
+        elif isinstance(obj, OrderItem):
+            item_order_ids.add(obj.order_id)
+        elif isinstance(obj, MarketplaceTransaction):
+            keys |= _transaction_keys(obj, False)
+
+    keys = {(d, p) for d, p in keys if d and p}
+    if keys:
+        session.connection().execute(FinanceFactService._mark_dirty_stmt(keys))
+    item_order_ids.discard(None)
+    if item_order_ids:
+        FinanceFactService.mark_orders_dirty(session.connection(), item_order_ids)
+    if product_ids:
+        FinanceFactService.mark_products_dirty(session.connection(), product_ids)
@@ -71,95 +71,17 @@ class FinanceService:
     
     @staticmethod
     def get_order_profitability(db: Session, start_date: datetime, end_date: datetime):
-        from app.models import OrderHeader, OrderItem, Product
-        from app.models.finance import MarketplaceTransaction
-        from sqlalchemy.orm import joinedload
-        
-        # ORM Query (SQLite Friendly)
-        orders = db.query(OrderHeader).options(
-            joinedload(OrderHeader.items).joinedload(OrderItem.product)
-        ).filter(
-            OrderHeader.order_datetime >= start_date,
-            OrderHeader.order_datetime <= end_date
-        ).order_by(desc(OrderHeader.order_datetime)).limit(2000).all()
-        
-        # Pre-fetch all fees for these orders in one query (batch)
-        order_ids = [o.id for o in orders]
-        
-        # Query actual fees from MarketplaceTransaction
-        fee_query = db.query(
-            MarketplaceTransaction.order_id,
-            func.sum(MarketplaceTransaction.amount).label("total_fees")
-        ).filter(
-            MarketplaceTransaction.order_id.in_(order_ids),
-            MarketplaceTransaction.transaction_type.in_([
-                'COMMISSION_FEE', 'SERVICE_FEE', 'TRANSACTION_FEE', 
-                'PAYMENT_FEE', 'SHIPPING_FEE'
-            ])
-        ).group_by(MarketplaceTransaction.order_id).all()
-        
-        # Create lookup map: order_id -> actual fees (negative values = deductions)
-        actual_fees_map = {str(order_id): float(total_fees or 0) for order_id, total_fees in fee_query}
-
-        results = []
-        for o in orders:
-            # Calculate COGS
-            order_cogs = 0
-            items_desc = []
-            
-            for item in o.items:
-                # Find cost: item.product.standard_cost/cost_price
-                # Fallback to 0 if not found
-                cost = 0
-                if item.product:
-                    cost = float(item.product.standard_cost or 0)
-                
-                qty = item.quantity or 0
-                item_cogs = cost * qty
-                order_cogs += item_cogs
-                
-                items_desc.append(f"{item.sku} x{qty}")
-
-            revenue = float(o.total_amount or 0)
-            
-            # Get actual fees from MarketplaceTransaction if available
-            actual_fees = actual_fees_map.get(str(o.id))
-            if actual_fees is not None:
-                # actual_fees is typically negative (deductions), so we take abs value
-                fees = abs(actual_fees)
-                fees_source = "actual"
-            else:
-                # Fallback to estimate 12% if no transaction data
-                fees = revenue * 0.12
-                fees_source = "estimate"
-            
-            # Net Profit
-            net_profit = revenue - fees - order_cogs
-            margin = (net_profit / revenue * 100) if revenue > 0 else 0
-
-            results.append({
-                "order_number": o.external_order_id,
-                "platform": o.channel_code,
-                "date": o.order_datetime.strftime('%Y-%m-%d') if o.order_datetime else "",
-                "items": ", ".join(items_desc),
-                "revenue": revenue,
-                "cogs": order_cogs,
-                "fees": fees,
-                "fees_source": fees_source,  # New field: "actual" or "estimate"
-                "net_profit": net_profit,
-                "margin_percent": margin
-            })
-            
-        return results
+        """Per-order profit for a date range, read from the materialized order_profit rows"""
+        from app.services.profit_service import ProfitService
+        return ProfitService.get_order_profitability(db, start_date, end_date)
 
     @staticmethod
     def get_performance_dashboard(db: Session, start_date: datetime, end_date: datetime) -> Dict[str, Any]:
         """
         Get finance performance with Reconciliation View (Tax vs Cash) and True Profit.
         """
-        from app.models.finance import MarketplaceTransaction, InternalExpense
-        from app.models import OrderHeader, OrderItem, Product
-        from sqlalchemy import and_, text
+        from app.models.finance import InternalExpense
+        from app.services.finance_fact_service import FinanceFactService, ORDER_FACT_TYPE
 
         # --- 1. Internal Expenses (Company Side) ---
         internal_expenses = db.query(InternalExpense).filter(
@@ -169,26 +91,19 @@ class FinanceService:
         
         total_internal_expense = sum(float(e.amount or 0) for e in internal_expenses)
 
-        # --- 2. COGS Calculation (Product Cost) ---
-        # Based on Orders placed in this period (Tax Base match)
-        cogs_query = db.query(
-            OrderHeader.channel_code,
-            func.sum(OrderItem.quantity * Product.standard_cost).label("total_cogs")
-        ).join(OrderItem, OrderHeader.id == OrderItem.order_id)\
-         .join(Product, OrderItem.product_id == Product.id)\
-         .filter(
-            OrderHeader.order_datetime >= start_date,
-            OrderHeader.order_datetime <= end_date,
-            OrderHeader.status_normalized != 'CANCELLED'
-        ).group_by(OrderHeader.channel_code).all()
+        # --- 2. Daily finance facts (pre-aggregated per platform / transaction type) ---
+        # Dates are local days (settings.TIMEZONE), the range is whole days
+        facts = FinanceFactService.get_facts(db, start_date.date(), end_date.date())
+        order_facts = {f.platform: f for f in facts if f.transaction_type == ORDER_FACT_TYPE}
 
+        # COGS Calculation (Product Cost)
+        # Based on Orders placed in this period (Tax Base match)
         cogs_map = {}
         total_cogs_ex_vat = 0
         total_cogs_inc_vat = 0
 
-        for channel, cogs_val in cogs_query:
-            plat = channel.lower() if channel else "unknown"
-            cogs_amt = float(cogs_val or 0)
+        for plat, fact in order_facts.items():
+            cogs_amt = float(fact.cogs or 0)
             cogs_map[plat] = cogs_amt
             total_cogs_ex_vat += cogs_amt
             total_cogs_inc_vat += (cogs_amt * 1.07) # Assuming 7% VAT
@@ -214,70 +129,37 @@ class FinanceService:
                 "net_profit_tax": 0
             }
 
-        # 3.1 Fetch Data (Unified MarketplaceTransaction)
-        
-        # A. TikTok Logic (JSONB Extraction)
-        try:
-            tiktok_stats = db.execute(text("""
-                SELECT 
-                    SUM(CAST(raw_data->>'gross_sales_amount' AS NUMERIC)) as gross_sales,
-                    SUM(CAST(raw_data->>'customer_paid_shipping_fee_amount' AS NUMERIC)) as shipping_paid,
-                    SUM(CAST(raw_data->>'fee_amount' AS NUMERIC)) as fees,
-                    SUM(CAST(raw_data->>'shipping_fee_amount' AS NUMERIC)) as shipping_cost_deduction,
-                    SUM(CAST(raw_data->>'settlement_amount' AS NUMERIC)) as settlement
-                FROM marketplace_transaction
-                WHERE platform = 'tiktok' 
-                  AND transaction_type = 'ORDER'
-                  AND transaction_date >= :start_date 
-                  AND transaction_date <= :end_date
-            """), {"start_date": start_date, "end_date": end_date}).first()
-            
-            if tiktok_stats:
-                # Revenue Side
-                prod_sales = float(tiktok_stats.gross_sales or 0)
-                ship_inc = float(tiktok_stats.shipping_paid or 0)
+        # 3.1 Marketplace transaction facts
+        for fact in facts:
+            plat, tx_type = fact.platform, fact.transaction_type
+            if plat not in platform_data or tx_type == ORDER_FACT_TYPE:
+                continue
+
+            if plat == 'tiktok':
+                # A. TikTok: fee components come from the ORDER statement rows
+                if tx_type != 'ORDER':
+                    continue
+                prod_sales = float(fact.gross_sales or 0)
+                ship_inc = float(fact.shipping_income or 0)
                 
                 platform_data['tiktok']['product_sales'] = prod_sales
                 platform_data['tiktok']['shipping_income'] = ship_inc
                 platform_data['tiktok']['tax_revenue'] = prod_sales + ship_inc
                 
-                # Expense Side (Fees are negative in DB usually? TikTok 'fee_amount' is negative)
-                # 'fee_amount' in TikTok usually INCLUDES shipping_fee if deducted. 
-                # We need to check if 'shipping_fee_amount' is overlapping.
-                # Standard TikTok: fee_amount = comm + tx + shipping + adjustments.
-                # To split, we rely on 'shipping_fee_amount' (usually negative).
-                
-                total_fees_blob = float(tiktok_stats.fees or 0)
-                ship_cost_deduct = float(tiktok_stats.shipping_cost_deduction or 0)
-                
-                # If ship_cost is part of fees, we split it out
-                # But 'fee_amount' sum is the master deduction. 
-                # Let's assume fee_amount is the TOTAL deduction.
-                # plat_fee = total_fees - ship_cost
+                # 'fee_amount' is the TOTAL deduction (negative) and includes the
+                # shipping fee deducted; split it out into shipping_cost
+                total_fees_blob = float(fact.fee_total or 0)
+                ship_cost_deduct = float(fact.shipping_cost or 0)
                 
                 platform_data['tiktok']['shipping_cost'] = ship_cost_deduct
                 platform_data['tiktok']['platform_fees'] = total_fees_blob - ship_cost_deduct
                 platform_data['tiktok']['cash_fees'] = total_fees_blob # Sum of both
                 
-                platform_data['tiktok']['cash_payout'] = float(tiktok_stats.settlement or 0) 
-                
-        except Exception as e:
-            print(f"Error TikTok Stats: {e}")
-
-        # B. General (Shopee/Others) - Try MarketplaceTransaction first
-        tx_query = db.query(
-            MarketplaceTransaction.platform,
-            MarketplaceTransaction.transaction_type,
-            func.sum(MarketplaceTransaction.amount)
-        ).filter(
-            MarketplaceTransaction.platform != 'tiktok',
-            MarketplaceTransaction.transaction_date >= start_date,
-            MarketplaceTransaction.transaction_date <= end_date
-        ).group_by(MarketplaceTransaction.platform, MarketplaceTransaction.transaction_type).all()
+                platform_data['tiktok']['cash_payout'] = float(fact.settlement or 0)
+                continue
 
-        for plat, tx_type, amount in tx_query:
-            if plat not in platform_data: continue
-            amt = float(amount or 0)
+            # B. General (Shopee/Others)
+            amt = float(fact.amount or 0)
             
             if tx_type == 'ITEM_PRICE':
                 platform_data[plat]['product_sales'] += amt
@@ -299,25 +181,13 @@ class FinanceService:
             elif tx_type == 'ESCROW_RELEASE' or tx_type == 'WITHDRAWAL':
                 platform_data[plat]['cash_payout'] += amt
 
-        # C. Fallback: Use OrderHeader for platforms without MarketplaceTransaction
-        # Query revenue from Orders directly
-        order_revenue_query = db.query(
-            OrderHeader.channel_code,
-            func.sum(OrderHeader.total_amount).label("revenue"),
-            func.sum(OrderHeader.shipping_fee).label("shipping_income")
-        ).filter(
-            OrderHeader.order_datetime >= start_date,
-            OrderHeader.order_datetime <= end_date,
-            OrderHeader.status_normalized.notin_(['CANCELLED', 'RETURNED'])
-        ).group_by(OrderHeader.channel_code).all()
-
-        for channel, revenue, ship_income in order_revenue_query:
-            plat = channel.lower() if channel else "unknown"
+        # C. Fallback: Use order facts for platforms without MarketplaceTransaction
+        for plat, fact in order_facts.items():
             if plat not in platform_data:
                 continue
             
-            rev = float(revenue or 0)
-            ship = float(ship_income or 0)
+            rev = float(fact.order_revenue or 0)
+            ship = float(fact.order_shipping_income or 0)
             
             # Only use fallback if MarketplaceTransaction data is missing
             if platform_data[plat]['product_sales'] == 0 and rev > 0:
@@ -1,7 +1,10 @@
+import hashlib
+import json
 import logging
 from datetime import datetime, timezone
 from decimal import Decimal
 from typing import Dict, List, Optional
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from sqlalchemy.dialects.postgresql import insert
 
@@ -9,13 +12,175 @@ from app.models.finance import MarketplaceTransaction
 from app.models.integration import PlatformConfig
 from app.services import integration_service
 from app.models.order import OrderHeader
+from app.services.profit_service import ProfitService
+from app.services.finance_fact_service import FinanceFactService
+from app.services.order_rollup_service import local_date
 
 logger = logging.getLogger(__name__)
 
+# Rows per multi-row INSERT (one transaction per API page)
+FINANCE_INSERT_BATCH_SIZE = 1000
+# TikTok statements fetched in parallel (pages share the client's rate limiter)
+TIKTOK_STATEMENT_CONCURRENCY = 5
+
+# Unique key of a marketplace transaction (ix_marketplace_transaction_idempotency)
+IDEMPOTENCY_COLUMNS = (
+    "platform", "shop_id", "external_order_id", "statement_id",
+    "transaction_type", "external_txn_id", "transaction_date",
+)
+# Typed fee columns filled from the platform payload: column -> JSON paths (summed)
+FEE_COLUMN_FIELDS = {
+    "gross_sales_amount": (("gross_sales_amount",),),
+    "settlement_amount": (("settlement_amount",),),
+    "fee_amount": (("fee_amount",),),
+    "platform_commission_amount": (("platform_commission_amount",),),
+    "affiliate_commission_amount": (("affiliate_commission_amount",),),
+    "affiliate_ads_commission_amount": (("affiliate_ads_commission_amount",),),
+    "affiliate_partner_commission_amount": (("affiliate_partner_commission_amount",),),
+    "ams_commission_amount": (
+        ("order_income", "ams_commission_fee"),
+        ("order_income", "order_ams_commission_fee"),
+    ),
+    "shipping_fee_amount": (("shipping_fee_amount",),),
+    "actual_shipping_fee_amount": (("actual_shipping_fee_amount",),),
+    "platform_shipping_discount_amount": (("platform_shipping_fee_discount_amount",),),
+    "customer_paid_shipping_amount": (("customer_paid_shipping_fee_amount",),),
+    "referral_fee_amount": (("referral_fee_amount",),),
+    "retail_delivery_fee_amount": (("retail_delivery_fee_amount",),),
+    "fbt_fee_amount": (("fbt_fulfillment_fee_amount",),),
+}
+
+# Columns refreshed when a re-sync meets an existing transaction
+_UPSERT_COLUMNS = (
+    "order_id", "amount", "currency", "payout_reference", "description", "raw_data",
+    *FEE_COLUMN_FIELDS,
+)
+
+
+def _payload_hash(payload: Dict) -> str:
+    """Stable id for platform rows that carry no transaction id"""
+    return hashlib.md5(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _fee_columns(raw_data: Optional[Dict]) -> Dict[str, Optional[Decimal]]:
+    """Typed fee values from a payload (None for components it does not carry)"""
+    fees = {}
+    for column, paths in FEE_COLUMN_FIELDS.items():
+        total = None
+        for path in paths:
+            value = raw_data
+            for key in path:
+                value = value.get(key) if isinstance(value, dict) else None
+            try:
+                number = Decimal(str(value)) if value not in (None, "") else None
+            except ArithmeticError:
+                number = None
+            if number is not None and number.is_finite():
+                total = (total or Decimal(0)) + number
+        fees[column] = total
+    return fees
+
+
 class FinanceSyncService:
     def __init__(self, db: Session):
         self.db = db
 
+    # ========== Writer ==========
+
+    def _resolve_orders(self, external_ids) -> Dict[str, tuple]:
+        """external_order_id -> (order_header.id, order_datetime), one IN query per batch"""
+        external_ids = list({str(e) for e in external_ids if e})
+        if not external_ids:
+            return {}
+        rows = self.db.query(OrderHeader.external_order_id, OrderHeader.id, OrderHeader.order_datetime).filter(
+            OrderHeader.external_order_id.in_(external_ids)
+        ).all()
+        return {ext: (oid, order_datetime) for ext, oid, order_datetime in rows}
+
+    def _write_transactions(self, rows: List[Dict]) -> int:
+        """
+        Upsert prepared transaction rows and commit (one transaction).
+        Order ids are resolved for the whole batch at once; rows already
+        stored under the same idempotency key are updated in place, so
+        overlapping re-syncs neither duplicate nor delete anything.
+        Rows without a platform transaction date take the order's create
+        time (the date is part of the key, so it must be stable); rows
+        with neither are skipped.
+        """
+        if not rows:
+            return 0
+        orders = self._resolve_orders(r["external_order_id"] for r in rows)
+        by_key = {}
+        skipped = 0
+        for r in rows:
+            order_id, order_datetime = orders.get(r["external_order_id"], (None, None))
+            r = dict(r, order_id=order_id)
+            if r["transaction_date"] is None:
+                if order_datetime is None:
+                    skipped += 1
+                    continue
+                r["transaction_date"] = order_datetime
+            by_key[tuple(r[c] for c in IDEMPOTENCY_COLUMNS)] = r  # Same key twice in a page: last wins
+        if skipped:
+            logger.warning(f"Skipped {skipped} {rows[0]['platform']} transactions without a date or known order")
+        values = list(by_key.values())
+        if not values:
+            return 0
+
+        stmt = insert(MarketplaceTransaction)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(IDEMPOTENCY_COLUMNS),
+            set_={**{c: stmt.excluded[c] for c in _UPSERT_COLUMNS}, "updated_at": func.now()},
+        )
+        try:
+            for i in range(0, len(values), FINANCE_INSERT_BATCH_SIZE):
+                self.db.execute(stmt, values[i:i + FINANCE_INSERT_BATCH_SIZE])
+            # Core INSERT skips the ORM hooks: queue profit and finance fact recompute here
+            ProfitService.mark_dirty(self.db, (r["order_id"] for r in values))
+            FinanceFactService.mark_dirty(self.db, ((local_date(r["transaction_date"]), r["platform"]) for r in values))
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        return len(values)
+
+    @staticmethod
+    def _tx_row(
+        config: PlatformConfig,
+        tx_type: str,
+        amount,
+        tx_date: Optional[datetime],
+        description: str,
+        raw_data: Dict,
+        external_order_id: Optional[str] = None,
+        payout_reference: Optional[str] = None,
+        currency: str = "THB",
+        statement_id: Optional[str] = None,
+        external_txn_id: Optional[str] = None,
+        with_fees: bool = True,
+    ) -> Dict:
+        """
+        One marketplace_transaction row (all rows share the same keys for batched INSERT).
+        with_fees=False leaves the typed fee columns empty, for rows that share a
+        payload already counted on a sibling row.
+        """
+        fees = _fee_columns(raw_data if with_fees else None)
+        return {
+            "platform": config.platform,
+            "shop_id": str(config.shop_id or ""),
+            "external_order_id": str(external_order_id or ""),
+            "statement_id": str(statement_id or ""),
+            "external_txn_id": str(external_txn_id or ""),
+            "transaction_type": tx_type,
+            "amount": Decimal(str(amount)),
+            "currency": currency or "THB",
+            "transaction_date": tx_date,
+            "payout_reference": payout_reference,
+            "description": description,
+            "raw_data": raw_data,
+            **fees,
+        }
+
     async def sync_platform_finance(
         self,
         config: PlatformConfig,
@@ -74,28 +239,16 @@ class FinanceSyncService:
             if not escrow_list:
                 continue
 
-            # 1. OPTIMIZATION: Filter out already synced orders (Idempotency)
-            order_sns = [item.get("order_sn") for item in escrow_list]
-            
-            # Check DB for existing transactions for these orders
-            # We assume if we have "ITEM_PRICE" transaction for this order in "shopee", it's synced.
-            # Or just check description containing the order_sn to be generic
-            existing_sns = set()
-            try:
-                # Batch query is faster
-                existing_q = self.db.query(MarketplaceTransaction.description).filter(
+            # 1. Skip escrows already stored (idempotency key index probe)
+            order_sns = [str(item.get("order_sn")) for item in escrow_list if item.get("order_sn")]
+            existing_sns = {
+                row.external_order_id
+                for row in self.db.query(MarketplaceTransaction.external_order_id).filter(
                     MarketplaceTransaction.platform == 'shopee',
-                    MarketplaceTransaction.description.in_([f"{config.shop_name} - {sn}" for sn in order_sns])
-                ).all()
-                # Description format: "{shop_name} - {order_sn}"
-                # Extract SN from description
-                for row in existing_q:
-                    desc = row.description
-                    if " - " in desc:
-                        sn_part = desc.split(" - ")[-1]
-                        existing_sns.add(sn_part)
-            except Exception as e:
-                logger.warning(f"Failed to batch check existing Finance: {e}")
+                    MarketplaceTransaction.shop_id == str(config.shop_id),
+                    MarketplaceTransaction.external_order_id.in_(order_sns)
+                ).distinct()
+            } if order_sns else set()
 
             # 2. Prepare tasks for missing
             tasks = []
@@ -103,7 +256,7 @@ class FinanceSyncService:
             
             for item in escrow_list:
                 order_sn = item.get("order_sn")
-                if order_sn in existing_sns:
+                if str(order_sn) in existing_sns:
                     continue # Skip existing
                 
                 stats["fetched"] += 1
@@ -118,23 +271,18 @@ class FinanceSyncService:
             logger.info(f"Fetching {len(tasks)} details concurrently...")
             results = await asyncio.gather(*tasks)
             
-            # 4. Save results
-            saved_count = 0
+            # 4. Save results (one insert + commit for the page)
+            rows = []
             for i, detail in enumerate(results):
                 if detail:
-                    self._save_shopee_transaction(detail, config, pending_items[i])
-                    saved_count += 1
-            
-            stats["created"] += saved_count
+                    rows.extend(self._build_shopee_rows(detail, config, pending_items[i]))
+            stats["created"] += self._write_transactions(rows)
             
             if not has_more:
                 break
 
     async def _sync_tiktok_finance(self, client, config, time_from, time_to, stats):
         """Sync TikTok Statements and Transactions (Concurrent)"""
-        import asyncio
-        import time 
-
         cursor = None
         has_more = True
         all_statements = []
@@ -162,79 +310,62 @@ class FinanceSyncService:
             return
 
         logger.info(f"Found {len(all_statements)} TikTok statements. Processing concurrently...")
+        await self.ingest_tiktok_statements(client, config, all_statements, stats)
 
-        # Step 2: Process Statements Concurrently
-        sem = asyncio.Semaphore(5) # Limit to 5 concurrent statements (intensive on DB/network)
+    async def ingest_tiktok_statements(self, client, config, statements: List[Dict], stats: Optional[Dict] = None):
+        """
+        Store statements with all their transactions, TIKTOK_STATEMENT_CONCURRENCY
+        at a time. The STATEMENT_SUMMARY row is written after the last page, so its
+        presence marks a statement whose transactions are fully stored.
+        """
+        import asyncio
+
+        stats = stats if stats is not None else {"fetched": 0, "created": 0, "errors": 0}
+        sem = asyncio.Semaphore(TIKTOK_STATEMENT_CONCURRENCY)
+        limiter = client.get_rate_limiter()
         
         async def process_statement(statement):
             async with sem:
                 statement_id = statement.get("id")
-                
-                # Check / Cleanup Existing
-                # If we are syncing this statement, clearer to wipe existing transactions for this statement_id
-                # so we don't duplicate.
-                existing = self.db.query(MarketplaceTransaction).filter(
-                    MarketplaceTransaction.platform == 'tiktok',
-                    MarketplaceTransaction.payout_reference == statement_id
-                ).delete()
-                # Also delete the statement summary itself if exists
-                # (We don't strictly have a separate table, just a tx with type STATEMENT_SUMMARY)
-                # The delete above covers it if we use payout_reference consistenly.
-                self.db.commit()
-                
-                # Save Statement Summary
-                self._save_tiktok_statement(statement, config)
-                stats["fetched"] += 1
+                stmt_ts = statement.get("statement_time")
+                stmt_time = datetime.fromtimestamp(stmt_ts, timezone.utc) if stmt_ts else None
                 
                 # Fetch Transactions (Pagination)
                 tx_cursor = None
-                tx_has_more = True
                 tx_count = 0
                 
-                while tx_has_more:
+                while True:
                     try:
+                        await limiter.acquire()
                         tx_resp = await client.get_statement_transactions(statement_id, tx_cursor)
-                        if not tx_resp:
-                            break
-                        
-                        transactions = tx_resp.get("statement_transactions", [])
-                        if not transactions:
-                            break
-                            
-                        # Bulk Insert Candidates
-                        bulk_txs = []
-                        
-                        stmt_ts = statement.get("statement_time")
-                        stmt_time = datetime.fromtimestamp(stmt_ts, timezone.utc) if stmt_ts else None
-
-                        for tx_data in transactions:
-                            tx_obj = self._prepare_tiktok_transaction(tx_data, config, statement_id, stmt_time)
-                            if tx_obj:
-                                bulk_txs.append(tx_obj)
-                        
-                        if bulk_txs:
-                            # self.db.bulk_save_objects(bulk_txs) # Can be problematic with some session states
-                            self.db.add_all(bulk_txs)
-                            self.db.commit()
-                            tx_count += len(bulk_txs)
-                            stats["created"] += len(bulk_txs)
-                            logger.info(f"Statement {statement_id}: Saved batch of {len(bulk_txs)} transactions.")
+                        transactions = (tx_resp or {}).get("statement_transactions", [])
                         
-                        tx_cursor = tx_resp.get("next_page_token")
-                        tx_has_more = bool(tx_cursor)
-                        
-                        # Rate limit protection within loop
-                        # await asyncio.sleep(0.1) 
+                        # Whole page: order ids resolved in one query, one INSERT, one commit
+                        rows = [
+                            self._build_tiktok_row(tx_data, config, statement_id, stmt_time)
+                            for tx_data in transactions
+                        ]
+                        saved = self._write_transactions(rows)
+                        if saved:
+                            tx_count += saved
+                            stats["created"] += saved
+                            logger.info(f"Statement {statement_id}: Saved batch of {saved} transactions.")
                         
+                        tx_cursor = (tx_resp or {}).get("next_page_token")
+                        if not tx_cursor:
+                            break
                     except Exception as e:
                         logger.error(f"Error processing statement {statement_id} page: {e}")
-                        break
+                        stats["errors"] += 1
+                        return
                 
+                # Statement Summary last: re-syncs upsert on the idempotency key
+                self._write_transactions([self._build_tiktok_statement_row(statement, config)])
+                stats["fetched"] += 1
                 logger.info(f"Statement {statement_id} done. {tx_count} txs synced.")
 
-        # Create Tasks
-        tasks = [process_statement(stmt) for stmt in all_statements]
-        await asyncio.gather(*tasks)
+        await asyncio.gather(*(process_statement(stmt) for stmt in statements if stmt.get("id")))
+        return stats
 
     async def _sync_lazada_finance(self, client, config, time_from, time_to, stats):
         """Sync Lazada Transaction Details"""
@@ -253,16 +384,15 @@ class FinanceSyncService:
             # Simple deduplication could be added here if we had a reliable unique ID
             # For now, we append.
             
-            for item in transactions:
-                self._save_lazada_transaction(item, config)
-                stats["fetched"] += 1
-                stats["created"] += 1
+            rows = [self._build_lazada_row(item, config) for item in transactions]
+            stats["fetched"] += len(rows)
+            stats["created"] += self._write_transactions(rows)
                 
         except Exception as e:
             logger.error(f"Error syncing lazada finance: {e}", exc_info=True)
 
-    def _save_lazada_transaction(self, item: Dict, config: PlatformConfig):
-        """Save Lazada Transaction"""
+    def _build_lazada_row(self, item: Dict, config: PlatformConfig) -> Dict:
+        """Lazada transaction -> row (order linked in _write_transactions)"""
         from dateutil.parser import parse
         
         # Extract Fields
@@ -300,49 +430,27 @@ class FinanceSyncService:
         # Date
         date_str = item.get("transaction_date")
         try:
-            if date_str:
-                # Expecting format like "2025-01-01" or ISO
-                tx_date = parse(date_str)
-            else:
-                tx_date = datetime.now()
+            # Expecting format like "2025-01-01" or ISO; None = order create time
+            tx_date = parse(date_str) if date_str else None
         except:
-            tx_date = datetime.now()
-
-        # Link Order
-        order_id = None
-        if order_no:
-            # Should optimize to avoid query per row if high volume
-            # But Lazada usually returns fewer items than Shopee/TikTok per day?
-            # Actually order items are individual lines.
-            order = self.db.query(OrderHeader).filter(OrderHeader.external_order_id == str(order_no)).first()
-            if order:
-                order_id = order.id
+            tx_date = None
 
         # Description
         details = item.get("details") or item.get("fee_name") or ""
         
-        tx = MarketplaceTransaction(
-            order_id=order_id,
-            platform="lazada",
-            transaction_type=tx_type,
-            amount=amount,
-            transaction_date=tx_date,
+        return self._tx_row(
+            config, tx_type, amount, tx_date,
             description=f"{config.shop_name} - {details}",
-            raw_data=item
+            raw_data=item,
+            external_order_id=order_no,
+            external_txn_id=item.get("transaction_number") or _payload_hash(item),
         )
-        self.db.add(tx)
-        # Commit every row or batch?
-        # Original code commits frequently. 
-        self.db.commit()
 
-    def _save_shopee_transaction(self, detail: Dict, config: PlatformConfig, summary: Dict):
-        """Save Shopee Escrow Detail to DB"""
+    def _build_shopee_rows(self, detail: Dict, config: PlatformConfig, summary: Dict) -> List[Dict]:
+        """Shopee escrow detail -> rows (order linked in _write_transactions)"""
         order_sn = detail.get("order_sn")
         order_income = detail.get("order_income", {})
-        
-        # Resolve order_id
-        order = self.db.query(OrderHeader).filter(OrderHeader.external_order_id == order_sn).first()
-        order_id = order.id if order else None
+        rows = []
         
         # Prepare Rows
         # Shopee structure: order_income -> items (price), seller_return_refund, cost_of_goods_sold, check keys
@@ -358,26 +466,25 @@ class FinanceSyncService:
         # 'seller_transaction_fee', 'commission_fee', 'service_fee' (Expenses)
         # 'escrow_amount' (Net)
         
-        tx_date = datetime.fromtimestamp(summary.get("escrow_release_time", 0)) if summary.get("escrow_release_time") else datetime.now()
+        # None = order create time (resolved in _write_transactions)
+        tx_date = datetime.fromtimestamp(summary.get("escrow_release_time", 0)) if summary.get("escrow_release_time") else None
         
-        # Helper to insert
-        def add_tx(tx_type, amount):
+        # Helper to insert (source field is the row's id within the escrow)
+        def add_tx(tx_type, amount, source):
             if amount and float(amount) != 0:
-                tx = MarketplaceTransaction(
-                    order_id=order_id,
-                    platform="shopee",
-                    transaction_type=tx_type,
-                    amount=Decimal(str(amount)),
-                    transaction_date=tx_date,
-                    payout_reference=None, # Shopee might not give batch ID easily in this API
+                rows.append(self._tx_row(
+                    config, tx_type, amount, tx_date,
                     description=f"{config.shop_name} - {order_sn}",
-                    raw_data=detail
-                )
-                self.db.add(tx)
+                    raw_data=detail,
+                    external_order_id=order_sn,
+                    payout_reference=None,  # Shopee might not give batch ID easily in this API
+                    external_txn_id=source,
+                    with_fees=not rows,  # Escrow-level fees once per order
+                ))
 
         # Map fields
         # Income
-        add_tx("ITEM_PRICE", order_income.get("items_total_amount", 0)) # Verify key
+        add_tx("ITEM_PRICE", order_income.get("items_total_amount", 0), "items_total_amount") # Verify key
         # Expenses (Negative? API usually gives positive value for fee, we should make it negative?)
         # Convention: Amount in DB should be signed. Income positive, Fee negative.
         # Shopee API usually returns Fee as positive number "10.00", so we must negate.
@@ -418,14 +525,14 @@ class FinanceSyncService:
                 # Except 'rebate' which is Income.
                 
                 if 'rebate' in fee_key:
-                    add_tx(tx_type, abs(amount))
+                    add_tx(tx_type, abs(amount), fee_key)
                 else:
-                    add_tx(tx_type, -abs(amount))
+                    add_tx(tx_type, -abs(amount), fee_key)
         
         # Income - Buyer Paid Shipping (Pass-through)
         buyer_shipping = order_income.get('buyer_paid_shipping_fee')
         if buyer_shipping and float(buyer_shipping) > 0:
-             add_tx('SHIPPING_INCOME', float(buyer_shipping))
+             add_tx('SHIPPING_INCOME', float(buyer_shipping), 'buyer_paid_shipping_fee')
 
         # Core Income
         # Use cost_of_goods_sold (payout amount for items) if available, otherwise original_price
@@ -433,120 +540,52 @@ class FinanceSyncService:
         original_price = order_income.get("original_cost_of_goods_sold")
         
         if deal_price and float(deal_price) != 0:
-            add_tx("ITEM_PRICE", float(deal_price))
+            add_tx("ITEM_PRICE", float(deal_price), "cost_of_goods_sold")
         elif original_price and float(original_price) != 0:
-            add_tx("ITEM_PRICE", float(original_price))
+            add_tx("ITEM_PRICE", float(original_price), "original_cost_of_goods_sold")
         
         # ESCROW_RELEASE - Net payout amount (for "เงินเข้าบัญชี" calculation)
         # This is the actual amount that gets released to seller's wallet
         escrow_amount = summary.get("escrow_amount") or order_income.get("escrow_amount")
         if escrow_amount and float(escrow_amount) != 0:
-            add_tx("ESCROW_RELEASE", float(escrow_amount))
+            add_tx("ESCROW_RELEASE", float(escrow_amount), "escrow_amount")
             
-        self.db.commit()
+        return rows
 
-    def _save_tiktok_statement(self, statement: Dict, config: PlatformConfig):
-        """Save TikTok Statement Summary"""
+    def _build_tiktok_statement_row(self, statement: Dict, config: PlatformConfig) -> Dict:
+        """TikTok statement summary -> row"""
         # Statement fields: id, statement_time, settlement_amount, currency, payment_status
         statement_id = statement.get("id")
-        settlement_amount = Decimal(str(statement.get("settlement_amount", 0)))
-        currency = statement.get("currency", "THB")
         statement_time = datetime.fromtimestamp(statement.get("statement_time", 0))
         
-        tx = MarketplaceTransaction(
-            order_id=None,  # Statement is summary, no specific order
-            platform="tiktok",
-            transaction_type="STATEMENT_SUMMARY",
-            amount=settlement_amount,
-            currency=currency,
-            transaction_date=statement_time,
-            payout_reference=statement_id,
+        return self._tx_row(
+            config, "STATEMENT_SUMMARY", statement.get("settlement_amount", 0), statement_time,
             description=f"{config.shop_name} - Statement {statement_id}",
-            raw_data=statement
+            raw_data=statement,
+            payout_reference=statement_id,  # Statement is summary, no specific order
+            currency=statement.get("currency", "THB"),
+            statement_id=statement_id,
         )
-        self.db.add(tx)
-        self.db.commit()
 
-    def _prepare_tiktok_transaction(self, transaction: Dict, config: PlatformConfig, statement_id: str = None, statement_time: datetime = None) -> MarketplaceTransaction:
-        """Prepare TikTok Transaction Object (No Commit)"""
+    def _build_tiktok_row(self, transaction: Dict, config: PlatformConfig, statement_id: str = None, statement_time: datetime = None) -> Dict:
+        """TikTok statement transaction -> row (order linked in _write_transactions)"""
         # TikTok V2 uses 'settlement_amount' for the net value of the transaction.
-        amount = Decimal(str(transaction.get("amount") or transaction.get("settlement_amount") or 0))
-        currency = transaction.get("currency", "THB")
-        tx_type = transaction.get("type", "UNKNOWN")
-        
-        # Date Logic
-        from datetime import timezone
+        amount = transaction.get("amount") or transaction.get("settlement_amount") or 0
         
         tx_ts = transaction.get("order_create_time")
         if tx_ts:
             tx_date = datetime.fromtimestamp(tx_ts, timezone.utc)
-        elif statement_time:
-             tx_date = statement_time
         else:
-             tx_date = datetime.now(timezone.utc)
-
-        
-        # Resolve order locally (cache could be optimized, but query is fast enough for now if indexed)
-        # For bulk operations, resolving order_id for 1000 items one by one is slow.
-        # Ideally we should pre-fetch map. But let's try direct first.
+            tx_date = statement_time  # None = order create time (resolved in _write_transactions)
         
         external_id = transaction.get("order_id")
-        # Optimization: We assume external_order_id is unique enough.
-        # If we really need order_id integers, we should map.
-        # But 'transaction' table usually links via order_id FK.
-        # Let's do a subquery or just leave it nullable if not found?
-        # A simple query per row is okay for batch of 20-50, but for thousands...
-        
-        # NOTE: For speed in bulk_save_objects, we might skip order_id lookup here if it's too slow 
-        # or do a batch lookup before loop.
-        # Let's do a single lookup for now.
-        
-        order_id = None
-        if external_id:
-            # This is synchronous blocking in async loop if not careful. 
-            # But we are in a thread pool executor usually? No, this is async def called. 
-            # DB operations here are blocking logic.
-            # However `db.query` is fast.
-            # To optimize: cache this lookup.
-            pass
-
-        # Since we are using bulk_save, we need the Order ID.
-        # For now, let's just lookup. If performance is bad, we cache.
-        
-        if external_id:
-             # Fast lookup match
-             # We might want to use a cached map if we passed it in.
-             # For now, simplistic.
-             # WARNING: This `self.db` usage inside `async def` (via `process_statement`) 
-             # without `await` is blocking the event loop.
-             # But SQLAlchemy Session is not async. 
-             # We should wrap this block in run_in_executor if we want true non-blocking.
-             # Or just accept it's "concurrently blocking" threads? No, Python async is single thread.
-             # So this blocks the loop.
-             # For true async with sync DB, we need separate thread.
-             
-             # But practically, `await client` releases loop, then we crunch data (block), then await next.
-             # It is "Interleaved", which is better than sequential network wait.
-             
-             existing_order_q = self.db.query(OrderHeader.id).filter(OrderHeader.external_order_id == external_id).first()
-             if existing_order_q:
-                 order_id = existing_order_q[0]
-
-        return MarketplaceTransaction(
-            order_id=order_id,
-            platform="tiktok",
-            transaction_type=tx_type,
-            amount=amount,
-            currency=currency,
-            transaction_date=tx_date,
-            payout_reference=statement_id,
+        return self._tx_row(
+            config, transaction.get("type", "UNKNOWN"), amount, tx_date,
             description=f"{config.shop_name} - {external_id or 'N/A'}",
-            raw_data=transaction
+            raw_data=transaction,
+            external_order_id=external_id,
+            payout_reference=statement_id,
+            currency=transaction.get("currency", "THB"),
+            statement_id=statement_id,
+            external_txn_id=transaction.get("id") or _payload_hash(transaction),
         )
-
-    def _save_tiktok_transaction(self, transaction: Dict, config: PlatformConfig, statement_id: str = None):
-        """Legacy Wrapper"""
-        obj = self._prepare_tiktok_transaction(transaction, config, statement_id)
-        self.db.add(obj)
-        self.db.commit()
-
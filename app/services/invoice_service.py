@@ -1,12 +1,27 @@
 """
 Invoice Service - Tax Invoice Generation
+
+Tax invoices are rendered from templates compiled once per process
+(tax_invoice_page.html for one invoice, tax_invoice.html for the printable
+document around one or more pages). Rendered pages are cached per order and
+invoice version (order/profile update time, line-item fingerprint, invoice
+number and date), so re-downloads and bulk prints only render invoices that
+changed.
 """
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from sqlalchemy import func, literal_column
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 from sqlalchemy.orm import Session
-from typing import Optional
+from typing import Dict, Iterable, List, Optional, Tuple
 from uuid import UUID
 from datetime import datetime
 from decimal import Decimal
 
+from jinja2 import Environment, FileSystemLoader
+
 from app.models import OrderHeader, OrderItem
 from app.models.invoice import InvoiceProfile
 
@@ -20,6 +35,38 @@ SELLER_INFO = {
     "phone": "",
 }
 
+# Rendered invoice pages kept in memory (LRU)
+INVOICE_RENDER_CACHE_SIZE = 2000
+# Upper bound for one bulk print
+INVOICE_BATCH_MAX = 500
+
+_TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "templates")
+# Templates do not change at runtime: compile once, never stat the files again
+_jinja_env = Environment(loader=FileSystemLoader(_TEMPLATE_DIR), auto_reload=False)
+_templates: Dict[str, object] = {}
+# (order_id, version) -> rendered page HTML
+_page_cache: "OrderedDict[tuple, str]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _template(name: str):
+    template = _templates.get(name)
+    if template is None:
+        with _cache_lock:
+            template = _templates.get(name)
+            if template is None:
+                template = _templates[name] = _jinja_env.get_template(name)
+    return template
+
+
+@lru_cache(maxsize=4096)
+def _baht_text(number_val: float) -> str:
+    try:
+        from bahttext import bahttext
+        return bahttext(number_val)
+    except ImportError:
+        return InvoiceService._simple_baht_text(number_val)
+
 
 class InvoiceService:
     """Service for generating Tax Invoices"""
@@ -33,18 +80,54 @@ class InvoiceService:
         return f"INV-{order_date.strftime('%Y%m')}-{order_id_suffix}"
     
     @staticmethod
-    def get_invoice_data(db: Session, order_id: UUID) -> Optional[dict]:
-        """Get all data needed for tax invoice"""
-        # Fetch order with items
-        order = db.query(OrderHeader).filter(OrderHeader.id == order_id).first()
-        if not order:
-            return None
-        
-        # Fetch invoice profile if exists
-        invoice_profile = db.query(InvoiceProfile).filter(
-            InvoiceProfile.order_id == order_id
-        ).first()
-        
+    def _load_orders(db: Session, order_ids: Iterable[UUID]) -> List[Tuple[OrderHeader, Optional[InvoiceProfile]]]:
+        """Orders with their invoice profile (one joined query)"""
+        return db.query(OrderHeader, InvoiceProfile).outerjoin(
+            InvoiceProfile, InvoiceProfile.order_id == OrderHeader.id
+        ).filter(OrderHeader.id.in_(list(order_ids))).all()
+    
+    @staticmethod
+    def _load_items(db: Session, order_ids: List[UUID]) -> Dict[UUID, List[OrderItem]]:
+        """Line items of several orders (one query)"""
+        items: Dict[UUID, List[OrderItem]] = {order_id: [] for order_id in order_ids}
+        if order_ids:
+            for item in db.query(OrderItem).filter(OrderItem.order_id.in_(order_ids)).order_by(OrderItem.id).all():
+                items[item.order_id].append(item)
+        return items
+    
+    @staticmethod
+    def _item_fingerprints(db: Session, order_ids: List[UUID]) -> Dict[UUID, Optional[str]]:
+        """
+        Digest of the printed line-item fields per order (one grouped query).
+        OrderItem has no updated_at, so item edits are detected by content.
+        """
+        if not order_ids:
+            return {}
+        line = func.concat_ws(
+            "|", OrderItem.id, OrderItem.sku, OrderItem.product_name,
+            OrderItem.quantity, OrderItem.unit_price, OrderItem.line_total,
+        )
+        rows = db.query(
+            OrderItem.order_id,
+            func.md5(func.string_agg(line, aggregate_order_by(literal_column("','"), OrderItem.id))),
+        ).filter(OrderItem.order_id.in_(order_ids)).group_by(OrderItem.order_id).all()
+        return dict(rows)
+    
+    @staticmethod
+    def _invoice_header(order: OrderHeader, profile: Optional[InvoiceProfile], issued: bool) -> Tuple[str, str]:
+        """(invoice_number, invoice_date) - the issued values when `issued`, else generated ones"""
+        if issued and profile is not None:
+            invoice_date = profile.invoice_date.strftime("%d/%m/%Y") if profile.invoice_date else datetime.now().strftime("%d/%m/%Y")
+            return profile.invoice_number, invoice_date
+        return InvoiceService.generate_invoice_number(order), datetime.now().strftime("%d/%m/%Y")
+    
+    @staticmethod
+    def _build_invoice_data(
+        order: OrderHeader,
+        invoice_profile: Optional[InvoiceProfile],
+        order_items: List[OrderItem],
+    ) -> dict:
+        """Template context for one invoice"""
         # Determine buyer info (from InvoiceProfile or Order)
         if invoice_profile:
             buyer_info = {
@@ -86,7 +169,7 @@ class InvoiceService:
         
         # Prepare line items
         items = []
-        for idx, item in enumerate(order.items, start=1):
+        for idx, item in enumerate(order_items, start=1):
             unit_price = float(item.unit_price or 0)
             quantity = item.quantity or 1
             line_total = float(item.line_total or 0)
@@ -126,22 +209,107 @@ class InvoiceService:
             "grand_total": float(gross_revenue),
             "grand_total_text": baht_text,
         }
-
+    
+    @staticmethod
+    def get_invoice_data(db: Session, order_id: UUID) -> Optional[dict]:
+        """Get all data needed for tax invoice"""
+        rows = InvoiceService._load_orders(db, [order_id])
+        if not rows:
+            return None
+        order, invoice_profile = rows[0]
+        items = InvoiceService._load_items(db, [order.id])[order.id]
+        return InvoiceService._build_invoice_data(order, invoice_profile, items)
+    
+    @staticmethod
+    def _render_pages(db: Session, order_ids: List[UUID], issued: bool = False) -> List[Tuple[str, str]]:
+        """
+        (invoice_number, page HTML) in the order of `order_ids` (missing orders are skipped).
+        Pages come from the cache when the invoice version is unchanged.
+        """
+        rows = {order.id: (order, profile) for order, profile in InvoiceService._load_orders(db, order_ids)}
+        fingerprints = InvoiceService._item_fingerprints(db, list(rows))
+        keys: Dict[UUID, tuple] = {}
+        pages: Dict[UUID, str] = {}
+        for order_id, (order, profile) in rows.items():
+            invoice_number, invoice_date = InvoiceService._invoice_header(order, profile, issued)
+            keys[order_id] = (
+                order_id,
+                order.updated_at,
+                profile.updated_at if profile is not None else None,
+                fingerprints.get(order_id),
+                invoice_number,
+                invoice_date,
+            )
+        with _cache_lock:
+            for order_id, key in keys.items():
+                page = _page_cache.get(key)
+                if page is not None:
+                    _page_cache.move_to_end(key)
+                    pages[order_id] = page
+        
+        misses = [order_id for order_id in keys if order_id not in pages]
+        if misses:
+            template = _template("tax_invoice_page.html")
+            items = InvoiceService._load_items(db, misses)
+            rendered = {}
+            for order_id in misses:
+                order, profile = rows[order_id]
+                data = InvoiceService._build_invoice_data(order, profile, items[order_id])
+                data["invoice_number"], data["invoice_date"] = keys[order_id][4], keys[order_id][5]
+                rendered[keys[order_id]] = pages[order_id] = template.render(**data)
+            with _cache_lock:
+                _page_cache.update(rendered)
+                while len(_page_cache) > INVOICE_RENDER_CACHE_SIZE:
+                    _page_cache.popitem(last=False)
+        
+        return [(keys[order_id][4], pages[order_id]) for order_id in order_ids if order_id in pages]
+    
+    @staticmethod
+    def render_document(pages: List[str], title: str) -> str:
+        """Printable HTML document around rendered invoice pages (one A4 page each)"""
+        return _template("tax_invoice.html").render(pages=pages, title=title)
+    
+    @staticmethod
+    def render_invoice_html(db: Session, order_id: UUID, issued: bool = False) -> Optional[str]:
+        """
+        Tax invoice HTML for one order.
+        With `issued`, the invoice number/date issued on the InvoiceProfile are printed.
+        """
+        pages = InvoiceService._render_pages(db, [order_id], issued=issued)
+        if not pages:
+            return None
+        invoice_number, html = pages[0]
+        return InvoiceService.render_document([html], title=f"ใบกำกับภาษี {invoice_number}")
+    
+    @staticmethod
+    def issued_order_ids(
+        db: Session,
+        start: datetime,
+        end: datetime,
+        limit: int = INVOICE_BATCH_MAX,
+    ) -> List[UUID]:
+        """Orders with an invoice issued in [start, end), by invoice number"""
+        rows = db.query(InvoiceProfile.order_id).filter(
+            InvoiceProfile.status == "ISSUED",
+            InvoiceProfile.invoice_date >= start,
+            InvoiceProfile.invoice_date < end,
+        ).order_by(InvoiceProfile.invoice_number, InvoiceProfile.order_id).limit(limit).all()
+        return [order_id for (order_id,) in rows]
+    
+    @staticmethod
+    def render_issued_batch(db: Session, order_ids: List[UUID], title: str = "ใบกำกับภาษี") -> str:
+        """Issued tax invoices of several orders as one printable document"""
+        pages = InvoiceService._render_pages(db, order_ids, issued=True)
+        return InvoiceService.render_document([html for _, html in pages], title=title)
+    
     @staticmethod
     def numeric_to_thai(number_val):
         """
         Convert number to Thai text (BahtText)
         Simple implementation or placeholder
         """
-        # Minimal implementation for common cases
-        # Or better: Attempt to import bahttext, if fail, fallback
-        try:
-            from bahttext import bahttext
-            return bahttext(number_val)
-        except ImportError:
-            # Fallback simple text (User might not have lib)
-            # return f"({number_val:,.2f} บาท)"
-            return InvoiceService._simple_baht_text(number_val)
+        # bahttext if installed, else the simple fallback; memoized per amount
+        return _baht_text(round(float(number_val), 2))
 
     @staticmethod
     def _simple_baht_text(number):
@@ -0,0 +1,208 @@
+"""
+Invoice Sync Service - Buyer tax-invoice requests from marketplace APIs
+
+Shopee buyer-invoice requests are fetched for whole order_sn_list chunks
+(ShopeeClient.BUYER_INVOICE_BATCH_SIZE) with a bounded number of chunks in
+flight, sharing the shop's rate limiter. Existing InvoiceProfile rows are
+checked with one query per chunk and new profiles inserted with
+ON CONFLICT (order_id) DO NOTHING.
+
+Each run is recorded as an INVOICE SyncJob; the next run only looks at
+orders created since the last successful one (minus a small overlap).
+Candidates are limited to the config's shop (raw_payload shop_id, stamped
+by ShopeeClient.normalize_order) so one shop's credentials never query
+another shop's order_sn.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import or_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.models.integration import PlatformConfig, SyncJob
+from app.models.invoice import InvoiceProfile
+from app.models.order import OrderHeader
+from app.services import integration_service
+
+logger = logging.getLogger(__name__)
+
+INVOICE_JOB_TYPE = "INVOICE"
+# Chunks requested in parallel (each chunk is one API call)
+INVOICE_SYNC_CONCURRENCY = 4
+# First run (no previous INVOICE job): orders created in the last N days
+INVOICE_SYNC_INITIAL_DAYS = 7
+# Re-check orders created shortly before the last run started
+INVOICE_SYNC_OVERLAP = timedelta(minutes=10)
+
+
+class InvoiceSyncService:
+    """Batched buyer-invoice sync into InvoiceProfile"""
+
+    @staticmethod
+    def _profile_values(order_id, order_sn: str, info: Dict[str, Any]) -> Dict[str, Any]:
+        now = datetime.utcnow()
+        tax_id = (info.get("tax_code") or info.get("tax_id") or "")[:20].strip()
+        return {
+            "order_id": order_id,
+            "profile_type": "COMPANY" if tax_id else "PERSONAL",
+            "invoice_name": (info.get("name") or info.get("invoice_name") or "-")[:200],
+            "tax_id": tax_id,
+            "branch": str(info.get("branch") or "00000")[:50].strip(),
+            "address_line1": (info.get("address") or "-")[:200],
+            "phone": (info.get("phone") or "")[:20],
+            "email": info.get("email"),
+            "status": "PENDING",
+            "created_source": "PLATFORM_API",
+            "platform_invoice_data": {
+                "platform": "SHOPEE",
+                "source": "API",
+                "raw_data": info,
+                "order_sn": order_sn,
+                "synced_at": now.isoformat(),
+            },
+            "platform_synced_at": now,
+        }
+
+    @staticmethod
+    def _since(db: Session, config: PlatformConfig) -> datetime:
+        """Start of the incremental window: last successful INVOICE job (with overlap)"""
+        last_start = db.query(SyncJob.started_at).filter(
+            SyncJob.platform_config_id == config.id,
+            SyncJob.job_type == INVOICE_JOB_TYPE,
+            SyncJob.status == "SUCCESS",
+        ).order_by(SyncJob.started_at.desc()).limit(1).scalar()
+        if last_start:
+            return last_start - INVOICE_SYNC_OVERLAP
+        return datetime.utcnow() - timedelta(days=INVOICE_SYNC_INITIAL_DAYS)
+
+    @staticmethod
+    def _candidates(
+        db: Session,
+        config: PlatformConfig,
+        since: datetime,
+        until: Optional[datetime] = None,
+    ) -> List[Tuple[Any, str]]:
+        """
+        (order id, order_sn) of the shop's Shopee orders created in the window without a profile.
+        Orders synced before shop_id was stamped into raw_payload are only attributable
+        (and included) while a single Shopee shop is active.
+        """
+        order_shop = OrderHeader.raw_payload["shop_id"].astext
+        shop_filter = order_shop == str(config.shop_id)
+        shops = integration_service.get_platform_configs(db, platform="shopee", is_active=True)
+        if len(shops) <= 1:
+            shop_filter = or_(shop_filter, order_shop.is_(None))
+
+        query = db.query(OrderHeader.id, OrderHeader.external_order_id).outerjoin(
+            InvoiceProfile, InvoiceProfile.order_id == OrderHeader.id
+        ).filter(
+            OrderHeader.channel_code == "shopee",
+            OrderHeader.created_at >= since,
+            OrderHeader.external_order_id.isnot(None),
+            InvoiceProfile.id.is_(None),
+            shop_filter,
+        )
+        if until:
+            query = query.filter(OrderHeader.created_at < until)
+        return query.order_by(OrderHeader.created_at).all()
+
+    @staticmethod
+    def _write_chunk(db: Session, chunk: List[Tuple[Any, str]], invoices: Dict[str, Dict]) -> int:
+        """Insert profiles for the chunk's orders with an invoice request (one existence query)"""
+        order_ids = [order_id for order_id, order_sn in chunk if order_sn in invoices]
+        if not order_ids:
+            return 0
+        existing = {
+            order_id for (order_id,) in db.query(InvoiceProfile.order_id).filter(
+                InvoiceProfile.order_id.in_(order_ids)
+            ).all()
+        }
+        rows = [
+            InvoiceSyncService._profile_values(order_id, order_sn, invoices[order_sn])
+            for order_id, order_sn in chunk
+            if order_sn in invoices and order_id not in existing
+        ]
+        if not rows:
+            return 0
+        # Profiles created meanwhile (customer portal, order sync) win
+        result = db.execute(
+            insert(InvoiceProfile).values(rows).on_conflict_do_nothing(index_elements=["order_id"])
+        )
+        db.commit()
+        return result.rowcount
+
+    @staticmethod
+    async def sync_shopee_invoices(
+        db: Session,
+        config: PlatformConfig,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ) -> Dict[str, int]:
+        """
+        Create InvoiceProfiles for Shopee orders with a buyer-invoice request.
+        Without `since`, only orders created since the last successful run are checked.
+        Returns: {checked, requested, created, errors}
+        """
+        stats = {"checked": 0, "requested": 0, "created": 0, "errors": 0}
+        job = integration_service.create_sync_job(db, platform_config_id=str(config.id), job_type=INVOICE_JOB_TYPE)
+        try:
+            if since is None:
+                since = InvoiceSyncService._since(db, config)
+            candidates = InvoiceSyncService._candidates(db, config, since, until)
+            client = integration_service.get_client_for_config(config)
+            limiter = client.get_rate_limiter()
+            semaphore = asyncio.Semaphore(INVOICE_SYNC_CONCURRENCY)
+            size = client.BUYER_INVOICE_BATCH_SIZE
+            chunks = [candidates[i:i + size] for i in range(0, len(candidates), size)]
+
+            async def fetch(chunk):
+                async with semaphore:
+                    await limiter.acquire()
+                    return await client.get_buyer_invoice_info_batch([order_sn for _, order_sn in chunk])
+
+            results = await asyncio.gather(*(fetch(chunk) for chunk in chunks), return_exceptions=True)
+            for chunk, invoices in zip(chunks, results):
+                stats["checked"] += len(chunk)
+                if isinstance(invoices, BaseException):
+                    logger.error(f"Buyer invoice fetch failed for {len(chunk)} orders: {invoices}")
+                    stats["errors"] += len(chunk)
+                    continue
+                stats["requested"] += len(invoices)
+                stats["created"] += InvoiceSyncService._write_chunk(db, chunk, invoices)
+
+            # A failed chunk keeps the window open for the next run
+            integration_service.complete_sync_job(
+                db,
+                job_id=str(job.id),
+                orders_fetched=stats["checked"],
+                orders_created=stats["created"],
+                orders_skipped=stats["checked"] - stats["requested"],
+                error_message=f"{stats['errors']} orders failed" if stats["errors"] else None,
+            )
+        except Exception as e:
+            db.rollback()
+            integration_service.complete_sync_job(db, job_id=str(job.id), error_message=str(e))
+            raise
+
+        logger.info(
+            f"Invoice sync {config.shop_name}: checked={stats['checked']}, "
+            f"requested={stats['requested']}, created={stats['created']}, errors={stats['errors']}"
+        )
+        return stats
+
+    @staticmethod
+    async def sync_all(db: Session, since: Optional[datetime] = None) -> Dict[str, Dict]:
+        """Invoice sync for every active Shopee shop"""
+        configs = integration_service.get_platform_configs(db, platform="shopee", is_active=True)
+        results = {}
+        for config in configs:
+            key = f"{config.platform}_{config.shop_id}"
+            try:
+                results[key] = await InvoiceSyncService.sync_shopee_invoices(db, config, since)
+            except Exception as e:
+                logger.error(f"Invoice sync failed for {config.shop_name}: {e}")
+                results[key] = {"error": str(e)}
+        return results
@@ -0,0 +1,425 @@
+"""
+Order Rollup Service - Daily order facts kept current from the write path
+
+order_daily_rollup holds one row per (local order date, channel, current
+status). Any flush that touches an order (or its items) marks its
+(date, channel) slice dirty in the same transaction, via a Session
+after_flush hook. Dirty slices are recomputed from order_header by a
+periodic job (reads never write: until then they aggregate dirty slices
+live); a nightly reconcile rebuilds the last ORDER_ROLLUP_RECONCILE_DAYS to
+catch writes that bypass the ORM. Rebuilds of the same day are serialized
+with transaction-scoped advisory locks and upsert their rows.
+
+Closed days are read from the rollup, the current local day is always
+aggregated live.
+
+Each slice also carries an order digest (XOR of 64-bit hashes of its
+(external id, status) pairs), so reconciliation can compare a day with the
+same digest of a marketplace order list without reading order_header.
+"""
+import hashlib
+import logging
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from uuid import UUID
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import event, func, inspect, text, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.core import settings
+from app.models import OrderHeader, OrderItem, OrderDailyRollup, OrderRollupDirty
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_FIELDS = ("order_count", "revenue", "item_quantity", "shipped_count", "collected_count", "order_digest")
+
+# Advisory lock key space of rollup rebuilds (second key: day ordinal)
+_REBUILD_LOCK_NAMESPACE = 0x4F52  # "OR"
+
+# Attributes of OrderHeader that feed the rollup
+_ROLLUP_ATTRS = (
+    "order_datetime", "channel_code", "status_normalized", "total_amount", "shipped_at", "collection_time",
+    "external_order_id",
+)
+
+# Statuses the order sync never moves between (final -> final, reverse flow):
+# the order digest folds them into one so they never read as a difference
+DIGEST_CLOSED_STATUSES = ("DELIVERED", "COMPLETED", "CANCELLED", "RETURNED", "DELIVERY_FAILED", "TO_RETURN")
+
+# Same value as order_pair_hash(): first 64 bits of md5("<external id>:<status>"), signed
+_ORDER_HASH_SQL = """
+    ('x' || substr(md5(COALESCE(oh.external_order_id, '') || ':' ||
+        CASE WHEN oh.status_normalized = ANY(CAST(:closed_statuses AS text[])) THEN 'CLOSED'
+             ELSE COALESCE(oh.status_normalized, 'UNKNOWN') END
+    ), 1, 16))::bit(64)::bigint
+"""
+
+_AGGREGATE_SQL = """
+    SELECT (oh.order_datetime AT TIME ZONE :tz)::date AS order_date,
+           oh.channel_code,
+           COALESCE(oh.status_normalized, 'UNKNOWN') AS status_normalized,
+           COUNT(*) AS order_count,
+           COALESCE(SUM(oh.total_amount), 0) AS revenue,
+           COALESCE(SUM(i.qty), 0) AS item_quantity,
+           COUNT(oh.shipped_at) AS shipped_count,
+           COUNT(oh.collection_time) AS collected_count,
+           COALESCE(BIT_XOR({order_hash}), 0) AS order_digest
+    FROM order_header oh
+    LEFT JOIN LATERAL (SELECT SUM(quantity) AS qty FROM order_item WHERE order_id = oh.id) i ON TRUE
+    WHERE oh.order_datetime >= :start_ts AND oh.order_datetime < :end_ts {channel_filter}
+    GROUP BY 1, 2, 3
+"""
+
+
+def _tz() -> ZoneInfo:
+    try:
+        return ZoneInfo(settings.TIMEZONE)
+    except Exception:
+        return ZoneInfo("UTC")
+
+
+def local_today() -> date:
+    return datetime.now(_tz()).date()
+
+
+def local_date(value: Optional[datetime]) -> Optional[date]:
+    """Local order date of a timestamp (naive values are UTC, as stored)"""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(_tz()).date()
+
+
+def digest_status(status: Optional[str]) -> str:
+    """Status as it enters the order digest"""
+    if status in DIGEST_CLOSED_STATUSES:
+        return "CLOSED"
+    return status or "UNKNOWN"
+
+
+def order_pair_hash(external_order_id: Optional[str], status: Optional[str]) -> int:
+    """64-bit hash of one (external id, status) pair of the order digest"""
+    key = f"{external_order_id or ''}:{digest_status(status)}"
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big", signed=True)
+
+
+def combine_digest(pairs: Iterable[Tuple[Optional[str], Optional[str]]]) -> Tuple[int, int]:
+    """(order count, digest) of (external id, status) pairs, comparable to get_digests()"""
+    count, digest = 0, 0
+    for external_order_id, status in pairs:
+        count += 1
+        digest ^= order_pair_hash(external_order_id, status)
+    return count, digest
+
+
+def _day_start_utc(day: date) -> datetime:
+    return datetime.combine(day, time.min).replace(tzinfo=_tz()).astimezone(timezone.utc)
+
+
+class OrderRollupService:
+    """Daily order rollup maintenance and reads"""
+
+    # ========== Dirty tracking ==========
+
+    @staticmethod
+    def _mark_dirty_stmt(keys: Iterable[Tuple[date, str]]):
+        stmt = insert(OrderRollupDirty).values([
+            {"order_date": d, "channel_code": c} for d, c in keys
+        ])
+        return stmt.on_conflict_do_update(
+            index_elements=[OrderRollupDirty.order_date, OrderRollupDirty.channel_code],
+            set_={"marked_at": func.now()},
+        )
+
+    @staticmethod
+    def mark_dirty(db: Session, keys: Iterable[Tuple[date, str]]):
+        """Mark (local date, channel) slices for recompute (does not commit)"""
+        keys = {(d, c) for d, c in keys if d and c}
+        if keys:
+            db.execute(OrderRollupService._mark_dirty_stmt(keys))
+
+    @staticmethod
+    def mark_orders_dirty(db: Session, order_ids: Iterable[UUID]):
+        """Mark the slices of the given orders (for set-based writes that skip the ORM hook)"""
+        order_ids = [str(oid) for oid in set(order_ids) if oid]
+        if not order_ids:
+            return
+        db.execute(text("""
+            INSERT INTO order_rollup_dirty (order_date, channel_code, marked_at)
+            SELECT DISTINCT (order_datetime AT TIME ZONE :tz)::date, channel_code, now()
+            FROM order_header
+            WHERE id = ANY(CAST(:ids AS uuid[])) AND order_datetime IS NOT NULL
+            ON CONFLICT (order_date, channel_code) DO UPDATE SET marked_at = EXCLUDED.marked_at
+        """), {"tz": str(_tz()), "ids": order_ids})
+
+    # ========== Rebuild ==========
+
+    @staticmethod
+    def _aggregate(db: Session, start_date: date, end_date: date, channels: Optional[List[str]] = None):
+        """Live aggregate of order_header for local dates start_date..end_date (inclusive)"""
+        params: Dict[str, Any] = {
+            "tz": str(_tz()),
+            "start_ts": _day_start_utc(start_date),
+            "end_ts": _day_start_utc(end_date + timedelta(days=1)),
+            "closed_statuses": list(DIGEST_CLOSED_STATUSES),
+        }
+        channel_filter = ""
+        if channels is not None:
+            channel_filter = "AND oh.channel_code = ANY(CAST(:channels AS text[]))"
+            params["channels"] = list(channels)
+        sql = _AGGREGATE_SQL.format(channel_filter=channel_filter, order_hash=_ORDER_HASH_SQL)
+        return db.execute(text(sql), params).all()
+
+    @staticmethod
+    def _lock_days(db: Session, start_date: date, end_date: date):
+        """Serialize concurrent rebuilds of the same days until the transaction ends"""
+        day = start_date
+        while day <= end_date:
+            db.execute(
+                text("SELECT pg_advisory_xact_lock(:ns, :day)"),
+                {"ns": _REBUILD_LOCK_NAMESPACE, "day": day.toordinal()},
+            )
+            day += timedelta(days=1)
+
+    @staticmethod
+    def rebuild(db: Session, start_date: date, end_date: date, channels: Optional[List[str]] = None) -> int:
+        """Recompute rollup rows for a date range (optionally some channels only). Does not commit."""
+        OrderRollupService._lock_days(db, start_date, end_date)
+        query = db.query(OrderDailyRollup).filter(
+            OrderDailyRollup.order_date >= start_date,
+            OrderDailyRollup.order_date <= end_date,
+        )
+        if channels is not None:
+            query = query.filter(OrderDailyRollup.channel_code.in_(channels))
+        query.delete(synchronize_session=False)
+
+        rows = OrderRollupService._aggregate(db, start_date, end_date, channels)
+        if rows:
+            stmt = insert(OrderDailyRollup)
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=[
+                    OrderDailyRollup.order_date, OrderDailyRollup.channel_code, OrderDailyRollup.status_normalized,
+                ],
+                set_={f: stmt.excluded[f] for f in ROLLUP_FIELDS},
+            ), [
+                {
+                    "order_date": r.order_date,
+                    "channel_code": r.channel_code,
+                    "status_normalized": r.status_normalized,
+                    **{f: getattr(r, f) for f in ROLLUP_FIELDS},
+                }
+                for r in rows
+            ])
+        return len(rows)
+
+    @staticmethod
+    def refresh_dirty(db: Session, start_date: Optional[date] = None, end_date: Optional[date] = None) -> int:
+        """
+        Recompute dirty slices of closed days (optionally within a date range) and commit.
+        Returns the number of slices refreshed.
+        """
+        query = db.query(
+            OrderRollupDirty.order_date, OrderRollupDirty.channel_code, OrderRollupDirty.marked_at
+        ).filter(OrderRollupDirty.order_date < local_today())
+        if start_date:
+            query = query.filter(OrderRollupDirty.order_date >= start_date)
+        if end_date:
+            query = query.filter(OrderRollupDirty.order_date <= end_date)
+        dirty = query.all()
+        if not dirty:
+            return 0
+
+        channels_by_date: Dict[date, List[str]] = defaultdict(list)
+        for d, c, _ in dirty:
+            channels_by_date[d].append(c)
+        for d, channels in channels_by_date.items():
+            OrderRollupService.rebuild(db, d, d, channels)
+
+        # Keep marks that moved while we were rebuilding
+        for d, c, marked_at in dirty:
+            db.query(OrderRollupDirty).filter(
+                OrderRollupDirty.order_date == d,
+                OrderRollupDirty.channel_code == c,
+                OrderRollupDirty.marked_at <= marked_at,
+            ).delete(synchronize_session=False)
+        db.commit()
+        return len(dirty)
+
+    @staticmethod
+    def reconcile(db: Session, days: Optional[int] = None) -> int:
+        """Rebuild the last N closed days from order_header and commit"""
+        days = days or settings.ORDER_ROLLUP_RECONCILE_DAYS
+        end_date = local_today() - timedelta(days=1)
+        start_date = end_date - timedelta(days=days - 1)
+        rows = OrderRollupService.rebuild(db, start_date, end_date)
+        db.query(OrderRollupDirty).filter(
+            OrderRollupDirty.order_date >= start_date,
+            OrderRollupDirty.order_date <= end_date,
+        ).delete(synchronize_session=False)
+        db.commit()
+        return rows
+
+    # ========== Reads ==========
+
+    @staticmethod
+    def _dirty_slices(db: Session, start_date: Optional[date] = None, end_date: Optional[date] = None) -> Dict[date, Set[str]]:
+        """Channels per closed day whose rollup rows are out of date"""
+        query = db.query(OrderRollupDirty.order_date, OrderRollupDirty.channel_code).filter(
+            OrderRollupDirty.order_date < local_today()
+        )
+        if start_date:
+            query = query.filter(OrderRollupDirty.order_date >= start_date)
+        if end_date:
+            query = query.filter(OrderRollupDirty.order_date <= end_date)
+        dirty: Dict[date, Set[str]] = defaultdict(set)
+        for d, c in query.all():
+            dirty[d].add(c)
+        return dirty
+
+    @staticmethod
+    def _aggregate_slices(db: Session, slices: Dict[date, Set[str]]) -> list:
+        """Live aggregate of the given (day, channels) slices in one query"""
+        if not slices:
+            return []
+        channels = sorted({c for cs in slices.values() for c in cs})
+        rows = OrderRollupService._aggregate(db, min(slices), max(slices), channels)
+        return [r for r in rows if r.channel_code in slices.get(r.order_date, ())]
+
+    @staticmethod
+    def get_daily(db: Session, start_date: date, end_date: date) -> List[Dict[str, Any]]:
+        """
+        Rollup rows (order_date, channel_code, status_normalized + ROLLUP_FIELDS)
+        for local dates start_date..end_date. Days from today on, and dirty slices
+        not yet refreshed by the periodic job, are aggregated live.
+        """
+        today = local_today()
+        rows = []
+
+        if start_date < today:
+            closed_end = min(end_date, today - timedelta(days=1))
+            dirty = OrderRollupService._dirty_slices(db, start_date, closed_end)
+            rows.extend(
+                r for r in db.query(OrderDailyRollup).filter(
+                    OrderDailyRollup.order_date >= start_date,
+                    OrderDailyRollup.order_date <= closed_end,
+                ).all()
+                if r.channel_code not in dirty.get(r.order_date, ())
+            )
+            rows.extend(OrderRollupService._aggregate_slices(db, dirty))
+
+        if end_date >= today:
+            rows.extend(OrderRollupService._aggregate(db, max(start_date, today), end_date))
+
+        return [
+            {
+                "order_date": r.order_date,
+                "channel_code": r.channel_code,
+                "status_normalized": r.status_normalized,
+                "order_count": int(r.order_count or 0),
+                "revenue": float(r.revenue or 0),
+                "item_quantity": int(r.item_quantity or 0),
+                "shipped_count": int(r.shipped_count or 0),
+                "collected_count": int(r.collected_count or 0),
+                "order_digest": int(r.order_digest or 0),
+            }
+            for r in rows
+        ]
+
+    @staticmethod
+    def get_digests(db: Session, start_date: date, end_date: date) -> Dict[Tuple[date, str], Tuple[int, int]]:
+        """
+        (order count, order digest) per (local date, channel) for start_date..end_date.
+        Equal digests mean the same set of (external id, digest status) pairs.
+        """
+        digests: Dict[Tuple[date, str], Tuple[int, int]] = {}
+        for row in OrderRollupService.get_daily(db, start_date, end_date):
+            key = (row["order_date"], row["channel_code"])
+            count, digest = digests.get(key, (0, 0))
+            digests[key] = (count + row["order_count"], digest ^ row["order_digest"])
+        return digests
+
+    @staticmethod
+    def get_status_totals(db: Session, statuses: Optional[List[str]] = None) -> Dict[Tuple[str, str], int]:
+        """All-time order counts per (channel, current status)"""
+        today = local_today()
+        dirty = OrderRollupService._dirty_slices(db)
+
+        closed = db.query(
+            OrderDailyRollup.channel_code,
+            OrderDailyRollup.status_normalized,
+            func.sum(OrderDailyRollup.order_count)
+        ).filter(OrderDailyRollup.order_date < today)
+        live = db.query(
+            OrderHeader.channel_code,
+            func.coalesce(OrderHeader.status_normalized, "UNKNOWN"),
+            func.count(OrderHeader.id)
+        ).filter(OrderHeader.order_datetime >= _day_start_utc(today))
+        if statuses:
+            closed = closed.filter(OrderDailyRollup.status_normalized.in_(statuses))
+            live = live.filter(OrderHeader.status_normalized.in_(statuses))
+
+        totals: Dict[Tuple[str, str], int] = defaultdict(int)
+        for channel, status, count in closed.group_by(OrderDailyRollup.channel_code, OrderDailyRollup.status_normalized).all():
+            totals[(channel, status)] += int(count or 0)
+        for channel, status, count in live.group_by(OrderHeader.channel_code, OrderHeader.status_normalized).all():
+            totals[(channel, status)] += int(count or 0)
+
+        # Dirty slices: replace their stored rows with a live aggregate
+        if dirty:
+            slice_keys = [(d, c) for d, channels in dirty.items() for c in channels]
+            stale = db.query(
+                OrderDailyRollup.channel_code, OrderDailyRollup.status_normalized, OrderDailyRollup.order_count
+            ).filter(tuple_(OrderDailyRollup.order_date, OrderDailyRollup.channel_code).in_(slice_keys))
+            if statuses:
+                stale = stale.filter(OrderDailyRollup.status_normalized.in_(statuses))
+            for channel, status, count in stale.all():
+                totals[(channel, status)] -= int(count or 0)
+            for r in OrderRollupService._aggregate_slices(db, dirty):
+                if not statuses or r.status_normalized in statuses:
+                    totals[(r.channel_code, r.status_normalized)] += int(r.order_count or 0)
+        return {key: count for key, count in totals.items() if count}
+
+
+# ========== Order hook ==========
+
+@event.listens_for(Session, "after_flush")
+def _mark_order_slices_dirty(session: Session, flush_context):
+    """Mark rollup slices of flushed orders/items dirty in the same transaction"""
+    keys: Set[Tuple[date, str]] = set()
+    item_order_ids: Set[UUID] = set()
+
+    for obj in session.new:
+        if isinstance(obj, OrderHeader):
+            keys.add((local_date(obj.order_datetime), obj.channel_code))
+        elif isinstance(obj, OrderItem):
+            item_order_ids.add(obj.order_id)
+
+    for obj in session.dirty:
+        if isinstance(obj, OrderHeader):
+            state = inspect(obj)
+            histories = {a: state.attrs[a].history for a in _ROLLUP_ATTRS}
+            if not any(h.has_changes() for h in histories.values()):
+                continue
+            keys.add((local_date(obj.order_datetime), obj.channel_code))
+            # Moved to another day/channel: the old slice changes too
+            old_datetimes = histories["order_datetime"].deleted or [obj.order_datetime]
+            old_channels = histories["channel_code"].deleted or [obj.channel_code]
+            keys.update((local_date(d), c) for d in old_datetimes for c in old_channels)
+        elif isinstance(obj, OrderItem) and inspect(obj).attrs["quantity"].history.has_changes():
+            item_order_ids.add(obj.order_id)
+
+    for obj in session.deleted:
+        if isinstance(obj, OrderHeader):
+            keys.add((local_date(obj.order_datetime), obj.channel_code))
+        elif isinstance(obj, OrderItem):
+            item_order_ids.add(obj.order_id)
+
+    keys = {(d, c) for d, c in keys if d and c}
+    if keys:
+        session.connection().execute(OrderRollupService._mark_dirty_stmt(keys))
+    if item_order_ids:
+        OrderRollupService.mark_orders_dirty(session.connection(), item_order_ids)
@@ -0,0 +1,141 @@
+"""
+Order Search Service - one search API for every order list/filter
+
+Orders keep a denormalized search_text column (order id, tracking number,
+customer name, phone digits) normalized the same way as search terms and
+indexed with pg_trgm, so substring search no longer scans order_header.
+Order ids and tracking numbers get exact and prefix fast paths first.
+"""
+import re
+from typing import Optional
+
+from sqlalchemy import event, exists, or_, select
+from sqlalchemy.orm import Session
+
+from app.models import OrderHeader
+
+# Thai vowel/tone marks above and below the line - dropped so that names match
+# regardless of how marks were typed (and trigrams are not split by them)
+_THAI_MARKS = re.compile("[\u0e31\u0e34-\u0e3a\u0e47-\u0e4e]")
+_THAI_TITLES = ("นางสาว", "นาง", "นาย", "คุณ", "น.ส.", "ด.ช.", "ด.ญ.")
+_TITLE_TOKENS = frozenset(_THAI_TITLES) | frozenset(_THAI_MARKS.sub("", t) for t in _THAI_TITLES)
+# Titles also stripped when glued to the name ("คุณสมชาย", "น.ส.สมศรี"); matched with
+# marks intact so that names such as "คณิต" are not cut. นาย/นาง only as whole tokens.
+_TITLE_PREFIXES = ("น.ส.", "ด.ช.", "ด.ญ.", "คุณ")
+_THAI_CONSONANT = re.compile("[\u0e01-\u0e2e]")
+_PHONE_LIKE = re.compile(r"^\+?[\d\s\-().]+$")
+_ID_LIKE = re.compile(r"^[A-Za-z0-9\-_]+$")
+
+# Shortest term that goes through the exact/prefix id paths
+MIN_ID_TERM_LENGTH = 6
+
+
+def normalize_phone(value: Optional[str]) -> str:
+    """Digits only, +66 country code folded to the local leading 0"""
+    digits = re.sub(r"\D", "", value or "")
+    if digits.startswith("66") and len(digits) == 11:
+        digits = "0" + digits[2:]
+    return digits
+
+
+def normalize_text(value: Optional[str]) -> str:
+    """Lowercase, Thai marks and name titles removed, whitespace collapsed"""
+    tokens = []
+    for token in (value or "").lower().split():
+        if token in _TITLE_TOKENS or _THAI_MARKS.sub("", token) in _TITLE_TOKENS:
+            continue
+        for title in _TITLE_PREFIXES:
+            rest = token[len(title):]
+            # "คุณ" + vowel is a name ("คุณากร"); the name after a title starts with a consonant
+            if token.startswith(title) and rest and (title.endswith(".") or _THAI_CONSONANT.match(rest)):
+                token = rest
+                break
+        tokens.append(_THAI_MARKS.sub("", token))
+    return " ".join(t for t in tokens if t)
+
+
+def build_search_text(order: OrderHeader) -> str:
+    parts = [
+        (order.external_order_id or "").lower(),
+        (order.tracking_number or "").lower(),
+        normalize_text(order.customer_name),
+        normalize_phone(order.customer_phone),
+    ]
+    return " ".join(p for p in parts if p)
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class OrderSearchService:
+
+    @staticmethod
+    def normalize_term(term: str) -> str:
+        """A search term in the same form as search_text"""
+        term = term.strip()
+        if _PHONE_LIKE.match(term) and sum(c.isdigit() for c in term) >= 3:
+            return normalize_phone(term)
+        return normalize_text(term)
+
+    @staticmethod
+    def _matches(db: Session, cond, scope=None) -> bool:
+        """Whether any order (within the scope query's filters, if given) matches cond"""
+        if scope is None:
+            return bool(db.execute(select(exists().where(cond))).scalar())
+        probe = scope.with_entities(OrderHeader.id).filter(cond).order_by(None).limit(1)
+        return db.query(probe.exists()).scalar()
+
+    @staticmethod
+    def condition(db: Session, term: Optional[str], scope=None):
+        """
+        SQL condition on OrderHeader for a search box term (None = no filter).
+
+        Semantics, most specific first:
+        1. exact order id / tracking number
+        2. order id / tracking number prefix
+        3. substring of order id, tracking number, customer name or phone
+
+        scope: the caller's filtered OrderHeader query. The exact/prefix paths
+        are only taken when they match an order inside it, so a match outside
+        the caller's channel/status/date filters cannot hide substring matches.
+        """
+        term = (term or "").strip()
+        if not term:
+            return None
+
+        if len(term) >= MIN_ID_TERM_LENGTH and _ID_LIKE.match(term) and any(c.isdigit() for c in term):
+            exact = or_(
+                OrderHeader.external_order_id == term,
+                OrderHeader.tracking_number == term,
+                OrderHeader.tracking_number == term.upper(),
+            )
+            if OrderSearchService._matches(db, exact, scope):
+                return exact
+
+            prefix = _escape_like(term)
+            prefix_match = or_(
+                OrderHeader.external_order_id.like(f"{prefix}%"),
+                OrderHeader.tracking_number.like(f"{prefix.upper()}%"),
+            )
+            if OrderSearchService._matches(db, prefix_match, scope):
+                return prefix_match
+
+        normalized = OrderSearchService.normalize_term(term)
+        if not normalized:
+            return None
+        return OrderHeader.search_text.like(f"%{_escape_like(normalized)}%")
+
+    @staticmethod
+    def apply(db: Session, query, term: Optional[str]):
+        """Filter a query over OrderHeader by a search term"""
+        cond = OrderSearchService.condition(db, term, scope=query)
+        return query if cond is None else query.filter(cond)
+
+
+@event.listens_for(OrderHeader, "before_insert")
+@event.listens_for(OrderHeader, "before_update")
+def _refresh_search_text(mapper, connection, target: OrderHeader):
+    search_text = build_search_text(target)
+    if target.search_text != search_text:
+        target.search_text = search_text
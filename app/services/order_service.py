@@ -1,9 +1,16 @@
 """
 Order Service - Business Logic for Orders
 """
+import asyncio
+import base64
+import json
+import logging
+import threading
+import time
 from sqlalchemy.orm import Session
-from sqlalchemy import func, or_
-from typing import List, Optional, Tuple
+from sqlalchemy import event, func, insert, inspect, or_, select, text, tuple_, update
+from sqlalchemy.dialects import postgresql
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
 from uuid import UUID
 from datetime import datetime
 from decimal import Decimal
@@ -11,7 +18,151 @@ from decimal import Decimal
 from app.models import OrderHeader, OrderItem, Product, AuditLog
 from app.schemas.order import OrderCreate, OrderUpdate
 from app.schemas.stock import StockMovementCreate
-from .stock_service import StockService
+from .stock_service import StockService, BulkMovementError
+from .order_search_service import OrderSearchService
+from .order_rollup_service import OrderRollupService
+from .profit_service import ProfitService
+from .finance_fact_service import FinanceFactService
+
+logger = logging.getLogger(__name__)
+
+# List totals: served from cache, refreshed in the background once stale
+ORDER_COUNT_TTL_SECONDS = 60
+_count_cache: Dict[str, Tuple[float, int]] = {}
+_count_refreshing: set = set()
+_count_lock = threading.Lock()
+
+# Dashboard stats per (start, end) date range, computed once per TTL
+DASHBOARD_CACHE_TTL_SECONDS = 30
+_dashboard_cache: Dict[tuple, Tuple[float, dict]] = {}
+_dashboard_key_locks: Dict[tuple, threading.Lock] = {}
+_dashboard_lock = threading.Lock()
+
+
+# Arrange shipment fan-out (per batch request)
+ARRANGE_SHIPMENT_CONCURRENCY = 8
+TIKTOK_DETAIL_BATCH_SIZE = 50  # Max ids per TikTok order detail request
+
+
+# Signature format: "<sku>=<qty>,..." sorted by SKU, with "\", ",", "=" and "#"
+# in SKUs escaped by a backslash. Longer signatures are cut and prefixed with
+# "#" + a hash of the full content so they stay indexable and unique; their
+# items must be read from order_item (see resolve_sku_signatures).
+SKU_SIGNATURE_MAX_LENGTH = 1000
+SKU_SIGNATURE_TRUNCATED_PREFIX = "#"
+
+_ESCAPED_SKU_SQL = r"""replace(replace(replace(replace(q.sku, '\', '\\'), ',', '\,'), '=', '\='), '#', '\#')"""
+
+_SKU_SIGNATURE_SQL = f"""
+    UPDATE order_header oh
+    SET sku_signature = CASE WHEN length(s.signature) > {SKU_SIGNATURE_MAX_LENGTH}
+                             THEN '{SKU_SIGNATURE_TRUNCATED_PREFIX}' || left(md5(s.signature), 12) || ':'
+                                  || left(s.signature, {SKU_SIGNATURE_MAX_LENGTH - 14})
+                             ELSE s.signature END,
+        item_count = s.item_count
+    FROM (
+        SELECT o.id AS order_id,
+               COALESCE(string_agg({_ESCAPED_SKU_SQL} || '=' || q.qty, ',' ORDER BY q.sku COLLATE "C"), '') AS signature,
+               COALESCE(SUM(q.qty), 0) AS item_count
+        FROM unnest(CAST(:ids AS uuid[])) AS o(id)
+        LEFT JOIN (
+            SELECT order_id, sku, SUM(quantity) AS qty
+            FROM order_item
+            WHERE order_id = ANY(CAST(:ids AS uuid[])) AND COALESCE(sku, '') <> ''
+            GROUP BY order_id, sku
+        ) q ON q.order_id = o.id
+        GROUP BY o.id
+    ) s
+    WHERE oh.id = s.order_id
+"""
+
+# Items of truncated signatures: orders sharing one have the same content
+# (the hash covers the full signature), so any one order's items will do
+_TRUNCATED_SIGNATURE_ITEMS_SQL = """
+    SELECT r.sku_signature, oi.sku, SUM(oi.quantity) AS qty
+    FROM (
+        SELECT DISTINCT ON (sku_signature) sku_signature, id
+        FROM order_header
+        WHERE sku_signature = ANY(CAST(:signatures AS text[]))
+        ORDER BY sku_signature, id
+    ) r
+    JOIN order_item oi ON oi.order_id = r.id AND COALESCE(oi.sku, '') <> ''
+    GROUP BY r.sku_signature, oi.sku
+    ORDER BY r.sku_signature, oi.sku COLLATE "C"
+"""
+
+
+def parse_sku_signature(signature: Optional[str]) -> Optional[List[Tuple[str, int]]]:
+    """
+    [(sku, qty), ...] from an OrderHeader.sku_signature.
+    None for a truncated signature (read those with resolve_sku_signatures).
+    """
+    if signature and signature.startswith(SKU_SIGNATURE_TRUNCATED_PREFIX):
+        return None
+    entries = []
+    sku: List[str] = []
+    qty: List[str] = []
+    current = sku
+    escaped = False
+
+    def add():
+        if sku and qty and "".join(qty).isdigit():
+            entries.append(("".join(sku), int("".join(qty))))
+
+    for ch in signature or "":
+        if escaped:
+            current.append(ch)
+            escaped = False
+        elif ch == "\\":
+            escaped = True
+        elif ch == "=" and current is sku:
+            current = qty
+        elif ch == ",":
+            add()
+            sku, qty = [], []
+            current = sku
+        else:
+            current.append(ch)
+    add()
+    return entries
+
+
+def resolve_sku_signatures(db: Session, signatures: Iterable[Optional[str]]) -> Dict[Optional[str], List[Tuple[str, int]]]:
+    """
+    {signature: [(sku, qty), ...]} for many signatures; truncated ones are
+    read from order_item in one query.
+    """
+    resolved: Dict[Optional[str], List[Tuple[str, int]]] = {}
+    truncated = []
+    for signature in set(signatures):
+        entries = parse_sku_signature(signature)
+        if entries is None:
+            truncated.append(signature)
+            resolved[signature] = []
+        else:
+            resolved[signature] = entries
+    if truncated:
+        for signature, sku, qty in db.execute(
+            text(_TRUNCATED_SIGNATURE_ITEMS_SQL), {"signatures": truncated}
+        ).all():
+            resolved[signature].append((sku, int(qty or 0)))
+    return resolved
+
+
+def encode_order_cursor(order_datetime: datetime, order_id: UUID) -> str:
+    """Opaque keyset cursor for the order list (last row of a page)"""
+    raw = json.dumps({"t": order_datetime.isoformat(), "id": str(order_id)})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_order_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    """Inverse of encode_order_cursor; raises ValueError on a malformed cursor"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(data["t"]), UUID(data["id"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
 
 class OrderService:
     """Order business logic"""
@@ -32,22 +183,37 @@ class OrderService:
         "CANCELLED": [],
     }
     
+    # Columns returned by the order list (no raw_payload)
+    LIST_COLUMNS = (
+        OrderHeader.id,
+        OrderHeader.external_order_id,
+        OrderHeader.channel_code,
+        OrderHeader.customer_name,
+        OrderHeader.customer_phone,
+        OrderHeader.total_amount,
+        OrderHeader.status_normalized,
+        OrderHeader.payment_status,
+        OrderHeader.courier_code,
+        OrderHeader.tracking_number,
+        OrderHeader.order_datetime,
+        OrderHeader.created_at,
+        OrderHeader.returned_at,
+        OrderHeader.return_reason,
+    )
+    LIST_PAID_STATUSES = ("PAID", "PACKING", "SHIPPED", "DELIVERED", "COMPLETED")
+
     @staticmethod
-    def get_orders(
-        db: Session,
+    def _filter_orders(
+        query,
         channel: Optional[str] = None,
         status: Optional[str] = None,
         search: Optional[str] = None,
         start_date: Optional[str] = None,
         end_date: Optional[str] = None,
-        page: int = 1,
-        per_page: int = 50,
         exclude_cancelled: bool = False,
-        date_field: str = "order_datetime"  # Can be "order_datetime" or "returned_at"
-    ) -> Tuple[List[OrderHeader], int]:
-        """Get orders with filters and pagination"""
-        query = db.query(OrderHeader)
-         
+        date_field: str = "order_datetime"
+    ):
+        """Apply the order list filters to a query over OrderHeader"""
         # Determine which date field to filter by
         if date_field == "returned_at":
             filter_date_col = OrderHeader.returned_at
@@ -96,16 +262,98 @@ class OrderService:
             query = query.filter(OrderHeader.status_normalized.notin_(["CANCELLED", "RETURNED"]))
         
         if search:
-            search_term = f"%{search}%"
-            query = query.filter(
-                or_(
-                    OrderHeader.external_order_id.ilike(search_term),
-                    OrderHeader.customer_name.ilike(search_term),
-                    OrderHeader.customer_phone.ilike(search_term)
-                )
-            )
+            query = OrderSearchService.apply(query.session, query, search)
         
-        total = query.count()
+        return query
+    
+    @staticmethod
+    def _count_statement(query):
+        """SELECT count(*) over a list query (before paging is applied)"""
+        subq = query.with_entities(OrderHeader.id).order_by(None).subquery()
+        return select(func.count()).select_from(subq)
+    
+    @staticmethod
+    def _refresh_count(key: str, stmt):
+        """Recount in a separate session (background thread)"""
+        from app.core import SessionLocal
+        db = SessionLocal()
+        try:
+            total = db.execute(stmt).scalar() or 0
+            with _count_lock:
+                _count_cache[key] = (time.monotonic(), total)
+        except Exception as e:
+            logger.warning(f"Order count refresh failed: {e}")
+        finally:
+            db.close()
+            with _count_lock:
+                _count_refreshing.discard(key)
+    
+    @staticmethod
+    def _schedule_count_refresh(key: str, stmt):
+        with _count_lock:
+            if key in _count_refreshing:
+                return
+            _count_refreshing.add(key)
+        threading.Thread(target=OrderService._refresh_count, args=(key, stmt), daemon=True).start()
+    
+    @staticmethod
+    def count_orders(db: Session, query, exact: bool = False) -> Tuple[int, bool]:
+        """
+        Total for a list query -> (total, is_exact).
+        Cached per filter set; a stale total is returned as-is and recounted in
+        the background. The unfiltered total starts from the planner estimate.
+        exact=True always counts now.
+        """
+        stmt = OrderService._count_statement(query)
+        compiled = stmt.compile(dialect=postgresql.dialect())
+        key = str(compiled) + repr(sorted(compiled.params.items(), key=lambda kv: kv[0]))
+        now = time.monotonic()
+        
+        if not exact:
+            with _count_lock:
+                cached = _count_cache.get(key)
+            if cached:
+                if now - cached[0] < ORDER_COUNT_TTL_SECONDS:
+                    return cached[1], True
+                OrderService._schedule_count_refresh(key, stmt)
+                return cached[1], False
+            
+            if query.whereclause is None:
+                estimate = db.execute(text(
+                    "SELECT reltuples::bigint FROM pg_class WHERE oid = 'order_header'::regclass"
+                )).scalar()
+                # reltuples is -1 until the table has been analyzed
+                if estimate is not None and estimate >= 0:
+                    OrderService._schedule_count_refresh(key, stmt)
+                    return int(estimate), False
+        
+        total = db.execute(stmt).scalar() or 0
+        with _count_lock:
+            # Drop stale entries while we hold the lock
+            for k in [k for k, (ts, _) in _count_cache.items() if now - ts >= ORDER_COUNT_TTL_SECONDS * 10]:
+                del _count_cache[k]
+            _count_cache[key] = (time.monotonic(), total)
+        return total, True
+    
+    @staticmethod
+    def get_orders(
+        db: Session,
+        channel: Optional[str] = None,
+        status: Optional[str] = None,
+        search: Optional[str] = None,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        page: int = 1,
+        per_page: int = 50,
+        exclude_cancelled: bool = False,
+        date_field: str = "order_datetime"  # Can be "order_datetime" or "returned_at"
+    ) -> Tuple[List[OrderHeader], int]:
+        """Get orders with filters and pagination"""
+        query = OrderService._filter_orders(
+            db.query(OrderHeader), channel, status, search, start_date, end_date, exclude_cancelled, date_field
+        )
+        
+        total, _ = OrderService.count_orders(db, query)
         
         orders = query.order_by(OrderHeader.order_datetime.desc())\
             .offset((page - 1) * per_page)\
@@ -115,18 +363,24 @@ class OrderService:
         return orders, total
     
     @staticmethod
-    def get_orders_by_sku_qty(
-        db: Session,
-        sku_qty_filters: List[str],  # Format: ["L14-70G:2", "L3-40G:1"]
+    def refresh_sku_signatures(db: Session, order_ids):
+        """Recompute sku_signature/item_count of orders from their items (does not commit)"""
+        order_ids = [str(oid) for oid in set(order_ids) if oid]
+        if order_ids:
+            db.execute(text(_SKU_SIGNATURE_SQL), {"ids": order_ids})
+    
+    @staticmethod
+    def _filter_sku_qty(
+        query,
+        sku_qty_filters: List[str],
         channel: Optional[str] = None,
-        status: Optional[str] = None,
-        page: int = 1,
-        per_page: int = 50
-    ) -> Tuple[List[OrderHeader], int]:
-        """Get orders filtered by SKU + consolidated quantity"""
-        # Build subquery to get order_ids matching the SKU+qty criteria
-        from sqlalchemy import text, literal
-        
+        status: Optional[str] = None
+    ):
+        """
+        Restrict a query over OrderHeader to orders whose consolidated quantity of
+        a SKU matches one of the "SKU:qty" filters (qty 3 = 3 or more).
+        Returns None when nothing can match.
+        """
         # Parse sku_qty filters
         sku_qty_conditions = []
         for filter_str in sku_qty_filters:
@@ -137,42 +391,49 @@ class OrderService:
                 sku_qty_conditions.append((sku, qty))
         
         if not sku_qty_conditions:
-            return [], 0
-        
-        # Subquery: get order_ids where sum(quantity) for SKU matches target qty
-        matching_order_ids = set()
+            return None
         
-        for sku, target_qty in sku_qty_conditions:
-            # Get orders with this SKU having the target consolidated quantity
-            subq = db.query(OrderItem.order_id)\
-                .join(OrderHeader)\
-                .filter(OrderItem.sku == sku)
-            
-            # Apply status filter
+        def status_channel(q):
             if status and status != "all":
                 if "," in status:
                     status_list = [s.strip() for s in status.split(",")]
-                    subq = subq.filter(OrderHeader.status_normalized.in_(status_list))
+                    q = q.filter(OrderHeader.status_normalized.in_(status_list))
                 else:
-                    subq = subq.filter(OrderHeader.status_normalized == status)
-            
+                    q = q.filter(OrderHeader.status_normalized == status)
             if channel and channel != "all" and channel != "ALL":
-                subq = subq.filter(func.lower(OrderHeader.channel_code) == channel.lower())
-            
-            # Group by order and filter by sum(qty)
-            subq = subq.group_by(OrderItem.order_id)\
-                .having(func.sum(OrderItem.quantity) == target_qty if target_qty < 3 else func.sum(OrderItem.quantity) >= 3)
-            
-            order_ids = [r[0] for r in subq.all()]
-            matching_order_ids.update(order_ids)
-        
-        if not matching_order_ids:
+                q = q.filter(func.lower(OrderHeader.channel_code) == channel.lower())
+            return q
+        
+        # Distinct item contents in scope (index on status + sku_signature), matched in Python
+        signatures = []
+        in_scope = [sig for (sig,) in status_channel(query.session.query(OrderHeader.sku_signature).distinct()).all()]
+        for signature, entries in resolve_sku_signatures(query.session, in_scope).items():
+            quantities = dict(entries)
+            for sku, target_qty in sku_qty_conditions:
+                qty = quantities.get(sku)
+                if qty and (qty == target_qty if target_qty < 3 else qty >= 3):
+                    signatures.append(signature)
+                    break
+        
+        if not signatures:
+            return None
+        return status_channel(query).filter(OrderHeader.sku_signature.in_(signatures))
+    
+    @staticmethod
+    def get_orders_by_sku_qty(
+        db: Session,
+        sku_qty_filters: List[str],  # Format: ["L14-70G:2", "L3-40G:1"]
+        channel: Optional[str] = None,
+        status: Optional[str] = None,
+        page: int = 1,
+        per_page: int = 50
+    ) -> Tuple[List[OrderHeader], int]:
+        """Get orders filtered by SKU + consolidated quantity"""
+        query = OrderService._filter_sku_qty(db.query(OrderHeader), sku_qty_filters, channel, status)
+        if query is None:
             return [], 0
         
-        # Now fetch the actual orders
-        query = db.query(OrderHeader).filter(OrderHeader.id.in_(matching_order_ids))
-        
-        total = query.count()
+        total, _ = OrderService.count_orders(db, query)
         
         orders = query.order_by(OrderHeader.order_datetime.desc())\
             .offset((page - 1) * per_page)\
@@ -181,6 +442,103 @@ class OrderService:
         
         return orders, total
     
+    @staticmethod
+    def list_orders_lean(
+        db: Session,
+        channel: Optional[str] = None,
+        status: Optional[str] = None,
+        search: Optional[str] = None,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        page: int = 1,
+        per_page: int = 50,
+        exclude_cancelled: bool = False,
+        date_field: str = "order_datetime",
+        sku_qty_filters: Optional[List[str]] = None,
+        cursor: Optional[str] = None,
+        exact_count: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Order list as plain dicts, for the /orders endpoint.
+        Selects only the list columns (never raw_payload) and loads the items
+        of the whole page in one query instead of one lazy load per order.
+        
+        Pages by page number (OFFSET) or, when cursor is given, by keyset on
+        (order_datetime, id). next_cursor continues from the last row either way.
+        Orders without order_datetime are only reachable by page number.
+        """
+        query = db.query(*OrderService.LIST_COLUMNS)
+        if sku_qty_filters:
+            query = OrderService._filter_sku_qty(query, sku_qty_filters, channel, status)
+            if query is None:
+                return {"orders": [], "total": 0, "total_exact": True, "next_cursor": None}
+        else:
+            query = OrderService._filter_orders(
+                query, channel, status, search, start_date, end_date, exclude_cancelled, date_field
+            )
+        total, total_exact = OrderService.count_orders(db, query, exact=exact_count)
+        
+        if cursor:
+            after_datetime, after_id = decode_order_cursor(cursor)
+            query = query.filter(tuple_(OrderHeader.order_datetime, OrderHeader.id) < (after_datetime, after_id))
+        else:
+            query = query.offset((page - 1) * per_page)
+        
+        # One extra row tells whether there is a next page
+        rows = query.order_by(OrderHeader.order_datetime.desc(), OrderHeader.id.desc())\
+            .limit(per_page + 1)\
+            .all()
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+        next_cursor = None
+        if has_more and rows[-1].order_datetime:
+            next_cursor = encode_order_cursor(rows[-1].order_datetime, rows[-1].id)
+        
+        items_by_order = {row.id: [] for row in rows}
+        if items_by_order:
+            item_rows = db.query(
+                OrderItem.order_id,
+                OrderItem.id,
+                OrderItem.sku,
+                OrderItem.product_name,
+                OrderItem.quantity,
+                OrderItem.unit_price,
+                OrderItem.line_total,
+                OrderItem.line_type,
+            ).filter(OrderItem.order_id.in_(list(items_by_order))).all()
+            for item in item_rows:
+                items_by_order[item.order_id].append({
+                    "id": str(item.id),
+                    "sku": item.sku,
+                    "product_name": item.product_name,
+                    "quantity": item.quantity,
+                    "unit_price": float(item.unit_price or 0),
+                    "line_total": float(item.line_total or 0),
+                    "line_type": item.line_type
+                })
+        
+        orders = [
+            {
+                "id": str(o.id),
+                "external_order_id": o.external_order_id,
+                "channel_code": o.channel_code,
+                "customer_name": o.customer_name,
+                "customer_phone": o.customer_phone,
+                "total_amount": float(o.total_amount or 0),
+                "status_normalized": o.status_normalized,
+                "payment_status": o.payment_status or ("PAID" if o.status_normalized in OrderService.LIST_PAID_STATUSES else "PENDING"),
+                "courier_code": o.courier_code or "-",
+                "tracking_number": o.tracking_number or "",
+                "order_datetime": o.order_datetime.isoformat() if o.order_datetime else None,
+                "created_at": o.created_at.isoformat() if o.created_at else None,
+                "returned_at": o.returned_at.isoformat() if o.returned_at else None,
+                "return_reason": o.return_reason,
+                "items": items_by_order[o.id]
+            }
+            for o in rows
+        ]
+        return {"orders": orders, "total": total, "total_exact": total_exact, "next_cursor": next_cursor}
+    
     @staticmethod
     def get_order_by_id(db: Session, order_id: UUID) -> Optional[OrderHeader]:
         """Get order by ID"""
@@ -419,47 +777,159 @@ class OrderService:
                 query = query.filter(OrderHeader.status_normalized == current_status)
             
             if search:
-                search_term = f"%{search}%"
-                query = query.filter(
-                    or_(
-                        OrderHeader.external_order_id.ilike(search_term),
-                        OrderHeader.customer_name.ilike(search_term),
-                        OrderHeader.customer_phone.ilike(search_term)
-                    )
-                )
-
-        orders = query.all()
-        count = 0
-        errors = 0
-        
-        for order in orders:
-            # Skip if already in status
-            if order.status_normalized == new_status:
-                continue
-                
-            success, msg = OrderService.update_status(db, order.id, new_status, performed_by)
-            if success:
-                count += 1
-            else:
-                errors += 1
-        
-        return count, f"Updated {count} orders ({errors} failed/skipped)"
+                query = OrderSearchService.apply(db, query, search)
+
+        # Orders already in the target status are skipped silently
+        query = query.filter(OrderHeader.status_normalized != new_status)
+        matched = query.count()
+        if not matched:
+            return 0, "Updated 0 orders (0 failed/skipped)"
+
+        try:
+            updated = OrderService.transition_status_bulk(db, query, new_status, performed_by)
+        except BulkMovementError as e:
+            logger.warning(f"Batch status {new_status} rolled back, stock movements invalid: {e.errors[:5]}")
+            return 0, f"Updated 0 orders (stock movements failed: {e.errors[0]['error']})"
+
+        count = len(updated)
+        return count, f"Updated {count} orders ({matched - count} failed/skipped)"
+
+    @staticmethod
+    def transition_status_bulk(
+        db: Session,
+        query,
+        new_status: str,
+        performed_by: Optional[UUID] = None,
+        status_changed_at: Optional[datetime] = None,
+    ) -> List[Tuple[UUID, str]]:
+        """
+        Move every order of a query over OrderHeader to new_status in one transaction.
+
+        Only orders whose current status allows the transition (STATUS_TRANSITIONS)
+        are updated, with one UPDATE ... RETURNING. Audit rows and the stock
+        movements of SHIPPED / RETURNED / DELIVERY_FAILED transitions are bulk
+        inserted in the same transaction, which is committed.
+        Returns [(order_id, old_status)] of the updated orders.
+        """
+        from app.services.cache_invalidation import add_order_tags
+
+        from_statuses = [s for s, targets in OrderService.STATUS_TRANSITIONS.items() if new_status in targets]
+        if not from_statuses:
+            return []
+        changed_at = status_changed_at or func.now()
+
+        # Lock the candidates and remember their old status for audit/stock
+        old = (
+            query.with_entities(OrderHeader.id.label("id"), OrderHeader.status_normalized.label("old_status"))
+            .filter(OrderHeader.status_normalized.in_(from_statuses))
+            .order_by(None)
+            .with_for_update(of=OrderHeader)
+            .subquery("old")
+        )
+        values = {"status_normalized": new_status}
+        if new_status in ("SHIPPED", "DELIVERED"):
+            values["shipped_at"] = func.coalesce(OrderHeader.shipped_at, changed_at)
+        if new_status in ("RETURNED", "DELIVERY_FAILED"):
+            values["returned_at"] = func.coalesce(OrderHeader.returned_at, changed_at)
+            values["return_reason"] = func.coalesce(
+                OrderHeader.return_reason,
+                "DELIVERY_FAILED" if new_status == "DELIVERY_FAILED" else "CUSTOMER_RETURN"
+            )
+
+        try:
+            rows = db.execute(
+                update(OrderHeader)
+                .where(OrderHeader.id == old.c.id)
+                .values(**values)
+                .returning(OrderHeader.id, old.c.old_status, OrderHeader.warehouse_id, OrderHeader.external_order_id)
+                .execution_options(synchronize_session=False)
+            ).all()
+            if not rows:
+                db.rollback()
+                return []
+
+            order_ids = [r.id for r in rows]
+            db.execute(insert(AuditLog), [
+                {
+                    "table_name": "order_header",
+                    "record_id": str(r.id),
+                    "action": "STATUS_CHANGE",
+                    "performed_by": performed_by,
+                    "before_data": {"status_normalized": r.old_status},
+                    "after_data": {"status_normalized": new_status},
+                }
+                for r in rows
+            ])
+
+            # Set-based write: no ORM flush, so mark rollup, profit, finance facts and cache here
+            OrderRollupService.mark_orders_dirty(db, order_ids)
+            ProfitService.mark_dirty(db, order_ids)
+            FinanceFactService.mark_orders_dirty(db, order_ids)
+            add_order_tags(db, order_ids, statuses={r.old_status for r in rows})
+
+            movements = OrderService._status_stock_movements(db, rows, new_status)
+            # Commits the status update, audit rows and movements together
+            StockService.bulk_add_stock_movements(db, movements, created_by=performed_by, reference_type="ORDER")
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+        return [(r.id, r.old_status) for r in rows]
+
+    @staticmethod
+    def _status_stock_movements(db: Session, rows, new_status: str) -> List[Dict]:
+        """Stock movement rows for orders that just moved to new_status (same rules as update_status)"""
+        if new_status == "SHIPPED":
+            movement_type, note = "OUT", "Order Shipped"
+            affected = [r for r in rows if r.old_status != "SHIPPED"]
+        elif new_status in ("RETURNED", "DELIVERY_FAILED"):
+            movement_type = "IN"
+            note = "Order Returned" if new_status == "RETURNED" else "Order Delivery Failed"
+            affected = [r for r in rows if r.old_status not in ("RETURNED", "DELIVERY_FAILED")]
+        else:
+            return []
+        if not affected:
+            return []
+
+        by_id = {r.id: r for r in affected}
+        items = db.query(OrderItem.order_id, OrderItem.product_id, OrderItem.quantity).filter(
+            OrderItem.order_id.in_(list(by_id)),
+            OrderItem.product_id.isnot(None),
+            OrderItem.quantity > 0,
+        ).all()
+        movements = []
+        for item in items:
+            order = by_id[item.order_id]
+            movement = {
+                "product_id": item.product_id,
+                "movement_type": movement_type,
+                "quantity": item.quantity,
+                "reference_type": "ORDER",
+                "reference_id": str(order.id),
+                "note": f"{note}: {order.external_order_id}",
+            }
+            if order.warehouse_id:
+                movement["warehouse_id"] = order.warehouse_id
+            movements.append(movement)
+        return movements
     
     @staticmethod
     def get_dashboard_stats(db: Session, start_date: Optional[str] = None, end_date: Optional[str] = None) -> dict:
-        """Get dashboard statistics with optional date range filtering"""
-        # Timezone handling
+        """
+        Get dashboard statistics with optional date range filtering.
+        Cached per (start, end) for DASHBOARD_CACHE_TTL_SECONDS; concurrent
+        requests for the same range wait for a single computation.
+        """
         from app.core import settings
         from zoneinfo import ZoneInfo
-        from datetime import timezone, timedelta
         
         try:
             tz = ZoneInfo(settings.TIMEZONE)
         except Exception:
             tz = ZoneInfo("UTC") # Fallback
             
-        now = datetime.now(tz)
-        today = now.date()
+        today = datetime.now(tz).date()
         
         # Determine date range
         if start_date and end_date:
@@ -475,188 +945,130 @@ class OrderService:
             filter_start = today
             filter_end = today
         
-        # Convert to UTC for querying
-        range_start_local = datetime.combine(filter_start, datetime.min.time()).replace(tzinfo=tz)
-        range_end_local = datetime.combine(filter_end, datetime.max.time()).replace(tzinfo=tz)
-        range_start_utc = range_start_local.astimezone(timezone.utc)
-        range_end_utc = range_end_local.astimezone(timezone.utc)
-        
-        # Count by status (all time for action items)
-        status_counts = db.query(
-            OrderHeader.status_normalized,
-            func.count(OrderHeader.id)
-        ).group_by(OrderHeader.status_normalized).all()
-        
-        # Orders in selected range
-        period_orders = db.query(func.count(OrderHeader.id)).filter(
-            OrderHeader.order_datetime >= range_start_utc,
-            OrderHeader.order_datetime <= range_end_utc
-        ).scalar() or 0
+        key = (filter_start, filter_end)
+        with _dashboard_lock:
+            cached = _dashboard_cache.get(key)
+            if cached and time.monotonic() - cached[0] < DASHBOARD_CACHE_TTL_SECONDS:
+                return cached[1]
+            key_lock = _dashboard_key_locks.setdefault(key, threading.Lock())
+        
+        with key_lock:
+            # Another request may have filled the cache while we waited
+            with _dashboard_lock:
+                cached = _dashboard_cache.get(key)
+            if cached and time.monotonic() - cached[0] < DASHBOARD_CACHE_TTL_SECONDS:
+                return cached[1]
+            
+            stats = OrderService._compute_dashboard_stats(db, filter_start, filter_end, tz)
+            
+            now = time.monotonic()
+            with _dashboard_lock:
+                for k in [k for k, (ts, _) in _dashboard_cache.items() if now - ts >= DASHBOARD_CACHE_TTL_SECONDS]:
+                    del _dashboard_cache[k]
+                    if k != key:
+                        _dashboard_key_locks.pop(k, None)
+                _dashboard_cache[key] = (now, stats)
+            return stats
+    
+    @staticmethod
+    def _compute_dashboard_stats(db: Session, filter_start, filter_end, tz) -> dict:
+        """Dashboard numbers from the daily rollup plus shipped totals and top products"""
+        from datetime import timezone, timedelta
         
-        # Revenue in selected range
-        period_revenue = db.query(func.sum(OrderHeader.total_amount)).filter(
-            OrderHeader.order_datetime >= range_start_utc,
-            OrderHeader.order_datetime <= range_end_utc,
-            OrderHeader.status_normalized.notin_(["CANCELLED", "RETURNED"])
-        ).scalar() or 0
+        excluded = ["CANCELLED", "RETURNED"]
         
-        # Shipped Orders in selected range (based on shipped_at, not order_datetime)
-        shipped_orders = db.query(func.count(OrderHeader.id)).filter(
-            OrderHeader.shipped_at.isnot(None),
-            OrderHeader.shipped_at >= range_start_utc,
-            OrderHeader.shipped_at <= range_end_utc,
-            OrderHeader.status_normalized.notin_(["CANCELLED", "RETURNED"])
-        ).scalar() or 0
+        def day_bounds_utc(start_day, end_day):
+            start_local = datetime.combine(start_day, datetime.min.time()).replace(tzinfo=tz)
+            end_local = datetime.combine(end_day, datetime.max.time()).replace(tzinfo=tz)
+            return start_local.astimezone(timezone.utc), end_local.astimezone(timezone.utc)
         
-        # Shipped Revenue in selected range
-        shipped_revenue = db.query(func.sum(OrderHeader.total_amount)).filter(
-            OrderHeader.shipped_at.isnot(None),
-            OrderHeader.shipped_at >= range_start_utc,
-            OrderHeader.shipped_at <= range_end_utc,
-            OrderHeader.status_normalized.notin_(["CANCELLED", "RETURNED"])
-        ).scalar() or 0
+        range_start_utc, range_end_utc = day_bounds_utc(filter_start, filter_end)
         
-        # Comparison (previous period of same length)
+        # Comparison (previous period of same length, directly before the range)
         period_days = (filter_end - filter_start).days + 1
         prev_start = filter_start - timedelta(days=period_days)
-        prev_end = filter_end - timedelta(days=period_days)
         
-        prev_start_local = datetime.combine(prev_start, datetime.min.time()).replace(tzinfo=tz)
-        prev_end_local = datetime.combine(prev_end, datetime.max.time()).replace(tzinfo=tz)
-        prev_start_utc = prev_start_local.astimezone(timezone.utc)
-        prev_end_utc = prev_end_local.astimezone(timezone.utc)
-        
-        prev_orders = db.query(func.count(OrderHeader.id)).filter(
-            OrderHeader.order_datetime >= prev_start_utc,
-            OrderHeader.order_datetime <= prev_end_utc
-        ).scalar() or 0
-        
-        prev_revenue = db.query(func.sum(OrderHeader.total_amount)).filter(
-            OrderHeader.order_datetime >= prev_start_utc,
-            OrderHeader.order_datetime <= prev_end_utc,
-            OrderHeader.status_normalized.notin_(["CANCELLED", "RETURNED"])
-        ).scalar() or 0
+        # 1. Status x channel over all orders (daily rollup): status tabs + operational counts
+        status_totals = OrderRollupService.get_status_totals(db)
         
+        status_counts = {}
+        # Map op counts to easy lookup: { 'shopee': {'PAID': 5, 'PACKING': 2}, ... }
+        op_map = {}
+        for (channel, status), count in status_totals.items():
+            status_counts[status] = status_counts.get(status, 0) + count
+            if status not in ("PAID", "PACKING", "READY_TO_SHIP"):
+                continue
+            if channel not in op_map:
+                op_map[channel] = {"paid_count": 0, "packing_count": 0}
+            # PAID -> paid_count (To Pack)
+            # PACKING, READY_TO_SHIP -> packing_count (To Ship / Packing)
+            if status == "PAID":
+                op_map[channel]["paid_count"] += count
+            else:
+                op_map[channel]["packing_count"] += count
         
-        # Sales Trend (Smart Grouping)
+        # 2. Previous + selected period from the daily rollup, by channel and day/month bucket
+        trunc = "month" if period_days > 40 else "day"
+        period_orders = prev_orders = 0
+        period_revenue = prev_revenue = 0.0
+        trend_map = {}
+        channel_stats = {}
+        sales_map = {}
+        for row in OrderRollupService.get_daily(db, prev_start, filter_end):
+            valid_row = row["status_normalized"] not in excluded
+            revenue = row["revenue"] if valid_row else 0.0
+            if row["order_date"] < filter_start:
+                prev_orders += row["order_count"]
+                prev_revenue += revenue
+                continue
+            period_orders += row["order_count"]
+            period_revenue += revenue
+            bucket_day = row["order_date"].replace(day=1) if trunc == "month" else row["order_date"]
+            trend_map[bucket_day] = trend_map.get(bucket_day, 0.0) + revenue
+            channel_stats[row["channel_code"]] = channel_stats.get(row["channel_code"], 0) + row["order_count"]
+            if valid_row:
+                sales = sales_map.setdefault(row["channel_code"], {"count": 0, "revenue": 0.0})
+                sales["count"] += row["order_count"]
+                sales["revenue"] += revenue
+        
+        # Sales Trend (Smart Grouping) - every bucket in range, zero-filled
         sales_trend = []
-        
-        if period_days > 40:
-            # Monthly grouping for long periods
+        if trunc == "month":
+            # Thai months abbr
+            thai_months = ["ม.ค.", "ก.พ.", "มี.ค.", "เม.ย.", "พ.ค.", "มิ.ย.", "ก.ค.", "ส.ค.", "ก.ย.", "ต.ค.", "พ.ย.", "ธ.ค."]
             current_date = filter_start.replace(day=1)
             while current_date <= filter_end:
-                # Calculate month start and end
-                month_start = current_date
-                # Find last day of month
-                if month_start.month == 12:
-                    month_end = month_start.replace(day=31)
-                    next_month = month_start.replace(year=month_start.year + 1, month=1, day=1)
+                sales_trend.append({
+                    "date": f"{thai_months[current_date.month - 1]} {current_date.year + 543}",
+                    "revenue": trend_map.get(current_date, 0.0)
+                })
+                if current_date.month == 12:
+                    current_date = current_date.replace(year=current_date.year + 1, month=1)
                 else:
-                    next_month = month_start.replace(month=month_start.month + 1, day=1)
-                    month_end = next_month - timedelta(days=1)
-                
-                # Clip to filter range
-                query_start = max(month_start, filter_start)
-                query_end = min(month_end, filter_end)
-                
-                if query_start <= query_end:
-                     d_start = datetime.combine(query_start, datetime.min.time()).replace(tzinfo=tz).astimezone(timezone.utc)
-                     d_end = datetime.combine(query_end, datetime.max.time()).replace(tzinfo=tz).astimezone(timezone.utc)
-                     
-                     month_revenue = db.query(func.sum(OrderHeader.total_amount)).filter(
-                        OrderHeader.order_datetime >= d_start,
-                        OrderHeader.order_datetime <= d_end,
-                        OrderHeader.status_normalized.notin_(["CANCELLED", "RETURNED"])
-                     ).scalar() or 0
-                     
-                     # Format label: "Jan 2025" or "01/2025"
-                     # Thai months abbr
-                     thai_months = ["ม.ค.", "ก.พ.", "มี.ค.", "เม.ย.", "พ.ค.", "มิ.ย.", "ก.ค.", "ส.ค.", "ก.ย.", "ต.ค.", "พ.ย.", "ธ.ค."]
-                     month_label = f"{thai_months[current_date.month - 1]} {current_date.year + 543}"
-                     
-                     sales_trend.append({
-                        "date": month_label,
-                        "revenue": float(month_revenue)
-                     })
-                
-                current_date = next_month
-                
+                    current_date = current_date.replace(month=current_date.month + 1)
         else:
-            # Daily grouping for short periods (existing logic)
-            trend_days = period_days # Show all days within period
-            # Start from filter_start and go forward
-            for i in range(trend_days):
+            for i in range(period_days):
                 day_date = filter_start + timedelta(days=i)
-                d_start = datetime.combine(day_date, datetime.min.time()).replace(tzinfo=tz).astimezone(timezone.utc)
-                d_end = datetime.combine(day_date, datetime.max.time()).replace(tzinfo=tz).astimezone(timezone.utc)
-                
-                day_revenue = db.query(func.sum(OrderHeader.total_amount)).filter(
-                    OrderHeader.order_datetime >= d_start,
-                    OrderHeader.order_datetime <= d_end,
-                    OrderHeader.status_normalized.notin_(["CANCELLED", "RETURNED"])
-                ).scalar() or 0
-                
                 sales_trend.append({
                     "date": day_date.strftime("%d/%m"),
-                    "revenue": float(day_revenue)
+                    "revenue": trend_map.get(day_date, 0.0)
                 })
-            
-        # Channel Stats (for selected period)
-        channel_stats = db.query(
-            OrderHeader.channel_code,
-            func.count(OrderHeader.id)
-        ).filter(
-            OrderHeader.order_datetime >= range_start_utc,
-            OrderHeader.order_datetime <= range_end_utc
-        ).group_by(OrderHeader.channel_code).all()
-
-        # Platform Breakdown (Count + Revenue) - Excluding Cancelled/Returned for Revenue accuracy
-        platform_breakdown_query = db.query(
-            OrderHeader.channel_code,
-            func.count(OrderHeader.id).label("count"),
-            func.sum(OrderHeader.total_amount).label("revenue")
-        ).filter(
-            OrderHeader.order_datetime >= range_start_utc,
-            OrderHeader.order_datetime <= range_end_utc,
-            OrderHeader.status_normalized.notin_(["CANCELLED", "RETURNED"])
-        ).group_by(OrderHeader.channel_code).all()
-        
-        # Operational Counts (Global - ignoring date range)
-        # We want to know pending work regardless of when order came in
-        op_counts = db.query(
-            OrderHeader.channel_code,
-            OrderHeader.status_normalized,
-            func.count(OrderHeader.id)
-        ).filter(
-            OrderHeader.status_normalized.in_(["PAID", "PACKING", "READY_TO_SHIP"])
-        ).group_by(
-            OrderHeader.channel_code, 
-            OrderHeader.status_normalized
-        ).all()
         
-        # Map op_counts to easy lookup: { 'shopee': {'PAID': 5, 'PACKING': 2}, ... }
-        op_map = {}
-        for channel, status, count in op_counts:
-            if channel not in op_map:
-                op_map[channel] = {"paid_count": 0, "packing_count": 0}
-            
-            # Map status to metric
-            # PAID -> paid_count (To Pack)
-            # PACKING, READY_TO_SHIP -> packing_count (To Ship / Packing)
-            if status == "PAID":
-                op_map[channel]["paid_count"] += count
-            elif status in ["PACKING", "READY_TO_SHIP"]:
-                op_map[channel]["packing_count"] += count
+        # 3. Shipped orders in selected range (based on shipped_at, not order_datetime)
+        valid = OrderHeader.status_normalized.notin_(excluded)
+        shipped_orders, shipped_revenue = db.query(
+            func.count(OrderHeader.id),
+            func.sum(OrderHeader.total_amount)
+        ).filter(
+            OrderHeader.shipped_at >= range_start_utc,
+            OrderHeader.shipped_at <= range_end_utc,
+            valid
+        ).one()
         
         # Merge results
         # We need to ensure we show platforms that might have pending work but NO sales in this period
-        all_platforms = set([p.channel_code for p in platform_breakdown_query]) | set(op_map.keys())
-        
-        # Helper to get sales data
-        sales_map = {p.channel_code: {"count": p.count, "revenue": float(p.revenue or 0)} for p in platform_breakdown_query}
-        
         platform_breakdown = []
-        for platform in all_platforms:
+        for platform in set(sales_map) | set(op_map):
              sales_data = sales_map.get(platform, {"count": 0, "revenue": 0.0})
              op_data = op_map.get(platform, {"paid_count": 0, "packing_count": 0})
              
@@ -671,7 +1083,7 @@ class OrderService:
         # Sort by revenue desc (optional)
         platform_breakdown.sort(key=lambda x: x["revenue"], reverse=True)
         
-        # Top Products (for selected period)
+        # 4. Top Products (for selected period)
         top_products = db.query(
             OrderItem.sku,
             OrderItem.product_name,
@@ -680,26 +1092,26 @@ class OrderService:
         ).join(OrderHeader).filter(
             OrderHeader.order_datetime >= range_start_utc,
             OrderHeader.order_datetime <= range_end_utc,
-            OrderHeader.status_normalized.notin_(["CANCELLED", "RETURNED"])
+            valid
         ).group_by(OrderItem.sku, OrderItem.product_name)\
          .order_by(func.sum(OrderItem.quantity).desc())\
          .limit(5).all()
         
         return {
-            "status_counts": dict(status_counts),
+            "status_counts": status_counts,
             "period_orders": period_orders,
-            "period_revenue": float(period_revenue),
-            "shipped_orders": shipped_orders,
-            "shipped_revenue": float(shipped_revenue),
+            "period_revenue": period_revenue,
+            "shipped_orders": shipped_orders or 0,
+            "shipped_revenue": float(shipped_revenue or 0),
             "prev_orders": prev_orders,
-            "prev_revenue": float(prev_revenue),
+            "prev_revenue": prev_revenue,
             # Legacy (for backward compat, same as period when no range)
             "today_orders": period_orders,
-            "today_revenue": float(period_revenue),
+            "today_revenue": period_revenue,
             "mtd_orders": period_orders,
-            "mtd_revenue": float(period_revenue),
+            "mtd_revenue": period_revenue,
             "sales_trend": sales_trend,
-            "channel_stats": dict(channel_stats),
+            "channel_stats": channel_stats,
             "platform_breakdown": platform_breakdown,
             "top_products": [
                 {
@@ -728,20 +1140,16 @@ class OrderService:
     ) -> List[dict]:
         """Get summary of SKUs for orders matching filters - OPTIMIZED VERSION
         
-        Uses SQL aggregation instead of Python loops for 100x+ performance improvement.
+        Counts orders per sku_signature in SQL (no order_item join), then spreads
+        the few distinct signatures over their SKUs in Python.
         """
-        from sqlalchemy import case, literal_column
-        from sqlalchemy.sql import func
-        
-        # Step 1: Create a subquery that consolidates qty per order per SKU
-        # This handles cases where TikTok stores same SKU as multiple rows
-        subq = db.query(
-            OrderItem.sku,
-            OrderItem.order_id,
-            func.sum(OrderItem.quantity).label('qty_sum')
-        ).join(OrderHeader).filter(
-            OrderItem.sku.isnot(None),
-            OrderItem.sku != ''
+        # Step 1: Orders per item content (consolidated qty per SKU is in the signature)
+        query = db.query(
+            OrderHeader.sku_signature,
+            func.count(OrderHeader.id).label('count')
+        ).filter(
+            OrderHeader.sku_signature.isnot(None),
+            OrderHeader.sku_signature != ''
         )
         
         # Apply filters
@@ -759,59 +1167,46 @@ class OrderService:
                 s_date = datetime.strptime(start_date, "%Y-%m-%d").date()
                 s_dt = datetime.combine(s_date, datetime.min.time()).replace(tzinfo=tz)
                 s_dt_utc = s_dt.astimezone(timezone.utc)
-                subq = subq.filter(OrderHeader.order_datetime >= s_dt_utc)
+                query = query.filter(OrderHeader.order_datetime >= s_dt_utc)
                 
             if end_date:
                 e_date = datetime.strptime(end_date, "%Y-%m-%d").date()
                 e_dt = datetime.combine(e_date, datetime.max.time()).replace(tzinfo=tz)
                 e_dt_utc = e_dt.astimezone(timezone.utc)
-                subq = subq.filter(OrderHeader.order_datetime <= e_dt_utc)
+                query = query.filter(OrderHeader.order_datetime <= e_dt_utc)
         
         if channel and channel != "all" and channel != "ALL":
-            subq = subq.filter(func.lower(OrderHeader.channel_code) == channel.lower())
+            query = query.filter(func.lower(OrderHeader.channel_code) == channel.lower())
         
         if status and status != "all":
             if "," in status:
                 status_list = [s.strip() for s in status.split(",")]
-                subq = subq.filter(OrderHeader.status_normalized.in_(status_list))
+                query = query.filter(OrderHeader.status_normalized.in_(status_list))
             else:
-                subq = subq.filter(OrderHeader.status_normalized == status)
+                query = query.filter(OrderHeader.status_normalized == status)
         
         if search:
-            search_term = f"%{search}%"
-            subq = subq.filter(
-                or_(
-                    OrderHeader.external_order_id.ilike(search_term),
-                    OrderHeader.customer_name.ilike(search_term),
-                    OrderHeader.customer_phone.ilike(search_term)
-                )
-            )
+            query = OrderSearchService.apply(db, query, search)
+        
+        # Step 2: Aggregate by SKU with qty buckets
+        summary = {}
+        groups = query.group_by(OrderHeader.sku_signature).all()
+        items_by_signature = resolve_sku_signatures(db, [signature for signature, _ in groups])
+        for signature, count in groups:
+            for sku, qty in items_by_signature[signature]:
+                row = summary.setdefault(sku, {
+                    "sku": sku, "count": 0, "total_qty": 0, "qty_1": 0, "qty_2": 0, "qty_3_plus": 0
+                })
+                row["count"] += count
+                row["total_qty"] += qty * count
+                if qty == 1:
+                    row["qty_1"] += count
+                elif qty == 2:
+                    row["qty_2"] += count
+                else:
+                    row["qty_3_plus"] += count
         
-        # Group by order_id and SKU to get consolidated qty per order
-        subq = subq.group_by(OrderItem.sku, OrderItem.order_id).subquery()
-        
-        # Step 2: Aggregate by SKU using SQL CASE WHEN for qty buckets
-        results = db.query(
-            subq.c.sku,
-            func.count(subq.c.order_id).label('count'),
-            func.sum(subq.c.qty_sum).label('total_qty'),
-            func.sum(case((subq.c.qty_sum == 1, 1), else_=0)).label('qty_1'),
-            func.sum(case((subq.c.qty_sum == 2, 1), else_=0)).label('qty_2'),
-            func.sum(case((subq.c.qty_sum >= 3, 1), else_=0)).label('qty_3_plus')
-        ).group_by(subq.c.sku).order_by(func.count(subq.c.order_id).desc()).all()
-        
-        # Convert to list of dicts
-        return [
-            {
-                "sku": r.sku,
-                "count": r.count,
-                "total_qty": int(r.total_qty) if r.total_qty else 0,
-                "qty_1": r.qty_1,
-                "qty_2": r.qty_2,
-                "qty_3_plus": r.qty_3_plus
-            }
-            for r in results
-        ]
+        return sorted(summary.values(), key=lambda r: r["count"], reverse=True)
 
     @staticmethod
     async def batch_arrange_shipment(
@@ -820,84 +1215,153 @@ class OrderService:
     ) -> tuple[int, List[dict]]:
         """
         Arrange shipment (RTS) for multiple orders.
-        Returns (success_count, results_list)
+        Returns (success_count, results_list) in the order of order_ids.
+        """
+        results = {}
+        async for event in OrderService.iter_arrange_shipment(db, order_ids):
+            if event["type"] == "result":
+                results[event["id"]] = {k: event[k] for k in ("id", "success", "message")}
+        ordered = [results[oid] for oid in dict.fromkeys(order_ids) if oid in results]
+        return sum(1 for r in ordered if r["success"]), ordered
+
+    @staticmethod
+    def _package_id(raw_order: Optional[dict]) -> Optional[str]:
+        """First package id of a TikTok order payload"""
+        packages = (raw_order or {}).get("packages") or []
+        return str(packages[0]["id"]) if packages and packages[0].get("id") else None
+
+    @staticmethod
+    async def iter_arrange_shipment(db: Session, order_ids: List[str]) -> AsyncIterator[dict]:
+        """
+        Arrange shipment for many orders, yielding progress as it goes:
+        {"type": "result", id, success, message, done, total} per order,
+        then {"type": "summary", success_count, total}.
+
+        Package ids come from the stored raw_payload; orders without one are
+        fetched in batches of TIKTOK_DETAIL_BATCH_SIZE. Packages are shipped
+        ARRANGE_SHIPMENT_CONCURRENCY at a time under the shop's rate limiter.
         """
         from app.services import integration_service
         from app.integrations.tiktok import TikTokClient
-        
-        results = []
+
+        order_ids = list(dict.fromkeys(oid for oid in order_ids if oid))
+        total = len(order_ids)
+        done = 0
         success_count = 0
-        
-        # Cache clients
-        client_cache = {}
-        
-        for order_id_str in order_ids:
+
+        def result(oid: str, success: bool, message: str) -> dict:
+            nonlocal done, success_count
+            done += 1
+            success_count += int(success)
+            return {"type": "result", "id": oid, "success": success, "message": message, "done": done, "total": total}
+
+        # 1. Resolve all orders in one query (UUIDs or external ids)
+        uuids, external_ids = {}, {}
+        for oid in order_ids:
             try:
-                # 1. Get Order
-                try:
-                    uuid_obj = UUID(order_id_str)
-                    order = OrderService.get_order_by_id(db, uuid_obj)
-                except ValueError:
-                    order = OrderService.get_order_by_external_id(db, order_id_str)
-                
-                if not order:
-                    results.append({"id": order_id_str, "success": False, "message": "Order not found"})
-                    continue
-                
-                if order.channel_code.lower() != 'tiktok':
-                    results.append({"id": order_id_str, "success": False, "message": f"Platform {order.channel_code} not supported"})
-                    continue
-                
-                # 2. Get Client
-                if 'tiktok' not in client_cache:
-                    configs = integration_service.get_platform_configs(db, platform='tiktok', is_active=True)
-                    if not configs:
-                        results.append({"id": order_id_str, "success": False, "message": "No active TikTok config"})
-                        continue
-                    client_cache['tiktok'] = integration_service.get_client_for_config(configs[0])
-                
-                client = client_cache['tiktok']
-                if not isinstance(client, TikTokClient):
-                    results.append({"id": order_id_str, "success": False, "message": "Client error"})
-                    continue
+                uuids[UUID(oid)] = oid
+            except ValueError:
+                external_ids[oid] = oid
+        conditions = []
+        if uuids:
+            conditions.append(OrderHeader.id.in_(list(uuids)))
+        if external_ids:
+            conditions.append(OrderHeader.external_order_id.in_(list(external_ids)))
+        rows = db.query(
+            OrderHeader.id, OrderHeader.external_order_id, OrderHeader.channel_code, OrderHeader.raw_payload
+        ).filter(or_(*conditions)).all() if conditions else []
 
-                # 3. Get Package ID via Order Detail
-                # We need fresh detail from API to get package ID
-                order_detail = await client.get_order_detail(order.external_order_id)
-                packages = order_detail.get("packages", [])
-                if not packages:
-                    results.append({"id": order_id_str, "success": False, "message": "No packages found"})
+        found = {}
+        for row in rows:
+            oid = uuids.get(row.id) or external_ids.get(row.external_order_id)
+            if oid and oid not in found:
+                found[oid] = row
+
+        pending = []  # (requested id, external order id, package id)
+        for oid in order_ids:
+            row = found.get(oid)
+            if not row:
+                yield result(oid, False, "Order not found")
+            elif (row.channel_code or "").lower() != "tiktok":
+                yield result(oid, False, f"Platform {row.channel_code} not supported")
+            else:
+                pending.append((oid, row.external_order_id, OrderService._package_id(row.raw_payload)))
+
+        if pending:
+            # 2. Client (one per batch)
+            client = None
+            configs = integration_service.get_platform_configs(db, platform='tiktok', is_active=True)
+            if configs:
+                client = integration_service.get_client_for_config(configs[0])
+            if not configs or not isinstance(client, TikTokClient):
+                message = "No active TikTok config" if not configs else "Client error"
+                for oid, _, _ in pending:
+                    yield result(oid, False, message)
+                pending = []
+
+        if pending:
+            limiter = client.get_rate_limiter()
+            # Token/shop cipher once, before requests run concurrently
+            await client.ensure_valid_token()
+            if not client.shop_cipher:
+                await client._fetch_shop_cipher()
+
+            # 3. Package ids missing from stored payloads: batch order details
+            missing = [ext for _, ext, package_id in pending if not package_id and ext]
+            fetched = {}
+            for i in range(0, len(missing), TIKTOK_DETAIL_BATCH_SIZE):
+                await limiter.acquire()
+                for detail in await client.get_order_details_batch(missing[i:i + TIKTOK_DETAIL_BATCH_SIZE]):
+                    fetched[str(detail.get("id"))] = OrderService._package_id(detail)
+
+            # 4. Ship packages concurrently, report as each finishes
+            semaphore = asyncio.Semaphore(ARRANGE_SHIPMENT_CONCURRENCY)
+
+            async def ship(oid: str, package_id: str):
+                async with semaphore:
+                    await limiter.acquire()
+                    try:
+                        await client.ship_package(package_id, handover_method="DROP_OFF")
+                        return oid, True, "Success"
+                    except Exception as e:
+                        logger.error(f"Failed to RTS order {oid}: {e}")
+                        return oid, False, str(e)
+
+            tasks = []
+            for oid, ext, package_id in pending:
+                package_id = package_id or fetched.get(str(ext))
+                if not package_id:
+                    yield result(oid, False, "No packages found")
                     continue
-                
-                package_id = packages[0].get("id")
-                
-                # 4. Ship Package
-                # Default to DROP_OFF for now
-                await client.ship_package(package_id, handover_method="DROP_OFF")
-                
-                # 5. Update Local Status
-                # "AWAITING_COLLECTION" is normalized to "PACKING" or "SHIPPED"?
-                # "Awaiting Collection" maps to "READY_TO_SHIP" in Shopee, usually "PACKING" in our system?
-                # Actually, if we RTS, strict status is "Ready to Ship".
-                # Update local DB status if desired?
-                # Let's verify status from API or just set to PACKING?
-                # User flow: Paid -> RTS -> Print -> Pack.
-                # If we RTS, it stays in 'PAID' list unless we change status?
-                # Packing page filters for 'PAID'.
-                # In TikTok: 'Awaiting Shipment' -> 'Awaiting Collection'.
-                # Our normalization: 'PAID' covers both?
-                # Let's check status map in tiktok.py:
-                # 'AWAITING_COLLECTION' -> 'PAID'?
-                # If it stays 'PAID', it stays on screen.
-                # If user workflow is RTS -> Print -> Mark as Packed (which moves to PACKING status),
-                # Then we SHOULD NOT change status here, just RTS API call.
-                
-                results.append({"id": order_id_str, "success": True, "message": "Success"})
-                success_count += 1
-                
-            except Exception as e:
-                logger.error(f"Failed to RTS order {order_id_str}: {e}")
-                results.append({"id": order_id_str, "success": False, "message": str(e)})
-        
-        return success_count, results
+                tasks.append(asyncio.create_task(ship(oid, package_id)))
+            # Local status is not changed here: RTS is followed by print and "Mark as Packed"
+            try:
+                for finished in asyncio.as_completed(tasks):
+                    yield result(*(await finished))
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+        yield {"type": "summary", "success_count": success_count, "total": total}
+
+
+# ========== Item hook ==========
 
+@event.listens_for(Session, "after_flush")
+def _refresh_flushed_sku_signatures(session: Session, flush_context):
+    """Keep sku_signature/item_count current for orders whose items were flushed"""
+    order_ids = set()
+    for obj in session.new:
+        if isinstance(obj, OrderItem):
+            order_ids.add(obj.order_id)
+    for obj in session.dirty:
+        if isinstance(obj, OrderItem):
+            state = inspect(obj)
+            if any(state.attrs[a].history.has_changes() for a in ("sku", "quantity", "order_id")):
+                order_ids.add(obj.order_id)
+                order_ids.update(state.attrs["order_id"].history.deleted or [])
+    for obj in session.deleted:
+        if isinstance(obj, OrderItem):
+            order_ids.add(obj.order_id)
+    if order_ids:
+        OrderService.refresh_sku_signatures(session.connection(), order_ids)
@@ -0,0 +1,373 @@
+"""
+Partition Service - Monthly range partitions and archive tier
+
+Large append-only tables are range partitioned by month on their date column.
+Old partitions can be detached into the `archive` schema; `source_for_range`
+returns a query source that transparently includes archived months when a
+date range needs them.
+
+Every partitioned table also has a DEFAULT partition (<table>_default) for
+rows outside the monthly partitions - backdated stock movements from order
+sync, months that were archived - so such inserts never fail. Creating a
+month that already has rows in the default partition moves them over.
+
+stock_ledger is special: on-hand is the sum of the whole ledger, so archiving
+a month first writes carry-forward rows (reference_type ARCHIVE_CARRY_FORWARD)
+into the first live month.
+"""
+import logging
+import re
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import text, select, union_all, table as sa_table, column as sa_column
+from sqlalchemy.orm import Session, aliased
+
+from app.core import settings
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_SCHEMA = "archive"
+
+# table -> partition key column
+PARTITIONED_TABLES: Dict[str, str] = {
+    "stock_ledger": "created_at",
+    "marketplace_transaction": "transaction_date",
+}
+
+_PARTITION_RE = re.compile(r"^(?P<table>.+)_y(?P<year>\d{4})m(?P<month>\d{2})$")
+
+
+def _month_start(year: int, month: int) -> datetime:
+    """Local midnight of the 1st of the month"""
+    return datetime(year, month, 1, tzinfo=ZoneInfo(settings.TIMEZONE))
+
+
+def _add_months(year: int, month: int, n: int) -> Tuple[int, int]:
+    index = year * 12 + (month - 1) + n
+    return index // 12, index % 12 + 1
+
+
+class PartitionService:
+    """Monthly partition management"""
+
+    @staticmethod
+    def partition_name(table: str, year: int, month: int) -> str:
+        return f"{table}_y{year:04d}m{month:02d}"
+
+    @staticmethod
+    def is_partitioned(db: Session, table: str) -> bool:
+        return bool(db.execute(text(
+            "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+            "WHERE c.relname = :table AND c.relnamespace = 'public'::regnamespace"
+        ), {"table": table}).scalar())
+
+    @staticmethod
+    def list_partitions(db: Session, table: str, schema: str = "public") -> List[Tuple[int, int, str]]:
+        """
+        Monthly partitions as (year, month, name), oldest first.
+        schema=public lists attached partitions, schema=archive lists detached ones.
+        """
+        if schema == "public":
+            rows = db.execute(text(
+                "SELECT c.relname FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "JOIN pg_class p ON p.oid = i.inhparent "
+                "WHERE p.relname = :table AND p.relnamespace = 'public'::regnamespace"
+            ), {"table": table}).scalars().all()
+        else:
+            rows = db.execute(text(
+                "SELECT tablename FROM pg_tables WHERE schemaname = :schema AND tablename LIKE :pattern"
+            ), {"schema": schema, "pattern": f"{table}_y%"}).scalars().all()
+
+        result = []
+        for name in rows:
+            m = _PARTITION_RE.match(name)
+            if m and m.group("table") == table:
+                result.append((int(m.group("year")), int(m.group("month")), name))
+        return sorted(result)
+
+    @staticmethod
+    def default_partition_name(table: str) -> str:
+        return f"{table}_default"
+
+    @staticmethod
+    def create_default_partition(db: Session, table: str):
+        """Catch-all partition for dates without a monthly partition (no-op if it exists)"""
+        db.execute(text(
+            f'CREATE TABLE IF NOT EXISTS "{PartitionService.default_partition_name(table)}" '
+            f'PARTITION OF "{table}" DEFAULT'
+        ))
+
+    @staticmethod
+    def create_month_partition(db: Session, table: str, year: int, month: int):
+        """
+        Create one monthly partition (no-op if it exists).
+        Rows of that month already in the default partition are moved into it.
+        """
+        name = PartitionService.partition_name(table, year, month)
+        start = _month_start(year, month)
+        end = _month_start(*_add_months(year, month, 1))
+        bounds = f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        default = PartitionService.default_partition_name(table)
+        exists_sql = text("SELECT to_regclass(:name) IS NOT NULL")
+        if db.execute(exists_sql, {"name": f"public.{name}"}).scalar():
+            return
+        has_default = db.execute(exists_sql, {"name": f"public.{default}"}).scalar()
+        key = PARTITIONED_TABLES[table]
+        in_month = f'"{key}" >= :start AND "{key}" < :end'
+        if has_default and db.execute(
+            text(f'SELECT 1 FROM "{default}" WHERE {in_month} LIMIT 1'), {"start": start, "end": end}
+        ).scalar():
+            # Attaching over rows still in the default partition would fail its constraint check
+            db.execute(text(f'CREATE TABLE "{name}" (LIKE "{table}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'))
+            db.execute(text(
+                f'WITH moved AS (DELETE FROM "{default}" WHERE {in_month} RETURNING *) '
+                f'INSERT INTO "{name}" SELECT * FROM moved'
+            ), {"start": start, "end": end})
+            db.execute(text(f'ALTER TABLE "{table}" ATTACH PARTITION "{name}" {bounds}'))
+        else:
+            db.execute(text(f'CREATE TABLE "{name}" PARTITION OF "{table}" {bounds}'))
+
+    @staticmethod
+    def ensure_partitions(db: Session, months_ahead: int = 3) -> Dict[str, int]:
+        """Create partitions for the current month and the next N months (partitioned tables only)"""
+        now = datetime.now(ZoneInfo(settings.TIMEZONE))
+        created = {}
+        for table in PARTITIONED_TABLES:
+            if not PartitionService.is_partitioned(db, table):
+                continue
+            PartitionService.create_default_partition(db, table)
+            existing = {(y, m) for y, m, _ in PartitionService.list_partitions(db, table)}
+            count = 0
+            for n in range(months_ahead + 1):
+                y, m = _add_months(now.year, now.month, n)
+                if (y, m) not in existing:
+                    PartitionService.create_month_partition(db, table, y, m)
+                    count += 1
+            created[table] = count
+        db.commit()
+        return created
+
+    @staticmethod
+    def _upgrade_partitioned(db: Session, table: str):
+        """
+        Bring a table converted by an earlier version up to date: default partition,
+        and (marketplace_transaction) a primary key instead of the plain id index.
+        """
+        key = PARTITIONED_TABLES[table]
+        try:
+            PartitionService.create_default_partition(db, table)
+            has_pkey = db.execute(text(
+                "SELECT 1 FROM pg_constraint WHERE conrelid = CAST(:table AS regclass) AND contype = 'p'"
+            ), {"table": table}).scalar()
+            if not has_pkey:
+                db.execute(text(f'UPDATE "{table}" SET "{key}" = created_at WHERE "{key}" IS NULL'))
+                db.execute(text(f'ALTER TABLE "{table}" ALTER COLUMN "{key}" SET NOT NULL'))
+                db.execute(text(f'ALTER TABLE "{table}" ADD PRIMARY KEY (id, "{key}")'))
+                db.execute(text(f'DROP INDEX IF EXISTS "ix_{table}_id"'))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+    @staticmethod
+    def convert_to_partitioned(db: Session, table: str, months_ahead: int = 3) -> Dict:
+        """
+        Migrate an existing plain table to a monthly partitioned table.
+        The old table is kept as <table>_legacy for verification (drop it manually).
+        Runs in one transaction; the table is locked while rows are copied.
+        """
+        key = PARTITIONED_TABLES[table]
+        if PartitionService.is_partitioned(db, table):
+            PartitionService._upgrade_partitioned(db, table)
+            return {"table": table, "status": "already_partitioned"}
+
+        legacy = f"{table}_legacy"
+        try:
+            db.execute(text(f'LOCK TABLE "{table}" IN ACCESS EXCLUSIVE MODE'))
+
+            # Indexes and foreign keys to recreate on the new parent
+            indexes = db.execute(text(
+                "SELECT i.relname, pg_get_indexdef(i.oid) FROM pg_index x "
+                "JOIN pg_class i ON i.oid = x.indexrelid "
+                "WHERE x.indrelid = CAST(:table AS regclass) AND NOT x.indisprimary"
+            ), {"table": table}).all()
+            foreign_keys = db.execute(text(
+                "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+                "WHERE conrelid = CAST(:table AS regclass) AND contype = 'f'"
+            ), {"table": table}).all()
+            pkey = db.execute(text(
+                "SELECT conname FROM pg_constraint "
+                "WHERE conrelid = CAST(:table AS regclass) AND contype = 'p'"
+            ), {"table": table}).scalar()
+            key_not_null = db.execute(text(
+                "SELECT attnotnull FROM pg_attribute "
+                "WHERE attrelid = CAST(:table AS regclass) AND attname = :key"
+            ), {"table": table, "key": key}).scalar()
+            if not key_not_null:
+                # Undated rows take their insert time, so the key can join the primary key
+                db.execute(text(f'UPDATE "{table}" SET "{key}" = created_at WHERE "{key}" IS NULL'))
+                db.execute(text(f'ALTER TABLE "{table}" ALTER COLUMN "{key}" SET NOT NULL'))
+            bounds = db.execute(text(
+                f'SELECT min("{key}"), max("{key}") FROM "{table}"'
+            )).first()
+
+            # Move the old table aside
+            db.execute(text(f'ALTER TABLE "{table}" RENAME TO "{legacy}"'))
+            for name, _ in indexes:
+                db.execute(text(f'ALTER INDEX "{name}" RENAME TO "{name}_legacy"'))
+            for name, _ in foreign_keys:
+                db.execute(text(f'ALTER TABLE "{legacy}" RENAME CONSTRAINT "{name}" TO "{name}_legacy"'))
+            if pkey:
+                db.execute(text(f'ALTER TABLE "{legacy}" RENAME CONSTRAINT "{pkey}" TO "{pkey}_legacy"'))
+
+            # New partitioned parent (partition key must be part of the primary key)
+            db.execute(text(
+                f'CREATE TABLE "{table}" (LIKE "{legacy}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+                f'PARTITION BY RANGE ("{key}")'
+            ))
+            db.execute(text(f'ALTER TABLE "{table}" ADD PRIMARY KEY (id, "{key}")'))
+            PartitionService.create_default_partition(db, table)
+
+            # Monthly partitions covering existing data + months ahead
+            tz = ZoneInfo(settings.TIMEZONE)
+            now = datetime.now(tz)
+            first = bounds[0].astimezone(tz) if bounds and bounds[0] else now
+            last = max(bounds[1].astimezone(tz), now) if bounds and bounds[1] else now
+            y, m = first.year, first.month
+            end_y, end_m = _add_months(last.year, last.month, months_ahead)
+            partitions = 0
+            while (y, m) <= (end_y, end_m):
+                PartitionService.create_month_partition(db, table, y, m)
+                partitions += 1
+                y, m = _add_months(y, m, 1)
+
+            # Definitions were read before the rename, so they target the new parent
+            for _, definition in indexes:
+                db.execute(text(definition))
+            for name, definition in foreign_keys:
+                db.execute(text(f'ALTER TABLE "{table}" ADD CONSTRAINT "{name}" {definition}'))
+
+            copied = db.execute(text(f'INSERT INTO "{table}" SELECT * FROM "{legacy}"')).rowcount
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+        logger.info(f"[PARTITION] {table}: {copied} rows into {partitions} monthly partitions")
+        return {"table": table, "status": "converted", "rows": copied, "partitions": partitions, "legacy_table": legacy}
+
+    @staticmethod
+    def _write_ledger_carry_forward(db: Session, partition: str, carry_date: datetime):
+        """
+        Before archiving stock_ledger rows, write their net effect into the live ledger
+        so on-hand/reserved (sum of the whole ledger) does not change.
+        on_hand: IN/RELEASE +, OUT/RESERVE -, ADJUST + ; reserved: RESERVE +, RELEASE -
+        """
+        params = {"carry_date": carry_date, "note": f"Carry forward from {partition}"}
+        net = f"""
+            SELECT warehouse_id, product_id,
+                   SUM(CASE WHEN movement_type IN ('IN', 'RELEASE', 'ADJUST') THEN quantity
+                            WHEN movement_type IN ('OUT', 'RESERVE') THEN -quantity ELSE 0 END) AS on_hand,
+                   SUM(CASE WHEN movement_type = 'RESERVE' THEN quantity
+                            WHEN movement_type = 'RELEASE' THEN -quantity ELSE 0 END) AS reserved
+            FROM "{partition}" GROUP BY warehouse_id, product_id
+        """
+        # Reserved part as RESERVE/RELEASE, remaining on-hand difference as ADJUST
+        db.execute(text(f"""
+            INSERT INTO stock_ledger (id, warehouse_id, product_id, movement_type, quantity,
+                                      reference_type, reference_id, note, created_at)
+            SELECT gen_random_uuid(), warehouse_id, product_id,
+                   CASE WHEN reserved > 0 THEN 'RESERVE' ELSE 'RELEASE' END, ABS(reserved),
+                   'ARCHIVE_CARRY_FORWARD', :partition, :note, :carry_date
+            FROM ({net}) n WHERE reserved <> 0
+        """), {**params, "partition": partition})
+        db.execute(text(f"""
+            INSERT INTO stock_ledger (id, warehouse_id, product_id, movement_type, quantity,
+                                      reference_type, reference_id, note, created_at)
+            SELECT gen_random_uuid(), warehouse_id, product_id, 'ADJUST', on_hand + reserved,
+                   'ARCHIVE_CARRY_FORWARD', :partition, :note, :carry_date
+            FROM ({net}) n WHERE on_hand + reserved <> 0
+        """), {**params, "partition": partition})
+
+    @staticmethod
+    def archive_partitions(db: Session, table: str, older_than_months: int) -> List[str]:
+        """
+        Detach monthly partitions older than N months and move them to the archive schema.
+        """
+        if older_than_months < 1 or not PartitionService.is_partitioned(db, table):
+            return []
+
+        now = datetime.now(ZoneInfo(settings.TIMEZONE))
+        cutoff = _add_months(now.year, now.month, -older_than_months)
+        to_archive = [p for p in PartitionService.list_partitions(db, table) if (p[0], p[1]) < cutoff]
+        if not to_archive:
+            return []
+
+        archived = []
+        try:
+            db.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{ARCHIVE_SCHEMA}"'))
+            for year, month, name in to_archive:
+                if table == "stock_ledger":
+                    PartitionService._write_ledger_carry_forward(db, name, _month_start(*cutoff))
+                db.execute(text(f'ALTER TABLE "{table}" DETACH PARTITION "{name}"'))
+                db.execute(text(f'ALTER TABLE "{name}" SET SCHEMA "{ARCHIVE_SCHEMA}"'))
+                archived.append(name)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+        logger.info(f"[PARTITION] Archived {len(archived)} partitions of {table}")
+        return archived
+
+    @staticmethod
+    def source_for_range(
+        db: Session,
+        model,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ):
+        """
+        Query source for a partitioned model covering [start, end].
+        Returns the model itself when no archived month overlaps the range,
+        otherwise an aliased entity over live UNION ALL archived partitions
+        (use it exactly like the model: db.query(src).filter(src.created_at >= ...)).
+        """
+        table = model.__tablename__
+        if table not in PARTITIONED_TABLES:
+            return model
+
+        tz = ZoneInfo(settings.TIMEZONE)
+        archived = []
+        for year, month, name in PartitionService.list_partitions(db, table, schema=ARCHIVE_SCHEMA):
+            month_start = _month_start(year, month)
+            month_end = _month_start(*_add_months(year, month, 1))
+            if end and end.replace(tzinfo=end.tzinfo or tz) < month_start:
+                continue
+            if start and start.replace(tzinfo=start.tzinfo or tz) >= month_end:
+                continue
+            archived.append(name)
+
+        if not archived:
+            return model
+
+        columns = [c.name for c in model.__table__.columns]
+        live = select(*[model.__table__.c[c] for c in columns])
+        if table == "stock_ledger":
+            # Carry-forward rows stand in for the archived months we are reading anyway
+            c = model.__table__.c
+            live = live.where(
+                c.reference_type.is_distinct_from("ARCHIVE_CARRY_FORWARD")
+                | c.reference_id.is_(None)
+                | c.reference_id.notin_(archived)
+            )
+        selects = [live]
+        for name in archived:
+            archive_table = sa_table(name, *[sa_column(c) for c in columns], schema=ARCHIVE_SCHEMA)
+            selects.append(select(*[archive_table.c[c] for c in columns]))
+
+        combined = union_all(*selects).subquery(f"{table}_with_archive")
+        return aliased(model, combined, adapt_on_names=True)
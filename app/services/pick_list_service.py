@@ -1,22 +1,126 @@
 """
 Pick List Service - Generate aggregated product summary for packing
+
+Aggregation runs in one SQL query. With explode_sets=True, SET products are
+expanded to their atomic components through a recursive CTE over product_set_bom.
+
+Batch pick lists are cached under the response-cache versions of the
+"orders" and "products" tags (see app/services/cache_invalidation.py), so any
+order, item or BOM write invalidates them.
 """
-from typing import List, Dict, Any
+import threading
+import time
+from typing import List, Dict, Any, Optional, Tuple
 from uuid import UUID
-from sqlalchemy.orm import Session, joinedload
-from app.services import OrderService
-from app.models import OrderHeader, Product
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.core.cache import response_cache
+
+# Batch pick lists: batch membership is fixed at cutoff, items rarely change
+BATCH_CACHE_TTL_SECONDS = 600
+# Response-cache tags a batch pick list depends on
+BATCH_CACHE_TAGS = ("orders", "products")
+# (batch id, explode_sets) -> (cached_at, tag versions, items)
+_batch_cache: Dict[Tuple[str, bool], Tuple[float, Dict[str, int], List[Dict[str, Any]]]] = {}
+_batch_cache_lock = threading.Lock()
+
+# Max set nesting followed by the BOM explosion (guards against cycles)
+MAX_BOM_DEPTH = 10
+
 
 class PickListService:
+
+    @staticmethod
+    def _aggregate(db: Session, order_filter: str, params: Dict[str, Any], explode_sets: bool) -> List[Dict[str, Any]]:
+        """
+        Aggregate order items matching order_filter (SQL on order_header oh).
+        Items are keyed by master SKU when linked, otherwise by the platform SKU.
+        Returns list sorted by SKU.
+        """
+        lines_cte = f"""
+            lines AS (
+                SELECT oi.order_id, oi.product_id, oi.sku, oi.product_name, oi.quantity
+                FROM order_item oi
+                JOIN order_header oh ON oh.id = oi.order_id
+                WHERE {order_filter}
+            )
+        """
+
+        if explode_sets:
+            sql = f"""
+                WITH RECURSIVE {lines_cte},
+                exploded AS (
+                    SELECT order_id, product_id, quantity, 0 AS depth
+                    FROM lines WHERE product_id IS NOT NULL
+                    UNION ALL
+                    SELECT e.order_id, b.component_product_id, e.quantity * b.quantity, e.depth + 1
+                    FROM exploded e
+                    JOIN product_set_bom b ON b.set_product_id = e.product_id
+                    WHERE e.depth < {MAX_BOM_DEPTH}
+                )
+                SELECT p.sku, p.name, p.image_url,
+                       SUM(e.quantity) AS quantity,
+                       COUNT(DISTINCT e.order_id) AS order_count,
+                       NULL AS components
+                FROM exploded e
+                JOIN product p ON p.id = e.product_id
+                WHERE NOT EXISTS (SELECT 1 FROM product_set_bom b WHERE b.set_product_id = e.product_id)
+                GROUP BY p.sku, p.name, p.image_url
+                UNION ALL
+                SELECT l.sku, MAX(l.product_name), NULL,
+                       SUM(l.quantity), COUNT(DISTINCT l.order_id), NULL
+                FROM lines l
+                WHERE l.product_id IS NULL AND COALESCE(l.sku, '') <> ''
+                GROUP BY l.sku
+            """
+        else:
+            # SETs are listed as-is, with their components for reference
+            sql = f"""
+                WITH {lines_cte},
+                agg AS (
+                    SELECT COALESCE(p.sku, l.sku) AS sku,
+                           COALESCE(MAX(p.name), MAX(l.product_name)) AS name,
+                           MAX(p.image_url) AS image_url,
+                           SUM(l.quantity) AS quantity,
+                           COUNT(DISTINCT l.order_id) AS order_count
+                    FROM lines l
+                    LEFT JOIN product p ON p.id = l.product_id
+                    WHERE COALESCE(p.sku, l.sku, '') <> ''
+                    GROUP BY COALESCE(p.sku, l.sku)
+                )
+                SELECT agg.*,
+                       (
+                           SELECT json_agg(json_build_object('sku', c.sku, 'name', c.name, 'qty', b.quantity))
+                           FROM product sp
+                           JOIN product_set_bom b ON b.set_product_id = sp.id
+                           JOIN product c ON c.id = b.component_product_id
+                           WHERE sp.sku = agg.sku AND sp.product_type = 'SET'
+                       ) AS components
+                FROM agg
+            """
+
+        rows = db.execute(text(sql), params).all()
+        result = [
+            {
+                "sku": row.sku,
+                "name": row.name,
+                "quantity": int(row.quantity or 0),
+                "order_count": int(row.order_count or 0),
+                "image_url": row.image_url,
+                "components": row.components or [],
+            }
+            for row in rows
+        ]
+        result.sort(key=lambda x: x["sku"])
+        return result
+
     @staticmethod
-    def generate_summary(db: Session, order_ids: List[str]) -> List[Dict[str, Any]]:
+    def generate_summary(db: Session, order_ids: List[str], explode_sets: bool = False) -> List[Dict[str, Any]]:
         """
-        Aggregate items from given orders.
-        Explode SET products into components.
+        Aggregate items from given orders (internal UUIDs or external order ids).
         Return list of items sorted by SKU.
         """
-        # 1. Fetch orders
-        # Convert IDs
         valid_uuids = []
         external_ids = []
         for oid in order_ids:
@@ -24,64 +128,70 @@ class PickListService:
                 valid_uuids.append(UUID(oid))
             except ValueError:
                 external_ids.append(oid)
-        
-        # We fetch orders one by one or in batch.
-        # OrderService has get_orders but maybe easier to query OrderHeader directly to join items
-        
-        # Let's iterate and build aggregate map
-        # Map: SKU -> {name, quantity, image_url}
-        summary_map = {}
-        
-        # Helper to add to map
-        def add_item(sku, name, qty, img, components=None):
-            if sku not in summary_map:
-                summary_map[sku] = {
-                    "sku": sku,
-                    "name": name,
-                    "quantity": 0,
-                    "image_url": img,
-                    "components": components or []
+
+        return PickListService._aggregate(
+            db,
+            "(oh.id = ANY(CAST(:ids AS uuid[])) OR oh.external_order_id = ANY(CAST(:external_ids AS text[])))",
+            {"ids": [str(u) for u in valid_uuids], "external_ids": external_ids},
+            explode_sets,
+        )
+
+    @staticmethod
+    def summarize_by_status(db: Session, status: str, explode_sets: bool = False) -> Dict[str, Any]:
+        """
+        Pick list for all orders in a status (mobile pick list).
+        Items sorted by quantity, most first.
+        """
+        items = PickListService._aggregate(db, "oh.status_normalized = :status", {"status": status}, explode_sets)
+        items.sort(key=lambda x: x["quantity"], reverse=True)
+
+        order_count = db.execute(
+            text("SELECT COUNT(*) FROM order_header WHERE status_normalized = :status"), {"status": status}
+        ).scalar() or 0
+
+        return {
+            "items": [
+                {
+                    "sku": item["sku"],
+                    "product_name": item["name"] or "-",
+                    "total_quantity": item["quantity"],
+                    "order_count": item["order_count"],
                 }
-            summary_map[sku]["quantity"] += qty
+                for item in items
+            ],
+            "order_count": order_count,
+            "sku_count": len(items),
+            "status": status,
+        }
 
-        from app.models import OrderItem, ProductSetBom
+    @staticmethod
+    def generate_batch_summary(db: Session, batch_id: str, explode_sets: bool = True, refresh: bool = False) -> List[Dict[str, Any]]:
+        """
+        Pick list for a packing batch, cached per (batch id, explode_sets)
+        until an order/item/product write bumps one of BATCH_CACHE_TAGS.
+        """
+        key = (str(batch_id), explode_sets)
+        now = time.monotonic()
+        # Taken before aggregating so a write racing with it still invalidates
+        versions = response_cache.tag_versions(BATCH_CACHE_TAGS)
+        if not refresh and versions is not None:
+            with _batch_cache_lock:
+                cached = _batch_cache.get(key)
+            if cached and now - cached[0] < BATCH_CACHE_TTL_SECONDS and cached[1] == versions:
+                return cached[2]
 
-        # Query items directly for these orders
-        query = db.query(OrderItem).join(OrderHeader).filter(
-            (OrderHeader.id.in_(valid_uuids)) | (OrderHeader.external_order_id.in_(external_ids))
-        ).options(
-            joinedload(OrderItem.product).joinedload(Product.set_components).joinedload(ProductSetBom.component_product)
+        items = PickListService._aggregate(
+            db,
+            "oh.id IN (SELECT order_id FROM packing_batch_order WHERE batch_id = CAST(:batch_id AS uuid))",
+            {"batch_id": str(batch_id)},
+            explode_sets,
         )
-        
-        items = query.all()
-        
-        for item in items:
-            product = item.product
-            quantity = item.quantity
-            
-            if not product:
-                # Fallback if product not linked
-                add_item(item.sku, item.product_name, quantity, None)
-                continue
-                
-            if product.product_type == "SET":
-                # Don't explode, just list components for reference
-                comps = []
-                if product.set_components:
-                    for bom in product.set_components:
-                        comp_prod = bom.component_product
-                        comps.append({
-                            "sku": comp_prod.sku,
-                            "name": comp_prod.name,
-                            "qty": bom.quantity
-                        })
-                add_item(product.sku, product.name, quantity, product.image_url, components=comps)
-            else:
-                # Normal item
-                add_item(product.sku, product.name, quantity, product.image_url)
-                
-        # Convert to list and sort
-        result = list(summary_map.values())
-        result.sort(key=lambda x: x["sku"])
-        
-        return result
+
+        if versions is None:  # Cache backend unavailable: cannot tell when to invalidate
+            return items
+        with _batch_cache_lock:
+            # Drop expired entries while we hold the lock
+            for k in [k for k, (ts, _, _) in _batch_cache.items() if now - ts >= BATCH_CACHE_TTL_SECONDS]:
+                del _batch_cache[k]
+            _batch_cache[key] = (now, versions, items)
+        return items
@@ -0,0 +1,348 @@
+"""
+Profit Service - Materialized per-order profit (order_profit)
+
+order_profit is recomputed only for orders queued in order_profit_dirty.
+A Session after_flush hook queues orders whose header, items or
+marketplace transactions were flushed, and every order containing a
+product whose standard_cost changed. Set-based writers that bypass the ORM
+call ProfitService.mark_dirty() themselves. The queue is drained in
+batches of ORDER_PROFIT_BATCH_SIZE orders, each recomputed by one
+INSERT ... SELECT, by a periodic job only (batches serialized with an
+advisory lock). Reads never write: queued or missing orders are computed
+live with the same SQL.
+
+Profit per order:
+    revenue = total_amount (0 when cancelled)
+    cogs    = SUM(quantity * product.standard_cost) (0 when cancelled)
+    fees    = |SUM(fee transactions)| when the order has any, otherwise an
+              estimate of PROFIT_FEE_ESTIMATE_RATE * revenue
+    net     = revenue - fees - cogs
+"""
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set
+from uuid import UUID
+
+from sqlalchemy import event, func, inspect, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.core import settings
+from app.models import OrderHeader, OrderItem, Product, OrderProfit, OrderProfitDirty
+from app.models.finance import MarketplaceTransaction
+
+logger = logging.getLogger(__name__)
+
+# Transaction types counted as platform fees
+PROFIT_FEE_TYPES = ("COMMISSION_FEE", "SERVICE_FEE", "TRANSACTION_FEE", "PAYMENT_FEE", "SHIPPING_FEE")
+# Fee estimate for orders without marketplace transactions yet
+PROFIT_FEE_ESTIMATE_RATE = 0.12
+# Rows returned by the profitability report
+PROFITABILITY_LIMIT = 2000
+
+# Attributes of OrderHeader / OrderItem that feed the profit
+_HEADER_ATTRS = ("total_amount", "status_normalized", "company_id", "currency_code")
+_ITEM_ATTRS = ("quantity", "product_id", "order_id")
+_TX_ATTRS = ("amount", "transaction_type", "order_id")
+
+# Profit of one order `oh` (used as a LATERAL subquery)
+_PROFIT_SQL = """
+    SELECT c.revenue, c.cogs, c.fees, c.fees_source,
+           c.revenue - c.fees - c.cogs AS net,
+           CASE WHEN c.revenue > 0
+                THEN LEAST(9999.99, GREATEST(-9999.99, ROUND((c.revenue - c.fees - c.cogs) / c.revenue * 100, 2)))
+                ELSE 0 END AS margin
+    FROM (
+        SELECT SUM(COALESCE(oi.quantity, 0) * COALESCE(p.standard_cost, 0)) AS cogs
+        FROM order_item oi
+        LEFT JOIN product p ON p.id = oi.product_id
+        WHERE oi.order_id = oh.id
+    ) it
+    CROSS JOIN (
+        SELECT COUNT(*) AS tx_count, SUM(mt.amount) AS amount
+        FROM marketplace_transaction mt
+        WHERE mt.order_id = oh.id AND mt.transaction_type = ANY(CAST(:fee_types AS text[]))
+    ) tx
+    CROSS JOIN LATERAL (
+        SELECT oh.status_normalized = 'CANCELLED' AS cancelled
+    ) s
+    CROSS JOIN LATERAL (
+        SELECT CASE WHEN s.cancelled THEN 0 ELSE COALESCE(oh.total_amount, 0) END AS revenue,
+               CASE WHEN s.cancelled THEN 0 ELSE COALESCE(it.cogs, 0) END AS cogs,
+               CASE WHEN tx.tx_count > 0 THEN ABS(COALESCE(tx.amount, 0))
+                    WHEN s.cancelled THEN 0
+                    ELSE ROUND(COALESCE(oh.total_amount, 0) * CAST(:estimate_rate AS numeric), 2) END AS fees,
+               CASE WHEN tx.tx_count > 0 THEN 'actual' ELSE 'estimate' END AS fees_source
+    ) c
+"""
+
+_REFRESH_SQL = f"""
+    INSERT INTO order_profit (
+        order_id, company_id, total_revenue, cogs_total, platform_fee_total,
+        fulfillment_cost_total, promo_cost_total, refund_total,
+        gross_profit, net_profit, profit_margin_percent, fees_source,
+        currency_code, calculated_at
+    )
+    SELECT oh.id,
+           oh.company_id,
+           p.revenue,
+           p.cogs,
+           p.fees,
+           0, 0, 0,
+           p.revenue - p.cogs,
+           p.net,
+           p.margin,
+           p.fees_source,
+           COALESCE(oh.currency_code, 'THB'),
+           now()
+    FROM order_header oh
+    CROSS JOIN LATERAL ({_PROFIT_SQL}) p
+    WHERE oh.id = ANY(CAST(:ids AS uuid[]))
+    ON CONFLICT (order_id) DO UPDATE SET
+        company_id = EXCLUDED.company_id,
+        total_revenue = EXCLUDED.total_revenue,
+        cogs_total = EXCLUDED.cogs_total,
+        platform_fee_total = EXCLUDED.platform_fee_total,
+        gross_profit = EXCLUDED.gross_profit,
+        net_profit = EXCLUDED.net_profit,
+        profit_margin_percent = EXCLUDED.profit_margin_percent,
+        fees_source = EXCLUDED.fees_source,
+        currency_code = EXCLUDED.currency_code,
+        calculated_at = EXCLUDED.calculated_at
+"""
+
+# Queued or never materialized orders are computed live (stored row may be stale);
+# the condition only references outer columns, so other orders skip the subquery
+_STALE_SQL = "op.order_id IS NULL OR EXISTS (SELECT 1 FROM order_profit_dirty d WHERE d.order_id = oh.id)"
+
+_PROFITABILITY_SQL = f"""
+    SELECT oh.external_order_id,
+           oh.channel_code,
+           oh.order_datetime,
+           li.items,
+           COALESCE(live.revenue, op.total_revenue) AS total_revenue,
+           COALESCE(live.cogs, op.cogs_total) AS cogs_total,
+           COALESCE(live.fees, op.platform_fee_total) AS platform_fee_total,
+           COALESCE(live.fees_source, op.fees_source) AS fees_source,
+           COALESCE(live.net, op.net_profit) AS net_profit,
+           COALESCE(live.margin, op.profit_margin_percent) AS profit_margin_percent
+    FROM order_header oh
+    LEFT JOIN order_profit op ON op.order_id = oh.id
+    LEFT JOIN LATERAL ({_PROFIT_SQL} WHERE {_STALE_SQL}) live ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT string_agg(COALESCE(oi.sku, 'N/A') || ' x' || COALESCE(oi.quantity, 0), ', ') AS items
+        FROM order_item oi
+        WHERE oi.order_id = oh.id
+    ) li ON TRUE
+    WHERE oh.order_datetime >= :start_ts AND oh.order_datetime <= :end_ts
+    ORDER BY oh.order_datetime DESC
+    LIMIT :limit
+"""
+
+_ORDER_PROFIT_LIVE_SQL = f"""
+    SELECT oh.company_id, COALESCE(oh.currency_code, 'THB') AS currency_code, p.*
+    FROM order_header oh
+    CROSS JOIN LATERAL ({_PROFIT_SQL}) p
+    WHERE oh.id = :order_id
+"""
+
+# pg_advisory_xact_lock key serializing refresh batches
+_REFRESH_LOCK_NAMESPACE = 0x5052
+
+
+class ProfitService:
+    """Order profit materialization and reads"""
+
+    # ========== Dirty tracking ==========
+
+    @staticmethod
+    def _mark_dirty_stmt(order_ids: Iterable[UUID]):
+        stmt = insert(OrderProfitDirty).values([{"order_id": oid} for oid in order_ids])
+        return stmt.on_conflict_do_update(
+            index_elements=[OrderProfitDirty.order_id],
+            set_={"marked_at": func.now()},
+        )
+
+    @staticmethod
+    def mark_dirty(db: Session, order_ids: Iterable[UUID]):
+        """Queue orders for profit recompute (does not commit)"""
+        order_ids = {oid for oid in order_ids if oid}
+        if order_ids:
+            db.execute(ProfitService._mark_dirty_stmt(order_ids))
+
+    @staticmethod
+    def mark_products_dirty(db: Session, product_ids: Iterable[UUID]):
+        """Queue every order containing the given products (cost changed)"""
+        product_ids = [str(pid) for pid in set(product_ids) if pid]
+        if not product_ids:
+            return
+        db.execute(text("""
+            INSERT INTO order_profit_dirty (order_id, marked_at)
+            SELECT DISTINCT order_id, now() FROM order_item
+            WHERE product_id = ANY(CAST(:ids AS uuid[]))
+            ON CONFLICT (order_id) DO UPDATE SET marked_at = EXCLUDED.marked_at
+        """), {"ids": product_ids})
+
+    # ========== Recompute ==========
+
+    @staticmethod
+    def _params() -> Dict[str, Any]:
+        return {"fee_types": list(PROFIT_FEE_TYPES), "estimate_rate": PROFIT_FEE_ESTIMATE_RATE}
+
+    @staticmethod
+    def recompute(db: Session, order_ids: List[UUID]) -> int:
+        """Recompute order_profit rows for a batch of orders in one statement (does not commit)"""
+        if not order_ids:
+            return 0
+        ids = [str(oid) for oid in order_ids]
+        result = db.execute(text(_REFRESH_SQL), {"ids": ids, **ProfitService._params()})
+        # Orders that no longer exist
+        db.execute(text("""
+            DELETE FROM order_profit op
+            WHERE op.order_id = ANY(CAST(:ids AS uuid[]))
+              AND NOT EXISTS (SELECT 1 FROM order_header oh WHERE oh.id = op.order_id)
+        """), {"ids": ids})
+        return result.rowcount
+
+    @staticmethod
+    def refresh_dirty(
+        db: Session,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        batch_size: Optional[int] = None,
+    ) -> int:
+        """
+        Drain the dirty queue (optionally only orders placed within a range),
+        committing after each batch. Returns the number of orders recomputed.
+        Batches are serialized across processes, so concurrent drains never
+        upsert the same orders.
+        """
+        batch_size = batch_size or settings.ORDER_PROFIT_BATCH_SIZE
+        total = 0
+        while True:
+            db.execute(text("SELECT pg_advisory_xact_lock(:ns, 0)"), {"ns": _REFRESH_LOCK_NAMESPACE})
+            query = db.query(OrderProfitDirty.order_id, OrderProfitDirty.marked_at)
+            if start_date or end_date:
+                query = query.join(OrderHeader, OrderHeader.id == OrderProfitDirty.order_id)
+                if start_date:
+                    query = query.filter(OrderHeader.order_datetime >= start_date)
+                if end_date:
+                    query = query.filter(OrderHeader.order_datetime <= end_date)
+            dirty = query.order_by(OrderProfitDirty.marked_at).limit(batch_size).all()
+            if not dirty:
+                db.commit()
+                return total
+
+            ProfitService.recompute(db, [d.order_id for d in dirty])
+            # Keep marks that moved while we were recomputing
+            db.execute(text("""
+                DELETE FROM order_profit_dirty d
+                USING unnest(CAST(:ids AS uuid[]), CAST(:marks AS timestamptz[])) AS s(order_id, marked_at)
+                WHERE d.order_id = s.order_id AND d.marked_at <= s.marked_at
+            """), {"ids": [str(d.order_id) for d in dirty], "marks": [d.marked_at for d in dirty]})
+            db.commit()
+            total += len(dirty)
+            if len(dirty) < batch_size:
+                return total
+
+    # ========== Reads ==========
+
+    @staticmethod
+    def get_order_profitability(db: Session, start_date: datetime, end_date: datetime) -> List[Dict[str, Any]]:
+        """
+        Profit of orders placed in a range, newest first. Read-only: orders still
+        queued for recompute are computed live instead of refreshed here.
+        """
+        rows = db.execute(text(_PROFITABILITY_SQL), {
+            "start_ts": start_date,
+            "end_ts": end_date,
+            "limit": PROFITABILITY_LIMIT,
+            **ProfitService._params(),
+        }).all()
+        return [
+            {
+                "order_number": r.external_order_id,
+                "platform": r.channel_code,
+                "date": r.order_datetime.strftime('%Y-%m-%d') if r.order_datetime else "",
+                "items": r.items or "",
+                "revenue": float(r.total_revenue or 0),
+                "cogs": float(r.cogs_total or 0),
+                "fees": float(r.platform_fee_total or 0),
+                "fees_source": r.fees_source,
+                "net_profit": float(r.net_profit or 0),
+                "margin_percent": float(r.profit_margin_percent or 0),
+            }
+            for r in rows
+        ]
+
+    @staticmethod
+    def get_order_profit(db: Session, order_id: UUID) -> Optional[OrderProfit]:
+        """
+        Profit of one order: the materialized row, or (queued or missing) a live
+        computed OrderProfit that is not added to the session.
+        """
+        profit = db.query(OrderProfit).filter(OrderProfit.order_id == order_id).first()
+        queued = db.query(OrderProfitDirty.order_id).filter(OrderProfitDirty.order_id == order_id).first()
+        if profit is not None and not queued:
+            return profit
+
+        row = db.execute(text(_ORDER_PROFIT_LIVE_SQL), {"order_id": order_id, **ProfitService._params()}).first()
+        if row is None:
+            return None
+        return OrderProfit(
+            order_id=order_id,
+            company_id=row.company_id,
+            total_revenue=row.revenue,
+            cogs_total=row.cogs,
+            platform_fee_total=row.fees,
+            gross_profit=row.revenue - row.cogs,
+            net_profit=row.net,
+            profit_margin_percent=row.margin,
+            fees_source=row.fees_source,
+            currency_code=row.currency_code,
+            calculated_at=datetime.now(timezone.utc),
+        )
+
+
+# ========== Write hook ==========
+
+def _changed(obj, attrs) -> bool:
+    state = inspect(obj)
+    return any(state.attrs[a].history.has_changes() for a in attrs)
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_order_profit_dirty(session: Session, flush_context):
+    """Queue orders whose profit inputs were flushed, in the same transaction"""
+    order_ids: Set[UUID] = set()
+    product_ids: Set[UUID] = set()
+
+    for obj in session.new:
+        if isinstance(obj, OrderHeader):
+            order_ids.add(obj.id)
+        elif isinstance(obj, (OrderItem, MarketplaceTransaction)):
+            order_ids.add(obj.order_id)
+
+    for obj in session.dirty:
+        if isinstance(obj, OrderHeader) and _changed(obj, _HEADER_ATTRS):
+            order_ids.add(obj.id)
+        elif isinstance(obj, (OrderItem, MarketplaceTransaction)):
+            attrs = _ITEM_ATTRS if isinstance(obj, OrderItem) else _TX_ATTRS
+            if _changed(obj, attrs):
+                order_ids.add(obj.order_id)
+                # Moved to another order: the old one changes too
+                order_ids.update(inspect(obj).attrs["order_id"].history.deleted)
+        elif isinstance(obj, Product) and _changed(obj, ("standard_cost",)):
+            product_ids.add(obj.id)
+
+    for obj in session.deleted:
+        if isinstance(obj, OrderHeader):
+            order_ids.add(obj.id)
+        elif isinstance(obj, (OrderItem, MarketplaceTransaction)):
+            order_ids.add(obj.order_id)
+
+    order_ids.discard(None)
+    if order_ids:
+        session.connection().execute(ProfitService._mark_dirty_stmt(order_ids))
+    if product_ids:
+        ProfitService.mark_products_dirty(session.connection(), product_ids)
@@ -1,20 +1,44 @@
 """
 Reconciliation Service - Compare WeOrder vs Marketplace data
 Detects missing orders and sync issues
+
+Marketplace reconciliation runs every active shop in parallel: it pulls
+only the order list (ids, status, update time) for local order dates and
+compares its order digest with the one kept in the daily order rollup.
+Days whose digests differ are compared with an (external id, status,
+updated_at) projection of order_header, and their missing and stale
+orders resynced through the order sync writer. One ReconciliationResult
+is stored per shop and day; the health dashboard reads the stored results.
 """
-from datetime import datetime, date, time, timedelta
-from typing import Dict, List, Any, Optional
-from uuid import UUID
+import asyncio
+from collections import defaultdict
+from datetime import datetime, date, timedelta, timezone
+from typing import Dict, List, Any, Optional, Tuple
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
+from sqlalchemy import func
+from starlette.concurrency import run_in_threadpool
 
 from app.models.order import OrderHeader
-from app.models.master import SalesChannel
+from app.models.integration import PlatformConfig
+from app.models.reconciliation import ReconciliationResult
 from app.core.config import settings
+from app.core.database import SessionLocal
+from app.services import integration_service
+from app.services.order_rollup_service import OrderRollupService, _day_start_utc, _tz, combine_digest, local_today
+from app.services.sync_service import FINAL_STATUSES, OrderSyncService
 
 import logging
 logger = logging.getLogger(__name__)
 
+REMOTE_PAGE_SIZE = 100
+LOCAL_LOOKUP_CHUNK = 5000
+MISSING_SAMPLE_SIZE = 50
+# Shop-day list fetches / drill-downs in flight (each shop's rate limiter still applies)
+RECONCILIATION_CONCURRENCY = 8
+# Statuses refined locally (returns sync, delivery failures) that the writer keeps
+REVERSE_STATUSES = ("CANCELLED", "RETURNED", "DELIVERY_FAILED", "TO_RETURN")
+
 
 class ReconciliationService:
     """
@@ -26,30 +50,16 @@ class ReconciliationService:
     @staticmethod
     def get_daily_summary(db: Session, target_date: date) -> Dict[str, Any]:
         """
-        Get order counts from WeOrder database for a given date
+        Get order counts from WeOrder database for a given (local) date
         """
-        start_dt = datetime.combine(target_date, time.min)
-        end_dt = datetime.combine(target_date, time.max)
-        
-        # Count orders by platform and status
-        result = db.query(
-            OrderHeader.channel_code,
-            OrderHeader.status_normalized,
-            func.count(OrderHeader.id).label('count')
-        ).filter(
-            OrderHeader.order_datetime >= start_dt,
-            OrderHeader.order_datetime <= end_dt
-        ).group_by(
-            OrderHeader.channel_code,
-            OrderHeader.status_normalized
-        ).all()
-        
+        # Count orders by platform and status (daily rollup, today live)
         summary = {}
-        for channel, status, count in result:
+        for row in OrderRollupService.get_daily(db, target_date, target_date):
+            channel = row['channel_code']
             if channel not in summary:
                 summary[channel] = {'total': 0, 'by_status': {}}
-            summary[channel]['total'] += count
-            summary[channel]['by_status'][status] = count
+            summary[channel]['total'] += row['order_count']
+            summary[channel]['by_status'][row['status_normalized']] = row['order_count']
             
         return summary
     
@@ -90,127 +100,427 @@ class ReconciliationService:
                 
         return sync_status
     
+    # ========== Marketplace reconciliation ==========
+    
+    @staticmethod
+    def _parse_update_time(value: Any) -> Optional[datetime]:
+        """Platform update time (unix seconds or ISO string) as an aware datetime"""
+        if not value:
+            return None
+        try:
+            if isinstance(value, (int, float)) or str(value).isdigit():
+                return datetime.fromtimestamp(int(value), timezone.utc)
+            parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        except ValueError:
+            try:
+                parsed = datetime.strptime(str(value), "%Y-%m-%d %H:%M:%S %z")
+            except ValueError:
+                return None
+        return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+    
+    @staticmethod
+    def _list_entry(platform: str, client, raw: Dict) -> Optional[Tuple[str, Optional[str], Optional[datetime]]]:
+        """(external id, normalized status, platform update time) of an order list entry"""
+        if platform == 'shopee':
+            order_id = raw.get('order_sn')
+            status = raw.get('order_status')
+            updated = None  # get_order_list has no update time
+        elif platform == 'lazada':
+            order_id = raw.get('order_id')
+            statuses = raw.get('statuses') or []
+            status = statuses[0] if statuses else None
+            updated = raw.get('updated_at')
+        else:
+            order_id = raw.get('id') or raw.get('order_id')
+            status = raw.get('status')
+            updated = raw.get('update_time')
+        if not order_id:
+            return None
+        normalized = client.normalize_order_status(status) if status else None
+        return str(order_id), normalized, ReconciliationService._parse_update_time(updated)
+    
+    @staticmethod
+    async def _fetch_order_list(
+        config: PlatformConfig,
+        time_from: datetime,
+        time_to: datetime,
+    ) -> Dict[str, Tuple[Optional[str], Optional[datetime]]]:
+        """external id -> (normalized status, update time) of orders created in [time_from, time_to)"""
+        client = integration_service.get_client_for_config(config)
+        limiter = client.get_rate_limiter()
+        orders = {}
+        cursor = None
+        while True:
+            await limiter.acquire()
+            result = await client.get_orders(
+                time_from=time_from,
+                time_to=time_to,
+                cursor=cursor,
+                page_size=REMOTE_PAGE_SIZE,
+            )
+            for raw in result.get("orders", []):
+                entry = ReconciliationService._list_entry(config.platform, client, raw)
+                if entry:
+                    orders[entry[0]] = entry[1:]
+            cursor = result.get("next_cursor")
+            if not (result.get("has_more") and cursor):
+                return orders
+    
+    @staticmethod
+    def _local_orders(db: Session, platform: str, external_ids: List[str]) -> Dict[str, Tuple[str, datetime]]:
+        """external id -> (status_normalized, updated_at) of the given orders"""
+        local = {}
+        for i in range(0, len(external_ids), LOCAL_LOOKUP_CHUNK):
+            rows = db.query(
+                OrderHeader.external_order_id,
+                OrderHeader.status_normalized,
+                OrderHeader.updated_at,
+            ).filter(
+                OrderHeader.channel_code == platform,
+                OrderHeader.external_order_id.in_(external_ids[i:i + LOCAL_LOOKUP_CHUNK]),
+            ).all()
+            local.update({ext_id: (status, updated_at) for ext_id, status, updated_at in rows})
+        return local
+    
+    @staticmethod
+    def _is_stale(
+        remote: Tuple[Optional[str], Optional[datetime]],
+        local: Tuple[str, Optional[datetime]],
+    ) -> bool:
+        """Whether a resync would change the stored order (mirrors the writer's guards)"""
+        remote_status, remote_updated = remote
+        local_status, local_updated = local
+        if not remote_status or remote_status == local_status:
+            return False
+        # The writer skips final -> final and never leaves the reverse flow
+        if local_status in FINAL_STATUSES and remote_status in FINAL_STATUSES:
+            return False
+        if local_status in REVERSE_STATUSES:
+            return False
+        # Written after the marketplace's last change: local status is newer
+        if remote_updated and local_updated:
+            if local_updated.tzinfo is None:
+                local_updated = local_updated.replace(tzinfo=timezone.utc)
+            if remote_updated <= local_updated:
+                return False
+        return True
+    
+    @staticmethod
+    def _save_results(db: Session, results: List[Dict[str, Any]]) -> None:
+        rows = [
+            {
+                "result_date": date.fromisoformat(r["date"]),
+                "platform": r["platform"],
+                "shop_id": r["shop_id"],
+                "marketplace_count": r.get("marketplace_count", 0),
+                "missing_count": r.get("missing_count", 0),
+                "stale_count": r.get("stale_count", 0),
+                "resynced_count": r.get("resynced_count", 0),
+                "digest_match": r.get("digest_match", False),
+                "status": r["status"],
+                "error": r.get("error"),
+                "missing_ids": r.get("missing_ids") or [],
+            }
+            for r in results
+        ]
+        if not rows:
+            return
+        stmt = insert(ReconciliationResult)
+        update = {k: stmt.excluded[k] for k in rows[0] if k not in ("result_date", "platform", "shop_id")}
+        update["checked_at"] = func.now()
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=["result_date", "platform", "shop_id"],
+            set_=update,
+        ), rows)
+        db.commit()
+    
+    @staticmethod
+    async def _fetch_day(config: PlatformConfig, target_date: date, semaphore: asyncio.Semaphore):
+        """Marketplace order list of one shop for one local order date"""
+        async with semaphore:
+            time_from = _day_start_utc(target_date).astimezone(_tz())
+            time_to = _day_start_utc(target_date + timedelta(days=1)).astimezone(_tz())
+            return await ReconciliationService._fetch_order_list(config, time_from, time_to)
+    
+    @staticmethod
+    async def _drill_down(
+        config: PlatformConfig,
+        remote: Dict[str, Tuple[Optional[str], Optional[datetime]]],
+        result: Dict[str, Any],
+        resync: bool,
+        semaphore: asyncio.Semaphore,
+    ) -> None:
+        """Diff one shop-day against order_header and resync it (own session, fills result)"""
+        async with semaphore:
+            db = SessionLocal()
+            try:
+                local = await run_in_threadpool(
+                    ReconciliationService._local_orders, db, config.platform, list(remote)
+                )
+                missing = [ext_id for ext_id in remote if ext_id not in local]
+                stale = [
+                    ext_id for ext_id, entry in remote.items()
+                    if ext_id in local and ReconciliationService._is_stale(entry, local[ext_id])
+                ]
+                result['stale_count'] = len(stale)
+                
+                if resync and (missing or stale):
+                    to_sync = (missing + stale)[:settings.RECONCILIATION_RESYNC_LIMIT]
+                    stats = await OrderSyncService(db).sync_order_ids(config, to_sync)
+                    result['resynced_count'] = stats['created'] + stats['updated']
+                    # What the resync could not fill in stays reported as missing
+                    found = await run_in_threadpool(
+                        ReconciliationService._local_orders, db, config.platform, missing
+                    )
+                    missing = [ext_id for ext_id in missing if ext_id not in found]
+                
+                result['missing_count'] = len(missing)
+                result['missing_ids'] = missing[:MISSING_SAMPLE_SIZE]
+                if missing:
+                    result['status'] = 'warning'
+                elif result['resynced_count']:
+                    result['status'] = 'resynced'
+            except Exception as e:
+                logger.error(f"Reconciliation error for {config.platform}/{config.shop_name}: {e}")
+                await run_in_threadpool(db.rollback)
+                result.update({'status': 'error', 'error': str(e)})
+            finally:
+                db.close()
+    
+    @staticmethod
+    async def reconcile_days(
+        db: Session,
+        dates: List[date],
+        platforms: Optional[List[str]] = None,
+        resync: bool = True,
+    ) -> List[Dict[str, Any]]:
+        """
+        Compare local order dates with the marketplace order lists of all
+        active shops and store a ReconciliationResult per shop and day.
+        
+        Lists are fetched in parallel. Each (day, platform) is first checked
+        by order digest against the daily rollup; only days whose digests
+        differ are diffed order by order, and their missing / stale orders
+        resynced through the order sync writer.
+        """
+        query = db.query(PlatformConfig).filter(
+            PlatformConfig.is_active == True,
+            PlatformConfig.sync_enabled == True,
+        )
+        if platforms:
+            query = query.filter(PlatformConfig.platform.in_(platforms))
+        configs = query.all()
+        if not configs or not dates:
+            return []
+        
+        semaphore = asyncio.Semaphore(RECONCILIATION_CONCURRENCY)
+        shop_days = [(config, day) for day in dates for config in configs]
+        lists = await asyncio.gather(
+            *(ReconciliationService._fetch_day(config, day, semaphore) for config, day in shop_days),
+            return_exceptions=True,
+        )
+        local = await run_in_threadpool(OrderRollupService.get_digests, db, min(dates), max(dates))
+        
+        # Shops of one platform share its channel_code: digests are compared per platform
+        groups: Dict[Tuple[date, str], List[Tuple[PlatformConfig, Any]]] = defaultdict(list)
+        for (config, day), remote in zip(shop_days, lists):
+            groups[(day, config.platform)].append((config, remote))
+        
+        results = []
+        drill_downs = []
+        for (day, platform), shops in groups.items():
+            fetched = not any(isinstance(remote, BaseException) for _, remote in shops)
+            digest_match = fetched and combine_digest(
+                (ext_id, entry[0]) for _, remote in shops for ext_id, entry in remote.items()
+            ) == local.get((day, platform), (0, 0))
+            
+            for config, remote in shops:
+                result = {
+                    'platform': platform,
+                    'shop_id': str(config.shop_id or ""),
+                    'shop_name': config.shop_name,
+                    'date': day.isoformat(),
+                    'digest_match': digest_match,
+                    'missing_count': 0,
+                    'stale_count': 0,
+                    'resynced_count': 0,
+                    'status': 'ok',
+                }
+                if isinstance(remote, BaseException):
+                    logger.error(f"Reconciliation error for {platform}/{config.shop_name}: {remote}")
+                    result.update({'marketplace_count': 0, 'status': 'error', 'error': str(remote)})
+                else:
+                    result['marketplace_count'] = len(remote)
+                    if not digest_match:
+                        drill_downs.append(ReconciliationService._drill_down(config, remote, result, resync, semaphore))
+                results.append(result)
+        
+        await asyncio.gather(*drill_downs)
+        await run_in_threadpool(ReconciliationService._save_results, db, results)
+        return results
+    
+    @staticmethod
+    async def reconcile_day(
+        db: Session,
+        target_date: date,
+        platforms: Optional[List[str]] = None,
+        resync: bool = True,
+    ) -> List[Dict[str, Any]]:
+        """Reconcile one local order date (see reconcile_days)"""
+        return await ReconciliationService.reconcile_days(db, [target_date], platforms, resync)
+    
+    @staticmethod
+    async def reconcile_recent(
+        db: Session,
+        days: Optional[int] = None,
+        platforms: Optional[List[str]] = None,
+        resync: bool = True,
+    ) -> List[Dict[str, Any]]:
+        """Reconcile the last N local order dates (settings.RECONCILIATION_DAYS)"""
+        days = days or settings.RECONCILIATION_DAYS
+        today = local_today()
+        dates = [today - timedelta(days=i) for i in range(days)]
+        return await ReconciliationService.reconcile_days(db, dates, platforms, resync)
+    
+    @staticmethod
+    async def audit_completeness(
+        db: Session,
+        days: int = 90,
+        platforms: Optional[List[str]] = None,
+        resync: bool = True,
+    ) -> Dict[str, Any]:
+        """
+        Order-set audit of the last N days: digest comparison per day and
+        platform, order-level diff and resync only for days that differ.
+        """
+        results = await ReconciliationService.reconcile_recent(db, days, platforms, resync)
+        mismatched = sorted({(r['date'], r['platform']) for r in results if not r['digest_match']})
+        return {
+            'checked_days': days,
+            'shop_days': len(results),
+            'mismatched_days': [{'date': d, 'platform': p} for d, p in mismatched],
+            'missing_count': sum(r['missing_count'] for r in results),
+            'stale_count': sum(r['stale_count'] for r in results),
+            'resynced_count': sum(r['resynced_count'] for r in results),
+            'errors': [r for r in results if r['status'] == 'error'],
+            'results': [r for r in results if not r['digest_match']],
+        }
+    
+    @staticmethod
+    def get_results(db: Session, start_date: date, end_date: date) -> List[Dict[str, Any]]:
+        """Stored reconciliation results for a date range, newest first"""
+        rows = db.query(ReconciliationResult).filter(
+            ReconciliationResult.result_date >= start_date,
+            ReconciliationResult.result_date <= end_date,
+        ).order_by(
+            ReconciliationResult.result_date.desc(),
+            ReconciliationResult.platform,
+            ReconciliationResult.shop_id,
+        ).all()
+        return [
+            {
+                'date': r.result_date.isoformat(),
+                'platform': r.platform,
+                'shop_id': r.shop_id,
+                'marketplace_count': r.marketplace_count,
+                'missing_count': r.missing_count,
+                'stale_count': r.stale_count,
+                'resynced_count': r.resynced_count,
+                'digest_match': bool(r.digest_match),
+                'missing_ids': r.missing_ids or [],
+                'status': r.status,
+                'error': r.error,
+                'checked_at': r.checked_at.isoformat() if r.checked_at else None,
+            }
+            for r in rows
+        ]
+    
     @staticmethod
     async def compare_with_marketplace(
         db: Session, 
         platform: str, 
-        target_date: date
+        target_date: date,
+        resync: bool = False,
     ) -> Dict[str, Any]:
         """
         Compare WeOrder orders with Marketplace API for a given date
-        Returns differences and missing orders
+        Returns differences and missing orders (summed over the platform's shops)
         """
-        from app.integrations.tiktok import TikTokClient
-        from app.integrations.shopee import ShopeeClient
-        from app.integrations.lazada import LazadaClient
-        
-        start_dt = datetime.combine(target_date, time.min)
-        end_dt = datetime.combine(target_date, time.max)
-        
-        # Get WeOrder orders
-        weorder_orders = db.query(OrderHeader).filter(
-            OrderHeader.channel_code == platform,
-            OrderHeader.order_datetime >= start_dt,
-            OrderHeader.order_datetime <= end_dt
-        ).all()
-        
-        weorder_ids = {o.external_order_id for o in weorder_orders}
-        
-        # Get channel config
-        channel = db.query(ChannelConfig).filter(
-            ChannelConfig.platform == platform,
-            ChannelConfig.is_active == True
-        ).first()
-        
-        if not channel:
+        shops = await ReconciliationService.reconcile_day(db, target_date, [platform], resync=resync)
+        if not shops:
             return {
                 'platform': platform,
                 'date': target_date.isoformat(),
                 'error': f'No active channel config for {platform}',
-                'weorder_count': len(weorder_ids),
                 'marketplace_count': 0,
                 'missing': []
             }
         
-        # Initialize client and fetch orders from marketplace
-        marketplace_ids = set()
-        missing_orders = []
+        marketplace_count = sum(s.get('marketplace_count', 0) for s in shops)
+        missing_count = sum(s.get('missing_count', 0) for s in shops)
+        missing_ids = [ext_id for s in shops for ext_id in s.get('missing_ids', [])]
+        errors = [s['error'] for s in shops if s.get('error')]
         
-        try:
-            if platform == 'tiktok':
-                client = TikTokClient(channel)
-                # Fetch orders from TikTok for this date range
-                orders = await client.get_orders(
-                    start_time=int(start_dt.timestamp()),
-                    end_time=int(end_dt.timestamp())
-                )
-                marketplace_ids = {o.get('order_id') for o in orders}
-                
-            elif platform == 'shopee':
-                client = ShopeeClient(channel)
-                orders = await client.get_orders(
-                    start_time=int(start_dt.timestamp()),
-                    end_time=int(end_dt.timestamp())
-                )
-                marketplace_ids = {o.get('order_sn') for o in orders}
-                
-            elif platform == 'lazada':
-                client = LazadaClient(channel)
-                orders = await client.get_orders(
-                    start_time=start_dt.isoformat(),
-                    end_time=end_dt.isoformat()
-                )
-                marketplace_ids = {str(o.get('order_id')) for o in orders}
-            
-            # Find missing orders (in marketplace but not in WeOrder)
-            missing_ids = marketplace_ids - weorder_ids
-            
-            return {
-                'platform': platform,
-                'date': target_date.isoformat(),
-                'weorder_count': len(weorder_ids),
-                'marketplace_count': len(marketplace_ids),
-                'missing_count': len(missing_ids),
-                'missing_ids': list(missing_ids)[:50],  # Limit to 50
-                'match_rate': round(len(weorder_ids) / max(len(marketplace_ids), 1) * 100, 1),
-                'status': 'ok' if len(missing_ids) == 0 else 'warning'
-            }
-            
-        except Exception as e:
-            logger.error(f"Reconciliation error for {platform}: {e}")
-            return {
-                'platform': platform,
-                'date': target_date.isoformat(),
-                'error': str(e),
-                'weorder_count': len(weorder_ids),
-                'marketplace_count': 0,
-                'missing': []
-            }
+        return {
+            'platform': platform,
+            'date': target_date.isoformat(),
+            'weorder_count': marketplace_count - missing_count,
+            'marketplace_count': marketplace_count,
+            'missing_count': missing_count,
+            'stale_count': sum(s.get('stale_count', 0) for s in shops),
+            'resynced_count': sum(s.get('resynced_count', 0) for s in shops),
+            'missing_ids': missing_ids[:MISSING_SAMPLE_SIZE],
+            'match_rate': round((marketplace_count - missing_count) / max(marketplace_count, 1) * 100, 1),
+            'status': 'error' if errors else ('ok' if missing_count == 0 else 'warning'),
+            'errors': errors,
+            'shops': shops,
+        }
     
     @staticmethod
     def get_recent_gaps(db: Session, days: int = 7) -> Dict[str, Any]:
         """
         Check for date gaps or anomalies in order data over last N days
         """
-        today = date.today()
-        gaps = []
+        today = local_today()
+        start = today - timedelta(days=days - 1)
         
+        # One read for the whole window instead of one query per day
+        counts = {}
+        for row in OrderRollupService.get_daily(db, start, today):
+            key = (row['order_date'], row['channel_code'])
+            counts[key] = counts.get(key, 0) + row['order_count']
+        
+        # Only platforms with orders somewhere in the window are expected every day
+        active = {channel for (_, channel), count in counts.items() if count}
+        
+        gaps = []
         for i in range(days):
             check_date = today - timedelta(days=i)
-            daily = ReconciliationService.get_daily_summary(db, check_date)
             
             for platform in ReconciliationService.PLATFORMS:
-                if platform in daily:
-                    count = daily[platform]['total']
-                    # Flag if count is unusually low (< 10% of average)
-                    # This is a simple heuristic - can be improved
-                    if count == 0:
-                        gaps.append({
-                            'date': check_date.isoformat(),
-                            'platform': platform,
-                            'count': count,
-                            'issue': 'no_orders'
-                        })
+                if platform not in active:
+                    continue
+                count = counts.get((check_date, platform), 0)
+                # Flag days without any order for an active platform
+                # This is a simple heuristic - can be improved
+                if count == 0:
+                    gaps.append({
+                        'date': check_date.isoformat(),
+                        'platform': platform,
+                        'count': count,
+                        'issue': 'no_orders'
+                    })
+        
+        # Order-set differences found by the reconciliation job (digest + diff)
+        for r in ReconciliationService.get_results(db, start, today):
+            if r['status'] == 'warning':
+                gaps.append({
+                    'date': r['date'],
+                    'platform': r['platform'],
+                    'shop_id': r['shop_id'],
+                    'count': r['missing_count'],
+                    'issue': 'missing_orders'
+                })
                         
         return {
             'checked_days': days,
@@ -226,6 +536,8 @@ class ReconciliationService:
         sync_status = ReconciliationService.get_sync_status(db)
         today_summary = ReconciliationService.get_daily_summary(db, date.today())
         gaps = ReconciliationService.get_recent_gaps(db, days=3)
+        today = local_today()
+        reconciliation = ReconciliationService.get_results(db, today - timedelta(days=2), today)
         
         # Calculate overall health
         issues = []
@@ -236,12 +548,20 @@ class ReconciliationService:
         if gaps['gaps_found'] > 0:
             issues.append(f"Found {gaps['gaps_found']} data gaps in last 3 days")
         
+        # Stored by the reconciliation job, not recomputed here
+        for r in reconciliation:
+            if r['status'] == 'warning':
+                issues.append(f"{r['platform']}/{r['shop_id']}: {r['missing_count']} orders missing on {r['date']}")
+            elif r['status'] == 'error':
+                issues.append(f"{r['platform']}/{r['shop_id']}: reconciliation failed on {r['date']}")
+        
         overall_status = 'healthy' if not issues else ('warning' if len(issues) < 3 else 'critical')
         
         return {
             'overall_status': overall_status,
             'sync_status': sync_status,
             'today_summary': today_summary,
+            'reconciliation': reconciliation,
             'issues': issues,
             'checked_at': datetime.now().isoformat()
         }
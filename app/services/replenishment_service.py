@@ -2,131 +2,356 @@
 Replenishment Service
 Handles logic for Smart Reorder System:
 - Calculate Sales Velocity (Avg sales per day)
+- Forecast demand (moving average + trend + weekday seasonality)
 - Estimate Days of Inventory Remaining
-- Suggest Reorder Quantities
+- Suggest Reorder Quantities (multi-horizon, lead time & safety stock)
+
+All products are forecast at once on a product x day sales matrix (NumPy),
+loaded with a single GROUP BY query.
 """
 from sqlalchemy.orm import Session
 from sqlalchemy import func, and_, case
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date, time
+from statistics import NormalDist
 from typing import List, Dict, Optional
 from uuid import UUID
+from zoneinfo import ZoneInfo
+import numpy as np
 
+from app.core import settings
 from app.models import Product, OrderHeader, OrderItem, StockBalance
 
+
+def service_level_z(service_level: float) -> float:
+    """z-score of a cycle service level (standard normal quantile)"""
+    if not 0 < service_level < 1:
+        raise ValueError(f"service_level must be between 0 and 1, got {service_level}")
+    return NormalDist().inv_cdf(service_level)
+
+
+# Reorder horizons (days of cover after the lead time)
+FORECAST_HORIZONS = [7, 14, 30, 60]
+
+
 class ReplenishmentService:
-    
+
+    @staticmethod
+    def _load_sales_matrix(
+        db: Session,
+        product_ids: List[UUID],
+        start_date: date,
+        end_date: date,
+    ) -> np.ndarray:
+        """
+        Load daily sold quantity as a (products x days) matrix in one query.
+        Days are local dates (settings.TIMEZONE), end_date inclusive.
+        Excludes Cancelled/Returned orders.
+        """
+        n_days = (end_date - start_date).days + 1
+        matrix = np.zeros((len(product_ids), n_days), dtype=np.float64)
+        if not product_ids:
+            return matrix
+
+        index = {pid: i for i, pid in enumerate(product_ids)}
+        local_day = func.date(func.timezone(settings.TIMEZONE, OrderHeader.order_datetime))
+
+        rows = db.query(
+            OrderItem.product_id,
+            local_day.label("day"),
+            func.sum(OrderItem.quantity).label("qty")
+        ).join(OrderHeader).filter(
+            OrderItem.product_id.isnot(None),
+            OrderHeader.order_datetime >= datetime.combine(start_date, time.min, tzinfo=ZoneInfo(settings.TIMEZONE)),
+            OrderHeader.status_normalized.notin_(["CANCELLED", "RETURNED"])
+        ).group_by(OrderItem.product_id, local_day).all()
+
+        if not rows:
+            return matrix
+
+        rows_idx, cols_idx, values = [], [], []
+        for r in rows:
+            i = index.get(r.product_id)
+            if i is None or r.day is None:
+                continue
+            j = (r.day - start_date).days
+            if 0 <= j < n_days:
+                rows_idx.append(i)
+                cols_idx.append(j)
+                values.append(r.qty or 0)
+
+        matrix[rows_idx, cols_idx] = values
+        return matrix
+
+    @staticmethod
+    def _campaign_days(days: List[date], sales: np.ndarray) -> np.ndarray:
+        """
+        Flag campaign days: double days (9.9, 11.11, 12.12 ...) and days where
+        store-wide sales spike above 2.5x the surrounding 4-week median.
+        """
+        double_day = np.array([d.month == d.day for d in days], dtype=bool)
+
+        total = sales.sum(axis=0)
+        spike = np.zeros(len(days), dtype=bool)
+        if len(days) >= 7:
+            window = 28
+            padded = np.pad(total, (window // 2, window // 2), mode="edge")
+            windows = np.lib.stride_tricks.sliding_window_view(padded, window + 1)
+            rolling_median = np.median(windows, axis=1)[:len(days)]
+            spike = total > np.maximum(rolling_median, 1.0) * 2.5
+
+        return double_day | spike
+
+    @staticmethod
+    def _dampen_outliers(sales: np.ndarray, campaign: np.ndarray) -> np.ndarray:
+        """
+        Cap campaign-day sales per SKU at median + 3 * MAD of normal days,
+        so one 11.11 does not inflate the baseline for the next month.
+        """
+        if not campaign.any() or campaign.all():
+            return sales
+
+        normal = sales[:, ~campaign]
+        median = np.median(normal, axis=1, keepdims=True)
+        mad = np.median(np.abs(normal - median), axis=1, keepdims=True)
+        cap = median + 3.0 * 1.4826 * mad
+        # Keep a floor so sparse SKUs (median 0) are not zeroed out
+        cap = np.maximum(cap, normal.max(axis=1, keepdims=True))
+
+        cleaned = sales.copy()
+        cleaned[:, campaign] = np.minimum(sales[:, campaign], cap)
+        return cleaned
+
+    @staticmethod
+    def _weekday_index(cleaned: np.ndarray, days: List[date]) -> np.ndarray:
+        """
+        Weekday seasonality index per SKU (products x 7, mean 1.0).
+        Shrunk towards 1.0 for slow movers so noise is not read as seasonality.
+        """
+        weekdays = np.array([d.weekday() for d in days])
+        n = cleaned.shape[0]
+        index = np.ones((n, 7))
+
+        overall = cleaned.mean(axis=1)
+        for w in range(7):
+            mask = weekdays == w
+            if mask.any():
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    index[:, w] = np.where(overall > 0, cleaned[:, mask].mean(axis=1) / overall, 1.0)
+
+        totals = cleaned.sum(axis=1, keepdims=True)
+        weight = totals / (totals + 50.0)
+        index = weight * index + (1.0 - weight) * 1.0
+
+        # Renormalise to mean 1
+        index = index / index.mean(axis=1, keepdims=True)
+        return index
+
+    @staticmethod
+    def forecast_demand(
+        db: Session,
+        product_ids: List[UUID],
+        days_lookback: int = 30,
+        history_days: int = 365,
+        forecast_days: int = 120,
+    ) -> Dict:
+        """
+        Forecast daily demand for many products at once.
+
+        Returns arrays aligned with product_ids:
+        - velocity: average daily sales over days_lookback (raw)
+        - sales_period: units sold over days_lookback (raw)
+        - ma7 / ma28: moving averages of outlier-dampened sales
+        - trend: slope (units/day per day) over days_lookback
+        - sigma: std dev of daily dampened sales over days_lookback
+        - daily: (products x forecast_days) forecast starting tomorrow
+        """
+        history_days = max(history_days, days_lookback, 28)
+        today = datetime.now(ZoneInfo(settings.TIMEZONE)).date()
+        end_date = today - timedelta(days=1)  # Last full day
+        start_date = end_date - timedelta(days=history_days - 1)
+        days = [start_date + timedelta(days=i) for i in range(history_days)]
+
+        sales = ReplenishmentService._load_sales_matrix(db, product_ids, start_date, end_date)
+        campaign = ReplenishmentService._campaign_days(days, sales)
+        cleaned = ReplenishmentService._dampen_outliers(sales, campaign)
+
+        recent = cleaned[:, -days_lookback:]
+        sales_period = sales[:, -days_lookback:].sum(axis=1)
+        velocity = sales_period / days_lookback
+        ma7 = cleaned[:, -7:].mean(axis=1)
+        ma28 = cleaned[:, -28:].mean(axis=1)
+        level = recent.mean(axis=1)
+        sigma = recent.std(axis=1)
+
+        # Least-squares slope over the lookback window
+        t = np.arange(days_lookback, dtype=np.float64)
+        t_centered = t - t.mean()
+        trend = (recent - level[:, None]) @ t_centered / (t_centered @ t_centered)
+        # Do not let a short-term trend more than double or zero the level
+        trend = np.clip(trend, -level / days_lookback, level / days_lookback)
+
+        seasonal = ReplenishmentService._weekday_index(cleaned, days)
+
+        # Forecast: level projected from the window centre + trend, times weekday index
+        h = np.arange(1, forecast_days + 1, dtype=np.float64)
+        distance = (days_lookback - 1) / 2.0 + h
+        base = np.maximum(level[:, None] + trend[:, None] * distance[None, :], 0.0)
+        future_weekdays = np.array([(today + timedelta(days=int(i))).weekday() for i in h])
+        daily = base * seasonal[:, future_weekdays]
+
+        return {
+            "velocity": velocity,
+            "sales_period": sales_period,
+            "ma7": ma7,
+            "ma28": ma28,
+            "trend": trend,
+            "sigma": sigma,
+            "daily": daily,
+        }
+
     @staticmethod
     def get_sales_velocity(db: Session, product_id: UUID, days: int = 30) -> float:
         """
         Calculate Average Daily Sales (ADS) over the last X days.
         """
+        return ReplenishmentService.get_sales_velocities(db, [product_id], days).get(product_id, 0.0)
+
+    @staticmethod
+    def get_sales_velocities(db: Session, product_ids: List[UUID], days: int = 30) -> Dict[UUID, float]:
+        """
+        Average Daily Sales for many products in one query.
+        """
         end_date = datetime.now()
         start_date = end_date - timedelta(days=days)
-        
-        # Query total quantity sold in period
+
         # Exclude Cancelled/Returned
-        total_sold = db.query(func.sum(OrderItem.quantity)).join(OrderHeader).filter(
-            OrderItem.product_id == product_id,
+        rows = db.query(
+            OrderItem.product_id,
+            func.sum(OrderItem.quantity).label("total_sold")
+        ).join(OrderHeader).filter(
+            OrderItem.product_id.in_(product_ids),
             OrderHeader.order_datetime >= start_date,
             OrderHeader.status_normalized.notin_(["CANCELLED", "RETURNED"])
-        ).scalar() or 0
-        
-        # Velocity = Total Sold / Days
-        return float(total_sold) / days
+        ).group_by(OrderItem.product_id).all()
+
+        velocities = {pid: 0.0 for pid in product_ids}
+        for r in rows:
+            velocities[r.product_id] = float(r.total_sold or 0) / days
+        return velocities
 
     @staticmethod
-    def get_replenishment_plan(db: Session, days_lookback: int = 30) -> List[Dict]:
+    def get_replenishment_plan(
+        db: Session,
+        days_lookback: int = 30,
+        history_days: int = 365,
+        service_level: float = 0.95,
+    ) -> List[Dict]:
         """
         Generate a replenishment plan for all active products.
         Returns detailed stats for each product.
         """
-        # 1. Get all active products
-        products = db.query(Product).filter(Product.is_active == True).all()
-        
+        # 1. Get all active products (only the columns we need)
+        products = db.query(
+            Product.id, Product.sku, Product.name, Product.image_url,
+            Product.reorder_point, Product.target_days_to_keep, Product.lead_time_days
+        ).filter(Product.is_active == True).all()
+
+        if not products:
+            return []
+
+        product_ids = [p.id for p in products]
+
+        # 2. Stock balances (summarized by product)
+        stock_map = {
+            pid: qty or 0 for pid, qty in db.query(
+                StockBalance.product_id,
+                func.sum(StockBalance.quantity).label('total_qty')
+            ).group_by(StockBalance.product_id).all()
+        }
+
+        current_stock = np.array([stock_map.get(pid, 0) for pid in product_ids], dtype=np.float64)
+        lead_time = np.array([p.lead_time_days or 7 for p in products], dtype=np.int64)
+        target_days = np.array([p.target_days_to_keep or 30 for p in products], dtype=np.int64)
+        reorder_point = np.array([p.reorder_point or 0 for p in products], dtype=np.float64)
+
+        # 3. Forecast everything at once
+        forecast_days = int(max(lead_time.max() + max(FORECAST_HORIZONS), target_days.max(), 120))
+        fc = ReplenishmentService.forecast_demand(
+            db, product_ids,
+            days_lookback=days_lookback,
+            history_days=history_days,
+            forecast_days=forecast_days,
+        )
+        daily = fc["daily"]
+        cumulative = np.cumsum(daily, axis=1)
+
+        def demand_within(n_days: np.ndarray) -> np.ndarray:
+            """Forecast demand over the next n days (per product)"""
+            n = np.clip(n_days, 0, forecast_days)
+            result = np.zeros(len(n))
+            has = n > 0
+            result[has] = cumulative[has, n[has] - 1]
+            return result
+
+        # 4. Lead time & safety stock
+        z = service_level_z(service_level)
+        safety_stock = z * fc["sigma"] * np.sqrt(lead_time)
+        lead_time_demand = demand_within(lead_time)
+        computed_rop = lead_time_demand + safety_stock
+
+        # 5. Days remaining = first day cumulative forecast exceeds stock
+        runs_out = cumulative > current_stock[:, None]
+        days_remaining = np.where(runs_out.any(axis=1), runs_out.argmax(axis=1), 999)
+        days_remaining = np.where(current_stock <= 0, 0, days_remaining)
+
+        # 6. Suggested order: cover lead time + target days, plus safety stock
+        target_stock = demand_within(lead_time + target_days) + safety_stock
+        suggested = np.maximum(np.ceil(target_stock - current_stock), 0).astype(np.int64)
+
+        horizon_suggestions = {
+            h: np.maximum(np.ceil(demand_within(lead_time + h) + safety_stock - current_stock), 0).astype(np.int64)
+            for h in FORECAST_HORIZONS
+        }
+
         plan = []
-        
-        # Optimization: Pre-fetch stock balances (summarized by product)
-        stock_map = {}
-        stock_query = db.query(
-            StockBalance.product_id, 
-            func.sum(StockBalance.quantity).label('total_qty')
-        ).group_by(StockBalance.product_id).all()
-        
-        for pid, qty in stock_query:
-            stock_map[pid] = qty or 0
-            
-        # Optimization: Pre-fetch sales data for all products in one go?
-        # For now, simplistic loop might be slow if 1000s of products.
-        # Let's use a single query for velocity to be efficient.
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=days_lookback)
-        
-        sales_query = db.query(
-            OrderItem.product_id,
-            func.sum(OrderItem.quantity).label('total_sold')
-        ).join(OrderHeader).filter(
-            OrderHeader.order_datetime >= start_date,
-            OrderHeader.status_normalized.notin_(["CANCELLED", "RETURNED"])
-        ).group_by(OrderItem.product_id).all()
-        
-        sales_map = {r.product_id: (r.total_sold or 0) for r in sales_query}
-        
-        for p in products:
-            # 1. Current Stock
-            current_stock = stock_map.get(p.id, 0)
-            
-            # 2. Sales Velocity (Avg/Day)
-            total_sold_period = sales_map.get(p.id, 0)
-            velocity = float(total_sold_period) / days_lookback
-            
-            # 3. Days Remaining
-            # If velocity is 0, days remaining is Infinite (999)
-            if velocity > 0:
-                days_remaining = int(current_stock / velocity)
-            else:
-                days_remaining = 999
-            
-            # 4. Target Stock
-            # Target Qty = Velocity * Target Days
-            target_days = p.target_days_to_keep or 30
-            target_stock = velocity * target_days
-            
-            # 5. Suggested Order
-            # Suggest = Target - Current (if < ReorderPoint logic? or just enforce Target?)
-            # Smart Logic: If Stock is projected to run out soon?
-            # Simple Logic: Fill up to Target.
-            suggested_qty = int(target_stock - current_stock)
-            
-            # Don't suggest negative
-            if suggested_qty < 0:
-                suggested_qty = 0
-                
+        for i, p in enumerate(products):
+            stock = int(current_stock[i])
+            remaining = int(days_remaining[i])
+
             # Status Flag
             status = "OK"
-            if current_stock <= (p.reorder_point or 0):
+            if stock <= reorder_point[i]:
                 status = "LOW_STOCK" # Below absolute minimum
-            elif days_remaining < (p.lead_time_days or 7):
+            elif remaining < lead_time[i]:
                 status = "CRITICAL" # Will run out before new stock arrives
-            elif suggested_qty > 0:
+            elif suggested[i] > 0:
                 status = "REORDER" # Below target
-            
+
             plan.append({
                 "product_id": str(p.id),
                 "sku": p.sku,
                 "name": p.name,
                 "image_url": p.image_url,
-                "current_stock": current_stock,
-                "velocity_per_day": round(velocity, 2),
-                "sales_30d": int(total_sold_period),
-                "days_remaining": days_remaining,
-                "target_days": target_days,
-                "suggested_qty": suggested_qty,
+                "current_stock": stock,
+                "velocity_per_day": round(float(fc["velocity"][i]), 2),
+                "sales_30d": int(fc["sales_period"][i]),
+                "ma_7d": round(float(fc["ma7"][i]), 2),
+                "ma_28d": round(float(fc["ma28"][i]), 2),
+                "trend_per_day": round(float(fc["trend"][i]), 3),
+                "forecast_per_day": round(float(daily[i, :7].mean()), 2),
+                "days_remaining": remaining,
+                "target_days": int(target_days[i]),
+                "lead_time_days": p.lead_time_days,
+                "lead_time_demand": round(float(lead_time_demand[i]), 1),
+                "safety_stock": int(np.ceil(safety_stock[i])),
+                "reorder_point_calc": int(np.ceil(computed_rop[i])),
+                "suggested_qty": int(suggested[i]),
+                "suggested_by_horizon": {str(h): int(horizon_suggestions[h][i]) for h in FORECAST_HORIZONS},
                 "status": status,
-                "lead_time_days": p.lead_time_days
             })
-            
+
         # Sort by urgency: CRITICAL -> LOW_STOCK -> REORDER -> OK
         priority_map = {"CRITICAL": 0, "LOW_STOCK": 1, "REORDER": 2, "OK": 3}
-        plan.sort(key=lambda x: priority_map[x["status"]])
-        
+        plan.sort(key=lambda x: (priority_map[x["status"]], x["days_remaining"]))
+
         return plan
@@ -2,14 +2,26 @@
 Stock Service - Business Logic for Inventory
 """
 from sqlalchemy.orm import Session
-from sqlalchemy import func, case
+from sqlalchemy import func, case, cast, or_, insert, update, values, column, Integer
+from sqlalchemy.dialects.postgresql import UUID as PGUUID
 from typing import List, Optional, Dict
 from uuid import UUID
 from datetime import datetime
 
-from app.models import StockLedger, Product, Warehouse
+from app.models import StockLedger, StockBalance, Product, Warehouse
 from app.schemas.stock import StockMovementCreate
 
+MOVEMENT_TYPES = {"IN", "OUT", "RESERVE", "RELEASE", "ADJUST"}
+
+
+class BulkMovementError(ValueError):
+    """Raised when any row of a bulk movement is invalid (nothing is written)"""
+
+    def __init__(self, errors: List[Dict]):
+        self.errors = errors
+        super().__init__(f"{len(errors)} invalid row(s), nothing was saved")
+
+
 class StockService:
     """Stock/Inventory business logic"""
     
@@ -75,7 +87,39 @@ class StockService:
                 })
         
         return results
-    
+
+    @staticmethod
+    def get_available_by_product(db: Session, product_ids: List[UUID]) -> Dict[UUID, int]:
+        """Get available qty (on hand - reserved, all warehouses) for many products in one query"""
+        if not product_ids:
+            return {}
+
+        rows = db.query(
+            StockLedger.product_id,
+            func.sum(
+                case(
+                    (StockLedger.movement_type.in_(["IN", "RELEASE"]), StockLedger.quantity),
+                    (StockLedger.movement_type.in_(["OUT", "RESERVE"]), -StockLedger.quantity),
+                    (StockLedger.movement_type == "ADJUST", StockLedger.quantity),
+                    else_=0
+                )
+            ).label("on_hand"),
+            func.sum(
+                case(
+                    (StockLedger.movement_type == "RESERVE", StockLedger.quantity),
+                    (StockLedger.movement_type == "RELEASE", -StockLedger.quantity),
+                    else_=0
+                )
+            ).label("reserved")
+        ).filter(
+            StockLedger.product_id.in_(product_ids)
+        ).group_by(StockLedger.product_id).all()
+
+        available = {pid: 0 for pid in product_ids}
+        for r in rows:
+            available[r.product_id] = int(r.on_hand or 0) - int(r.reserved or 0)
+        return available
+
     @staticmethod
     def add_stock_movement(db: Session, movement_data: StockMovementCreate, created_by: Optional[UUID] = None, created_at_override: Optional[datetime] = None) -> StockLedger:
         """Add stock movement and update balance"""
@@ -193,21 +237,25 @@ class StockService:
         end_date: Optional[datetime] = None
     ) -> List[StockLedger]:
         """Get recent stock movements with optional date filter"""
-        query = db.query(StockLedger)
+        from app.services.partition_service import PartitionService
+
+        # Archived ledger months are only read when start_date reaches into them
+        Ledger = PartitionService.source_for_range(db, StockLedger, start_date, end_date) if start_date else StockLedger
+        query = db.query(Ledger)
         
         if warehouse_id:
-            query = query.filter(StockLedger.warehouse_id == warehouse_id)
+            query = query.filter(Ledger.warehouse_id == warehouse_id)
         
         if movement_type:
-            query = query.filter(StockLedger.movement_type == movement_type)
+            query = query.filter(Ledger.movement_type == movement_type)
         
         if start_date:
-            query = query.filter(StockLedger.created_at >= start_date)
+            query = query.filter(Ledger.created_at >= start_date)
         
         if end_date:
-            query = query.filter(StockLedger.created_at <= end_date)
+            query = query.filter(Ledger.created_at <= end_date)
         
-        return query.order_by(StockLedger.created_at.desc()).limit(limit).all()
+        return query.order_by(Ledger.created_at.desc()).limit(limit).all()
 
     @staticmethod
     def _resolve_components(db: Session, product_id: UUID, quantity: int) -> List[Dict]:
@@ -424,30 +472,285 @@ class StockService:
             Location.is_active == True
         ).all()
 
+    @staticmethod
+    def _parse_uuid(value) -> Optional[UUID]:
+        """UUID from a request/CSV value, None if malformed"""
+        try:
+            return value if isinstance(value, UUID) else UUID(str(value).strip())
+        except (TypeError, ValueError, AttributeError):
+            return None
+
+    @staticmethod
+    def bulk_add_stock_movements(
+        db: Session,
+        movements: List[Dict],
+        created_by: Optional[UUID] = None,
+        reference_type: Optional[str] = None,
+        note: Optional[str] = None,
+    ) -> Dict:
+        """
+        Add many stock movements in one transaction (all-or-nothing).
+        movements: dicts with product_id or sku, warehouse_id or warehouse_code
+        (default: first active warehouse), location_id, movement_type, quantity,
+        reference_type, reference_id, note.
+        movement_type COUNT means "counted quantity" and becomes an ADJUST of the difference.
+
+        SKUs/warehouses/locations are validated in one query each, ledger rows are bulk inserted
+        and StockBalance is updated with one statement per warehouse.
+        """
+        if not movements:
+            return {"success": True, "rows": 0, "ledger_rows": 0, "products": 0, "warehouses": 0}
+
+        # 1. Resolve products and warehouses (one query each)
+        skus = {m["sku"].strip() for m in movements if m.get("sku") and not m.get("product_id")}
+        product_ids = {StockService._parse_uuid(m["product_id"]) for m in movements if m.get("product_id")}
+        product_ids.discard(None)
+        products = db.query(Product.id, Product.sku).filter(
+            or_(Product.sku.in_(skus), Product.id.in_(product_ids))
+        ).all() if (skus or product_ids) else []
+        sku_map = {p.sku: p.id for p in products}
+        known_ids = {p.id for p in products}
+
+        warehouses = db.query(Warehouse.id, Warehouse.code, Warehouse.is_active).all()
+        wh_codes = {w.code: w.id for w in warehouses}
+        wh_ids = {w.id for w in warehouses}
+        default_wh = next((w.id for w in warehouses if w.is_active), None)
+
+        from app.models.stock import Location
+        location_ids = {StockService._parse_uuid(m["location_id"]) for m in movements if m.get("location_id")}
+        location_ids.discard(None)
+        location_wh = dict(
+            db.query(Location.id, Location.warehouse_id).filter(Location.id.in_(location_ids)).all()
+        ) if location_ids else {}
+
+        errors = []
+        rows = []
+        for i, m in enumerate(movements, start=1):
+            movement_type = (m.get("movement_type") or "").strip().upper()
+            try:
+                quantity = int(m.get("quantity"))
+            except (TypeError, ValueError):
+                errors.append({"row": i, "error": f"Invalid quantity: {m.get('quantity')}"})
+                continue
+
+            if m.get("product_id"):
+                product_id = StockService._parse_uuid(m["product_id"])
+                if product_id is None:
+                    errors.append({"row": i, "error": f"Invalid product_id: {m['product_id']}"})
+                    continue
+                if product_id not in known_ids:
+                    errors.append({"row": i, "error": f"Product not found: {product_id}"})
+                    continue
+            elif m.get("sku"):
+                product_id = sku_map.get(m["sku"].strip())
+                if not product_id:
+                    errors.append({"row": i, "error": f"SKU not found: {m['sku']}"})
+                    continue
+            else:
+                errors.append({"row": i, "error": "Missing sku/product_id"})
+                continue
+
+            if m.get("warehouse_id"):
+                warehouse_id = StockService._parse_uuid(m["warehouse_id"])
+                if warehouse_id is None:
+                    errors.append({"row": i, "error": f"Invalid warehouse_id: {m['warehouse_id']}"})
+                    continue
+                if warehouse_id not in wh_ids:
+                    errors.append({"row": i, "error": f"Warehouse not found: {warehouse_id}"})
+                    continue
+            elif m.get("warehouse_code"):
+                warehouse_id = wh_codes.get(m["warehouse_code"].strip())
+                if not warehouse_id:
+                    errors.append({"row": i, "error": f"Warehouse not found: {m['warehouse_code']}"})
+                    continue
+            else:
+                warehouse_id = default_wh
+                if not warehouse_id:
+                    errors.append({"row": i, "error": "No active warehouse found"})
+                    continue
+
+            location_id = None
+            if m.get("location_id"):
+                location_id = StockService._parse_uuid(m["location_id"])
+                if location_id is None:
+                    errors.append({"row": i, "error": f"Invalid location_id: {m['location_id']}"})
+                    continue
+                if location_id not in location_wh:
+                    errors.append({"row": i, "error": f"Location not found: {location_id}"})
+                    continue
+                if location_wh[location_id] != warehouse_id:
+                    errors.append({"row": i, "error": f"Location {location_id} is not in warehouse {warehouse_id}"})
+                    continue
+
+            if movement_type not in MOVEMENT_TYPES and movement_type != "COUNT":
+                errors.append({"row": i, "error": f"Invalid movement_type: {m.get('movement_type')}"})
+                continue
+            if movement_type not in ("ADJUST", "COUNT") and quantity <= 0:
+                errors.append({"row": i, "error": "Quantity must be positive"})
+                continue
+            if movement_type == "COUNT" and quantity < 0:
+                errors.append({"row": i, "error": "Counted quantity cannot be negative"})
+                continue
+
+            rows.append({
+                "warehouse_id": warehouse_id,
+                "location_id": location_id,
+                "product_id": product_id,
+                "movement_type": movement_type,
+                "quantity": quantity,
+                "reference_type": m.get("reference_type") or reference_type or "BULK_ADJUSTMENT",
+                "reference_id": m.get("reference_id"),
+                "note": m.get("note") or note,
+            })
+
+        if errors:
+            raise BulkMovementError(errors)
+
+        try:
+            # 2. Cycle counts -> ADJUST by difference vs current on hand (one query)
+            count_rows = [r for r in rows if r["movement_type"] == "COUNT"]
+            if count_rows:
+                on_hand = {
+                    (r.warehouse_id, r.product_id): int(r.on_hand or 0)
+                    for r in db.query(
+                        StockLedger.warehouse_id,
+                        StockLedger.product_id,
+                        func.sum(
+                            case(
+                                (StockLedger.movement_type.in_(["IN", "RELEASE"]), StockLedger.quantity),
+                                (StockLedger.movement_type.in_(["OUT", "RESERVE"]), -StockLedger.quantity),
+                                (StockLedger.movement_type == "ADJUST", StockLedger.quantity),
+                                else_=0
+                            )
+                        ).label("on_hand")
+                    ).filter(
+                        StockLedger.product_id.in_({r["product_id"] for r in count_rows})
+                    ).group_by(StockLedger.warehouse_id, StockLedger.product_id).all()
+                }
+                for r in count_rows:
+                    key = (r["warehouse_id"], r["product_id"])
+                    counted = r["quantity"]
+                    r["movement_type"] = "ADJUST"
+                    r["quantity"] = counted - on_hand.get(key, 0)
+                    r["note"] = r["note"] or f"Stock count: {on_hand.get(key, 0)} -> {counted}"
+                    # Same product counted twice in one sheet: second row sees the first
+                    on_hand[key] = counted
+                rows = [r for r in rows if not (r["movement_type"] == "ADJUST" and r["quantity"] == 0)]
+
+            if not rows:
+                return {"success": True, "rows": len(movements), "ledger_rows": 0, "products": 0, "warehouses": 0}
+
+            # 3. Bulk insert ledger
+            db.execute(insert(StockLedger), [
+                {
+                    "warehouse_id": r["warehouse_id"],
+                    "product_id": r["product_id"],
+                    "movement_type": r["movement_type"],
+                    "quantity": r["quantity"],
+                    "reference_type": r["reference_type"],
+                    "reference_id": r["reference_id"],
+                    "note": r["note"],
+                    "created_by": created_by,
+                }
+                for r in rows
+            ])
+
+            # 4. Aggregate balance deltas per (warehouse, location, product)
+            deltas: Dict[tuple, List[int]] = {}
+            for r in rows:
+                qty_delta, reserved_delta = 0, 0
+                if r["movement_type"] in ("IN", "RELEASE", "ADJUST"):
+                    qty_delta = r["quantity"]
+                elif r["movement_type"] in ("OUT", "RESERVE"):
+                    qty_delta = -r["quantity"]
+                if r["movement_type"] == "RESERVE":
+                    reserved_delta = r["quantity"]
+                elif r["movement_type"] == "RELEASE":
+                    reserved_delta = -r["quantity"]
+                d = deltas.setdefault((r["warehouse_id"], r["location_id"], r["product_id"]), [0, 0])
+                d[0] += qty_delta
+                d[1] += reserved_delta
+
+            by_warehouse: Dict[UUID, List[tuple]] = {}
+            for (wh, loc, pid), (dq, dr) in deltas.items():
+                by_warehouse.setdefault(wh, []).append((pid, loc, dq, dr))
+
+            for wh, entries in by_warehouse.items():
+                # Create missing balance rows
+                existing = {
+                    (b.product_id, b.location_id)
+                    for b in db.query(StockBalance.product_id, StockBalance.location_id).filter(
+                        StockBalance.warehouse_id == wh,
+                        StockBalance.product_id.in_({e[0] for e in entries})
+                    ).all()
+                }
+                missing = [e for e in entries if (e[0], e[1]) not in existing]
+                if missing:
+                    db.execute(insert(StockBalance), [
+                        {"warehouse_id": wh, "product_id": pid, "location_id": loc, "quantity": 0, "reserved_quantity": 0}
+                        for pid, loc, _, _ in missing
+                    ])
+
+                # One UPDATE ... FROM (VALUES ...) per warehouse
+                v = values(
+                    column("product_id", PGUUID(as_uuid=True)),
+                    column("location_id", PGUUID(as_uuid=True)),
+                    column("dq", Integer),
+                    column("dr", Integer),
+                    name="v",
+                ).data(entries)
+                db.execute(
+                    update(StockBalance)
+                    .where(
+                        StockBalance.warehouse_id == wh,
+                        StockBalance.product_id == v.c.product_id,
+                        StockBalance.location_id.is_not_distinct_from(cast(v.c.location_id, PGUUID(as_uuid=True))),
+                    )
+                    .values(
+                        quantity=StockBalance.quantity + v.c.dq,
+                        reserved_quantity=StockBalance.reserved_quantity + v.c.dr,
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+
+            # Bulk inserts bypass the flush hook, mark products for marketplace push here
+            from app.services.stock_sync_service import StockSyncService
+            StockSyncService.mark_dirty(db, [r["product_id"] for r in rows])
+            from app.services.cache_invalidation import add_tags
+            add_tags(db, ["stock"])
+
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+        return {
+            "success": True,
+            "rows": len(movements),
+            "ledger_rows": len(rows),
+            "products": len({r["product_id"] for r in rows}),
+            "warehouses": len(by_warehouse),
+        }
+
     @staticmethod
     def transfer_stock(db: Session, from_wh: UUID, to_wh: UUID, product_id: UUID, qty: int, user_id: UUID = None):
         """Transfer stock between warehouses"""
-        from app.schemas.stock import StockMovementCreate
-        
-        # OUT from source
-        out_move = StockMovementCreate(
-            warehouse_id=from_wh,
-            product_id=product_id,
-            movement_type="OUT",
-            quantity=qty,
-            reference_type="TRANSFER",
-            note=f"Transfer to {to_wh}"
-        )
-        StockService.add_stock_movement(db, out_move, user_id)
-        
-        # IN to destination
-        in_move = StockMovementCreate(
-            warehouse_id=to_wh,
-            product_id=product_id,
-            movement_type="IN",
-            quantity=qty,
-            reference_type="TRANSFER",
-            note=f"Transfer from {from_wh}"
-        )
-        StockService.add_stock_movement(db, in_move, user_id)
+        StockService.transfer_stock_bulk(db, from_wh, to_wh, [{"product_id": product_id, "quantity": qty}], user_id)
         return True
+
+    @staticmethod
+    def transfer_stock_bulk(db: Session, from_wh: UUID, to_wh: UUID, items: List[Dict], user_id: UUID = None, note: Optional[str] = None) -> Dict:
+        """
+        Transfer many products between warehouses in one transaction.
+        items: dicts with product_id or sku, quantity
+        """
+        if from_wh == to_wh:
+            raise ValueError("Source and destination warehouse must differ")
+
+        movements = []
+        for item in items:
+            base = {"product_id": item.get("product_id"), "sku": item.get("sku"), "quantity": item.get("quantity")}
+            movements.append({**base, "warehouse_id": from_wh, "movement_type": "OUT", "note": note or f"Transfer to {to_wh}"})
+            movements.append({**base, "warehouse_id": to_wh, "movement_type": "IN", "note": note or f"Transfer from {from_wh}"})
+
+        return StockService.bulk_add_stock_movements(db, movements, created_by=user_id, reference_type="TRANSFER")
@@ -0,0 +1,489 @@
+"""
+Stock Sync Service - Debounced, batched stock push to marketplaces
+
+Every StockLedger insert marks its product dirty (same transaction, via a
+Session after_flush hook). A background worker picks up products that have
+been quiet for STOCK_SYNC_DEBOUNCE_SECONDS (or dirty for longer than
+STOCK_SYNC_MAX_WAIT_SECONDS), recomputes the sellable quantity of every
+PlatformListing that uses them and pushes one batched update per platform/shop.
+
+Listings without the identifiers their platform needs (STOCK_PUSH_REQUIRED_IDS)
+are skipped rather than failed; products whose push failed wait
+STOCK_SYNC_RETRY_SECONDS before they are picked again.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set
+from uuid import UUID
+
+from sqlalchemy import event, func, or_, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session, selectinload
+
+from app.core import settings
+from app.core.database import SessionLocal
+from app.models import StockLedger, PlatformListing, PlatformListingItem, ProductSetBom, StockSyncState
+from app.models.integration import PlatformConfig
+from app.services import integration_service
+from app.services.stock_service import StockService
+
+logger = logging.getLogger(__name__)
+
+# PlatformListing fields a platform needs to address a listing for stock push
+STOCK_PUSH_REQUIRED_IDS = {
+    "shopee": ("platform_item_id",),
+    "tiktok": ("platform_item_id", "platform_model_id"),
+}
+# How far back order payloads are searched for listing identifiers
+LISTING_ID_BACKFILL_DAYS = 180
+
+# Latest item_id/model_id (product_id/sku_id) seen per platform SKU in synced orders
+_LISTING_ID_BACKFILL_SQL = {
+    "shopee": """
+        SELECT DISTINCT ON (sku) sku, item_id, model_id
+        FROM (
+            SELECT COALESCE(NULLIF(it->>'model_sku', ''), it->>'item_sku') AS sku,
+                   it->>'item_id' AS item_id,
+                   NULLIF(NULLIF(it->>'model_id', ''), '0') AS model_id,
+                   oh.order_datetime
+            FROM order_header oh
+            CROSS JOIN LATERAL jsonb_array_elements(
+                CASE WHEN jsonb_typeof(oh.raw_payload->'item_list') = 'array'
+                     THEN oh.raw_payload->'item_list' ELSE '[]'::jsonb END
+            ) it
+            WHERE oh.channel_code = 'shopee' AND oh.order_datetime >= :since
+        ) x
+        WHERE sku <> '' AND item_id IS NOT NULL
+        ORDER BY sku, order_datetime DESC NULLS LAST
+    """,
+    "tiktok": """
+        SELECT DISTINCT ON (sku) sku, item_id, model_id
+        FROM (
+            SELECT it->>'seller_sku' AS sku,
+                   it->>'product_id' AS item_id,
+                   it->>'sku_id' AS model_id,
+                   oh.order_datetime
+            FROM order_header oh
+            CROSS JOIN LATERAL jsonb_array_elements(
+                CASE WHEN jsonb_typeof(oh.raw_payload->'line_items') = 'array'
+                     THEN oh.raw_payload->'line_items' ELSE '[]'::jsonb END
+            ) it
+            WHERE oh.channel_code = 'tiktok' AND oh.order_datetime >= :since
+        ) x
+        WHERE sku <> '' AND item_id IS NOT NULL AND model_id IS NOT NULL
+        ORDER BY sku, order_datetime DESC NULLS LAST
+    """,
+}
+
+
+class StockSyncService:
+    """Dirty SKU tracking and marketplace stock push"""
+
+    @staticmethod
+    def _mark_dirty_stmt(product_ids: List[UUID]):
+        now = datetime.now(timezone.utc)
+        stmt = insert(StockSyncState).values([
+            {"product_id": pid, "dirty_since": now, "last_marked_at": now, "push_count": 0}
+            for pid in product_ids
+        ])
+        return stmt.on_conflict_do_update(
+            index_elements=[StockSyncState.product_id],
+            set_={
+                # Keep the first change time so lag covers the whole debounce window
+                "dirty_since": func.coalesce(StockSyncState.dirty_since, stmt.excluded.dirty_since),
+                "last_marked_at": stmt.excluded.last_marked_at,
+            },
+        )
+
+    @staticmethod
+    def mark_dirty(db: Session, product_ids: List[UUID]):
+        """Mark products as needing a stock push (does not commit)"""
+        product_ids = list({pid for pid in product_ids if pid})
+        if not product_ids:
+            return
+        db.execute(StockSyncService._mark_dirty_stmt(product_ids))
+
+    @staticmethod
+    def get_due_product_ids(db: Session, force: bool = False, limit: int = 500) -> List[UUID]:
+        """Products whose debounce window has elapsed"""
+        query = db.query(StockSyncState.product_id).filter(StockSyncState.dirty_since.isnot(None))
+
+        if not force:
+            now = datetime.now(timezone.utc)
+            query = query.filter(or_(
+                StockSyncState.last_marked_at <= now - timedelta(seconds=settings.STOCK_SYNC_DEBOUNCE_SECONDS),
+                StockSyncState.dirty_since <= now - timedelta(seconds=settings.STOCK_SYNC_MAX_WAIT_SECONDS),
+            ), or_(
+                # Failed pushes back off instead of blocking the head of the queue
+                StockSyncState.last_failed_at.is_(None),
+                StockSyncState.last_failed_at <= now - timedelta(seconds=settings.STOCK_SYNC_RETRY_SECONDS),
+            ))
+
+        return [r.product_id for r in query.order_by(StockSyncState.dirty_since).limit(limit).all()]
+
+    @staticmethod
+    def backfill_listing_ids(db: Session) -> Dict[str, int]:
+        """
+        Fill missing platform_item_id/platform_model_id of listings from the
+        item payloads of recently synced orders. Returns listings updated per platform.
+        """
+        since = datetime.now(timezone.utc) - timedelta(days=LISTING_ID_BACKFILL_DAYS)
+        updated = {}
+        for platform, source_sql in _LISTING_ID_BACKFILL_SQL.items():
+            result = db.execute(text(f"""
+                UPDATE platform_listing pl
+                SET platform_item_id = COALESCE(pl.platform_item_id, src.item_id),
+                    platform_model_id = COALESCE(pl.platform_model_id, src.model_id)
+                FROM ({source_sql}) src
+                WHERE pl.platform = :platform
+                  AND pl.platform_sku = src.sku
+                  AND (pl.platform_item_id IS NULL OR pl.platform_model_id IS NULL)
+            """), {"since": since, "platform": platform})
+            updated[platform] = result.rowcount
+        db.commit()
+        return updated
+
+    @staticmethod
+    def _is_addressable(listing: Dict) -> bool:
+        return all(listing.get(field) for field in STOCK_PUSH_REQUIRED_IDS.get(listing["platform"], ()))
+
+    @staticmethod
+    def _load_bom(db: Session):
+        """Return (children, parents) maps of the whole set BOM"""
+        children: Dict[UUID, List[tuple]] = defaultdict(list)
+        parents: Dict[UUID, Set[UUID]] = defaultdict(set)
+        for bom in db.query(ProductSetBom).all():
+            children[bom.set_product_id].append((bom.component_product_id, bom.quantity))
+            parents[bom.component_product_id].add(bom.set_product_id)
+        return children, parents
+
+    @staticmethod
+    def calculate_listing_quantities(db: Session, product_ids: List[UUID]) -> List[Dict]:
+        """
+        Sellable quantity of every listing that uses the given products
+        (directly or as a set component).
+        Listing qty = min over items of (units of product // item qty),
+        set units = min over components of (available // component qty).
+        """
+        children, parents = StockSyncService._load_bom(db)
+
+        # Products affected = dirty products + every set that contains them
+        affected: Set[UUID] = set()
+        stack = list(product_ids)
+        while stack:
+            pid = stack.pop()
+            if pid in affected:
+                continue
+            affected.add(pid)
+            stack.extend(parents.get(pid, ()))
+
+        listing_ids = db.query(PlatformListingItem.listing_id).filter(
+            PlatformListingItem.product_id.in_(affected)
+        ).distinct()
+        listings = db.query(PlatformListing).options(
+            selectinload(PlatformListing.items)
+        ).filter(PlatformListing.id.in_(listing_ids)).all()
+
+        if not listings:
+            return []
+
+        # Resolve atomic components and fetch availability in one query
+        def atomic_of(pid, seen=()):
+            if pid in seen or pid not in children:
+                return {pid}
+            result = set()
+            for component_id, _ in children[pid]:
+                result |= atomic_of(component_id, seen + (pid,))
+            return result
+
+        atomic: Set[UUID] = set()
+        for listing in listings:
+            for item in listing.items:
+                atomic |= atomic_of(item.product_id)
+        available = StockService.get_available_by_product(db, list(atomic))
+
+        units_cache: Dict[UUID, int] = {}
+
+        def units_of(pid, seen=()):
+            if pid in units_cache:
+                return units_cache[pid]
+            if pid in seen or pid not in children:
+                units = available.get(pid, 0)
+            else:
+                units = min(
+                    units_of(component_id, seen + (pid,)) // max(qty, 1)
+                    for component_id, qty in children[pid]
+                )
+            units_cache[pid] = max(units, 0)
+            return units_cache[pid]
+
+        results = []
+        for listing in listings:
+            if not listing.items:
+                continue
+            qty = min(units_of(item.product_id) // max(item.quantity, 1) for item in listing.items)
+            results.append({
+                "platform": listing.platform,
+                "shop_id": listing.shop_id,
+                "sku": listing.platform_sku,
+                "platform_item_id": listing.platform_item_id,
+                "platform_model_id": listing.platform_model_id,
+                "quantity": max(qty, 0),
+                "product_ids": {item.product_id for item in listing.items},
+            })
+        return results
+
+    @staticmethod
+    async def push_pending(db: Session, force: bool = False) -> Dict:
+        """
+        Push stock for all due dirty products.
+        Products whose push failed stay dirty and are retried after
+        STOCK_SYNC_RETRY_SECONDS. Listings the platform cannot address
+        (missing item/model ids) are skipped.
+        """
+        cycle_start = datetime.now(timezone.utc)
+        dirty_ids = StockSyncService.get_due_product_ids(db, force=force)
+        if not dirty_ids:
+            return {"products": 0, "pushed": 0, "failed": 0, "skipped": 0}
+
+        listings = StockSyncService.calculate_listing_quantities(db, dirty_ids)
+        unaddressable = [l["sku"] for l in listings if not StockSyncService._is_addressable(l)]
+        if unaddressable:
+            logger.warning(
+                f"[STOCK PUSH] skipped {len(unaddressable)} listings without platform ids "
+                f"(e.g. {', '.join(map(str, unaddressable[:5]))})"
+            )
+            listings = [l for l in listings if StockSyncService._is_addressable(l)]
+
+        # Which dirty products does each listing depend on
+        children, _ = StockSyncService._load_bom(db)
+
+        def expand(pid, seen=()):
+            if pid in seen:
+                return set()
+            result = {pid}
+            for component_id, _ in children.get(pid, ()):
+                result |= expand(component_id, seen + (pid,))
+            return result
+
+        dirty_set = set(dirty_ids)
+        for listing in listings:
+            deps = set()
+            for pid in listing["product_ids"]:
+                deps |= expand(pid)
+            listing["dirty_ids"] = deps & dirty_set
+
+        # Group per platform -> active shops
+        by_platform: Dict[str, List[Dict]] = defaultdict(list)
+        for listing in listings:
+            by_platform[listing["platform"]].append(listing)
+
+        configs = db.query(PlatformConfig).filter(
+            PlatformConfig.platform.in_(list(by_platform.keys())),
+            PlatformConfig.is_active == True,
+        ).all()
+
+        async def push_shop(config: PlatformConfig, shop_listings: List[Dict]):
+            items = [
+                {k: l[k] for k in ("sku", "quantity", "platform_item_id", "platform_model_id")}
+                for l in shop_listings
+            ]
+            try:
+                client = integration_service.get_client_for_config(config)
+                return await client.update_stock_batch(items)
+            except NotImplementedError:
+                return {"success": [], "failed": [{"sku": i["sku"], "error": "Not supported"} for i in items]}
+            except Exception as e:
+                logger.error(f"Stock push failed for {config.platform}/{config.shop_id}: {e}")
+                return {"success": [], "failed": [{"sku": i["sku"], "error": str(e)} for i in items]}
+
+        tasks = []
+        task_listings = []
+        for config in configs:
+            shop_listings = [
+                l for l in by_platform[config.platform]
+                if not l["shop_id"] or l["shop_id"] == config.shop_id
+            ]
+            if shop_listings:
+                tasks.append(push_shop(config, shop_listings))
+                task_listings.append(shop_listings)
+
+        # Shops are independent; each client throttles itself
+        results = await asyncio.gather(*tasks) if tasks else []
+
+        pushed = 0
+        failed_products: Dict[UUID, str] = {}
+        for shop_listings, result in zip(task_listings, results):
+            pushed += len(result.get("success", []))
+            errors = {f.get("sku"): f.get("error") for f in result.get("failed", [])}
+            for listing in shop_listings:
+                if listing["sku"] in errors:
+                    for pid in listing["dirty_ids"]:
+                        failed_products[pid] = str(errors[listing["sku"]])[:500]
+
+        # Clear pushed products (unless they changed again during the push)
+        ok_ids = [pid for pid in dirty_ids if pid not in failed_products]
+        now = datetime.now(timezone.utc)
+        if ok_ids:
+            db.query(StockSyncState).filter(
+                StockSyncState.product_id.in_(ok_ids),
+                StockSyncState.last_marked_at <= cycle_start,
+            ).update({
+                StockSyncState.last_push_lag_ms: func.floor(
+                    func.extract("epoch", now - StockSyncState.dirty_since) * 1000
+                ),
+                StockSyncState.dirty_since: None,
+                StockSyncState.last_pushed_at: now,
+                StockSyncState.last_error: None,
+                StockSyncState.last_failed_at: None,
+                StockSyncState.push_count: StockSyncState.push_count + 1,
+            }, synchronize_session=False)
+
+        for pid, error in failed_products.items():
+            db.query(StockSyncState).filter(StockSyncState.product_id == pid).update(
+                {StockSyncState.last_error: error, StockSyncState.last_failed_at: now}, synchronize_session=False
+            )
+
+        db.commit()
+
+        logger.info(
+            f"[STOCK PUSH] products={len(dirty_ids)} listings={len(listings)} "
+            f"pushed={pushed} failed_products={len(failed_products)} skipped={len(unaddressable)}"
+        )
+        return {
+            "products": len(dirty_ids),
+            "pushed": pushed,
+            "failed": len(failed_products),
+            "skipped": len(unaddressable),
+        }
+
+    @staticmethod
+    def get_sync_status(db: Session) -> Dict:
+        """Pending dirty products and push lag over the last hour"""
+        pending = db.query(func.count(StockSyncState.product_id)).filter(
+            StockSyncState.dirty_since.isnot(None)
+        ).scalar() or 0
+        oldest = db.query(func.min(StockSyncState.dirty_since)).scalar()
+        failing = db.query(func.count(StockSyncState.product_id)).filter(
+            StockSyncState.dirty_since.isnot(None),
+            StockSyncState.last_error.isnot(None),
+        ).scalar() or 0
+
+        since = datetime.now(timezone.utc) - timedelta(hours=1)
+        lag = db.query(
+            func.count(StockSyncState.product_id),
+            func.avg(StockSyncState.last_push_lag_ms),
+            func.max(StockSyncState.last_push_lag_ms),
+        ).filter(StockSyncState.last_pushed_at >= since).first()
+
+        return {
+            "pending": pending,
+            "failing": failing,
+            "oldest_dirty_since": oldest.isoformat() if oldest else None,
+            "pushed_last_hour": lag[0] or 0,
+            "avg_lag_ms": int(lag[1]) if lag[1] is not None else None,
+            "max_lag_ms": int(lag[2]) if lag[2] is not None else None,
+        }
+
+
+# ========== Ledger hook ==========
+
+@event.listens_for(Session, "after_flush")
+def _mark_ledger_products_dirty(session: Session, flush_context):
+    """Mark products of newly flushed StockLedger rows dirty in the same transaction"""
+    product_ids = [obj.product_id for obj in session.new if isinstance(obj, StockLedger)]
+    if product_ids:
+        session.connection().execute(StockSyncService._mark_dirty_stmt(list(set(product_ids))))
+
+
+# ========== Worker ==========
+
+class StockSyncWorker:
+    """Background worker pushing debounced stock changes"""
+
+    def __init__(self, poll_interval: int = 5):
+        self.poll_interval = poll_interval
+        self.is_running = False
+        self.last_run: Optional[datetime] = None
+        self.last_result: Dict = {}
+        self.total_pushed: int = 0
+        self._task = None
+
+    async def start(self):
+        """Start the background worker"""
+        if self.is_running:
+            logger.warning("Stock sync worker already running")
+            return
+
+        self.is_running = True
+        self._task = asyncio.create_task(self._run_loop())
+        logger.info(f"[OK] Stock sync worker started (polling every {self.poll_interval}s)")
+
+    async def stop(self):
+        """Stop the background worker"""
+        self.is_running = False
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        logger.info("Stock sync worker stopped")
+
+    async def _run_loop(self):
+        """Main loop"""
+        while self.is_running:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Stock sync worker error: {e}")
+
+            await asyncio.sleep(self.poll_interval)
+
+    async def run_once(self, force: bool = False) -> Dict:
+        """Run one push cycle"""
+        db: Session = SessionLocal()
+        try:
+            result = await StockSyncService.push_pending(db, force=force)
+            self.last_result = result
+            self.total_pushed += result.get("pushed", 0)
+            self.last_run = datetime.utcnow()
+            return result
+        finally:
+            db.close()
+
+    def get_status(self) -> Dict:
+        """Get worker status"""
+        return {
+            "is_running": self.is_running,
+            "poll_interval": self.poll_interval,
+            "debounce_seconds": settings.STOCK_SYNC_DEBOUNCE_SECONDS,
+            "max_wait_seconds": settings.STOCK_SYNC_MAX_WAIT_SECONDS,
+            "last_run": self.last_run.isoformat() if self.last_run else None,
+            "last_result": self.last_result,
+            "total_pushed": self.total_pushed,
+        }
+
+
+# Singleton instance
+_worker: StockSyncWorker = None
+
+
+def get_worker() -> StockSyncWorker:
+    """Get or create the stock sync worker instance"""
+    global _worker
+    if _worker is None:
+        _worker = StockSyncWorker(poll_interval=5)
+    return _worker
+
+
+async def start_stock_sync_worker():
+    """Start the stock sync worker"""
+    await get_worker().start()
+
+
+async def stop_stock_sync_worker():
+    """Stop the stock sync worker"""
+    await get_worker().stop()
@@ -56,6 +56,20 @@ class OrderSyncService:
         except (ValueError, TypeError):
             return 0
     
+    def _shipping_fields(self, normalized: NormalizedOrder) -> Tuple[Optional[str], Optional[str]]:
+        """Tracking number and courier, falling back to the first package in raw_payload"""
+        tracking = normalized.tracking_number
+        courier = normalized.courier
+        if not (tracking and courier) and isinstance(normalized.raw_payload, dict):
+            packages = normalized.raw_payload.get("packages")
+            package = packages[0] if isinstance(packages, list) and packages and isinstance(packages[0], dict) else {}
+            tracking = tracking or package.get("tracking_number") or None
+            courier = courier or package.get("shipping_provider_name") or None
+        # Column sizes of order_header.tracking_number / courier_code
+        tracking = str(tracking)[:100] if tracking else None
+        courier = str(courier)[:50] if courier else None
+        return tracking, courier
+    
     async def sync_platform_orders(
         self,
         config: PlatformConfig,
@@ -324,6 +338,8 @@ class OrderSyncService:
         ]
         full_address = " ".join([p for p in address_parts if p])
 
+        tracking_number, courier = self._shipping_fields(normalized)
+        
         order = OrderHeader(
             company_id=company_id,
             channel_code=normalized.platform,
@@ -348,8 +364,8 @@ class OrderSyncService:
             
             shipping_method=normalized.shipping_method,
             # Field name mapping
-            tracking_number=normalized.tracking_number,
-            courier_code=normalized.courier,
+            tracking_number=tracking_number,
+            courier_code=courier,
             
             # shipped_at: ONLY set if platform provides actual pickup/collection time
             # Do NOT use fallback (order_updated_at) as it's inaccurate for Daily Outbound
@@ -452,11 +468,12 @@ class OrderSyncService:
                     logger.error(f"Failed to deduct stock for {existing.external_order_id}: {e}")
 
         # 2. Update tracking info if missing or changed
-        if normalized.tracking_number and existing.tracking_number != normalized.tracking_number:
-            existing.tracking_number = normalized.tracking_number
+        tracking_number, courier = self._shipping_fields(normalized)
+        if tracking_number and existing.tracking_number != tracking_number:
+            existing.tracking_number = tracking_number
             updated = True
-        if normalized.courier and existing.courier_code != normalized.courier:
-            existing.courier_code = normalized.courier
+        if courier and existing.courier_code != courier:
+            existing.courier_code = courier
             updated = True
         
         # 3. Update raw payload (always update to get latest data)
@@ -583,15 +600,8 @@ class OrderSyncService:
         if not invoice_data:
             return
         
-        # Check if InvoiceProfile already exists for this order
-        existing = self.db.query(InvoiceProfile).filter(
-            InvoiceProfile.order_id == order.id
-        ).first()
-        
-        if existing:
-            logger.debug(f"InvoiceProfile already exists for order {order.external_order_id}")
-            return
-        
+        # Only called for orders created in this transaction: no profile can exist yet,
+        # so no existence query (buyer-invoice requests are synced by InvoiceSyncService)
         try:
             # Extract fields from invoice_data
             # Shopee format: {number, series_number, info: {name, address, tax_code, ...}}
@@ -668,6 +678,59 @@ class OrderSyncService:
         # Process order (Blocking)
         return await run_in_threadpool(self._process_order, normalized, company.id)
 
+    async def sync_order_ids(self, config: PlatformConfig, order_ids: List[str]) -> Dict[str, int]:
+        """
+        Fetch and write specific orders of one shop (reconciliation resync).
+        Details are fetched in batches of 50 where the client supports it.
+        Returns: {fetched, created, updated, skipped, errors}
+        """
+        stats = {"fetched": 0, "created": 0, "updated": 0, "skipped": 0, "errors": 0}
+        if not order_ids:
+            return stats
+
+        company = await run_in_threadpool(lambda: self.db.query(Company).first())
+        if not company:
+            raise Exception("No company found")
+
+        client = integration_service.get_client_for_config(config)
+        limiter = client.get_rate_limiter()
+        chunk_size = 50
+        for i in range(0, len(order_ids), chunk_size):
+            chunk = order_ids[i:i + chunk_size]
+            raw_orders = []
+            try:
+                if hasattr(client, "get_order_details_batch"):
+                    await limiter.acquire()
+                    raw_orders = await client.get_order_details_batch(chunk)
+                else:
+                    for order_id in chunk:
+                        await limiter.acquire()
+                        detail = await client.get_order_detail(order_id)
+                        if detail:
+                            raw_orders.append(detail)
+            except Exception as e:
+                logger.error(f"Resync fetch failed for {config.platform}/{config.shop_name}: {e}")
+                stats["errors"] += len(chunk)
+                continue
+
+            for raw_order in raw_orders:
+                stats["fetched"] += 1
+                try:
+                    normalized = client.normalize_order(raw_order)
+                    created, updated = await run_in_threadpool(self._process_order, normalized, company.id)
+                    if created:
+                        stats["created"] += 1
+                    elif updated:
+                        stats["updated"] += 1
+                    else:
+                        stats["skipped"] += 1
+                except Exception as e:
+                    logger.error(f"Error processing resynced order: {e}")
+                    await run_in_threadpool(self.db.rollback)
+                    stats["errors"] += 1
+
+        return stats
+
     async def sync_returns(self, config: PlatformConfig, time_from: datetime, time_to: datetime) -> Dict[str, int]:
         """
         Sync returns/reverse orders (Specific for TikTok)
@@ -0,0 +1,207 @@
+"""
+TikTok Analytics Service - GMV breakdown and creative analytics
+
+The GMV breakdown is aggregated from statement transactions already stored
+in marketplace_transaction by the finance sync. Only statements that are
+not stored yet (or unsettled ones older than UNSETTLED_STATEMENT_REFRESH)
+are fetched, concurrently and with full pagination, and stored on the way;
+settled statements never change, so once stored they are never fetched
+again. The statement list itself is cached for STATEMENT_LIST_TTL.
+
+Affiliate orders and creator stats are not ingested, so the SKU creative
+count and creator performance are cached per shop for
+CREATIVE_CACHE_TTL and kept warm by a maintenance job.
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.integrations.tiktok import add_gmv_transaction, empty_gmv_breakdown
+from app.models.finance import MarketplaceTransaction
+from app.models.integration import PlatformConfig
+from app.services import integration_service
+
+logger = logging.getLogger(__name__)
+
+STATEMENT_LIST_TTL = timedelta(minutes=5)
+UNSETTLED_STATEMENT_REFRESH = timedelta(hours=1)
+CREATIVE_CACHE_TTL = timedelta(minutes=30)
+# Statement payment_status values after which a statement no longer changes
+SETTLED_STATEMENT_STATUSES = ("PAID",)
+# Statement lists are fetched for this window and filtered per request
+STATEMENT_LIST_DAYS = 90
+
+# Same classification as gmv_content_type()
+_GMV_SQL = """
+    SELECT CASE
+               WHEN upper(COALESCE(mt.raw_data->>'sale_type', '')) LIKE '%VIDEO%' THEN 'video'
+               WHEN upper(COALESCE(mt.raw_data->>'sale_type', '')) LIKE '%LIVE%' THEN 'live'
+               WHEN upper(COALESCE(mt.raw_data->>'sale_type', '')) LIKE '%SHOWCASE%'
+                    OR COALESCE(mt.affiliate_commission_amount, 0) > 0 THEN 'showcase'
+               ELSE 'direct'
+           END AS content_type,
+           COUNT(*) AS order_count,
+           SUM(CASE WHEN mt.raw_data->>'order_amount' ~ '^-?[0-9]+(\\.[0-9]+)?$'
+                    THEN (mt.raw_data->>'order_amount')::numeric ELSE 0 END) AS order_amount,
+           COALESCE(SUM(mt.affiliate_commission_amount), 0) AS affiliate_commission
+    FROM marketplace_transaction mt
+    WHERE mt.platform = 'tiktok'
+      AND mt.shop_id = :shop_id
+      AND mt.statement_id = ANY(CAST(:statement_ids AS text[]))
+      AND mt.transaction_type <> 'STATEMENT_SUMMARY'
+    GROUP BY 1
+"""
+
+# shop_id -> (fetched_at, window_start, statements)
+_statement_lists: Dict[str, Tuple[float, datetime, List[Dict]]] = {}
+# (kind, shop_id, *args) -> (fetched_at, value)
+_creative_cache: Dict[tuple, Tuple[float, Any]] = {}
+_cache_lock = threading.Lock()
+
+
+class TikTokAnalyticsService:
+    """TikTok GMV breakdown from stored statements, cached creative analytics"""
+
+    @staticmethod
+    def get_config(db: Session) -> Optional[PlatformConfig]:
+        return db.query(PlatformConfig).filter(
+            PlatformConfig.platform == 'tiktok',
+            PlatformConfig.is_active == True
+        ).first()
+
+    # ========== Statements ==========
+
+    @staticmethod
+    async def _list_statements(client, shop_id: str, time_from: datetime, time_to: datetime) -> List[Dict]:
+        """Statements with statement_time in [time_from, time_to), from a short-lived list cache"""
+        now = time.monotonic()
+        with _cache_lock:
+            cached = _statement_lists.get(shop_id)
+        if not cached or now - cached[0] > STATEMENT_LIST_TTL.total_seconds() or cached[1] > time_from:
+            window_start = min(time_from, datetime.now(timezone.utc) - timedelta(days=STATEMENT_LIST_DAYS))
+            statements = await client.get_all_statements(window_start, datetime.now(timezone.utc) + timedelta(days=1))
+            cached = (now, window_start, statements)
+            with _cache_lock:
+                _statement_lists[shop_id] = cached
+
+        start_ts, end_ts = time_from.timestamp(), time_to.timestamp()
+        return [
+            s for s in cached[2]
+            if s.get("id") and start_ts <= (s.get("statement_time") or 0) < end_ts
+        ]
+
+    @staticmethod
+    def _stored_statements(db: Session, shop_id: str, statement_ids: List[str]) -> Dict[str, Tuple[str, datetime]]:
+        """statement_id -> (payment_status, stored_at) of fully stored statements"""
+        if not statement_ids:
+            return {}
+        rows = db.query(
+            MarketplaceTransaction.statement_id,
+            MarketplaceTransaction.raw_data["payment_status"].astext,
+            MarketplaceTransaction.updated_at,
+        ).filter(
+            MarketplaceTransaction.platform == "tiktok",
+            MarketplaceTransaction.shop_id == shop_id,
+            MarketplaceTransaction.transaction_type == "STATEMENT_SUMMARY",
+            MarketplaceTransaction.statement_id.in_(statement_ids),
+        ).all()
+        return {sid: (status, stored_at) for sid, status, stored_at in rows}
+
+    @staticmethod
+    def _local_statement_ids(db: Session, shop_id: str, time_from: datetime, time_to: datetime) -> List[str]:
+        """Stored statements in a range (used when the statement list cannot be fetched)"""
+        rows = db.query(MarketplaceTransaction.statement_id).filter(
+            MarketplaceTransaction.platform == "tiktok",
+            MarketplaceTransaction.shop_id == shop_id,
+            MarketplaceTransaction.transaction_type == "STATEMENT_SUMMARY",
+            MarketplaceTransaction.transaction_date >= time_from,
+            MarketplaceTransaction.transaction_date < time_to,
+        ).all()
+        return [sid for (sid,) in rows]
+
+    @staticmethod
+    def _needs_fetch(stored: Optional[Tuple[str, datetime]]) -> bool:
+        if stored is None:
+            return True
+        status, stored_at = stored
+        if status in SETTLED_STATEMENT_STATUSES:
+            return False
+        if stored_at is None:
+            return True
+        if stored_at.tzinfo is None:
+            stored_at = stored_at.replace(tzinfo=timezone.utc)
+        return datetime.now(timezone.utc) - stored_at > UNSETTLED_STATEMENT_REFRESH
+
+    # ========== GMV ==========
+
+    @staticmethod
+    async def get_gmv_breakdown(db: Session, config: PlatformConfig, time_from: datetime, time_to: datetime) -> Dict[str, Any]:
+        """
+        GMV by content type for statements settled in [time_from, time_to).
+        Returns the breakdown plus a "source" block with statement counts.
+        """
+        from app.services.finance_sync_service import FinanceSyncService
+
+        shop_id = str(config.shop_id or "")
+        client = integration_service.get_client_for_config(config)
+        fetched = 0
+        try:
+            statements = await TikTokAnalyticsService._list_statements(client, shop_id, time_from, time_to)
+            statement_ids = [str(s["id"]) for s in statements]
+            stored = TikTokAnalyticsService._stored_statements(db, shop_id, statement_ids)
+            missing = [s for s in statements if TikTokAnalyticsService._needs_fetch(stored.get(str(s["id"])))]
+            if missing:
+                stats = await FinanceSyncService(db).ingest_tiktok_statements(client, config, missing)
+                fetched = stats["fetched"]
+        except Exception as e:
+            logger.warning(f"TikTok statement list unavailable, using stored statements: {e}")
+            statement_ids = TikTokAnalyticsService._local_statement_ids(db, shop_id, time_from, time_to)
+
+        result = empty_gmv_breakdown()
+        for r in db.execute(text(_GMV_SQL), {"shop_id": shop_id, "statement_ids": statement_ids}).all():
+            add_gmv_transaction(
+                result, r.content_type, float(r.order_amount or 0),
+                float(r.affiliate_commission or 0), int(r.order_count or 0),
+            )
+        result["source"] = {
+            "statements": len(statement_ids),
+            "fetched_statements": fetched,
+        }
+        return result
+
+    # ========== Creative analytics ==========
+
+    @staticmethod
+    async def _cached(key: tuple, compute, refresh: bool = False):
+        now = time.monotonic()
+        with _cache_lock:
+            hit = _creative_cache.get(key)
+        if hit and not refresh and now - hit[0] < CREATIVE_CACHE_TTL.total_seconds():
+            return hit[1], datetime.now(timezone.utc) - timedelta(seconds=now - hit[0])
+        value = await compute()
+        if value:  # The client returns empty results on API errors: do not pin those
+            with _cache_lock:
+                _creative_cache[key] = (time.monotonic(), value)
+        return value, datetime.now(timezone.utc)
+
+    @staticmethod
+    async def get_sku_creative_count(config: PlatformConfig, refresh: bool = False) -> Tuple[Dict, datetime]:
+        """(SKU creative counts over the last 30 days, computed_at)"""
+        client = integration_service.get_client_for_config(config)
+        return await TikTokAnalyticsService._cached(
+            ("sku_creative_count", str(config.shop_id)), client.get_sku_creative_count, refresh
+        )
+
+    @staticmethod
+    async def get_creator_performance(config: PlatformConfig, creator_id: str, days: int) -> Tuple[Dict, datetime]:
+        """(Creator performance, computed_at)"""
+        client = integration_service.get_client_for_config(config)
+        return await TikTokAnalyticsService._cached(
+            ("creator_performance", str(config.shop_id), creator_id, days),
+            lambda: client.get_creator_performance(creator_id, days),
+        )
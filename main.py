@@ -12,6 +12,7 @@ from app.core import settings, engine, Base
 from app.api.router import api_router
 from app.jobs import start_scheduler, stop_scheduler
 from app.services.webhook_processor import start_webhook_processor, stop_webhook_processor
+from app.services.stock_sync_service import start_stock_sync_worker, stop_stock_sync_worker
 
 # Lifespan for startup/shutdown
 @asynccontextmanager
@@ -24,6 +25,11 @@ async def lifespan(app: FastAPI):
     await start_webhook_processor()
     print("[OK] Webhook processor started (auto-processing pending webhooks)")
     
+    # Start debounced marketplace stock push
+    if settings.STOCK_SYNC_ENABLED:
+        await start_stock_sync_worker()
+        print("[OK] Stock sync worker started (debounced stock push)")
+    
     # Start order sync scheduler automatically
     try:
         start_scheduler()
@@ -37,6 +43,9 @@ async def lifespan(app: FastAPI):
     await stop_webhook_processor()
     print("Webhook processor stopped")
     
+    if settings.STOCK_SYNC_ENABLED:
+        await stop_stock_sync_worker()
+    
     try:
         stop_scheduler()
         print("Order sync scheduler stopped")
@@ -124,7 +124,7 @@ async def sync_finance():
         for config in configs:
             try:
                 result = await service.sync_platform_finance(config, start_date, end_date)
-                txs = result.get('transactions', 0) if isinstance(result, dict) else 0
+                txs = result.get('created', 0) if isinstance(result, dict) else 0
                 total_txs += txs
                 logger.info(f"  ✓ {config.platform} finance: {txs} transactions")
             except Exception as e:
@@ -135,6 +135,19 @@ async def sync_finance():
         db.close()
 
 
+async def sync_invoices():
+    """Sync Shopee buyer-invoice requests for orders created since the last run"""
+    from app.core.database import SessionLocal
+    from app.services.invoice_sync_service import InvoiceSyncService
+    
+    db = SessionLocal()
+    try:
+        results = await InvoiceSyncService.sync_all(db)
+        return {'created': sum(r.get('created', 0) for r in results.values())}
+    finally:
+        db.close()
+
+
 async def refresh_tokens():
     """Refresh tokens for all platforms before they expire"""
     from app.core.database import SessionLocal
@@ -192,6 +205,26 @@ def run_token_refresh():
         logger.error(f"❌ Token refresh failed: {e}")
 
 
+def run_finance_sync():
+    """Run finance sync only (idempotent upserts, cheap to repeat)"""
+    logger.info("💰 Syncing finance (last 7 days)...")
+    try:
+        result = asyncio.run(sync_finance())
+        logger.info(f"✅ Finance sync completed: {result.get('transactions', 0)} transactions")
+    except Exception as e:
+        logger.error(f"❌ Finance sync failed: {e}")
+
+
+def run_invoice_sync():
+    """Run incremental buyer-invoice sync"""
+    logger.info("🧾 Syncing buyer invoice requests...")
+    try:
+        result = asyncio.run(sync_invoices())
+        logger.info(f"✅ Invoice sync completed: {result.get('created', 0)} new profiles")
+    except Exception as e:
+        logger.error(f"❌ Invoice sync failed: {e}")
+
+
 def run_sync():
     """Run all sync tasks"""
     start_time = datetime.now()
@@ -224,6 +257,8 @@ def main():
     logger.info(f"   Log dir: {LOG_DIR}")
     logger.info(f"   Schedule: Twice daily at 08:00 and 20:00")
     logger.info(f"   Token Refresh: Every 3 hours")
+    logger.info(f"   Finance: Hourly")
+    logger.info(f"   Invoices: Hourly (incremental)")
     logger.info(f"   Note: Webhooks handle real-time updates, Sync is backup only")
     
     # Refresh tokens immediately on start
@@ -239,6 +274,12 @@ def main():
     schedule.every().day.at("08:00").do(run_sync)
     schedule.every().day.at("20:00").do(run_sync)
     
+    # Finance writes are upserts on the idempotency key, so overlapping windows are cheap
+    schedule.every().hour.at(":30").do(run_finance_sync)
+    
+    # Buyer-invoice requests: only orders created since the last run
+    schedule.every().hour.at(":45").do(run_invoice_sync)
+    
     while True:
         schedule.run_pending()
         time.sleep(60)  # Check every minute
@@ -5,8 +5,7 @@ from datetime import datetime, timezone
 from sqlalchemy import create_engine, text
 from app.core import SessionLocal
 from app.models import OrderHeader
-from app.models.integration import PlatformConfig
-from app.integrations.tiktok import TikTokClient
+from app.services.reconciliation_service import ReconciliationService
 
 # Logging
 logging.basicConfig(
@@ -15,56 +14,28 @@ logging.basicConfig(
 )
 logger = logging.getLogger("audit")
 
-async def get_client(db, platform):
-    config = db.query(PlatformConfig).filter(PlatformConfig.platform == platform, PlatformConfig.is_active == True).first()
-    if not config:
-        return None
-        
-    client = TikTokClient(
-        app_key=config.app_key,
-        app_secret=config.app_secret,
-        shop_id=config.shop_id,
-        access_token=config.access_token,
-        refresh_token=config.refresh_token
-    )
-    return client
-
-async def check_platform(db, platform="tiktok"):
+async def check_platform(db, platform="tiktok", days=90):
     logger.info(f"--- Auditing {platform} ---")
-    client = await get_client(db, platform)
-    if not client:
-        return
 
-    # Check Total Count 2025
-    start_date = datetime(2025, 1, 1, tzinfo=timezone.utc)
-    end_date = datetime.now(timezone.utc)
-    
-    # 1. API Count
-    # We use page_size=1 just to get 'total'
-    # Note: TikTok search API 'total' might be capped or fuzzy for huge ranges, 
-    # but strictly it returns total_count.
-    resp = await client.get_orders(time_from=start_date, time_to=end_date, page_size=1)
-    api_total = resp.get("total", -1)
-    
-    logger.info(f"API Reported Total (2025-Now): {api_total}")
-    
-    # 2. DB Count
-    # Query: count of orders created >= 2025-01-01
-    db_count = db.query(OrderHeader).filter(
-        OrderHeader.channel_code == platform,
-        OrderHeader.order_datetime >= start_date.replace(tzinfo=None) # Local DB is naive usually or matches driver
-    ).count()
-    
-    logger.info(f"DB Reported Total  (2025-Now): {db_count}")
-    
-    diff = api_total - db_count
-    match_icon = "✅" if diff == 0 else "❌"
-    logger.info(f"Result: {match_icon} Diff: {diff}")
+    # 1. Order-set audit: per-day digest vs the marketplace order list.
+    # Only days whose digests differ are diffed and refetched.
+    audit = await ReconciliationService.audit_completeness(db, days, [platform])
+    mismatched = audit["mismatched_days"]
+    logger.info(f"Days checked: {days}, mismatched: {len(mismatched)}")
+    for d in mismatched:
+        logger.info(f"  {d['date']}: digest differs")
+
+    missing = audit["missing_count"]
+    resynced = audit["resynced_count"]
+    match_icon = "✅" if missing == 0 else "❌"
+    logger.info(f"Result: {match_icon} resynced={resynced}, still missing={missing}")
+    for r in audit["errors"]:
+        logger.error(f"  {r['date']} shop {r['shop_id']}: {r['error']}")
     
-    # 3. Anomaly Scan
+    # 2. Anomaly Scan
     logger.info("Scanning for anomalies...")
     
-    # 3.1 1970 Dates
+    # 2.1 1970 Dates
     bad_dates = db.query(OrderHeader).filter(
         OrderHeader.channel_code == platform,
         OrderHeader.shipped_at < '2000-01-01',
@@ -74,7 +45,7 @@ async def check_platform(db, platform="tiktok"):
     date_icon = "✅" if bad_dates == 0 else "❌"
     logger.info(f"Invalid Dates (<2000): {bad_dates} {date_icon}")
     
-    # 3.2 Monthly Breakdown
+    # 2.2 Monthly Breakdown
     # Fetch API Breakdown? Hard without many requests. 
     # For now, just output DB breakdown for user review.
     rows = db.execute(text(f"""
@@ -90,8 +61,9 @@ async def check_platform(db, platform="tiktok"):
         print(f"{r[0]}: {r[1]}")
         
     return {
-        "api_total": api_total,
-        "db_total": db_count,
+        "mismatched_days": len(mismatched),
+        "missing": missing,
+        "resynced": resynced,
         "bad_dates": bad_dates
     }
 
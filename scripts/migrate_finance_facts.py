@@ -0,0 +1,45 @@
+import os
+import sys
+from datetime import timedelta
+from sqlalchemy import text
+
+# Add parent directory to path so we can import app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core import engine, SessionLocal
+from app.models import FinanceDailyFact, FinanceFactDirty
+from app.services.finance_fact_service import FinanceFactService
+from app.services.order_rollup_service import local_date, local_today
+
+def migrate():
+    print("Migrating database...")
+    FinanceDailyFact.__table__.create(bind=engine, checkfirst=True)
+    print("Created table: finance_daily_fact")
+    FinanceFactDirty.__table__.create(bind=engine, checkfirst=True)
+    print("Created table: finance_fact_dirty")
+    
+    # Backfill from the first order / transaction, one month at a time
+    db = SessionLocal()
+    try:
+        first = db.execute(text("""
+            SELECT LEAST(
+                (SELECT MIN(order_datetime) FROM order_header),
+                (SELECT MIN(transaction_date) FROM marketplace_transaction)
+            )
+        """)).scalar()
+        if not first:
+            print("Nothing to backfill")
+            return
+        day = local_date(first).replace(day=1)
+        today = local_today()
+        while day <= today:
+            month_end = (day.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+            rows = FinanceFactService.rebuild(db, day, min(month_end, today))
+            db.commit()
+            print(f"  {day:%Y-%m}: {rows} rows")
+            day = month_end + timedelta(days=1)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    migrate()
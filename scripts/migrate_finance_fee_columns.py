@@ -0,0 +1,100 @@
+"""
+Add typed fee columns + (platform, transaction_date) index to marketplace_transaction.
+
+Existing rows are backfilled from raw_data with the same field mapping the
+finance sync uses at ingest (FEE_COLUMN_FIELDS). Shopee rows of one order
+share the escrow payload, so its fees land on a single row per order (the
+row that already carries fees, if any) and are cleared on the others; re-runs
+keep the same row.
+"""
+import os
+import sys
+from sqlalchemy import text
+
+# Add parent directory to path so we can import app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core import engine
+from app.core.database import SessionLocal
+from app.services.finance_sync_service import FEE_COLUMN_FIELDS
+from app.services.partition_service import PartitionService
+
+
+def _json_number(path) -> str:
+    """SQL for a numeric raw_data field (NULL when missing or not a number)"""
+    expr = "raw_data" + "".join(f"->'{key}'" for key in path[:-1]) + f"->>'{path[-1]}'"
+    return f"CASE WHEN ({expr}) ~ '^-?[0-9]+(\\.[0-9]+)?$' THEN ({expr})::numeric END"
+
+
+def _fee_expr(paths) -> str:
+    if len(paths) == 1:
+        return _json_number(paths[0])
+    parts = ", ".join(_json_number(p) for p in paths)
+    # NULL only when every path is missing, like the ingest side
+    return f"CASE WHEN COALESCE({parts}) IS NOT NULL THEN " + " + ".join(
+        f"COALESCE({_json_number(p)}, 0)" for p in paths
+    ) + " END"
+
+
+def migrate():
+    print("Migrating database...")
+    with engine.connect() as conn:
+        with conn.begin():
+            for column in FEE_COLUMN_FIELDS:
+                conn.execute(text(
+                    f"ALTER TABLE marketplace_transaction ADD COLUMN IF NOT EXISTS {column} NUMERIC(12, 2)"
+                ))
+                print(f"Added column: marketplace_transaction.{column}")
+
+    print("Backfilling fee columns from raw_data...")
+    assignments = ",\n                ".join(
+        f"{column} = {_fee_expr(paths)}" for column, paths in FEE_COLUMN_FIELDS.items()
+    )
+    with engine.connect() as conn:
+        with conn.begin():
+            result = conn.execute(text(f"""
+                UPDATE marketplace_transaction SET
+                {assignments}
+                WHERE raw_data IS NOT NULL AND platform <> 'shopee'
+            """))
+            print(f"  non-Shopee rows: {result.rowcount}")
+            # One row per escrow keeps the fees, the others are cleared in the same statement.
+            # A row that already has fees (set at ingest or by an earlier run) keeps them.
+            has_fees = "COALESCE(" + ", ".join(FEE_COLUMN_FIELDS) + ") IS NOT NULL"
+            shopee_assignments = ",\n                ".join(
+                f"{column} = CASE WHEN r.keeps_fees THEN {_fee_expr(paths)} END"
+                for column, paths in FEE_COLUMN_FIELDS.items()
+            )
+            result = conn.execute(text(f"""
+                WITH ranked AS (
+                    SELECT id, ROW_NUMBER() OVER (
+                        PARTITION BY shop_id, external_order_id, raw_data->>'order_sn'
+                        ORDER BY {has_fees} DESC, created_at, id
+                    ) = 1 AS keeps_fees
+                    FROM marketplace_transaction
+                    WHERE platform = 'shopee' AND raw_data IS NOT NULL
+                )
+                UPDATE marketplace_transaction SET
+                {shopee_assignments}
+                FROM ranked r
+                WHERE marketplace_transaction.id = r.id
+            """))
+            print(f"  Shopee rows (fees on one row per order): {result.rowcount}")
+
+    db = SessionLocal()
+    try:
+        partitioned = PartitionService.is_partitioned(db, "marketplace_transaction")
+    finally:
+        db.close()
+
+    # CONCURRENTLY cannot run inside a transaction block, nor on a partitioned parent
+    index_sql = "ix_marketplace_transaction_platform_date ON marketplace_transaction (platform, transaction_date)"
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if partitioned:
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {index_sql}"))
+        else:
+            conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_sql}"))
+        print("Created index: ix_marketplace_transaction_platform_date")
+
+if __name__ == "__main__":
+    migrate()
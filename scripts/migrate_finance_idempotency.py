@@ -0,0 +1,163 @@
+"""
+Add idempotency key columns + unique index to marketplace_transaction.
+
+Existing rows are backfilled from what they already carry (shop from the
+description prefix or else the platform's only active shop, order from
+order_id or the payload / description suffix, TikTok statement/txn ids);
+rows still without a shop are reported. Shopee rows synced before the keys
+existed cannot tell which escrow field they came from, so they (and any row
+still colliding) get a per-row key; legacy Shopee rows of an escrow that
+has since been stored with real keys are dropped.
+
+Safe to re-run.
+"""
+import os
+import sys
+from sqlalchemy import text
+
+# Add parent directory to path so we can import app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core import engine
+from app.core.database import SessionLocal
+from app.services.partition_service import PartitionService
+
+KEY_COLUMNS = "platform, shop_id, external_order_id, statement_id, transaction_type, external_txn_id, transaction_date"
+
+def migrate():
+    print("Migrating database...")
+    with engine.connect() as conn:
+        with conn.begin():
+            for column in ("shop_id", "external_order_id", "statement_id", "external_txn_id"):
+                conn.execute(text(
+                    f"ALTER TABLE marketplace_transaction ADD COLUMN IF NOT EXISTS {column} VARCHAR(100) NOT NULL DEFAULT ''"
+                ))
+                print(f"Added column: marketplace_transaction.{column}")
+
+    print("Backfilling keys...")
+    with engine.connect() as conn:
+        with conn.begin():
+            result = conn.execute(text("""
+                UPDATE marketplace_transaction mt SET shop_id = pc.shop_id
+                FROM platform_config pc
+                WHERE mt.shop_id = '' AND pc.platform = mt.platform
+                  AND pc.shop_name IS NOT NULL AND mt.description LIKE pc.shop_name || ' - %'
+            """))
+            print(f"  shop_id: {result.rowcount} rows")
+            # Prefix did not match (shop renamed, other format): a platform with one active shop owns them
+            result = conn.execute(text("""
+                UPDATE marketplace_transaction mt SET shop_id = pc.shop_id
+                FROM platform_config pc
+                WHERE mt.shop_id = '' AND pc.platform = mt.platform AND pc.is_active
+                  AND pc.shop_id IS NOT NULL
+                  AND (SELECT COUNT(*) FROM platform_config c WHERE c.platform = pc.platform AND c.is_active) = 1
+            """))
+            print(f"  shop_id from single active shop: {result.rowcount} rows")
+            unkeyed = conn.execute(text("""
+                SELECT platform, COUNT(*) FROM marketplace_transaction WHERE shop_id = '' GROUP BY platform
+            """)).all()
+            for platform, count in unkeyed:
+                print(f"  WARNING: {count} {platform} rows left without shop_id (re-synced escrows may duplicate them)")
+            result = conn.execute(text("""
+                UPDATE marketplace_transaction mt SET external_order_id = oh.external_order_id
+                FROM order_header oh
+                WHERE mt.external_order_id = '' AND mt.order_id = oh.id AND oh.external_order_id IS NOT NULL
+            """))
+            print(f"  external_order_id: {result.rowcount} rows")
+            # Rows not linked to an order: the payload (or the "<shop> - <order_sn>" description)
+            result = conn.execute(text("""
+                UPDATE marketplace_transaction mt
+                SET external_order_id = LEFT(src.external_order_id, 100)
+                FROM (
+                    SELECT id, COALESCE(
+                        NULLIF(CASE platform
+                            WHEN 'shopee' THEN raw_data->>'order_sn'
+                            WHEN 'tiktok' THEN raw_data->>'order_id'
+                            WHEN 'lazada' THEN raw_data->>'order_no'
+                        END, ''),
+                        CASE WHEN platform = 'shopee' AND description LIKE '% - %'
+                             THEN NULLIF(regexp_replace(description, '^.* - ', ''), 'N/A') END
+                    ) AS external_order_id
+                    FROM marketplace_transaction
+                    WHERE external_order_id = ''
+                ) src
+                WHERE mt.id = src.id AND src.external_order_id IS NOT NULL
+                  -- A keyed twin re-synced since: leave it to the duplicate cleanup below
+                  AND NOT EXISTS (
+                      SELECT 1 FROM marketplace_transaction t
+                      WHERE t.platform = mt.platform AND t.shop_id = mt.shop_id
+                        AND t.external_order_id = LEFT(src.external_order_id, 100)
+                        AND t.statement_id = mt.statement_id AND t.transaction_type = mt.transaction_type
+                        AND t.external_txn_id = mt.external_txn_id AND t.transaction_date = mt.transaction_date
+                  )
+            """))
+            print(f"  external_order_id from payload: {result.rowcount} rows")
+            result = conn.execute(text("""
+                UPDATE marketplace_transaction
+                SET statement_id = COALESCE(payout_reference, ''),
+                    external_txn_id = CASE WHEN transaction_type = 'STATEMENT_SUMMARY' THEN ''
+                                           ELSE COALESCE(raw_data->>'id', 'legacy:' || id) END
+                WHERE platform = 'tiktok' AND statement_id = '' AND external_txn_id = ''
+            """))
+            print(f"  tiktok statement/txn ids: {result.rowcount} rows")
+            result = conn.execute(text("""
+                UPDATE marketplace_transaction SET external_txn_id = 'legacy:' || id
+                WHERE platform <> 'tiktok' AND external_txn_id = ''
+            """))
+            print(f"  legacy per-row keys: {result.rowcount} rows")
+            # Legacy Shopee rows of escrows since re-synced with real keys are duplicates
+            result = conn.execute(text("""
+                DELETE FROM marketplace_transaction mt
+                WHERE mt.platform = 'shopee' AND mt.external_txn_id LIKE 'legacy:%'
+                  AND mt.external_order_id <> ''
+                  AND EXISTS (
+                      SELECT 1 FROM marketplace_transaction t
+                      WHERE t.platform = 'shopee' AND t.shop_id = mt.shop_id
+                        AND t.external_order_id = mt.external_order_id
+                        AND t.external_txn_id NOT LIKE 'legacy:%'
+                  )
+            """))
+            print(f"  superseded legacy shopee rows: {result.rowcount} rows")
+            # Unlinked legacy rows whose keyed twin exists (see external_order_id above)
+            result = conn.execute(text("""
+                DELETE FROM marketplace_transaction mt
+                WHERE mt.external_order_id = '' AND mt.external_txn_id <> ''
+                  AND EXISTS (
+                      SELECT 1 FROM marketplace_transaction t
+                      WHERE t.id <> mt.id AND t.platform = mt.platform AND t.shop_id = mt.shop_id
+                        AND t.external_order_id <> '' AND t.statement_id = mt.statement_id
+                        AND t.transaction_type = mt.transaction_type
+                        AND t.external_txn_id = mt.external_txn_id AND t.transaction_date = mt.transaction_date
+                  )
+            """))
+            print(f"  superseded unlinked rows: {result.rowcount} rows")
+            # Duplicates left by earlier re-syncs: keep the newest row of each key
+            result = conn.execute(text(f"""
+                DELETE FROM marketplace_transaction WHERE id IN (
+                    SELECT id FROM (
+                        SELECT id, ROW_NUMBER() OVER (
+                            PARTITION BY {KEY_COLUMNS} ORDER BY created_at DESC, id
+                        ) AS rn
+                        FROM marketplace_transaction
+                    ) d WHERE d.rn > 1
+                )
+            """))
+            print(f"  removed duplicates: {result.rowcount} rows")
+
+    db = SessionLocal()
+    try:
+        partitioned = PartitionService.is_partitioned(db, "marketplace_transaction")
+    finally:
+        db.close()
+
+    # CONCURRENTLY cannot run inside a transaction block, nor on a partitioned parent
+    index_sql = f"ix_marketplace_transaction_idempotency ON marketplace_transaction ({KEY_COLUMNS})"
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if partitioned:
+            conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS {index_sql}"))
+        else:
+            conn.execute(text(f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {index_sql}"))
+        print("Created index: ix_marketplace_transaction_idempotency")
+
+if __name__ == "__main__":
+    migrate()
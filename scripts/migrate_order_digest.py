@@ -0,0 +1,45 @@
+"""
+Add the order-set digest to order_daily_rollup (+ digest_match to reconciliation_result).
+
+Closed days are rebuilt one month at a time so every slice gets its digest.
+"""
+import os
+import sys
+from datetime import timedelta
+from sqlalchemy import text
+
+# Add parent directory to path so we can import app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core import engine, SessionLocal
+from app.services.order_rollup_service import OrderRollupService, local_date, local_today
+
+def migrate():
+    print("Migrating database...")
+    with engine.connect() as conn:
+        with conn.begin():
+            conn.execute(text("ALTER TABLE order_daily_rollup ADD COLUMN IF NOT EXISTS order_digest BIGINT NOT NULL DEFAULT 0"))
+            print("Added column: order_daily_rollup.order_digest")
+            conn.execute(text("ALTER TABLE IF EXISTS reconciliation_result ADD COLUMN IF NOT EXISTS digest_match BOOLEAN NOT NULL DEFAULT false"))
+            print("Added column: reconciliation_result.digest_match")
+    
+    # Backfill all closed days, one month at a time
+    db = SessionLocal()
+    try:
+        first = db.execute(text("SELECT MIN(order_datetime) FROM order_header")).scalar()
+        if not first:
+            print("No orders to backfill")
+            return
+        day = local_date(first).replace(day=1)
+        last_closed = local_today() - timedelta(days=1)
+        while day <= last_closed:
+            month_end = (day.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+            rows = OrderRollupService.rebuild(db, day, min(month_end, last_closed))
+            db.commit()
+            print(f"  {day:%Y-%m}: {rows} rows")
+            day = month_end + timedelta(days=1)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,22 @@
+import os
+import sys
+from sqlalchemy import text
+
+# Add parent directory to path so we can import app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core import engine
+
+def migrate():
+    print("Migrating database...")
+    # CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        # Keyset pagination of the order list (order_datetime, id)
+        conn.execute(text(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_order_header_datetime_id "
+            "ON order_header (order_datetime, id)"
+        ))
+        print("Created index: ix_order_header_datetime_id")
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,30 @@
+import os
+import sys
+from sqlalchemy import text
+
+# Add parent directory to path so we can import app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core import engine
+
+def migrate():
+    print("Backfilling order list columns from raw_payload...")
+    with engine.connect() as conn:
+        with conn.begin():
+            # Sync now stores the packages[0] fallbacks; copy them for existing orders
+            result = conn.execute(text("""
+                UPDATE order_header
+                SET tracking_number = COALESCE(NULLIF(tracking_number, ''),
+                                               LEFT(raw_payload->'packages'->0->>'tracking_number', 100)),
+                    courier_code = COALESCE(NULLIF(courier_code, ''),
+                                            LEFT(raw_payload->'packages'->0->>'shipping_provider_name', 50))
+                WHERE jsonb_typeof(raw_payload->'packages') = 'array'
+                  AND (
+                      (COALESCE(tracking_number, '') = '' AND COALESCE(raw_payload->'packages'->0->>'tracking_number', '') <> '')
+                      OR (COALESCE(courier_code, '') = '' AND COALESCE(raw_payload->'packages'->0->>'shipping_provider_name', '') <> '')
+                  )
+            """))
+            print(f"Updated orders: {result.rowcount}")
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,45 @@
+import os
+import sys
+from sqlalchemy import text
+
+# Add parent directory to path so we can import app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core import engine, SessionLocal
+from app.models import OrderProfit, OrderProfitDirty
+from app.services.profit_service import ProfitService
+
+def migrate():
+    print("Migrating database...")
+    OrderProfit.__table__.create(bind=engine, checkfirst=True)
+    print("Created table: order_profit")
+    OrderProfitDirty.__table__.create(bind=engine, checkfirst=True)
+    print("Created table: order_profit_dirty")
+    
+    with engine.connect() as conn:
+        with conn.begin():
+            conn.execute(text("ALTER TABLE order_profit ADD COLUMN IF NOT EXISTS fees_source VARCHAR(10)"))
+            print("Added column: order_profit.fees_source")
+    
+    # Product cost changes queue every order containing the product
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_order_item_product_id ON order_item (product_id)"))
+        print("Created index: ix_order_item_product_id")
+    
+    # Queue every order and drain the queue in batches
+    db = SessionLocal()
+    try:
+        queued = db.execute(text("""
+            INSERT INTO order_profit_dirty (order_id, marked_at)
+            SELECT id, now() FROM order_header
+            ON CONFLICT (order_id) DO NOTHING
+        """)).rowcount
+        db.commit()
+        print(f"Queued {queued} orders")
+        refreshed = ProfitService.refresh_dirty(db)
+        print(f"Computed profit for {refreshed} orders")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,44 @@
+import os
+import sys
+from datetime import timedelta
+from sqlalchemy import text
+
+# Add parent directory to path so we can import app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core import engine, SessionLocal
+from app.models import OrderDailyRollup, OrderRollupDirty
+from app.services.order_rollup_service import OrderRollupService, local_date, local_today
+
+def migrate():
+    print("Migrating database...")
+    OrderDailyRollup.__table__.create(bind=engine, checkfirst=True)
+    print("Created table: order_daily_rollup")
+    OrderRollupDirty.__table__.create(bind=engine, checkfirst=True)
+    print("Created table: order_rollup_dirty")
+    
+    # Item quantities are summed per order
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_order_item_order_id ON order_item (order_id)"))
+        print("Created index: ix_order_item_order_id")
+    
+    # Backfill all closed days, one month at a time
+    db = SessionLocal()
+    try:
+        first = db.execute(text("SELECT MIN(order_datetime) FROM order_header")).scalar()
+        if not first:
+            print("No orders to backfill")
+            return
+        day = local_date(first).replace(day=1)
+        last_closed = local_today() - timedelta(days=1)
+        while day <= last_closed:
+            month_end = (day.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+            rows = OrderRollupService.rebuild(db, day, min(month_end, last_closed))
+            db.commit()
+            print(f"  {day:%Y-%m}: {rows} rows")
+            day = month_end + timedelta(days=1)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    migrate()
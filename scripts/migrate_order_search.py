@@ -0,0 +1,56 @@
+import os
+import sys
+from sqlalchemy import text
+
+# Add parent directory to path so we can import app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core import engine
+from app.services.order_search_service import build_search_text
+
+BATCH_SIZE = 5000
+
+def migrate():
+    print("Migrating database...")
+    with engine.connect() as conn:
+        with conn.begin():
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            conn.execute(text("ALTER TABLE order_header ADD COLUMN IF NOT EXISTS search_text TEXT"))
+            print("Added column: order_header.search_text")
+    
+    # Backfill with the same normalization the app uses on write
+    print("Backfilling order_header.search_text...")
+    last_id = None
+    total = 0
+    with engine.connect() as conn:
+        while True:
+            with conn.begin():
+                rows = conn.execute(text("""
+                    SELECT id, external_order_id, tracking_number, customer_name, customer_phone
+                    FROM order_header
+                    WHERE CAST(:last_id AS uuid) IS NULL OR id > CAST(:last_id AS uuid)
+                    ORDER BY id
+                    LIMIT :limit
+                """), {"last_id": last_id, "limit": BATCH_SIZE}).all()
+                if not rows:
+                    break
+                conn.execute(
+                    text("UPDATE order_header SET search_text = :search_text WHERE id = :id"),
+                    [{"id": row.id, "search_text": build_search_text(row)} for row in rows]
+                )
+            last_id = str(rows[-1].id)
+            total += len(rows)
+            print(f"  {total} orders")
+    
+    # CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for name, ddl in [
+            ("ix_order_header_search_trgm", "ON order_header USING gin (search_text gin_trgm_ops)"),
+            ("ix_order_header_external_prefix", "ON order_header (external_order_id text_pattern_ops)"),
+            ("ix_order_header_tracking_prefix", "ON order_header (tracking_number text_pattern_ops)"),
+        ]:
+            conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} {ddl}"))
+            print(f"Created index: {name}")
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,53 @@
+"""
+Convert large append-only tables to monthly range partitions.
+
+Usage:
+    python scripts/migrate_partitioning.py                     # convert all (stock_ledger, marketplace_transaction)
+    python scripts/migrate_partitioning.py --table stock_ledger
+    python scripts/migrate_partitioning.py --archive-older-than 24
+
+The old table is kept as <table>_legacy. Verify row counts, then drop it manually.
+Re-running on converted tables adds the default partition and missing primary keys.
+Backup first (see .agent/workflows/db-migration.md). Stop the app while converting.
+"""
+import argparse
+import os
+import sys
+from sqlalchemy import text
+
+# Add parent directory to path so we can import app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core import engine
+from app.core.database import SessionLocal
+from app.services.partition_service import PartitionService, PARTITIONED_TABLES
+
+def migrate(tables, archive_older_than: int = 0):
+    print("Migrating database...")
+    db = SessionLocal()
+    try:
+        for table in tables:
+            result = PartitionService.convert_to_partitioned(db, table)
+            print(f"{table}: {result}")
+            if archive_older_than > 0:
+                archived = PartitionService.archive_partitions(db, table, archive_older_than)
+                print(f"{table}: archived {len(archived)} partitions")
+    finally:
+        db.close()
+    
+    # order_header is referenced by many tables and has a unique (channel_code, external_order_id)
+    # key, which Postgres cannot enforce across partitions. Use BRIN for cheap date-range scans.
+    with engine.connect() as conn:
+        with conn.begin():
+            try:
+                conn.execute(text("CREATE INDEX IF NOT EXISTS ix_order_header_order_datetime_brin ON order_header USING brin (order_datetime)"))
+                print("Added index: ix_order_header_order_datetime_brin")
+            except Exception as e:
+                print(f"Skipped BRIN index on order_header: {e}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--table", choices=list(PARTITIONED_TABLES.keys()))
+    parser.add_argument("--archive-older-than", type=int, default=0, help="Months to keep attached")
+    args = parser.parse_args()
+    migrate([args.table] if args.table else list(PARTITIONED_TABLES.keys()), args.archive_older_than)
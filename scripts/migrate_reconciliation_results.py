@@ -0,0 +1,16 @@
+import os
+import sys
+
+# Add parent directory to path so we can import app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core import engine
+from app.models import ReconciliationResult
+
+def migrate():
+    print("Migrating database...")
+    ReconciliationResult.__table__.create(bind=engine, checkfirst=True)
+    print("Created table: reconciliation_result")
+
+if __name__ == "__main__":
+    migrate()
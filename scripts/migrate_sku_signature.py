@@ -0,0 +1,54 @@
+import os
+import sys
+from sqlalchemy import text
+
+# Add parent directory to path so we can import app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core import engine, SessionLocal
+from app.services.order_service import OrderService
+
+BATCH_SIZE = 5000
+
+def migrate():
+    print("Migrating database...")
+    with engine.connect() as conn:
+        with conn.begin():
+            conn.execute(text('ALTER TABLE order_header ADD COLUMN IF NOT EXISTS sku_signature VARCHAR(1000) COLLATE "C"'))
+            print("Added column: order_header.sku_signature")
+            conn.execute(text("ALTER TABLE order_header ADD COLUMN IF NOT EXISTS item_count INTEGER DEFAULT 0"))
+            print("Added column: order_header.item_count")
+    
+    # Backfill from order_item
+    print("Backfilling sku_signature / item_count...")
+    db = SessionLocal()
+    try:
+        last_id = None
+        total = 0
+        while True:
+            ids = [r[0] for r in db.execute(text("""
+                SELECT id FROM order_header
+                WHERE CAST(:last_id AS uuid) IS NULL OR id > CAST(:last_id AS uuid)
+                ORDER BY id
+                LIMIT :limit
+            """), {"last_id": last_id, "limit": BATCH_SIZE}).all()]
+            if not ids:
+                break
+            OrderService.refresh_sku_signatures(db, ids)
+            db.commit()
+            last_id = str(ids[-1])
+            total += len(ids)
+            print(f"  {total} orders")
+    finally:
+        db.close()
+    
+    # CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_order_header_status_sku_signature "
+            "ON order_header (status_normalized, sku_signature)"
+        ))
+        print("Created index: ix_order_header_status_sku_signature")
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,41 @@
+import os
+import sys
+from sqlalchemy import text
+
+# Add parent directory to path so we can import app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core import engine, SessionLocal
+from app.models.stock_sync import StockSyncState
+from app.services.stock_sync_service import StockSyncService
+
+def migrate():
+    print("Migrating database...")
+    with engine.connect() as conn:
+        with conn.begin():
+            # Platform identifiers for stock push
+            for column in ["shop_id", "platform_item_id", "platform_model_id"]:
+                try:
+                    conn.execute(text(f"ALTER TABLE platform_listing ADD COLUMN IF NOT EXISTS {column} VARCHAR(100)"))
+                    print(f"Added column: platform_listing.{column}")
+                except Exception as e:
+                    print(f"Skipped {column} (might exist): {e}")
+    
+    # Dirty SKU queue (created before the ALTER below, which upgrades older tables)
+    StockSyncState.__table__.create(bind=engine, checkfirst=True)
+    print("Created table: stock_sync_state")
+    with engine.connect() as conn:
+        with conn.begin():
+            conn.execute(text("ALTER TABLE stock_sync_state ADD COLUMN IF NOT EXISTS last_failed_at TIMESTAMPTZ"))
+            print("Added column: stock_sync_state.last_failed_at")
+    
+    # Platform identifiers of existing listings, from synced order payloads
+    db = SessionLocal()
+    try:
+        filled = StockSyncService.backfill_listing_ids(db)
+        print(f"Backfilled platform ids: {filled}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,30 @@
+import os
+import sys
+from sqlalchemy import text
+
+# Add parent directory to path so we can import app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core import engine
+from app.core.database import SessionLocal
+from app.services.partition_service import PartitionService
+
+def migrate():
+    print("Migrating database...")
+    db = SessionLocal()
+    try:
+        partitioned = PartitionService.is_partitioned(db, "marketplace_transaction")
+    finally:
+        db.close()
+
+    # CONCURRENTLY cannot run inside a transaction block, nor on a partitioned parent
+    index_sql = "ix_marketplace_transaction_statement ON marketplace_transaction (platform, shop_id, statement_id)"
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if partitioned:
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {index_sql}"))
+        else:
+            conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_sql}"))
+        print("Created index: ix_marketplace_transaction_statement")
+
+if __name__ == "__main__":
+    migrate()
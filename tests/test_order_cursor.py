@@ -0,0 +1,33 @@
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+import pytest
+
+sys.path.append(os.getcwd())
+
+from app.services.order_service import decode_order_cursor, encode_order_cursor
+
+
+def test_round_trip():
+    order_datetime = datetime(2026, 3, 1, 12, 30, 15, 123456, tzinfo=timezone(timedelta(hours=7)))
+    order_id = uuid4()
+    assert decode_order_cursor(encode_order_cursor(order_datetime, order_id)) == (order_datetime, order_id)
+
+
+def test_naive_datetime_round_trip():
+    order_datetime = datetime(2026, 1, 31, 23, 59, 59)
+    order_id = uuid4()
+    assert decode_order_cursor(encode_order_cursor(order_datetime, order_id)) == (order_datetime, order_id)
+
+
+def test_cursor_is_url_safe_without_padding():
+    cursor = encode_order_cursor(datetime(2026, 1, 1, tzinfo=timezone.utc), uuid4())
+    assert "=" not in cursor and "+" not in cursor and "/" not in cursor
+
+
+@pytest.mark.parametrize("cursor", ["", "not-a-cursor", "e30", "eyJ0IjogIngiLCAiaWQiOiAieSJ9"])
+def test_malformed_cursor_raises_value_error(cursor):
+    with pytest.raises(ValueError):
+        decode_order_cursor(cursor)
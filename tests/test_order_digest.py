@@ -0,0 +1,69 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.getcwd())
+
+from app.services.order_rollup_service import (
+    DIGEST_CLOSED_STATUSES,
+    _ORDER_HASH_SQL,
+    combine_digest,
+    digest_status,
+    order_pair_hash,
+)
+
+
+def test_digest_status():
+    for status in DIGEST_CLOSED_STATUSES:
+        assert digest_status(status) == "CLOSED"
+    assert digest_status("PAID") == "PAID"
+    assert digest_status(None) == "UNKNOWN"
+    assert digest_status("") == "UNKNOWN"
+
+
+def test_pair_hash_is_signed_64_bit():
+    value = order_pair_hash("2601010ABCDEF", "PAID")
+    assert -(2 ** 63) <= value < 2 ** 63
+    assert order_pair_hash("2601010ABCDEF", "PAID") == value
+    assert order_pair_hash("2601010ABCDEF", "SHIPPED") != value
+
+
+def test_closed_statuses_hash_alike():
+    assert order_pair_hash("A1", "DELIVERED") == order_pair_hash("A1", "COMPLETED")
+    assert order_pair_hash(None, None) == order_pair_hash("", "UNKNOWN")
+
+
+def test_combine_digest_is_order_independent():
+    pairs = [("A1", "PAID"), ("A2", "SHIPPED"), ("A3", "CANCELLED")]
+    count, digest = combine_digest(pairs)
+    assert count == 3
+    assert combine_digest(reversed(pairs)) == (count, digest)
+    assert combine_digest(pairs + [("A4", "PAID"), ("A4", "PAID")]) == (5, digest)
+    assert combine_digest([]) == (0, 0)
+
+
+def test_pair_hash_matches_sql():
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.exc import OperationalError
+
+    from app.core import settings
+
+    try:
+        conn = create_engine(settings.DATABASE_URL).connect()
+    except OperationalError as e:
+        pytest.skip(f"database not available: {e}")
+
+    pairs = [("2601010ABCDEF", "PAID"), ("A1", "COMPLETED"), (None, None), ("ไทย-1", "SHIPPED")]
+    sql = text(
+        f"SELECT {_ORDER_HASH_SQL} FROM (SELECT CAST(:external_order_id AS text) AS external_order_id, "
+        f"CAST(:status AS text) AS status_normalized) oh"
+    )
+    with conn:
+        for external_order_id, status in pairs:
+            value = conn.execute(sql, {
+                "external_order_id": external_order_id,
+                "status": status,
+                "closed_statuses": list(DIGEST_CLOSED_STATUSES),
+            }).scalar()
+            assert value == order_pair_hash(external_order_id, status)
@@ -0,0 +1,40 @@
+import os
+import sys
+
+sys.path.append(os.getcwd())
+
+from app.services.order_search_service import OrderSearchService, normalize_phone, normalize_text
+
+
+def test_title_tokens_are_dropped():
+    assert normalize_text("คุณ สมชาย ใจดี") == "สมชาย ใจด"
+    assert normalize_text("นางสาว สมศรี") == "สมศร"
+    assert normalize_text("นาย") == ""
+
+
+def test_glued_titles_are_stripped():
+    assert normalize_text("คุณสมชาย") == "สมชาย"
+    assert normalize_text("น.ส.สมศรี") == "สมศร"
+    assert normalize_text("ด.ช.สมปอง") == "สมปอง"
+
+
+def test_names_resembling_titles_are_kept():
+    assert normalize_text("คณิต ใจดี") == "คณต ใจด"
+    assert normalize_text("คุณากร") == "คณากร"
+    assert normalize_text("นางรอง") == "นางรอง"
+    assert normalize_text("นายก") == "นายก"
+
+
+def test_text_is_lowercased_and_collapsed():
+    assert normalize_text("  Somchai   JAIDEE ") == "somchai jaidee"
+    assert normalize_text(None) == ""
+
+
+def test_normalize_term_matches_stored_form():
+    assert OrderSearchService.normalize_term("คณิต") == normalize_text("คณิต ใจดี").split()[0]
+    assert OrderSearchService.normalize_term(" คุณสมชาย ") == "สมชาย"
+
+
+def test_phone_terms():
+    assert OrderSearchService.normalize_term("+66 81-234-5678") == "0812345678"
+    assert normalize_phone("081 234 5678") == "0812345678"
@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.getcwd())
+
+from app.services.replenishment_service import service_level_z
+
+
+def test_common_service_levels():
+    assert service_level_z(0.5) == pytest.approx(0.0)
+    assert service_level_z(0.90) == pytest.approx(1.2816, abs=1e-4)
+    assert service_level_z(0.95) == pytest.approx(1.6449, abs=1e-4)
+    assert service_level_z(0.99) == pytest.approx(2.3263, abs=1e-4)
+
+
+def test_symmetric_and_increasing():
+    assert service_level_z(0.2) == pytest.approx(-service_level_z(0.8))
+    levels = [0.8, 0.85, 0.9, 0.95, 0.975, 0.99, 0.999]
+    zs = [service_level_z(level) for level in levels]
+    assert zs == sorted(zs)
+
+
+@pytest.mark.parametrize("level", [0, 1, -0.1, 1.5, 95])
+def test_out_of_range_rejected(level):
+    with pytest.raises(ValueError):
+        service_level_z(level)
@@ -0,0 +1,48 @@
+import os
+import sys
+
+sys.path.append(os.getcwd())
+
+from app.services.order_service import (
+    SKU_SIGNATURE_MAX_LENGTH,
+    SKU_SIGNATURE_TRUNCATED_PREFIX,
+    parse_sku_signature,
+)
+
+
+def _escape(sku):
+    # Same replacement order as _ESCAPED_SKU_SQL
+    return sku.replace("\\", "\\\\").replace(",", "\\,").replace("=", "\\=").replace("#", "\\#")
+
+
+def _signature(items):
+    return ",".join(f"{_escape(sku)}={qty}" for sku, qty in sorted(items))
+
+
+def test_plain_signature():
+    assert parse_sku_signature("A-1=2,B-2=1") == [("A-1", 2), ("B-2", 1)]
+
+
+def test_escape_round_trip():
+    items = [("A,B", 1), ("C=D", 2), ("E\\F", 3), ("#G", 4), ("H\\,=#", 5)]
+    assert parse_sku_signature(_signature(items)) == sorted(items)
+
+
+def test_leading_hash_sku_is_not_truncated():
+    assert parse_sku_signature(_signature([("#1", 2)])) == [("#1", 2)]
+
+
+def test_truncated_signature_returns_none():
+    body = _signature([(f"SKU-{i:04d}", 1) for i in range(200)])
+    assert len(body) > SKU_SIGNATURE_MAX_LENGTH
+    truncated = SKU_SIGNATURE_TRUNCATED_PREFIX + "0123456789ab:" + body[:SKU_SIGNATURE_MAX_LENGTH - 14]
+    assert parse_sku_signature(truncated) is None
+
+
+def test_empty_and_none():
+    assert parse_sku_signature("") == []
+    assert parse_sku_signature(None) == []
+
+
+def test_malformed_entries_are_skipped():
+    assert parse_sku_signature("A=1,B=x,=3,C") == [("A", 1)]